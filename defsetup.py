@@ -67,16 +67,23 @@ except AttributeError:
 STIMAGE_SOURCES = [ # List of pure-C files to compile
     'immatch/geomap.c',
     'immatch/xyxymatch.c',
+    'immatch/lib/offsets.c',
     'immatch/lib/tolerance.c',
     'immatch/lib/triangles.c',
+    'immatch/lib/triangles_ransac.c',
     'immatch/lib/triangles_vote.c',
+    'lib/budget.c',
     'lib/error.c',
     'lib/lintransform.c',
     'lib/polynomial.c',
+    'lib/radixsort.c',
+    'lib/threads.c',
     'lib/util.c',
     'lib/xybbox.c',
     'lib/xycoincide.c',
+    'lib/xygrid.c',
     'lib/xysort.c',
+    'surface/basis.c',
     'surface/cholesky.c',
     'surface/fit.c',
     'surface/surface.c',
@@ -87,6 +94,7 @@ STIMAGE_WRAP_SOURCES = [
     'stimage_module.c',
     'wrap_util.c',
     'immatch/py_xyxymatch.c',
+    'immatch/py_reference_catalog.c',
     'immatch/py_geomap.c'
     ]
 STIMAGE_WRAP_SOURCES = [join('src_wrap', x) for x in STIMAGE_WRAP_SOURCES]
@@ -97,6 +105,8 @@ libraries = []
 define_macros = []
 undef_macros = []
 extra_compile_args = []
+if sys.platform != 'win32':
+    libraries.append('pthread')
 if DEBUG:
     define_macros.append(('DEBUG', None))
     undef_macros.append('NDEBUG')
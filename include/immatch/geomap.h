@@ -108,6 +108,16 @@ typedef struct {
     double* x2coeff;
     size_t ny2coeff;
     double* y2coeff;
+    /** The fitted surfaces, which map reference coordinates to input
+        coordinates: the linear part of the fit, and the distortion
+        part, if has_sx2 or has_sy2 is set.  Used by
+        geomap_result_eval. */
+    surface_t sx1;
+    surface_t sy1;
+    surface_t sx2;
+    surface_t sy2;
+    int has_sx2;
+    int has_sy2;
 } geomap_result_t;
 
 /**
@@ -265,6 +275,349 @@ geomap(
         geomap_result_t* const result,
         stimage_error_t* const error);
 
+/**
+Evaluate a fit found by geomap at a list of reference coordinates,
+giving the corresponding input coordinates.  These are computed
+exactly as the fit column of the output of geomap is.  The result is
+not modified, so it may be evaluated from several threads at once.
+
+@param result The result of geomap
+
+@param ncoord The number of coordinates
+
+@param ref The reference coordinates
+
+@param xfit, yfit Output: The input coordinates
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref, /* [ncoord] */
+        /* Output */
+        double* const xfit, /* [ncoord] */
+        double* const yfit, /* [ncoord] */
+        stimage_error_t* const error);
+
+/**
+Invert a fit found by geomap: find the reference coordinates that the
+fit maps to each of a list of input coordinates, using Newton's method
+with the analytic derivatives of the fitted surfaces.  A coordinate is
+only returned once the fit at it is within tolerance of the input
+coordinate in both x and y.  Coordinates for which that does not
+happen within maxiter iterations, or whose Newton step stops
+shrinking, such as those far outside the region of the fit, are set to
+NaN.  Like geomap_result_eval, this may
+be called from several threads at once.
+
+@param result The result of geomap
+
+@param ncoord The number of coordinates
+
+@param input The input coordinates
+
+@param tolerance The largest residual allowed, in input coordinates
+
+@param maxiter The largest number of iterations for each coordinate
+
+@param xref, yref Output: The reference coordinates
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_eval_inverse(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input, /* [ncoord] */
+        const double tolerance,
+        const size_t maxiter,
+        /* Output */
+        double* const xref, /* [ncoord] */
+        double* const yref, /* [ncoord] */
+        stimage_error_t* const error);
+
+/**
+Fit a number of lists of matched coordinates ("frames") with the same
+parameters, spreading the frames over a number of threads.  Each
+frame gives exactly the same results as passing it to geomap on its
+own.
+
+@param nframes The number of frames
+
+@param ninputs, inputs The input coordinates of each frame
+
+@param nrefs, refs The reference coordinates of each frame
+
+@param bboxes The bounding box of each frame, or NULL to use all of
+       the coordinates of every frame
+
+@param noutputs Output: The number of output records of each frame
+
+@param outputs The output records of each frame, each with room for
+       MAX(ninputs[i], nrefs[i]) records
+
+@param results Output: The fit of each frame.  They are initialized
+       here, and the caller must free them with geomap_result_free,
+       even if an error occurred.
+
+@param nthreads The maximum number of threads to use.  If 0, use one
+       per processor.
+
+@param error Set to a meaningful message if an error occurred.  If
+       more than one frame fails, the error of the first of them is
+       reported.
+
+See geomap for the remaining parameters, which are the same for all
+of the frames.
+
+@return Non-zero on error
+*/
+int
+geomap_many(
+        const size_t nframes,
+        const size_t* const ninputs, /* [nframes] */
+        const coord_t* const* const inputs, /* [nframes][ninputs[i]] */
+        const size_t* const nrefs, /* [nframes] */
+        const coord_t* const* const refs, /* [nframes][nrefs[i]] */
+        const bbox_t* const bboxes, /* [nframes] */
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t xxorder,
+        const size_t xyorder,
+        const size_t yxorder,
+        const size_t yyorder,
+        const xterms_e xxterms,
+        const xterms_e yxterms,
+        const size_t maxiter,
+        const double reject,
+        /* Output */
+        size_t* const noutputs, /* [nframes] */
+        geomap_output_t* const* const outputs, /* [nframes][MAX(ninputs[i], nrefs[i])] */
+        geomap_result_t* const results, /* [nframes] */
+        const size_t nthreads,
+        stimage_error_t* const error);
+
+/**
+A fit like that of geomap, with fit_geometry "general" and no
+rejection, to coordinates that are given a chunk at a time, so that
+they never need to all be in memory at once.  Only the normal
+equations of the fit are kept between chunks.
+
+The fit is made in two passes over the coordinates.  In the first,
+each chunk is passed to geomap_stream_add, and then
+geomap_stream_solve finds the fit.  In the optional second pass, each
+chunk is passed to geomap_stream_add_residuals, which gives the fit
+and residuals of each coordinate and keeps the rms of the fit up to
+date.
+
+The bbox must be given up front, since the basis functions of the fit
+are scaled to it.  Coordinates outside it are ignored.
+*/
+typedef struct {
+    surface_type_e function;
+    bbox_t         bbox;
+    size_t         xxorder;
+    size_t         xyorder;
+    size_t         yxorder;
+    size_t         yyorder;
+    xterms_e       xxterms;
+    xterms_e       yxterms;
+    /* The normal equations of the linear part of the fit, and of the
+       whole fit, if it has a distortion part */
+    surface_t      sx1;
+    surface_t      sy1;
+    surface_t      sx2;
+    surface_t      sy2;
+    int            has_sx2;
+    int            has_sy2;
+    /* The number of coordinates, and the sums of the coordinates, in
+       the first pass */
+    size_t         ncoord;
+    coord_t        sum_ref;
+    coord_t        sum_input;
+    /* The number of coordinates, and the sums of the squares of the
+       residuals, in the second pass */
+    size_t         nresidual;
+    coord_t        sum_sq_residual;
+} geomap_stream_t;
+
+/**
+Mark a stream as uninitialized, so that geomap_stream_free is safe to
+call on it.
+*/
+void
+geomap_stream_new(
+        geomap_stream_t* const stream);
+
+/**
+Start a streaming fit.
+
+@param bbox The bounding box of the reference coordinates.  It must be
+       finite, with max greater than min on both axes.
+
+@param error
+
+See geomap for the remaining parameters.  Each distortion surface
+must have an order of at least 2 in both x and y.
+
+@return Non-zero on error
+*/
+int
+geomap_stream_init(
+        geomap_stream_t* const stream,
+        const bbox_t* const bbox,
+        const surface_type_e function,
+        const size_t xxorder,
+        const size_t xyorder,
+        const size_t yxorder,
+        const size_t yyorder,
+        const xterms_e xxterms,
+        const xterms_e yxterms,
+        stimage_error_t* const error);
+
+/**
+Add a chunk of matched coordinates to the first pass of a streaming
+fit.
+
+@param ncoord The number of coordinates
+
+@param input, ref The input and reference coordinates
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_stream_add(
+        geomap_stream_t* const stream,
+        const size_t ncoord,
+        const coord_t* const input, /* [ncoord] */
+        const coord_t* const ref, /* [ncoord] */
+        stimage_error_t* const error);
+
+/**
+Find the fit to all of the coordinates added so far.  The rms of the
+result is 0 until the second pass, which this restarts.  The first
+pass is kept, so more coordinates may be added and the fit found
+again.
+
+@param result Output: The fit, as geomap gives it
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_stream_solve(
+        geomap_stream_t* const stream,
+        geomap_result_t* const result,
+        stimage_error_t* const error);
+
+/**
+Add a chunk of matched coordinates to the second pass of a streaming
+fit, updating the rms of the result.
+
+@param result The result of geomap_stream_solve.  Its rms is updated.
+
+@param ncoord The number of coordinates
+
+@param input, ref The input and reference coordinates
+
+@param noutput Output: The number of output records, the number of
+       coordinates in the bbox.  May be NULL if output is.
+
+@param output Output: The output records for the coordinates in the
+       bbox, as geomap gives them, or NULL.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_stream_add_residuals(
+        geomap_stream_t* const stream,
+        geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input, /* [ncoord] */
+        const coord_t* const ref, /* [ncoord] */
+        size_t* const noutput,
+        geomap_output_t* const output, /* [ncoord] */
+        stimage_error_t* const error);
+
+/**
+Add the coordinates added to another streaming fit to this one, in
+both passes, as though they had been added to it directly.  The other
+stream must have the same bbox, function, orders and cross terms.
+
+Together with geomap_stream_get_state and geomap_stream_set_state,
+this lets the coordinates of one fit be accumulated by many workers,
+each shipping only the normal equations of its share, which are then
+merged and solved once.
+
+@param stream The stream to add to
+
+@param other The stream to add
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_stream_merge(
+        geomap_stream_t* const stream,
+        const geomap_stream_t* const other,
+        stimage_error_t* const error);
+
+/**
+The number of values in the state of a stream, which depends only on
+its function, orders and cross terms.
+*/
+size_t
+geomap_stream_state_size(
+        const geomap_stream_t* const stream);
+
+/**
+Get the accumulated state of a stream: the counts and sums of both
+passes, and the normal equations of its surfaces.
+
+@param state Output: The state [geomap_stream_state_size(stream)]
+*/
+void
+geomap_stream_get_state(
+        const geomap_stream_t* const stream,
+        double* state);
+
+/**
+Replace the accumulated state of a stream with one from
+geomap_stream_get_state of a stream with the same bbox, function,
+orders and cross terms.
+
+@param nstate The number of values in state, which must be
+       geomap_stream_state_size(stream)
+
+@param state The state
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_stream_set_state(
+        geomap_stream_t* const stream,
+        const size_t nstate,
+        const double* state, /* [nstate] */
+        stimage_error_t* const error);
+
+void
+geomap_stream_free(
+        geomap_stream_t* const stream);
+
 void
 geomap_result_print(
         const geomap_result_t* const result);
@@ -0,0 +1,106 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#ifndef _STIMAGE_OFFSETS_H_
+#define _STIMAGE_OFFSETS_H_
+
+#include "lib/util.h"
+#include "lib/lintransform.h"
+
+/**
+Find the transformation between two coordinate lists by voting on the
+offsets between every pair of a reference and an input coordinate.
+The offsets of the pairs that are the same object pile up in one place
+in a 2-D histogram with bins of about tolerance, while those of
+unrelated pairs are spread out, so the peak of the histogram gives the
+shift between the lists without any prior estimate.  Rotations and
+scales are handled by trying each of a small set of them, rotating and
+scaling the input coordinates about their center, and keeping the one
+with the highest peak.
+
+If the lists are so long that there would be too many pairs, both are
+evenly subsampled.  Coordinates that are not finite are ignored.
+
+@param nref The number of reference coordinates (specifically, the
+length of ref_sorted)
+
+@param ref_sorted A list of pointers to reference coordinates that
+have been sorted with xysort and culled with xycoincide.
+
+@param ninput The number of input coordinates (specifically, the
+length of input_sorted)
+
+@param input_sorted A list of pointers to input coordinates that have
+been sorted with xysort and culled with xycoincide.
+
+@param tolerance The size of the histogram bins.  Must be positive.
+
+@param nrotations The number of rotations to try
+
+@param rotations The rotations to try, in degrees.  If NULL, only 0.0
+is tried.
+
+@param nscales The number of scales to try
+
+@param scales The scales to try.  If NULL, only 1.0 is tried.
+
+@param transform On output, the transformation from the input to the
+reference coordinates.
+
+@param nvotes On output, the number of pairs in the peak of the
+histogram.  A peak of only one or two pairs can not be told apart
+from chance.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+find_offsets_transform(
+        const size_t                 nref,
+        const coord_t* const * const ref_sorted,
+        const size_t                 ninput,
+        const coord_t* const * const input_sorted,
+        const double                 tolerance,
+        const size_t                 nrotations,
+        const double* const          rotations,
+        const size_t                 nscales,
+        const double* const          scales,
+        lintransform_t* const        transform,
+        size_t* const                nvotes,
+        stimage_error_t* const       error);
+
+#endif /* _STIMAGE_OFFSETS_H_ */
@@ -40,6 +40,13 @@ DAMAGE.
 #include "lib/util.h"
 #include "immatch/lib/match_util.h"
 
+typedef enum {
+    tolerance_search_auto,
+    tolerance_search_sweep,
+    tolerance_search_grid,
+    tolerance_search_LAST
+} tolerance_search_e;
+
 /**
 Given two lists of coordinates, finds pairs that are within a certain
 tolerance.  For each pair, a callback is called, allowing the caller
@@ -63,6 +70,27 @@ been sorted with xysort and culled with xycoincide.
 
 @param tolerance The maximum distance to be considered a match
 
+@param search How to find the input coordinates near each reference
+coordinate.  The choices are:
+
+    - tolerance_search_sweep: Walk a band of the y-sorted input list
+      for each reference coordinate, and scan it linearly in x.  The
+      work is proportional to the number of input coordinates within
+      tolerance in y, which can be large in crowded fields or with
+      large tolerances.
+
+    - tolerance_search_grid: Build a uniform grid hash over the input
+      coordinates with a cell size of tolerance, and only examine the
+      3x3 block of cells around each reference coordinate.
+
+    - tolerance_search_auto: Use the grid when the expected size of
+      the sweep's band is large enough that the grid will win.
+
+All of the search methods return exactly the same matches, in the same
+order.  If more than one input coordinate is at the same minimum
+distance from a reference coordinate, the one that comes last in
+input_sorted is chosen.
+
 @param callback Called for every matching pair.  Its arguments are
 (data, ref_index, input_index, error).  data is always whatever
 callback_data is.  ref_index is the index in the original ref array to
@@ -86,6 +114,7 @@ match_tolerance(
         const coord_t* const         input,
         const coord_t* const * const input_sorted,
         const double                 tolerance,
+        const tolerance_search_e     search,
         coord_match_callback_t*      callback,
         void*                        callback_data,
         stimage_error_t* const       error);
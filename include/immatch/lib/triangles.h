@@ -37,9 +37,61 @@ DAMAGE.
 #ifndef _STIMAGE_TRIANGLES_H_
 #define _STIMAGE_TRIANGLES_H_
 
+#include "lib/budget.h"
 #include "lib/util.h"
 #include "immatch/lib/match_util.h"
 
+/**
+The type of the invariants and tolerances of each triangle.  When
+built with STIMAGE_TRIANGLES_SINGLE defined, they are stored in
+single precision, which halves the memory used by the triangle lists
+and by the index that merge_triangles searches, at the cost of
+slightly coarser comparisons.
+*/
+#ifdef STIMAGE_TRIANGLES_SINGLE
+typedef float triangle_real_t;
+#else
+typedef double triangle_real_t;
+#endif
+
+/**
+How the matched triangles are turned into matched coordinates.  See
+match_triangles.
+*/
+typedef enum {
+    triangle_consensus_reject,
+    triangle_consensus_ransac,
+    triangle_consensus_LAST
+} triangle_consensus_e;
+
+/**
+Stores information about a triangle
+*/
+typedef struct {
+    /** The log of the perimeter of the triangle */
+    triangle_real_t log_perimeter;
+
+    /** The ratio of the longest to shortest side */
+    triangle_real_t ratio;
+
+    /** Cosine of angle at vertex 1 */
+    triangle_real_t cosine_v1;
+
+    /** Tolerance in the ratio */
+    triangle_real_t ratio_tolerance;
+
+    /** Tolerance in the cosine */
+    triangle_real_t cosine_tolerance;
+
+    /** The vertices of the triangle, as indices into the list of
+        coordinates the triangle was found from */
+    STIMAGE_UInt32 vertices[3];
+
+    /** Sense of the triangle (clockwise (non-zero) or anti-clockwise
+        (zero)) */
+    char sense;
+} triangle_t;
+
 /**
 Compute the intersection of two lists using a pattern matching
 algorithm. This algorithm is based on one developed by Edward Groth
@@ -61,6 +113,13 @@ determining indices into the original set.
 It is assumed that this array has already been sorted with xysort and
 culled with xycoincide.
 
+@param nref_triangles The number of triangles in ref_triangles
+
+@param ref_triangles The triangles of ref_sorted, if they have already
+been found with find_list_triangles using the same nmatch, nneighbors,
+tolerance and maxratio.  Only the input triangles are then found.  If
+NULL, the reference triangles are found here.
+
 @param ninput The number of input coordinates
 
 @param ninput_unique The number of unique input coordinates
@@ -77,7 +136,13 @@ culled with xycoincide.
 use in matching.  If either list contains more coordinates than
 nmatch, the lists are subsampled.  nmatch should be kept small, as the
 computation and memory requirements of the triangles algorithm depend
-on a high power of the lengths of the respective lists.
+on a high power of the lengths of the respective lists.  Ignored if
+nneighbors is non-zero.
+
+@param nneighbors If non-zero, use all of the coordinates, but only
+form triangles from each coordinate and pairs of its nneighbors
+nearest neighbors (see find_triangles_local).  If zero, form every
+triangle from the subsampled lists.
 
 @param tolerance The matching tolerance in pixels.
 
@@ -86,6 +151,32 @@ the triangles used for matching.
 
 @param nreject The maximum number of rejection iteration cycles.
 
+@param consensus How the coordinate matches are found from the matched
+triangles:
+
+    - triangle_consensus_reject: Reject matched triangles whose ratio
+      of perimeters is far from the mode, for up to nreject
+      iterations, and then those of the less common sense, and let
+      the remaining ones vote on the coordinate matches (see
+      reject_triangles and vote_triangle_matches).
+
+    - triangle_consensus_ransac: Draw single matched triangles at
+      random, and keep the similarity transformation between their
+      vertices that carries the most coordinates to within tolerance
+      of another (see ransac_triangle_matches).  This converges in
+      few samples even when most of the matched triangles are false,
+      and every unique coordinate may be matched, not just the
+      subsample the triangles were formed from.
+
+@param nthreads The number of threads to find the triangles with.  If
+0, use one per processor.  The result does not depend on the number
+of threads.
+
+@param budget Limits the work done finding, merging and rejecting
+triangles.  Each candidate triangle built and each pair of triangles
+compared is one unit of work.  If the budget runs out, an error is
+returned and the callback is not called.  If NULL, there is no limit.
+
 @param callback A callback function that is called with each matching
 coordinate pair.  Its arguments are (data, ref_index, input_index,
 error).  data is always whatever callback_data is.  ref_index is the
@@ -104,14 +195,20 @@ match_triangles(
         const size_t nref_unique,
         const coord_t* const ref,
         const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles, /*[nref_triangles]*/
         const size_t ninput,
         const size_t ninput_unique,
         const coord_t* const input, /*[ninput]*/
         const coord_t* const * const input_sorted,
         const size_t nmatch,
+        const size_t nneighbors,
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const triangle_consensus_e consensus,
+        const size_t nthreads,
+        budget_t* const budget,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error);
@@ -120,33 +217,6 @@ match_triangles(
 BELOW IS THE SECONDARY API -- SUBJECT TO CHANGE
 ********************************************************************************/
 
-/**
-Stores information about a triangle
-*/
-typedef struct {
-    /** The vertices of the triangle */
-    const coord_t* vertices[3];
-
-    /** The log of the perimeter of the triangle */
-    double log_perimeter;
-
-    /** The ratio of the longest to shortest side */
-    double ratio;
-
-    /** Cosine of angle at vertex 1 */
-    double cosine_v1;
-
-    /** Tolerance in the ratio */
-    double ratio_tolerance;
-
-    /** Tolerance in the cosine */
-    double cosine_tolerance;
-
-    /** Sense of the triangle (clockwise (non-zero) or anti-clockwise
-        (zero)) */
-    int sense;
-} triangle_t;
-
 /**
 Pointers to a matching pair of triangles.
 */
@@ -179,12 +249,11 @@ between vertices 1 and 3.
 these coordinates have already been sorted with xysort and culled with
 xycoincide.
 
-@param ntriangles On input, the number of triangles allocated in the
-triangle list.  On output, the number of triangles found.  The number
-of triangles to allocate should be determined using max_num_triangles.
+@param ntriangles On output, the number of triangles found.
 
-@param triangles An array of triangle_t structs to store the
-triangles.
+@param triangles On output, a newly allocated array of the triangles
+found, which the caller must free.  It is only as large as the number
+of triangles found, rather than every possible triangle.
 
 @param maxnpoints The maximum number of points.
 
@@ -194,6 +263,13 @@ rejected.
 @param maxratio Triangles with a ratio of longest side to shortest
 side greater than maxratio are rejected.
 
+@param nthreads The number of threads to find and sort the triangles
+with.  If 0, use one per processor.  The triangles, and their order,
+do not depend on the number of threads.
+
+@param budget Charged one unit for each candidate triangle.  May be
+NULL.
+
 @param error Contains an error message if an error occurred.
  */
 int
@@ -201,16 +277,116 @@ find_triangles(
         const size_t ncoords,
         const coord_t* const * const coords,
         size_t* ntriangles,
-        triangle_t* triangles,
+        triangle_t** triangles,
         const size_t maxnpoints,
         const double tolerance,
         const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
+        stimage_error_t* const error);
+
+/**
+Find the triangles of one coordinate list the way match_triangles
+does: every triangle of a subsample of at most nmatch coordinates if
+nneighbors is zero (see find_triangles), otherwise those between
+nearest neighbors (see find_triangles_local).
+
+@param triangles On output, a newly allocated array of the triangles
+found, which the caller must free.  Must point to NULL on input.
+
+The other parameters are as for match_triangles.
+
+@return Non-zero on error
+*/
+int
+find_list_triangles(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
+        size_t* ntriangles,
+        triangle_t** triangles,
+        stimage_error_t* const error);
+
+/**
+Compute the maximum number of triangles find_triangles_local can
+find given the number of coordinates and neighbors.
+*/
+int
+max_num_triangles_local(
+        const size_t ncoords,
+        const size_t nneighbors,
+        size_t* num_triangles,
+        stimage_error_t* const error);
+
+/**
+Construct the triangles formed by each coordinate and every pair of
+its nearest neighbors.
+
+Unlike find_triangles, which forms every triangle from a subsample of
+at most maxnpoints coordinates, this uses all of the coordinates, but
+only forms small triangles between coordinates that are near each
+other.  The number of triangles grows linearly with the number of
+coordinates, so it is suited to large, crowded lists where
+subsampling would leave few coordinates in common between the two
+lists.  The triangles are ordered the same way as in find_triangles.
+
+@param ncoords The number of coordinates in the coordinate list
+
+@param coords A list of pointers to coordinates.  It is assumed that
+these coordinates have already been sorted with xysort and culled with
+xycoincide.
+
+@param nneighbors The number of nearest neighbors of each coordinate
+to form triangles with.  Must be at least 2.
+
+@param ntriangles On output, the number of triangles found.
+
+@param triangles On output, a newly allocated array of the triangles
+found, which the caller must free.
+
+@param tolerance Triangles with vertices closer than tolerance are
+rejected.
+
+@param maxratio Triangles with a ratio of longest side to shortest
+side greater than maxratio are rejected.
+
+@param nthreads The number of threads to sort the triangles with.  If
+0, use one per processor.
+
+@param budget Charged one unit for each candidate triangle.  May be
+NULL.
+
+@param error Contains an error message if an error occurred.
+ */
+int
+find_triangles_local(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t nneighbors,
+        size_t* ntriangles,
+        triangle_t** triangles,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
         stimage_error_t* const error);
 
 /**
 Compute the intersection of the two sorted lists of triangles using
 the ratio tolerance parameter.
 
+Each triangle in r_triangles is matched to the closest triangle in
+l_triangles that is within both of their ratio and cosine tolerances.
+The candidates are found with a grid over (ratio, cosine_v1) of
+l_triangles, rather than by scanning everything within the largest
+ratio tolerance, so this is close to linear in the number of
+triangles.
+
 @param nr_triangles The number of reference triangles
 
 @param r_triangles An array of triangles
@@ -224,6 +400,9 @@ The number of matches found.
 
 @param matches An array to store the match pairs.
 
+@param budget Charged one unit for each r triangle, and for each
+triangle of l_triangles it is compared with.  May be NULL.
+
 @param error
 */
 int
@@ -234,6 +413,7 @@ merge_triangles(
         const triangle_t* const l_triangles,
         size_t* nmatches,
         triangle_match_t* const matches,
+        budget_t* const budget,
         stimage_error_t* const error);
 
 /**
@@ -245,6 +425,9 @@ Remove false matches from the list of matched triangles.
 
 @param nreject The number of rejection iterations to perform
 
+@param budget Charged one unit for each match in each iteration.  May
+be NULL.
+
 @param error
 */
 int
@@ -252,6 +435,7 @@ reject_triangles(
         size_t* nmatches,
         triangle_match_t* const matches,
         const size_t nreject,
+        budget_t* const budget,
         stimage_error_t* error);
 
 /**
@@ -260,6 +444,16 @@ in the set of matched triangles. If a particular pair of points occurs
 in many triangles it is much more likely to be a true match than if it
 occurs in very few.
 
+@param nleft The number of coordinates in left
+
+@param left The array of coordinates the l triangles of the matches
+refer to.  The coordinates are counted by their position in it.
+
+@param left_coords The list of pointers into left that the l
+triangles were found from, which their vertex indices refer to.
+
+@param nright, right, right_coords The same, for the r triangles.
+
 @param ntriangle_matches The number of triangle match pairs
 
 @param triangle_matches An array of triangle match pairs
@@ -277,19 +471,92 @@ inputcoord_matches.
 reference set that correspond to the coordinates in
 inputcoord_matches.
 
+@param majority If zero, a pair is only matched if it has more than
+half as many votes as the pair with the most votes overall, which
+assumes that every coordinate is in about the same number of
+triangles, as with find_triangles.  If non-zero, a pair is matched if
+it has more than half of the votes of its coordinate in the right
+list, which is needed with find_triangles_local.
+
 @param error
 */
 int
 vote_triangle_matches(
         const size_t nleft,
         const coord_t* const left,
+        const coord_t* const * const left_coords,
         const size_t nright,
         const coord_t* const right,
+        const coord_t* const * const right_coords,
+        const size_t ntriangle_matches,
+        const triangle_match_t* const triangle_matches,
+        size_t* ncoord_matches,
+        const coord_t** const refcoord_matches,
+        const coord_t** const inputcoord_matches,
+        const int majority,
+        stimage_error_t* const error);
+
+/**
+Find the coordinate matches from the set of matched triangles by
+random sample consensus.  Each sample is one matched triangle, whose
+vertices give a similarity transformation (a flip is included if the
+triangles are of opposite sense).  A sample is scored by the number of
+left coordinates in any matched triangle that it carries to within
+tolerance of a right coordinate, found with a grid.  Sampling stops
+once the fraction of matched triangles that agree with the best
+hypothesis so far means a sample of true matches has been drawn with
+99.9% confidence.  The best hypothesis is refit to every coordinate
+pair it finds, and those pairs are the matches.
+
+The samples are drawn in a fixed pseudo-random order, so the result is
+repeatable.
+
+@param nleft_coords The number of coordinates in left_coords
+
+@param left_coords The list of pointers to coordinates that the l
+triangles were found from, which their vertex indices refer to.  Any
+of them may be matched.
+
+@param nright_coords, right_coords The same, for the r triangles.
+
+@param ntriangle_matches The number of triangle match pairs
+
+@param triangle_matches An array of triangle match pairs
+
+@param tolerance The matching tolerance in pixels.
+
+@param ncoord_matches On input: The number of coordinate matches
+allocated, which must be at least the smaller of nleft_coords and
+nright_coords.  On output: The number of matches found.  Fewer than 3
+are never returned.
+
+@param refcoord_matches The matched coordinates from left_coords
+
+@param inputcoord_matches The matched coordinates from right_coords,
+in the same order.
+
+@param nconsensus On output, the number of matched triangles whose
+vertices all agree with the final transformation.
+
+@param budget Charged one unit for each coordinate a sample is scored
+on.  May be NULL.
+
+@param error
+*/
+int
+ransac_triangle_matches(
+        const size_t nleft_coords,
+        const coord_t* const * const left_coords,
+        const size_t nright_coords,
+        const coord_t* const * const right_coords,
         const size_t ntriangle_matches,
         const triangle_match_t* const triangle_matches,
+        const double tolerance,
         size_t* ncoord_matches,
         const coord_t** const refcoord_matches,
         const coord_t** const inputcoord_matches,
+        size_t* nconsensus,
+        budget_t* const budget,
         stimage_error_t* const error);
 
 #endif /* _STIMAGE_TRIANGLES_H_ */
@@ -33,6 +33,8 @@ DAMAGE.
 #define _STIMAGE_XYXYMATCH_H_
 
 #include "lib/util.h"
+#include "immatch/lib/tolerance.h"
+#include "immatch/lib/triangles.h"
 
 typedef struct {
     coord_t coord;
@@ -41,12 +43,294 @@ typedef struct {
     size_t  ref_idx;
 } xyxymatch_output_t;
 
+/**
+A function that receives each match found by xyxymatch, in place of
+it being stored in the output array.  See xyxymatch_options_t.
+
+@param data The output_data member of the options
+
+@param match The match
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error, which stops the matching
+*/
+typedef int (*xyxymatch_output_func_t)(
+        void* data,
+        const xyxymatch_output_t* const match,
+        stimage_error_t* const error);
+
+/**
+A buffer of matches, for use with xyxymatch_output_buffer_append as
+the output function of xyxymatch.  It either grows as matches are
+added, so that it only takes as much memory as there are matches, or
+has a fixed size.
+*/
+typedef struct {
+    /** The matches */
+    xyxymatch_output_t* output; /* [size] */
+    /** The number of matches in output */
+    size_t              n;
+    /** The number of matches output has room for */
+    size_t              size;
+    /** If non-zero, output is owned by the buffer, and grows as
+        needed.  Otherwise it is not owned, and adding a match to a
+        full buffer is an error. */
+    int                 growable;
+    /** Set when a match did not fit in a buffer that is not
+        growable */
+    int                 full;
+} xyxymatch_output_buffer_t;
+
+/**
+Initialize an output buffer.
+
+@param buffer The buffer to initialize
+
+@param output If NULL, the buffer starts empty and grows as needed.
+Otherwise, the fixed-size array to store the matches in.
+
+@param size The size of output
+*/
+void
+xyxymatch_output_buffer_init(
+        xyxymatch_output_buffer_t* const buffer,
+        xyxymatch_output_t* const output, /* [size] */
+        const size_t size);
+
+/**
+Add a match to an output buffer.  Has the signature of an
+xyxymatch_output_func_t, with the buffer as the data.
+*/
+int
+xyxymatch_output_buffer_append(
+        void* data,
+        const xyxymatch_output_t* const match,
+        stimage_error_t* const error);
+
+/**
+Give back the memory a growable buffer does not use.
+*/
+void
+xyxymatch_output_buffer_trim(
+        xyxymatch_output_buffer_t* const buffer);
+
+/**
+Free the memory held by a growable buffer.
+*/
+void
+xyxymatch_output_buffer_free(
+        xyxymatch_output_buffer_t* const buffer);
+
 typedef enum {
     xyxymatch_algo_tolerance,
     xyxymatch_algo_triangles,
+    xyxymatch_algo_offsets,
     xyxymatch_algo_LAST
 } xyxymatch_algo_e;
 
+/**
+Less commonly used parameters to xyxymatch.  These all have sensible
+defaults, which are filled in by xyxymatch_options_init.  New members
+should be added here, rather than as arguments to xyxymatch, so that
+existing callers are unaffected.
+*/
+typedef struct {
+    /** How the tolerance algorithm finds the input coordinates near
+        each reference coordinate.  See match_tolerance.  (auto) */
+    tolerance_search_e search;
+
+    /** If non-zero, the triangles algorithm uses all of the
+        coordinates, forming triangles from each coordinate and pairs
+        of its nneighbors nearest neighbors, rather than every
+        triangle from at most nmatch coordinates.  See
+        find_triangles_local.  (0) */
+    size_t nneighbors;
+
+    /** The number of threads the triangles algorithm uses to find
+        and sort the triangles.  If 0, use one per processor.  The
+        matches do not depend on the number of threads.  (1) */
+    size_t nthreads;
+
+    /** How the triangles algorithm finds the coordinate matches from
+        the matched triangles.  See match_triangles.  (reject) */
+    triangle_consensus_e consensus;
+
+    /** Limits the work the triangles algorithm does, so that a bad
+        list fails quickly with an error rather than running for a
+        long time.  Not owned, and may be shared between calls on
+        different threads.  See match_triangles.  (NULL) */
+    budget_t* budget;
+
+    /** The rotations, in degrees, that the offsets algorithm tries.
+        If NULL, only 0.0.  Not owned.  See find_offsets_transform.
+        (NULL) */
+    size_t        nrotations;
+    const double* rotations;
+
+    /** The scales that the offsets algorithm tries.  If NULL, only
+        1.0.  Not owned.  (NULL) */
+    size_t        nscales;
+    const double* scales;
+
+    /** If not NULL, each match is passed to output_func, with
+        output_data, rather than being stored in the output array of
+        xyxymatch.  The output array may then be NULL, and its size is
+        ignored.  The matches are passed in the same order they would
+        be stored.  (NULL) */
+    xyxymatch_output_func_t output_func;
+    void*                   output_data;
+} xyxymatch_options_t;
+
+/**
+Fill in an xyxymatch_options_t with the default values.
+*/
+void
+xyxymatch_options_init(
+        xyxymatch_options_t* const options);
+
+/**
+A reference coordinate list that has been prepared for matching: the
+coordinates are sorted with xysort and culled with xycoincide.  The
+same prepared list can be used to match any number of input lists
+with xyxymatch_prepared, and it is not modified by matching, so it may
+be shared between threads.
+
+The reference triangles of the triangles algorithm may also be found
+once, with xyxymatch_ref_build_triangles, or attached from elsewhere,
+for example from a memory-mapped file, with
+xyxymatch_ref_set_triangles.  They are then used whenever the same
+nmatch, nneighbors, tolerance and maxratio are given to
+xyxymatch_prepared, and only the input triangles are found for each
+input list.
+*/
+typedef struct {
+    /** The number of reference coordinates */
+    size_t          nref;
+    /** The reference coordinates.  Not owned. */
+    const coord_t*  ref;
+    /** The minimum separation used to cull the coordinates */
+    double          separation;
+    /** The number of coordinates left after culling */
+    size_t          nref_unique;
+    /** Pointers to the culled coordinates, sorted in (y, x) */
+    const coord_t** ref_sorted; /* [nref_unique] */
+    /** The number of reference triangles, if any */
+    size_t            ntriangles;
+    /** The reference triangles found from ref_sorted, or NULL */
+    const triangle_t* triangles; /* [ntriangles] */
+    /** The reference triangles, if they are owned by this object */
+    triangle_t*       triangles_owned;
+    /** The parameters the reference triangles were found with */
+    size_t            triangles_nmatch;
+    size_t            triangles_nneighbors;
+    double            triangles_tolerance;
+    double            triangles_maxratio;
+} xyxymatch_ref_t;
+
+/**
+Initialize all of the members of an xyxymatch_ref_t to NULL/zero so
+that it can be safely passed to xyxymatch_ref_free.
+*/
+void
+xyxymatch_ref_new(
+        xyxymatch_ref_t* const ref);
+
+/**
+Prepare a reference coordinate list for matching.
+
+@param prepared The object to initialize
+
+@param nref The number of reference coordinates
+
+@param ref Array of reference coordinates.  This is not copied, so it
+must remain valid for the lifetime of prepared.
+
+@param separation The minimum separation for objects in the reference
+coordinate list.  This is also used for the input coordinate lists
+when matching with xyxymatch_prepared.  (9.0)
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+xyxymatch_ref_init(
+        xyxymatch_ref_t* const prepared,
+        const size_t nref,
+        const coord_t* const ref /*[nref]*/,
+        const double separation,
+        stimage_error_t* const error);
+
+/**
+Find the reference triangles of a prepared reference list, so that
+they do not need to be found again for each input list.  Any
+reference triangles it already had are replaced.
+
+@param prepared A reference list prepared with xyxymatch_ref_init
+
+@param nmatch, nneighbors, tolerance, maxratio The parameters of the
+triangles algorithm, as for xyxymatch.  The triangles are only used
+when xyxymatch_prepared is given the same values.
+
+@param nthreads The number of threads to find the triangles with.  If
+0, use one per processor.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+xyxymatch_ref_build_triangles(
+        xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        stimage_error_t* const error);
+
+/**
+Use reference triangles found earlier, for example by
+xyxymatch_ref_build_triangles on a prepared list of the same
+coordinates with the same separation.  Any reference triangles it
+already had are replaced.
+
+@param prepared A reference list prepared with xyxymatch_ref_init
+
+@param nmatch, nneighbors, tolerance, maxratio The parameters the
+triangles were found with.
+
+@param ntriangles The number of triangles
+
+@param triangles The triangles.  These are not copied, so they must
+remain valid for the lifetime of prepared.  Each vertex is checked to
+be within the culled reference list.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+xyxymatch_ref_set_triangles(
+        xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t ntriangles,
+        const triangle_t* const triangles /*[ntriangles]*/,
+        stimage_error_t* const error);
+
+/**
+Free the memory held by a prepared reference list.  The reference
+coordinates themselves, and any reference triangles given to
+xyxymatch_ref_set_triangles, are not freed.
+*/
+void
+xyxymatch_ref_free(
+        xyxymatch_ref_t* const prepared);
+
 /**
 xyxymatch
 
@@ -62,10 +346,12 @@ xyxymatch
        output: The numbe of output coordinate pairs found
 
 @param output Array of xyxymatch_output_t objects to store the output
-       information.  Should be allocated to the same size as the
-       number of input coordinates, but it doesn't have to be.  If
-       the allocated space is not big enough for all the results, an
-       error will be emitted.
+       information.  There is at most one match for each reference
+       coordinate, so it should be allocated to the larger of the
+       number of input and reference coordinates, but it doesn't
+       have to be.  If the allocated space is not big enough for all
+       the results, an error will be emitted.  May be NULL if
+       options->output_func is set.
 
 @param origin The origin of the input coordinate system.  If NULL,
        assume (0.0, 0.0)
@@ -114,6 +400,18 @@ xyxymatch
       the x and y axes, and higher order distortion terms in the
       coordinate transformation.
 
+    - xyxymatch_algo_offsets: A linear transformation is applied to
+      the input coordinate list, and the shift between it and the
+      reference list is found from the peak of a histogram of the
+      offsets between every pair of reference and input coordinates.
+      The rotations and scales in options are each tried, and the one
+      with the highest peak kept.  The input list is transformed by
+      the result and matched with the tolerance algorithm.  This
+      needs neither an estimate of the shift nor tie points, and is
+      much faster than the triangles algorithm for lists that differ
+      mostly by a shift.  If the peak has fewer than 3 pairs, there
+      are no matches.
+
 @param tolerance The matching tolerance in pixels.
 
 @param separation The minimum separation for objects in the input and
@@ -124,9 +422,11 @@ to matching. (9.0)
 @param nmatch The maximum number of reference and input coordinates
 used by the xyxymatch_algo_triangles pattern matching algorithm.  If
 either list contains more coordinates than nmatch, the lists are
-subsampled.  nmatch should be kept small as the computation and memory
-requirements of the triangles algorithm depend on a high power of
-lengths of the respective lists.
+subsampled, a linear transformation is fit to the matches found from
+the subsamples, and the entire lists are then matched with the
+tolerance algorithm.  nmatch should be kept small as the computation
+and memory requirements of the triangles algorithm depend on a high
+power of lengths of the respective lists.
 
 @param maxratio The maximum ratio of the longest to shortest side of the
 triangles generated by the triangles pattern matching algorithm.
@@ -137,6 +437,9 @@ set higher than 10.0 but may be set as low as 5.0.
 @param nreject The maximum number of rejection iterations for the
 triangles pattern matching algorithm.
 
+@param options Additional parameters.  If NULL, the defaults from
+xyxymatch_options_init are used.
+
 @return Non-zero on error
  */
 int
@@ -154,6 +457,87 @@ xyxymatch(
     const size_t nmatch,
     const double maxratio,
     const size_t nreject,
+    const xyxymatch_options_t* options,
+    stimage_error_t* const error);
+
+/**
+The same as xyxymatch, but using a reference coordinate list that has
+already been prepared with xyxymatch_ref_init.  The input coordinates
+are culled using the separation from the prepared reference list.
+
+@return Non-zero on error
+*/
+int
+xyxymatch_prepared(
+    const size_t ninput, const coord_t* const input /*[ninput]*/,
+    const xyxymatch_ref_t* const ref,
+    size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+    const coord_t* const origin, /* good default: 0.0, 0.0 */
+    const coord_t* const mag, /* good default: 1.0, 1.0 */
+    const coord_t* const rotation, /* good default: 0.0, 0.0 */
+    const coord_t* const ref_origin, /* good default: 0.0, 0.0 */
+    const xyxymatch_algo_e algorithm,
+    const double tolerance,
+    const size_t nmatch,
+    const double maxratio,
+    const size_t nreject,
+    const xyxymatch_options_t* options,
+    stimage_error_t* const error);
+
+/**
+Match a number of input coordinate lists ("frames") against the same
+prepared reference list, spreading the frames over a number of
+threads.  Each frame gives exactly the same results as passing it to
+xyxymatch_prepared on its own, except that a frame with no input
+coordinates simply has no matches.
+
+@param nframes The number of input coordinate lists
+
+@param ninputs The number of input coordinates in each frame
+
+@param inputs The input coordinates of each frame
+
+@param prepared A reference list prepared with xyxymatch_ref_init
+
+@param noutputs Output: The number of output coordinate pairs found in
+       each frame.
+
+@param outputs Output: The matches of each frame, each in an array of
+       noutputs[i] xyxymatch_output_t allocated with malloc.  The
+       caller must free them, even if an error occurred, in which
+       case the frames that were not matched are set to NULL.
+
+@param nthreads The maximum number of threads to use.  If 0, use one
+       per processor.
+
+@param error Set to a meaningful message if an error occurred.  If
+       more than one frame fails, the error of the first of them is
+       reported.
+
+See xyxymatch for the remaining parameters, which are the same for
+all of the frames.
+
+@return Non-zero on error
+*/
+int
+xyxymatch_many(
+    const size_t nframes,
+    const size_t* const ninputs /*[nframes]*/,
+    const coord_t* const* const inputs /*[nframes][ninputs[i]]*/,
+    const xyxymatch_ref_t* const prepared,
+    size_t* const noutputs /*[nframes]*/,
+    xyxymatch_output_t** const outputs /*[nframes][noutputs[i]]*/,
+    const coord_t* const origin, /* good default: 0.0, 0.0 */
+    const coord_t* const mag, /* good default: 1.0, 1.0 */
+    const coord_t* const rotation, /* good default: 0.0, 0.0 */
+    const coord_t* const ref_origin, /* good default: 0.0, 0.0 */
+    const xyxymatch_algo_e algorithm,
+    const double tolerance,
+    const size_t nmatch,
+    const double maxratio,
+    const size_t nreject,
+    const xyxymatch_options_t* options,
+    const size_t nthreads,
     stimage_error_t* const error);
 
 #endif /* _STIMAGE_XYXYMATCH_H_ */
@@ -0,0 +1,153 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#ifndef _STIMAGE_BUDGET_H_
+#define _STIMAGE_BUDGET_H_
+
+#include "lib/error.h"
+#include "lib/threads.h"
+#include "lib/util.h"
+
+/*
+A limit on the work done by a long-running call, so that a bad input
+makes it fail quickly rather than keeping its thread busy.
+
+The work is counted in abstract units charged by the code doing it
+(for triangle matching, the candidate triangles built and the
+triangles compared), so the same input always runs out of budget at
+the same place.  There may also be a wall-clock time limit, and a
+callback that can cancel the work, for example when the user
+interrupts it.  The budget may be shared by the threads of
+parallel_for.
+
+Once the budget runs out, every later charge against it also fails,
+so that all of the threads doing the work stop soon.
+*/
+
+/**
+Called from time to time while charging a budget.  Returns non-zero
+to cancel the work.  It may be called from any of the threads that
+charge the budget.
+*/
+typedef int (*budget_cancel_func_t)(void* data);
+
+typedef enum {
+    budget_ok,
+    budget_exceeded_work,
+    budget_exceeded_time,
+    budget_cancelled
+} budget_status_e;
+
+typedef struct {
+    /** The most units of work that may be done, or 0 for no limit */
+    size_t               max_work;
+
+    /** The time limit in seconds from budget_init, or 0 for none */
+    double               timeout;
+
+    /** The callback that may cancel the work, or NULL */
+    budget_cancel_func_t cancel;
+    void*                cancel_data;
+
+    /* The rest is private */
+    size_t               work;
+    double               deadline;
+    double               next_cancel;
+    budget_status_e      status;
+    threads_mutex_t      mutex;
+} budget_t;
+
+/**
+Start a budget.  The time limit counts from now.  Must be freed with
+budget_free.
+
+@param budget The budget to initialize
+
+@param max_work The most units of work that may be done, or 0 for no
+limit
+
+@param timeout The time limit in seconds, or 0 for none
+
+@param cancel Called from time to time while charging the budget to
+check whether the work should be cancelled.  May be NULL.
+
+@param cancel_data Passed unchanged to cancel
+*/
+void
+budget_init(
+        budget_t* const budget,
+        const size_t max_work,
+        const double timeout,
+        budget_cancel_func_t cancel,
+        void* cancel_data);
+
+/**
+Free the resources held by a budget.
+*/
+void
+budget_free(
+        budget_t* const budget);
+
+/**
+Charge some work against a budget, before doing it.
+
+@param budget The budget.  If NULL, there is no limit.
+
+@param work The units of work about to be done
+
+@param stage What the work is, to finish the error message, for
+example "merging triangles"
+
+@param error Set to a meaningful message if the budget has run out.
+
+@return Non-zero if the budget has run out, and the work should not be
+done
+*/
+int
+budget_charge(
+        budget_t* const budget,
+        const size_t work,
+        const char* const stage,
+        stimage_error_t* const error);
+
+/**
+Returns why the budget ran out, or budget_ok if it has not.
+*/
+budget_status_e
+budget_get_status(
+        budget_t* const budget);
+
+#endif /* _STIMAGE_BUDGET_H_ */
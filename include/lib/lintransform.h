@@ -87,4 +87,29 @@ apply_lintransform(
     const coord_t* const input, /* [ncoords] */
     coord_t* output);
 
+/**
+Fit a linear transformation, in the least-squares sense, that maps one
+list of coordinates onto another.
+
+With at least 3 coordinates that are not all on a line, all six
+coefficients are fit.  Otherwise, only a shift is fit, with the
+identity for the rest of the transformation, and with no coordinates
+at all the result is the identity.
+
+@param ncoords The number of coordinate pairs
+
+@param input The coordinates to transform from
+
+@param ref The coordinates to transform to, in the same order as input
+
+@param coeffs The output set of coefficients, as used by
+apply_lintransform
+*/
+void
+fit_lintransform(
+    size_t ncoords,
+    const coord_t* const input, /* [ncoords] */
+    const coord_t* const ref, /* [ncoords] */
+    lintransform_t* coeffs);
+
 #endif /* _STIMAGE_LINTRANSFORM_H_ */
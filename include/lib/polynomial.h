@@ -283,6 +283,114 @@ eval_legendre(
         double* const zfit,
         stimage_error_t* const error);
 
+/**
+Evaluate the partial derivatives of a polynomial with respect to x
+and y.  The arguments are the same as for eval_poly, and an order of 1
+in x or y is handled as eval_1dpoly does.
+
+@param dzdx The derivative with respect to x at each point
+
+@param dzdy The derivative with respect to y at each point
+
+@return non-zero on failure
+ */
+int
+deriv_poly(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error);
+
+/**
+Evaluate the partial derivatives of a Chebyshev polynomial with respect to x
+and y.  The arguments are the same as for eval_chebyshev, and an order of 1
+in x or y is handled as eval_1dchebyshev does.
+
+@param dzdx The derivative with respect to x at each point
+
+@param dzdy The derivative with respect to y at each point
+
+@return non-zero on failure
+ */
+int
+deriv_chebyshev(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error);
+
+/**
+Evaluate the partial derivatives of a Legendre polynomial with respect to x
+and y.  The arguments are the same as for eval_legendre, and an order of 1
+in x or y is handled as eval_1dlegendre does.
+
+@param dzdx The derivative with respect to x at each point
+
+@param dzdy The derivative with respect to y at each point
+
+@return non-zero on failure
+ */
+int
+deriv_legendre(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error);
+
+/**
+Evaluate a polynomial surface, of any of the types, from its basis
+functions at each point, already computed by basis_poly,
+basis_chebyshev or basis_legendre.
+
+@param xb The x basis functions [xorder * ncoord]
+
+@param yb The y basis functions [yorder * ncoord]
+
+See eval_poly for the remaining parameters.
+*/
+int
+eval_basis(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const xterms_e xterms,
+        const double* const xb,
+        const double* const yb,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error);
+
 int
 basis_poly(
         const size_t ncoord,
@@ -0,0 +1,118 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#ifndef _STIMAGE_RADIXSORT_H_
+#define _STIMAGE_RADIXSORT_H_
+
+#include <string.h>
+
+#include "lib/util.h"
+
+/*
+A stable LSD radix sort of records with one or two 64-bit keys.
+
+Sorting keys copied out into a contiguous buffer avoids the function
+call and the pointer dereferences that qsort makes for every
+comparison, and takes a fixed number of passes over the data however
+it is ordered.  Passes over bytes of the key that are the same in
+every record are skipped, so keys with only a few significant bytes
+(small ranges of values) are sorted in only a few passes.
+
+Floating-point values are turned into keys with radix_key_double,
+which orders them the same way as the < operator.
+*/
+
+#define RADIX_MAX_KEYS 2
+
+typedef struct {
+    /** The keys, compared in order */
+    STIMAGE_UInt64 key[RADIX_MAX_KEYS];
+
+    /** The index of the record in whatever is being sorted */
+    size_t index;
+} radix_record_t;
+
+/**
+Convert a double into a key that sorts in the same order.  -0.0 and
+0.0 become the same key, since they compare equal, and all NaNs
+become the largest key, so they sort after everything else.
+*/
+static inline STIMAGE_UInt64
+radix_key_double(
+        double value) {
+
+    STIMAGE_UInt64 bits;
+
+    if (value != value) {
+        return ~(STIMAGE_UInt64)0;
+    }
+
+    if (value == 0.0) {
+        value = 0.0;
+    }
+
+    memcpy(&bits, &value, sizeof(STIMAGE_UInt64));
+
+    /* Flip all of the bits of negative numbers, so larger magnitudes
+       sort first, and just the sign bit of positive numbers, so they
+       sort after the negative ones */
+    if (bits >> 63) {
+        return ~bits;
+    }
+    return bits | ((STIMAGE_UInt64)1 << 63);
+}
+
+/**
+Sort records by their keys.  The sort is stable, so records with
+equal keys stay in the order they were given in.
+
+@param n The number of records
+
+@param nkeys The number of keys to sort on, 1 or 2.  Records are
+ordered by key[0], and then by key[1] if nkeys is 2.
+
+@param records The records to sort, in place
+
+@param tmp Scratch space for n records
+*/
+void
+radix_sort(
+        const size_t n,
+        const size_t nkeys,
+        radix_record_t* const records, /* [n] */
+        radix_record_t* const tmp /* [n] */);
+
+#endif /* _STIMAGE_RADIXSORT_H_ */
@@ -0,0 +1,130 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#ifndef _STIMAGE_THREADS_H_
+#define _STIMAGE_THREADS_H_
+
+#if defined(_WIN32)
+    #include <windows.h>
+#else
+    #include <pthread.h>
+#endif
+
+#include "lib/error.h"
+#include "lib/util.h"
+
+/*
+A minimal, portable way to spread independent pieces of work over a
+number of native threads.  POSIX threads are used everywhere except
+Windows, which uses its own thread API.
+*/
+
+/*
+A mutex and a thread, for state that is shared by the threads of
+parallel_for.
+*/
+#if defined(_WIN32)
+    typedef CRITICAL_SECTION threads_mutex_t;
+    typedef HANDLE           threads_thread_t;
+    #define threads_mutex_init(m)    InitializeCriticalSection(m)
+    #define threads_mutex_destroy(m) DeleteCriticalSection(m)
+    #define threads_mutex_lock(m)    EnterCriticalSection(m)
+    #define threads_mutex_unlock(m)  LeaveCriticalSection(m)
+#else
+    typedef pthread_mutex_t  threads_mutex_t;
+    typedef pthread_t        threads_thread_t;
+    #define threads_mutex_init(m)    pthread_mutex_init((m), NULL)
+    #define threads_mutex_destroy(m) pthread_mutex_destroy(m)
+    #define threads_mutex_lock(m)    pthread_mutex_lock(m)
+    #define threads_mutex_unlock(m)  pthread_mutex_unlock(m)
+#endif
+
+/**
+The work done for each index by parallel_for.
+
+@param data The data pointer passed to parallel_for
+
+@param i The index of the piece of work, in [0, n)
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+typedef int (*parallel_for_func_t)(
+        void* data,
+        size_t i,
+        stimage_error_t* const error);
+
+/**
+Returns the number of processors available, which is always at least 1.
+*/
+size_t
+threads_ncpu(void);
+
+/**
+Call func for every index in [0, n), using up to nthreads threads.
+
+Indices are handed out in increasing order to whichever thread is
+free, so func must be safe to call concurrently for different indices.
+When nthreads is 1 (or n is 1), everything runs in the calling thread.
+
+Once func fails for any index, no new indices are handed out.  Every
+index below a failed one has already been handed out, so the error
+that is reported, that of the lowest failed index, does not depend
+on the scheduling.
+
+@param n The number of pieces of work
+
+@param nthreads The maximum number of threads to use.  If 0, use
+threads_ncpu().
+
+@param func The function to call for each index
+
+@param data Passed unchanged to func
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+parallel_for(
+        const size_t n,
+        const size_t nthreads,
+        parallel_for_func_t func,
+        void* data,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_THREADS_H_ */
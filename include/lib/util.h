@@ -50,6 +50,7 @@ DAMAGE.
 
 #include <math.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "lib/error.h"
 
@@ -86,47 +87,74 @@ DAMAGE.
     #endif
 #endif
 
+#if defined(_MSC_VER)
+    typedef unsigned __int64         STIMAGE_UInt64;
+#else
+    #if defined(_ISOC99_SOURCE)
+        typedef uint64_t                 STIMAGE_UInt64;
+    #else
+        typedef unsigned long long       STIMAGE_UInt64;
+    #endif
+#endif
+
+#if defined(_MSC_VER)
+    typedef unsigned __int32         STIMAGE_UInt32;
+#else
+    typedef unsigned int             STIMAGE_UInt32;
+#endif
+
+/* The bits of a double.  They are copied with memcpy, which compilers
+   turn into a single move, because reading them through a pointer to
+   an integer breaks the strict aliasing rules. */
+static inline STIMAGE_Int64
+double_bits(
+    const double d) {
+    STIMAGE_Int64 u;
+    memcpy(&u, &d, sizeof(STIMAGE_Int64));
+    return u;
+}
+
 #if !defined(U64)
-    #define U64(u) (* (STIMAGE_Int64 *) &(u) )
+    #define U64(u) double_bits(u)
 #endif /* U64 */
 
 #if !defined(isnan64)
     #if !defined(_MSC_VER)
         #define isnan64(u) \
-            ( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)  && ((U64(u) &  0x000fffffffffffffLL) != 0)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)  && ((U64(u) &  0x000fffffffffffffLL) != 0)) ? 1:0)
     #else
         #define isnan64(u) \
-            ( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)  && ((U64(u) & 0x000fffffffffffffi64) != 0)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)  && ((U64(u) & 0x000fffffffffffffi64) != 0)) ? 1:0)
     #endif
 #endif /* isnan64 */
 
 #if !defined(isinf64)
     #if !defined(_MSC_VER)
         #define isinf64(u) \
-            ( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)  && ((U64(u) &  0x000fffffffffffffLL) == 0)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)  && ((U64(u) &  0x000fffffffffffffLL) == 0)) ? 1:0)
     #else
         #define isinf64(u) \
-            ( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)  && ((U64(u) & 0x000fffffffffffffi64) == 0)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)  && ((U64(u) & 0x000fffffffffffffi64) == 0)) ? 1:0)
     #endif
 #endif /* isinf64 */
 
 #if !defined(isfinite64)
     #if !defined(_MSC_VER)
         #define isfinite64(u) \
-            ( (( U64(u) & 0x7ff0000000000000LL)  != 0x7ff0000000000000LL)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000LL)  != 0x7ff0000000000000LL)) ? 1:0)
     #else
         #define isfinite64(u) \
-            ( (( U64(u) & 0x7ff0000000000000i64) != 0x7ff0000000000000i64)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000i64) != 0x7ff0000000000000i64)) ? 1:0)
     #endif
 #endif /* isfinite64 */
 
 #if !defined(notisfinite64)
     #if !defined(_MSC_VER)
         #define notisfinite64(u) \
-            ( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000LL)  == 0x7ff0000000000000LL)) ? 1:0)
     #else
         #define notisfinite64(u) \
-            ( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)) ? 1:0
+            (( (( U64(u) & 0x7ff0000000000000i64) == 0x7ff0000000000000i64)) ? 1:0)
     #endif
 #endif /* notisfinite64 */
 
@@ -44,6 +44,14 @@ Removes coordinates from the list that are too close together, as
 given by tolerance.  This function assumes that the coordinates have
 already been sorted using xysort.
 
+Coordinates are kept in sorted order: each one is removed if it is
+within the tolerance of an earlier coordinate that was kept.
+Coordinates that are not finite are always kept.  The search sweeps
+forward in y from each coordinate, unless many coordinates share a
+narrow range of y, when it uses a grid hash with cells the size of the
+tolerance instead, so it takes about linear time however the
+coordinates are distributed.
+
 @param coords The number of coordinates
 
 @param input A sorted list of pointers to coordinates
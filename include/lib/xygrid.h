@@ -0,0 +1,229 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+
+#ifndef _STIMAGE_XYGRID_H_
+#define _STIMAGE_XYGRID_H_
+
+#include "lib/util.h"
+#include "lib/xybbox.h"
+
+/*
+A uniform grid hash over a list of coordinates.
+
+The plane is divided into square cells of at least cell_size on a
+side, so every coordinate within cell_size of a given point lies in
+the 3x3 block of cells around the point's cell.  When the coordinates
+are sparse, the cells are made larger so that each holds about one
+coordinate.  The density is taken from the box holding the bulk of
+the coordinates, leaving out a few percent at each end of each axis,
+so a handful of distant coordinates can not make the cells huge.
+Cells are identified by a pair of integer indices that are hashed
+into a power-of-two number of buckets, so the memory used is
+proportional to the number of coordinates rather than the area they
+cover.
+
+The hash numbers the cells in row-major order, wrapping around the
+buckets, so the three cells of a row of the 3x3 block land in
+consecutive buckets and can be scanned as a single range.  When there
+are more buckets than cells covering the bulk of the coordinates there
+are no collisions among them.  Otherwise, a range may also contain
+entries from cells that are far away, so callers must still check the
+distance (or the cell, using xygrid_cell) of each entry.
+
+Each entry holds a copy of its coordinate, so scanning a range does
+not need to follow any pointers, and its index in the list the grid
+was built from.  Within a bucket, the entries are in the same order as
+that list.  Coordinates that are not finite are left out of the grid.
+*/
+
+typedef struct {
+    coord_t coord;
+    size_t  index;
+} xygrid_entry_t;
+
+typedef struct {
+    STIMAGE_Int64 x;
+    STIMAGE_Int64 y;
+} xygrid_cell_t;
+
+typedef struct {
+    size_t          nentries;
+    double          cell_size;
+    coord_t         origin;
+    size_t          row_stride;
+    size_t          nbuckets;
+    size_t*         bucket_start; /* [nbuckets + 1] */
+    xygrid_entry_t* entries;      /* [nentries] */
+} xygrid_t;
+
+/**
+Initialize all of the members of a grid to NULL/zero so that it can
+be safely passed to xygrid_free.
+*/
+void
+xygrid_new(
+        xygrid_t* const grid);
+
+/**
+Build a grid over a list of coordinates.
+
+@param grid The grid to initialize
+
+@param ncoords The number of coordinates
+
+@param coords A list of pointers to coordinates.  The entries of the
+grid refer to the coordinates by their index in this list.
+
+@param cell_size The minimum cell size.  Must be > 0.  The actual
+size is stored in grid->cell_size.
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+xygrid_init(
+        xygrid_t* const grid,
+        const size_t ncoords,
+        const coord_t* const * const coords, /* [ncoords] */
+        const double cell_size,
+        stimage_error_t* const error);
+
+/**
+Find the box holding the bulk of a list of coordinates, leaving out a
+few percent of them at each end of each axis, so that a handful of
+distant coordinates can not stretch it.  The ends are estimated from
+an evenly strided sample of the coordinates.
+
+@param ncoords The number of coordinates
+
+@param coords A list of pointers to coordinates
+
+@param extent On output, the box.  Its members are NaN if none of the
+coordinates are finite.
+
+@param ninside On output, the number of coordinates inside the box
+
+@param error Set to a meaningful message if an error occurred.
+
+@return Non-zero on error
+*/
+int
+xygrid_extent(
+        const size_t ncoords,
+        const coord_t* const * const coords, /* [ncoords] */
+        bbox_t* const extent,
+        size_t* const ninside,
+        stimage_error_t* const error);
+
+/**
+Free the memory held by a grid.
+*/
+void
+xygrid_free(
+        xygrid_t* const grid);
+
+/**
+Find the cell containing the given (finite) coordinate.
+*/
+static inline void
+xygrid_cell(
+        const xygrid_t* const grid,
+        const coord_t* const c,
+        xygrid_cell_t* const cell) {
+
+    /* Keep the cell indices well within the range of a 64-bit
+       integer.  Coordinates this far out all share the outermost
+       cells, which keeps the neighbourhood search correct. */
+    const double limit = 1e15;
+    double x, y;
+
+    x = (c->x - grid->origin.x) / grid->cell_size;
+    y = (c->y - grid->origin.y) / grid->cell_size;
+    cell->x = (STIMAGE_Int64)floor(CLAMP(x, -limit, limit));
+    cell->y = (STIMAGE_Int64)floor(CLAMP(y, -limit, limit));
+}
+
+/**
+Return the bucket that the given cell hashes to.
+*/
+static inline size_t
+xygrid_hash(
+        const xygrid_t* const grid,
+        const xygrid_cell_t* const cell) {
+
+    const size_t hash =
+        (size_t)cell->x + (size_t)cell->y * grid->row_stride;
+
+    return hash & (grid->nbuckets - 1);
+}
+
+/**
+Find the entries in the buckets for the three cells centered on the
+given cell in x.  Since the buckets may wrap around the end of the
+hash, the entries are returned as up to two ranges, [start[i],
+end[i]).
+
+@return The number of ranges
+*/
+static inline size_t
+xygrid_row(
+        const xygrid_t* const grid,
+        const xygrid_cell_t* const center,
+        size_t* const start, /* [2] */
+        size_t* const end /* [2] */) {
+
+    xygrid_cell_t left;
+    size_t        hash;
+
+    left.x = center->x - 1;
+    left.y = center->y;
+    hash = xygrid_hash(grid, &left);
+
+    start[0] = grid->bucket_start[hash];
+    if (hash + 3 <= grid->nbuckets) {
+        end[0] = grid->bucket_start[hash + 3];
+        return 1;
+    }
+
+    end[0] = grid->bucket_start[grid->nbuckets];
+    start[1] = grid->bucket_start[0];
+    end[1] = grid->bucket_start[hash + 3 - grid->nbuckets];
+    return 2;
+}
+
+#endif /* _STIMAGE_XYGRID_H_ */
@@ -0,0 +1,118 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#ifndef _STIMAGE_SURFACE_BASIS_H_
+#define _STIMAGE_SURFACE_BASIS_H_
+
+#include "surface.h"
+
+/**
+The basis functions of a surface at a fixed set of coordinates.
+
+Fitting a surface, and evaluating it, both start by computing the
+value of each of its basis functions at each coordinate.  When many
+surfaces are fit to, or evaluated at, the same coordinates, as the x
+and y surfaces of geomap are in every rejection iteration, the basis
+functions can be computed once and shared by all of them.
+
+The basis functions of each order do not depend on the highest order,
+so a basis computed to some order serves every surface of the same
+type and bbox whose order is no higher.
+*/
+typedef struct {
+    surface_type_e type;
+    size_t         ncoord;
+    size_t         xorder;
+    size_t         yorder;
+    double         xrange;
+    double         xmaxmin;
+    double         yrange;
+    double         ymaxmin;
+    double*        xbasis; /* [xorder * ncoord] */
+    double*        ybasis; /* [yorder * ncoord] */
+} surface_basis_t;
+
+/**
+Mark a basis as uninitialized, so that surface_basis_free is safe to
+call on it.
+*/
+void
+surface_basis_new(
+        surface_basis_t* const b);
+
+/**
+Compute the basis functions of a surface at a set of coordinates.
+
+@param b The basis
+
+@param s A surface with the type and bbox of the surfaces that will
+       use the basis, and the highest order in x and y of any of them.
+       Only its geometry is used.
+
+@param ncoord The number of coordinates
+
+@param coord The coordinates
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_basis_init(
+        surface_basis_t* const b,
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        stimage_error_t* const error);
+
+/**
+Returns non-zero if the basis can stand in for the basis functions of
+the surface s at ncoord coordinates: it has the same type and bbox,
+an order at least as high, and the same number of coordinates.  It is
+up to the caller to use it with the same coordinates it was computed
+for.
+*/
+int
+surface_basis_covers(
+        const surface_basis_t* const b,
+        const surface_t* const s,
+        const size_t ncoord);
+
+void
+surface_basis_free(
+        surface_basis_t* const b);
+
+#endif
@@ -37,6 +37,7 @@ DAMAGE.
 #ifndef _STIMAGE_SURFACE_FIT_H_
 #define _STIMAGE_SURFACE_FIT_H_
 
+#include "surface/basis.h"
 #include "surface/surface.h"
 
 typedef enum {
@@ -94,4 +95,153 @@ surface_fit(
         surface_fit_error_e* const error_type,
         stimage_error_t* const error);
 
+/**
+Fit a surface, as surface_fit does with user weights, to points whose
+basis functions are already computed.
+
+@param s Surface descriptor
+
+@param basis The basis functions at the data points.  It must cover s
+       (see surface_basis_covers).
+
+@param z data array [basis->ncoord]
+
+@param w weights array [basis->ncoord]
+
+@param error_type
+
+@param error
+*/
+int
+surface_fit_basis(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const double* const z,
+        const double* const w,
+        /* Output */
+        surface_fit_error_e* const error_type,
+        stimage_error_t* const error);
+
+/* was: dgsacpts */
+
+/**
+Accumulate the inner products of the basis functions, and of the basis
+functions and the data ordinates, for a number of data points into the
+normal equations of a surface, as surface_fit does.  Together with
+surface_zero and surface_fit_solve, this fits a surface to points
+given a chunk at a time: zero the surface, add each chunk, and solve.
+
+@param s Surface descriptor
+
+@param ncoord Number of data points
+
+@param coord Data points
+
+@param z data array
+
+@param w weights array.  Overwritten with the weights used unless
+       weight_type is surface_fit_weight_user.
+
+@param weight_type type of weights
+
+@param error
+*/
+int
+surface_fit_add_points(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        stimage_error_t* const error);
+
+/**
+Accumulate the normal equations of a surface for points whose basis
+functions are already computed, as surface_fit_add_points does with
+user weights.
+
+@param s Surface descriptor
+
+@param basis The basis functions at the data points.  It must cover s
+       (see surface_basis_covers).
+
+@param z data array [basis->ncoord]
+
+@param w weights array [basis->ncoord]
+
+@param error
+*/
+int
+surface_fit_add_basis(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const double* const z,
+        const double* const w,
+        stimage_error_t* const error);
+
+/**
+Subtract the contributions of points, added earlier by
+surface_fit_add_points with the given weights, from the normal
+equations of a surface.  The number of points is not changed, so
+solving gives the same result as fitting again with the weights of
+those points set to zero.
+
+@param s Surface descriptor
+
+@param ncoord Number of data points
+
+@param coord Data points
+
+@param z data array
+
+@param w The weights the points were added with
+
+@param error
+*/
+int
+surface_fit_remove_points(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        const double* const w,
+        stimage_error_t* const error);
+
+/**
+Solve the normal equations accumulated by surface_fit_add_points for
+the coefficients of the surface.
+
+@param s Surface descriptor
+
+@param error_type Output: surface_fit_error_no_degrees_of_freedom if
+       there were fewer points than coefficients
+
+@param error
+*/
+int
+surface_fit_solve(
+        surface_t* const s,
+        /* Output  */
+        surface_fit_error_e* const error_type,
+        stimage_error_t* const error);
+
+/**
+Add the normal equations accumulated in another surface to those of s,
+as though the points added to it had been added to s.  This lets the
+points of a fit be accumulated in separate pieces, in any order, and
+merged before solving.
+
+@param s Surface descriptor
+
+@param other A surface of the same type, orders, cross terms and bbox
+
+@param error
+*/
+int
+surface_fit_merge(
+        surface_t* const s,
+        const surface_t* const other,
+        stimage_error_t* const error);
+
 #endif
@@ -38,6 +38,7 @@ DAMAGE.
 #define _STIMAGE_SURFACE_VECTOR_H_
 
 #include "surface.h"
+#include "surface/basis.h"
 
 /*
   was dgsvector
@@ -53,4 +54,30 @@ surface_vector(
         double* const zfit,
         stimage_error_t* const error);
 
+/**
+Evaluate the fitted surface at the points a basis was computed for.
+The basis must cover s (see surface_basis_covers).
+*/
+int
+surface_vector_basis(
+        const surface_t* const s,
+        const surface_basis_t* const basis,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error);
+
+/**
+Evaluate the partial derivatives of the fitted surface with respect
+to x and y at an array of points.
+*/
+int
+surface_vector_deriv(
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error);
+
 #endif
@@ -28,9 +28,242 @@
 # DAMAGE.
 
 from __future__ import absolute_import
+
+import hashlib
+import os
+import struct
+
+import numpy as np
+
 from .version import *
 from . import _stimage
 
+from ._stimage import BudgetExceededError
+
+class ReferenceCatalog(_stimage.ReferenceCatalog):
+    """
+    A reference coordinate list prepared for repeated matching.
+
+    Before matching, `xyxymatch` sorts the reference coordinates and
+    removes those closer together than *separation*.  When many input
+    lists are matched against the same reference list, that work can
+    be done once by building a `ReferenceCatalog` and passing it as
+    the *ref* argument of `xyxymatch` in place of the array.  The
+    results are exactly the same as passing the array itself.
+
+    The catalog keeps its own copy of the coordinates, so later
+    changes to the array it was built from do not affect it, and it
+    may be shared between threads.
+
+    **Parameters:**
+
+    - *ref*: Array of reference coordinates, in any of the forms
+      accepted by `xyxymatch`.
+
+    - *separation*: The minimum separation for objects in the
+      reference coordinate list.  Objects closer together than
+      *separation* pixels are removed prior to matching.  The same
+      separation is used for the input coordinates when the catalog
+      is matched.  Default: 9.0
+
+    **Attributes:**
+
+    - *ref*: A copy of the reference coordinates.
+
+    - *separation*: The minimum separation.
+
+    - *nunique*: The number of reference coordinates remaining after
+      removing those closer together than *separation*.
+
+    - *ntriangles*: The number of reference triangles found by
+      `build_triangles` or read by `load_triangles`, or 0.
+
+    - *triangle_params*: The ``(nmatch, nneighbors, tolerance,
+      maxratio)`` the reference triangles were found with, or
+      ``None``.
+
+    ``len(catalog)`` is the number of reference coordinates.
+
+    **Reference triangles:**
+
+    The ``'triangles'`` algorithm normally finds and sorts the
+    triangles of the reference coordinates every time it is called.
+    `build_triangles` finds them once and keeps them with the catalog,
+    and `save_triangles` and `load_triangles` store them in a file,
+    which is memory-mapped when it is read, so that a fixed reference
+    field only ever needs them found once.  They are used whenever the
+    catalog is matched with the same *nmatch*, *nneighbors*,
+    *tolerance* and *maxratio* they were found with, and ignored
+    otherwise, so the results are always the same as without them.
+
+    Because matching may use the reference triangles from any thread,
+    a catalog can only be given them once.
+    """
+
+    # The file written by save_triangles is a fixed-size header
+    # followed by the triangles exactly as they are stored in memory.
+    # The layout of the triangles is not portable, so the header
+    # records enough to refuse a file from an incompatible build, as
+    # well as a digest of the reference coordinates the triangles'
+    # vertices refer to.
+    _TRIANGLES_MAGIC = b'STIMGTRI'
+    _TRIANGLES_VERSION = 1
+    _TRIANGLES_BYTE_ORDER = 0x01020304
+    _TRIANGLES_HEADER = struct.Struct('=8sIIIIQQdQQddQ20s')
+    _TRIANGLES_HEADER_SIZE = 128
+
+    def _digest(self):
+        return hashlib.sha1(
+            np.ascontiguousarray(self.ref, dtype=np.float64).tobytes()
+        ).digest()
+
+    def build_triangles(self, nmatch=30, nneighbors=0, tolerance=1.0,
+                        maxratio=10.0, nthreads=1):
+        """
+        Find the reference triangles used by the ``'triangles'``
+        algorithm of `xyxymatch`, so that they are not found again
+        each time the catalog is matched.
+
+        The parameters are the same as for `xyxymatch`, and the
+        triangles are only used when the catalog is matched with the
+        same *nmatch*, *nneighbors*, *tolerance* and *maxratio*.
+        """
+        self._build_triangles(nmatch, nneighbors, tolerance, maxratio,
+                              nthreads)
+
+    def save_triangles(self, path):
+        """
+        Write the reference triangles found by `build_triangles` to
+        the file *path*, to be read back with `load_triangles`.
+        """
+        triangles = self._get_triangles()
+        if triangles is None:
+            raise ValueError("The ReferenceCatalog has no reference triangles")
+
+        nmatch, nneighbors, tolerance, maxratio = self.triangle_params
+        itemsize, realsize = self._triangle_format
+        header = self._TRIANGLES_HEADER.pack(
+            self._TRIANGLES_MAGIC, self._TRIANGLES_VERSION,
+            self._TRIANGLES_BYTE_ORDER, itemsize, realsize,
+            len(self), self.nunique, self.separation,
+            nmatch, nneighbors, tolerance, maxratio,
+            self.ntriangles, self._digest())
+
+        with open(path, 'wb') as fd:
+            fd.write(header)
+            fd.write(b'\0' * (self._TRIANGLES_HEADER_SIZE - len(header)))
+            fd.write(triangles)
+
+    def load_triangles(self, path):
+        """
+        Use the reference triangles in the file *path*, written by
+        `save_triangles` from a catalog of the same reference
+        coordinates and separation.  The file is memory-mapped rather
+        than read, and must not be changed while the catalog exists.
+
+        Raises `ValueError` if the file was not written for this
+        catalog or by a compatible version of this package.
+        """
+        with open(path, 'rb') as fd:
+            header = fd.read(self._TRIANGLES_HEADER.size)
+        if (len(header) != self._TRIANGLES_HEADER.size or
+            header[:len(self._TRIANGLES_MAGIC)] != self._TRIANGLES_MAGIC):
+            raise ValueError("%r is not a reference triangles file" % path)
+
+        (magic, version, byte_order, itemsize, realsize, nref, nunique,
+         separation, nmatch, nneighbors, tolerance, maxratio, ntriangles,
+         digest) = self._TRIANGLES_HEADER.unpack(header)
+
+        if version != self._TRIANGLES_VERSION:
+            raise ValueError(
+                "%r has reference triangles format version %d, not %d" %
+                (path, version, self._TRIANGLES_VERSION))
+        if (byte_order != self._TRIANGLES_BYTE_ORDER or
+            (itemsize, realsize) != tuple(self._triangle_format)):
+            raise ValueError(
+                "%r was written on an incompatible platform or build" % path)
+        if (nref != len(self) or nunique != self.nunique or
+            separation != self.separation or digest != self._digest()):
+            raise ValueError(
+                "%r was written for a different reference catalog" % path)
+
+        size = ntriangles * itemsize
+        if os.path.getsize(path) != self._TRIANGLES_HEADER_SIZE + size:
+            raise ValueError("%r is truncated or corrupt" % path)
+
+        if size:
+            triangles = np.memmap(path, dtype=np.uint8, mode='r',
+                                  offset=self._TRIANGLES_HEADER_SIZE,
+                                  shape=(size,))
+        else:
+            triangles = b''
+        self._set_triangles(triangles, nmatch, nneighbors, tolerance,
+                            maxratio)
+
+
+class GeomapStream(_stimage.GeomapStream):
+    """
+    A `geomap` fit of more matched coordinates than fit in memory at
+    once, given a chunk at a time.
+
+    Each chunk is passed to `add`, which only adds it to running sums,
+    and `fit` then finds the fit to all of the coordinates added so
+    far, as `geomap` would with the "general" *fit_geometry* and no
+    rejection.  The rms of the fit is 0 until the chunks are passed a
+    second time, to `add_residuals`, which also gives their residuals.
+
+    **Parameters:**
+
+    - *bbox*: The bounding box of the reference coordinates, as the
+      *bbox* argument of `geomap`.  Unlike `geomap`, it must be given,
+      be finite and have a nonzero width and height, since the fit is
+      scaled to it before any coordinates are seen.  Coordinates
+      outside of it are ignored.
+
+    - *function*, *xxorder*, *xyorder*, *yxorder*, *yyorder*,
+      *xxterms*, *yxterms*: The same as for `geomap`, except that the
+      orders may not be 1 when there are higher order terms.  This is
+      checked when the `GeomapStream` is made, before any coordinates
+      are added.
+
+    **Attributes:**
+
+    - *ncoord*: The number of coordinates in the bbox added so far.
+
+    **Methods:**
+
+    - ``add(input, ref)``: Add a chunk of matched input and reference
+      coordinates, each in any of the forms accepted by `geomap`.
+
+    - ``fit()``: Return a `GeomapResults` for all of the coordinates
+      added so far.  More may be added and the fit found again.
+
+    - ``add_residuals(input, ref)``: Find the residuals of a chunk
+      from the last fit and update the *rms* of its `GeomapResults`.
+      Returns the output for the chunk as a structured array, with
+      the same columns as the output of `geomap`.
+
+    - ``merge(other)``: Add the coordinates added to *other*, a
+      `GeomapStream` with the same parameters, to this one, in both
+      passes.
+
+    **Distributed fits:**
+
+    A `GeomapStream` only holds running sums and the normal equations
+    of the fit, a few kilobytes whatever the number of coordinates,
+    and can be pickled.  So a fit of coordinates spread over many
+    exposures can be made by having each worker of a process pool add
+    its share to its own empty `GeomapStream`, with the same
+    parameters, and send it back, to be merged into one and fit once.
+    """
+
+    def __reduce__(self):
+        return (self.__class__, self._get_params(), self._get_state())
+
+    def __setstate__(self, state):
+        self._set_state(state)
+
+
 def xyxymatch(input,
               ref,
               origin = (0.0, 0.0),
@@ -39,10 +272,20 @@ def xyxymatch(input,
               ref_origin = (0.0, 0.0),
               algorithm = 'tolerance',
               tolerance = 1.0,
-              separation = 9.0,
+              separation = None,
               nmatch = 30,
               maxratio = 10.0,
-              nreject = 10):
+              nreject = 10,
+              search = 'auto',
+              nneighbors = 0,
+              nthreads = 1,
+              rotations = None,
+              scales = None,
+              consensus = 'reject',
+              max_work = 0,
+              timeout = None,
+              indices_only = False,
+              out = None):
     """
     Match pixels coordinate lists using various methods.
 
@@ -67,8 +310,8 @@ def xyxymatch(input,
        with a minimum separation specified by the parameter separation
        from both lists
 
-    4. matching the two lists using either the "tolerance" or
-       "triangles" algorithm
+    4. matching the two lists using the "tolerance", "triangles" or
+       "offsets" algorithm
 
     5. storing the matched list to the output array
 
@@ -146,11 +389,37 @@ def xyxymatch(input,
       parameter will increase the ability to deal with distortions but
       will also produce more false matches.
 
+    - If *algorithm* is "offsets", `xyxymatch` histograms the *x* and
+      *y* offsets between every pair of reference and transformed
+      input coordinates in bins of *tolerance* pixels, and takes the
+      offset with the most pairs in a 3x3 block of bins as the shift
+      between the two lists.  If *rotations* or *scales* are given,
+      the histogram is repeated for each candidate rotation and scale
+      of the input coordinates, and the best scoring one is used.  The
+      input coordinates are then shifted and the lists are matched
+      with the "tolerance" algorithm.  Its cost grows with the product
+      of the lengths of the lists (which are evenly subsampled when
+      that exceeds about a million pairs) rather than with the cube of
+      *nmatch*, and unlike the "triangles" algorithm it does not need
+      the two lists to contain well-measured triangles in common, so
+      it is well suited to large, crowded fields with an unknown
+      shift.
+
     **Parameters:**
 
-    - *input*: Array of input coordinates. (Must be an Nx2 array).
+    - *input*: Array of input coordinates. (Must be an Nx2 array, or
+      have x and y columns).  The coordinates may also be given as
+      separate columns: the ``x`` and ``y`` fields of a structured or
+      record array, or the ``'x'`` and ``'y'`` items of a mapping such
+      as a dict or a table.  The coordinates are used in place when
+      they are already a C-contiguous Nx2 array of doubles, or x and
+      y fields of doubles that are next to each other in each record;
+      otherwise they are converted with a single copy.
 
-    - *ref*: Array of reference coordinates. (Must be an Nx2 array).
+    - *ref*: Array of reference coordinates, in any of the forms
+      accepted for *input*.  May also be a `ReferenceCatalog`, to
+      reuse the sorting and culling of the reference coordinates
+      between calls.
 
     - *origin*: The origin of the input coordinate system.  Default:
       (0.0, 0.0)
@@ -197,19 +466,36 @@ def xyxymatch(input,
         between the *x* and *y* axes, and higher order distortion
         terms in the coordinate transformation.
 
+      - ``'offsets'``: A linear transformation is applied to the input
+        coordinate list, the transformed input list and the reference
+        list are sorted, points which are too close together are
+        removed, the shift between the lists is found from a histogram
+        of the offsets between all pairs of reference and input
+        coordinates, and the shifted input coordinates are matched to
+        the reference coordinates with the tolerance algorithm.  The
+        offsets algorithm does not require prior knowledge of the
+        shift, and only requires knowledge of the rotation and scale
+        to within the candidates given by *rotations* and *scales*.
+
     - *tolerance*: The matching tolerance in pixels. Default: 1.0
 
     - *separation*: The minimum separation for objects in the input
       and reference coordinate lists.  Objects closer together than
       *separation* pixels are removed from the input and reference
-      coordinate lists prior to matching. Default: 9.0
+      coordinate lists prior to matching.  When *ref* is a
+      `ReferenceCatalog`, this must be ``None`` or equal to the
+      catalog's separation.  Default: 9.0, or the separation of the
+      `ReferenceCatalog`
 
     - *nmatch*: The maximum number of reference and input coordinates
       used by the ``'triangles'`` pattern matching algorithm.  If
       either list contains more coordinates than *nmatch*, the lists
-      are subsampled.  *nmatch* should be kept small as the
-      computation and memory requirements of the triangles algorithm
-      depend on a high power of lengths of the respective lists.
+      are subsampled, and the matches found from them are only used
+      to fit a new linear transformation for matching the entire
+      lists with the ``'tolerance'`` algorithm, as described above.
+      *nmatch* should be kept small as the computation and memory
+      requirements of the triangles algorithm depend on a high power
+      of lengths of the respective lists.
       Default: 30
 
     - *maxratio*: The maximum ratio of the longest to shortest side of
@@ -222,6 +508,103 @@ def xyxymatch(input,
     - *nreject*: The maximum number of rejection iterations for the
       ``'triangles'`` pattern matching algorithm.  Default: 10
 
+    - *search*: How the ``'tolerance'`` algorithm finds the input
+      coordinates near each reference coordinate.  All of the choices
+      return exactly the same matches.  The choices are:
+
+      - ``'sweep'``: Walk the band of input coordinates within
+        *tolerance* in *y* of each reference coordinate.  This is
+        fastest for sparse fields and small tolerances.
+
+      - ``'grid'``: Build a grid hash over the input coordinates with
+        a cell size of *tolerance*, and only examine the 3x3 block of
+        cells around each reference coordinate.  This is much faster
+        for crowded fields, large catalogs and large tolerances.
+
+      - ``'auto'``: Choose between ``'sweep'`` and ``'grid'`` based
+        on the expected number of coordinates in the sweep's band.
+
+      Default: ``'auto'``
+
+    - *nneighbors*: If non-zero, the ``'triangles'`` algorithm uses
+      all of the coordinates rather than at most *nmatch* of them, but
+      only forms triangles from each coordinate and pairs of its
+      *nneighbors* nearest neighbors.  The number of triangles then
+      grows linearly with the number of coordinates, rather than with
+      the cube of *nmatch*, which makes it practical to match large,
+      crowded lists that subsampling would reduce to a few
+      coordinates in common.  Values around 6 to 8 work well.  If 0,
+      every triangle of the subsampled lists is used.  Default: 0
+
+    - *nthreads*: The number of threads the ``'triangles'`` algorithm
+      uses to build and sort the reference and input triangles.  If
+      0, use one per processor.  The matches do not depend on the
+      number of threads.  Default: 1
+
+    - *rotations*: A sequence of candidate rotations, in degrees, of
+      the input coordinates about their center, that the
+      ``'offsets'`` algorithm tries after applying the initial
+      transformation.  If ``None``, only a rotation of 0 is tried.
+      Default: None
+
+    - *scales*: A sequence of candidate scale factors of the input
+      coordinates that the ``'offsets'`` algorithm tries.  Every
+      combination of *rotations* and *scales* is tried.  If ``None``,
+      only a scale of 1 is tried.  Default: None
+
+    - *consensus*: How the ``'triangles'`` algorithm turns the matched
+      triangles into matched coordinates.  The choices are:
+
+      - ``'reject'``: Iteratively reject matched triangles whose
+        ratio of perimeters is far from the most common one, and those
+        of the less common sense, and let the rest vote on the
+        coordinate matches, as described above.
+
+      - ``'ransac'``: Draw matched triangles at random, and keep the
+        rotation, scale and shift between their vertices that carries
+        the most coordinates to within *tolerance* of another.
+        Sampling stops as soon as a sample of true matches has almost
+        certainly been drawn, so this needs far fewer passes than
+        ``'reject'`` when most of the matched triangles are false.
+        Every coordinate that the final transformation pairs up is
+        matched, not just the *nmatch* that the triangles were formed
+        from.  The results are repeatable.
+
+      Default: ``'reject'``
+
+    - *max_work*: The most work the ``'triangles'`` algorithm may do,
+      in units of one candidate triangle built or one pair of
+      triangles compared.  If it would do more, `BudgetExceededError`
+      is raised, so that a list with many spurious coordinates fails
+      quickly rather than running for a long time.  The same input
+      always runs out at the same place.  If 0, there is no limit.
+      Default: 0
+
+    - *timeout*: The most time, in seconds, the ``'triangles'``
+      algorithm may take.  If it would take longer,
+      `BudgetExceededError` is raised.  If ``None``, there is no
+      limit.  Default: None
+
+    - *indices_only*: If True, return only the indices of the matched
+      coordinates in *input* and *ref*, rather than a copy of the
+      coordinates as well.  Default: False
+
+    - *out*: Arrays to store the matches in, so that the same memory
+      can be reused from one call to the next.  If *indices_only* is
+      False, a 1-dimensional array with the dtype of the result;
+      otherwise a pair of 1-dimensional `numpy.intp` arrays.  They must
+      be C-contiguous and writeable, or `TypeError` is raised, and long
+      enough for all of the matches, or `ValueError` is raised.  The
+      result is then a view of the first rows of *out*.  If ``None``,
+      new arrays are allocated, which are only as long as the number
+      of matches.  Default: None
+
+    When called from the main thread, matching may be interrupted
+    with ``KeyboardInterrupt`` (Ctrl-C) while the ``'triangles'``
+    algorithm runs.  Python only handles signals in the main thread,
+    so calls from other threads can only be limited with *max_work*
+    and *timeout*.
+
     **Returns**: A structured array containing the output
     information.  It has the following columns:
 
@@ -231,6 +614,9 @@ def xyxymatch(input,
     - *ref_x*
     - *ref_y*
     - *ref_idx*
+
+    If *indices_only* is True, instead a pair of `numpy.intp` arrays,
+    ``(input_idx, ref_idx)``.
     """
     return _stimage.xyxymatch(
         input,
@@ -244,7 +630,106 @@ def xyxymatch(input,
         separation,
         nmatch,
         maxratio,
-        nreject)
+        nreject,
+        search,
+        nneighbors,
+        nthreads,
+        rotations,
+        scales,
+        consensus,
+        max_work,
+        0.0 if timeout is None else timeout,
+        indices_only,
+        out)
+
+
+def xyxymatch_many(inputs,
+                   ref,
+                   origin = (0.0, 0.0),
+                   mag = (1.0, 1.0),
+                   rotation = (0.0, 0.0),
+                   ref_origin = (0.0, 0.0),
+                   algorithm = 'tolerance',
+                   tolerance = 1.0,
+                   separation = None,
+                   nmatch = 30,
+                   maxratio = 10.0,
+                   nreject = 10,
+                   search = 'auto',
+                   offsets = None,
+                   nthreads = 0,
+                   nneighbors = 0,
+                   rotations = None,
+                   scales = None,
+                   consensus = 'reject',
+                   max_work = 0,
+                   timeout = None):
+    """
+    Match many input coordinate lists against the same reference
+    coordinate list in one call.
+
+    Each input coordinate list ("frame") is matched exactly as
+    `xyxymatch` would match it, with the same parameters, but the
+    reference coordinates are sorted and culled only once and the
+    frames are matched in parallel on a pool of native threads.  This
+    is much faster than calling `xyxymatch` in a loop when there are
+    many small frames.
+
+    **Parameters:**
+
+    - *inputs*: A sequence of arrays of input coordinates, one per
+      frame, each in any of the forms accepted by `xyxymatch`.  If
+      *offsets* is given, this is instead a single array holding the
+      coordinates of all of the frames, one after another.
+
+    - *ref*: Array of reference coordinates, in any of the forms
+      accepted by `xyxymatch`.  May also be a `ReferenceCatalog`.
+
+    - *offsets*: When *inputs* is a single array, the index of the
+      first row of each frame, starting with 0.  Each frame runs up to
+      the first row of the next one, and the last frame runs to the
+      end of *inputs*.  Default: None
+
+    - *nthreads*: The maximum number of threads to use.  If 0, use
+      one per processor.  Each frame is matched by a single thread.
+      Default: 0
+
+    All of the other parameters are the same as for `xyxymatch`, and
+    apply to every frame.
+
+    A frame with no coordinates has no matches.  If matching any
+    frame fails, a `RuntimeError` naming the first such frame is
+    raised.  *max_work* and *timeout* limit all of the frames
+    together, rather than each frame.
+
+    **Returns**: A structured array with the matches of all of the
+    frames, in order of frame.  It has the same columns as the
+    result of `xyxymatch`, plus a *frame* column giving the index of
+    the frame each match came from.  *input_idx* is the index of the
+    input coordinate within its own frame.
+    """
+    return _stimage.xyxymatch_many(
+        inputs,
+        ref,
+        origin,
+        mag,
+        rotation,
+        ref_origin,
+        algorithm,
+        tolerance,
+        separation,
+        nmatch,
+        maxratio,
+        nreject,
+        search,
+        offsets,
+        nthreads,
+        nneighbors,
+        rotations,
+        scales,
+        consensus,
+        max_work,
+        0.0 if timeout is None else timeout)
 
 
 def geomap(input,
@@ -421,9 +906,11 @@ def geomap(input,
 
     **Parameters:**
 
-    - *input*: Array of input coordinates. (Must be an Nx2 array).
+    - *input*: Array of input coordinates, in any of the forms
+      accepted by `xyxymatch`.
 
-    - *ref*: Array of reference coordinates. (Must be an Nx2 array).
+    - *ref*: Array of reference coordinates, in any of the forms
+      accepted by `xyxymatch`.
 
     - *bbox*: The range of reference coordinates over which the
       computed coordinate transformation is valid.  Must be
@@ -560,6 +1047,18 @@ def geomap(input,
       - *y2coeff* double array: The second-order *y* coefficients of
         the fit.
 
+      The object keeps the fit, and can evaluate it at other reference
+      coordinates: calling it with an Nx2 array of them returns the
+      fitted input coordinates as an Nx2 array, and
+      ``evaluate(x, y)`` does the same for separate *x* and *y* arrays
+      of any shape, returning an ``(xfit, yfit)`` tuple of arrays of
+      that shape.  ``inverse(xy, tolerance=1e-8, maxiter=20)`` goes
+      the other way, from an Nx2 array of input coordinates to the
+      reference coordinates that the fit maps to them.  It uses
+      Newton's method, and each coordinate is either within
+      *tolerance* of the input coordinate when the fit is applied to
+      it, or NaN.  The evaluation runs without holding the GIL.
+
     - A Numpy structured array with the following columns:
 
       - *input_x*
@@ -585,3 +1084,83 @@ def geomap(input,
         yxterms,
         maxiter,
         reject)
+
+
+def geomap_many(inputs,
+                refs,
+                bboxes=None,
+                fit_geometry="general",
+                function="polynomial",
+                xxorder=2,
+                xyorder=2,
+                yxorder=2,
+                yyorder=2,
+                xxterms="half",
+                yxterms="half",
+                maxiter=0,
+                reject=0.0,
+                offsets=None,
+                nthreads=0):
+    """
+    Fit many lists of matched coordinates in one call.
+
+    Each pair of input and reference coordinate lists ("frame") is
+    fit exactly as `geomap` would fit it, with the same parameters,
+    but the frames are fit in parallel on a pool of native threads.
+    This is much faster than calling `geomap` in a loop when there
+    are many small frames, such as one per detector chip.
+
+    **Parameters:**
+
+    - *inputs*: A sequence of arrays of input coordinates, one per
+      frame, each in any of the forms accepted by `geomap`.  If
+      *offsets* is given, this is instead a single array holding the
+      coordinates of all of the frames, one after another.
+
+    - *refs*: The reference coordinates of each frame, in the same
+      form as *inputs*.
+
+    - *bboxes*: A sequence with the bounding box of each frame, each
+      as the *bbox* argument of `geomap`, or None to use all of the
+      coordinates of every frame.  Default: None
+
+    - *offsets*: When *inputs* and *refs* are single arrays, the index
+      of the first row of each frame, starting with 0.  Each frame
+      runs up to the first row of the next one, and the last frame
+      runs to the end of the arrays.  Default: None
+
+    - *nthreads*: The maximum number of threads to use.  If 0, use
+      one per processor.  Each frame is fit by a single thread.
+      Default: 0
+
+    All of the other parameters are the same as for `geomap`, and
+    apply to every frame.
+
+    If fitting any frame fails, a `RuntimeError` naming the first such
+    frame is raised.
+
+    **Returns:** A 2-tuple with the following parts:
+
+    - A list of `GeomapResults` objects, one per frame.
+
+    - A Numpy structured array with the output of all of the frames,
+      in order of frame.  It has the same columns as the output of
+      `geomap`, plus a *frame* column giving the index of the frame
+      each row came from.
+    """
+    return _stimage.geomap_many(
+        inputs,
+        refs,
+        bboxes,
+        fit_geometry,
+        function,
+        xxorder,
+        xyorder,
+        yxorder,
+        yyorder,
+        xxterms,
+        yxterms,
+        maxiter,
+        reject,
+        offsets,
+        nthreads)
@@ -27,6 +27,8 @@
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 
+import pickle
+
 import numpy as np
 import stsci.stimage as stimage
 
@@ -42,5 +44,303 @@ import stsci.stimage as stimage
 
 #     assert False
 
-if __name__ == '__main__':
-    test_same()
+
+def test_linear():
+    np.random.seed(0)
+    ref = np.random.random((256, 2)) * 100.0
+    theta = np.radians(10.0)
+    x = np.empty_like(ref)
+    # geomap follows the IRAF convention for the sense of the rotation
+    x[:, 0] = 1.5 * (ref[:, 0] * np.cos(theta) + ref[:, 1] * np.sin(theta)) + 12.5
+    x[:, 1] = 1.5 * (ref[:, 1] * np.cos(theta) - ref[:, 0] * np.sin(theta)) - 3.25
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, output = stimage.geomap(x, ref, fit_geometry='rscale',
+                                     function=function)
+
+        assert len(output) == 256
+        assert np.allclose(fit.shift, (12.5, -3.25))
+        assert np.allclose(fit.mag, (1.5, 1.5))
+        assert np.allclose(fit.rotation, (10.0, 10.0))
+        assert np.all(np.abs(output['resid_x']) < 1e-8)
+        assert np.all(np.abs(output['resid_y']) < 1e-8)
+
+
+def _assert_same_fit(r0, r1):
+    fit0, out0 = r0
+    fit1, out1 = r1
+
+    assert fit0.fit_geometry == fit1.fit_geometry
+    assert fit0.function == fit1.function
+    for name in ('rms', 'mean_ref', 'mean_input', 'shift', 'mag',
+                 'rotation', 'xcoeff', 'ycoeff', 'x2coeff', 'y2coeff'):
+        assert np.array_equal(getattr(fit0, name), getattr(fit1, name),
+                              equal_nan=True)
+    for name in out0.dtype.names:
+        assert np.array_equal(out0[name], out1[name], equal_nan=True)
+
+
+def test_threaded():
+    import threading
+
+    nthreads = 8
+    np.random.seed(0)
+    args_list = []
+    for i in range(32):
+        ref = np.random.random((512, 2)) * 100.0
+        x = ref * (1.0 + i * 0.01) + (np.random.random((512, 2)) - 0.5)
+        fit_geometry = ('general', 'shift', 'rscale')[i % 3]
+        function = ('polynomial', 'legendre', 'chebyshev')[i % 4 % 3]
+        args_list.append((x, ref, fit_geometry, function))
+
+    def fit(x, ref, fit_geometry, function):
+        return stimage.geomap(x, ref, fit_geometry=fit_geometry,
+                              function=function, maxiter=3, reject=3.0)
+
+    serial = [fit(*args) for args in args_list]
+
+    threaded = [None] * len(args_list)
+    errors = []
+
+    def worker(i):
+        try:
+            for j in range(i, len(args_list), nthreads):
+                threaded[j] = fit(*args_list[j])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors, errors
+    for r0, r1 in zip(serial, threaded):
+        _assert_same_fit(r0, r1)
+
+
+def test_evaluate():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 100.0
+    x = np.empty_like(ref)
+    x[:, 0] = ref[:, 0] * 1.01 + 1e-4 * ref[:, 1] ** 2 + 3.0
+    x[:, 1] = ref[:, 1] * 0.99 - 2e-4 * ref[:, 0] * ref[:, 1] - 2.0
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, output = stimage.geomap(x, ref, function=function,
+                                     xxorder=3, xyorder=3,
+                                     yxorder=3, yyorder=3)
+
+        xy = fit(ref)
+        assert xy.shape == (512, 2)
+        assert np.array_equal(xy[:, 0], output['fit_x'])
+        assert np.array_equal(xy[:, 1], output['fit_y'])
+
+        xfit, yfit = fit.evaluate(ref[:, 0].reshape((16, 32)),
+                                  ref[:, 1].reshape((16, 32)))
+        assert xfit.shape == (16, 32)
+        assert np.array_equal(xfit.ravel(), output['fit_x'])
+        assert np.array_equal(yfit.ravel(), output['fit_y'])
+
+    assert fit(np.empty((0, 2))).shape == (0, 2)
+
+
+def test_inverse():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 100.0
+    x = np.empty_like(ref)
+    x[:, 0] = ref[:, 0] * 1.01 + 1e-4 * ref[:, 1] ** 2 + 3.0
+    x[:, 1] = ref[:, 1] * 0.99 - 2e-4 * ref[:, 0] * ref[:, 1] - 2.0
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, output = stimage.geomap(x, ref, function=function,
+                                     xxorder=3, xyorder=3,
+                                     yxorder=3, yyorder=3)
+
+        inv = fit.inverse(x, tolerance=1e-10)
+        assert np.allclose(inv, ref, atol=1e-6)
+        assert np.all(np.abs(fit(inv) - x) <= 1e-10)
+
+    inv = fit.inverse([[np.nan, 0.0], [50.0, 50.0]])
+    assert np.all(np.isnan(inv[0]))
+    assert np.all(np.isfinite(inv[1]))
+
+    try:
+        fit.inverse(x, maxiter=-1)
+    except ValueError:
+        pass
+    else:
+        assert False, "Negative maxiter did not raise ValueError"
+
+    # A tolerance below the rounding error can never be met, and gives
+    # NaN once the steps stop shrinking rather than after maxiter
+    inv = fit.inverse(x, tolerance=0.0, maxiter=2 ** 62)
+    assert inv.shape == x.shape
+
+
+def test_many():
+    np.random.seed(0)
+    inputs = []
+    refs = []
+    bboxes = []
+    for i in range(20):
+        ref = np.random.random((200 + i, 2)) * 100.0
+        x = ref * (1.0 + i * 0.01) + (np.random.random(ref.shape) - 0.5)
+        inputs.append(x)
+        refs.append(ref)
+        bboxes.append(None if i % 2 else (10.0, 10.0, 90.0, 90.0))
+
+    kwargs = dict(function='legendre', xxorder=3, xyorder=3,
+                  yxorder=3, yyorder=3, maxiter=2, reject=3.0)
+    fits, output = stimage.geomap_many(inputs, refs, bboxes, nthreads=4,
+                                       **kwargs)
+
+    assert len(fits) == 20
+    assert output.dtype.names[0] == 'frame'
+    for i in range(20):
+        r = stimage.geomap(inputs[i], refs[i], bboxes[i], **kwargs)
+        _assert_same_fit(r, (fits[i], output[output['frame'] == i]))
+        assert np.array_equal(fits[i](refs[i]), r[0](refs[i]))
+
+    offsets = np.cumsum([0] + [len(x) for x in inputs[:-1]])
+    fits2, output2 = stimage.geomap_many(
+        np.concatenate(inputs), np.concatenate(refs), bboxes,
+        offsets=offsets, **kwargs)
+    for name in output.dtype.names:
+        assert np.array_equal(output[name], output2[name], equal_nan=True)
+
+    fits, output = stimage.geomap_many([], [])
+    assert fits == [] and len(output) == 0
+
+    try:
+        stimage.geomap_many(inputs[:2], [refs[0], refs[0][:10]])
+    except RuntimeError as e:
+        assert str(e).startswith('Frame 1:')
+    else:
+        assert False
+
+    try:
+        stimage.geomap_many(inputs, refs, nthreads=-1)
+    except ValueError:
+        pass
+    else:
+        assert False, "Negative nthreads did not raise ValueError"
+
+
+def test_stream():
+    np.random.seed(1)
+    ref = np.random.random((1000, 2)) * 100.0
+    x = ref.copy()
+    x[:, 0] += 0.0001 * ref[:, 1] ** 2 + 3.0
+    x[:, 1] += -0.0002 * ref[:, 0] * ref[:, 1] - 2.0
+    x += (np.random.random(ref.shape) - 0.5) * 0.1
+    bbox = (0.0, 0.0, 100.0, 100.0)
+
+    kwargs = dict(function='chebyshev', xxorder=4, xyorder=4,
+                  yxorder=3, yyorder=3, xxterms='half', yxterms='full')
+    r = stimage.geomap(x, ref, bbox, **kwargs)
+
+    stream = stimage.GeomapStream(bbox, **kwargs)
+    for i in range(0, len(ref), 64):
+        stream.add(x[i:i + 64], ref[i:i + 64])
+    assert stream.ncoord == len(ref)
+    fit = stream.fit()
+    assert np.all(fit.rms == 0.0)
+    output = np.concatenate([
+        stream.add_residuals(x[i:i + 64], ref[i:i + 64])
+        for i in range(0, len(ref), 64)])
+
+    np.testing.assert_allclose(fit.rms, r[0].rms, rtol=1e-9)
+    np.testing.assert_allclose(fit.mean_ref, r[0].mean_ref, rtol=1e-12)
+    np.testing.assert_allclose(fit.mag, r[0].mag, rtol=1e-9)
+    for name in ('fit_x', 'fit_y', 'resid_x', 'resid_y'):
+        np.testing.assert_allclose(output[name], r[1][name], atol=1e-9)
+    np.testing.assert_allclose(fit(ref), r[0](ref), atol=1e-9)
+
+    try:
+        stimage.GeomapStream(None)
+    except RuntimeError:
+        pass
+    else:
+        assert False
+
+    try:
+        stimage.GeomapStream((0.0, 0.0, 0.0, 1000.0))
+    except RuntimeError:
+        pass
+    else:
+        assert False, "A zero-width bbox did not raise"
+
+    for kwargs, exc in (({'xxorder': 1, 'xyorder': 3}, RuntimeError),
+                        ({'yyorder': 1, 'yxterms': 'full'}, RuntimeError),
+                        ({'xxorder': -1}, ValueError)):
+        try:
+            stimage.GeomapStream(bbox, **kwargs)
+        except exc:
+            pass
+        else:
+            assert False, "Bad orders did not raise %s" % exc.__name__
+
+
+def test_stream_merge():
+    np.random.seed(2)
+    ref = np.random.random((1000, 2)) * 100.0
+    x = ref * 1.01 + 0.00001 * ref ** 2 + 3.0
+    x += (np.random.random(ref.shape) - 0.5) * 0.1
+    bbox = (0.0, 0.0, 100.0, 100.0)
+    kwargs = dict(function='legendre', xxorder=3, xyorder=3,
+                  yxorder=3, yyorder=3)
+
+    whole = stimage.GeomapStream(bbox, **kwargs)
+    whole.add(x, ref)
+
+    merged = stimage.GeomapStream(bbox, **kwargs)
+    for i in range(0, len(ref), 300):
+        part = stimage.GeomapStream(bbox, **kwargs)
+        part.add(x[i:i + 300], ref[i:i + 300])
+        merged.merge(pickle.loads(pickle.dumps(part)))
+    assert merged.ncoord == whole.ncoord
+
+    r0 = whole.fit()
+    r1 = merged.fit()
+    np.testing.assert_allclose(r1.xcoeff, r0.xcoeff, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(r1.y2coeff, r0.y2coeff, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(r1(ref), r0(ref), atol=1e-9)
+
+    other = stimage.GeomapStream(bbox, function='chebyshev')
+    try:
+        merged.merge(other)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_reject():
+    # Rejecting points gives the same fit as leaving them out
+    np.random.seed(3)
+    ref = np.random.random((5000, 2)) * 100.0
+    x = ref * 1.01 + 0.0001 * ref ** 2 + 3.0
+    x += np.random.normal(0.0, 0.05, ref.shape)
+    x[::25] += np.random.normal(0.0, 2.0, x[::25].shape)
+    bbox = (0.0, 0.0, 100.0, 100.0)
+
+    for fit_geometry, xxterms in (('general', 'full'),
+                                  ('general', 'half'),
+                                  ('rxyscale', 'none')):
+        kwargs = dict(fit_geometry=fit_geometry, function='legendre',
+                      xxorder=4, xyorder=3, yxorder=3, yyorder=3,
+                      xxterms=xxterms)
+        r, output = stimage.geomap(x, ref, bbox, maxiter=10, reject=2.5,
+                                   **kwargs)
+        kept = np.isfinite(output['fit_x'])
+        assert 150 < np.sum(~kept) < 400
+
+        r2, output2 = stimage.geomap(x[kept], ref[kept], bbox, **kwargs)
+        np.testing.assert_allclose(output['fit_x'][kept], output2['fit_x'],
+                                   rtol=0, atol=1e-9)
+        np.testing.assert_allclose(output['fit_y'][kept], output2['fit_y'],
+                                   rtol=0, atol=1e-9)
+        np.testing.assert_allclose(r.rms, r2.rms, rtol=1e-9)
@@ -73,3 +73,647 @@ def test_different():
         assert r['ref_idx'][i] < 512
 
 
+def test_search():
+    np.random.seed(0)
+    x = np.random.random((2048, 2)) * 100.0
+    y = x + (np.random.random((2048, 2)) - 0.5) * 2.0
+
+    for tolerance in (0.5, 5.0):
+        r_sweep = stimage.xyxymatch(x, y, tolerance=tolerance,
+                                    separation=0.0, search='sweep')
+        r_grid = stimage.xyxymatch(x, y, tolerance=tolerance,
+                                   separation=0.0, search='grid')
+        r_auto = stimage.xyxymatch(x, y, tolerance=tolerance,
+                                   separation=0.0, search='auto')
+
+        assert len(r_sweep) > 0
+        assert np.all(r_sweep == r_grid)
+        assert np.all(r_sweep == r_auto)
+
+
+def test_reference_catalog():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 100.0
+
+    catalog = stimage.ReferenceCatalog(ref, separation=0.5)
+    assert len(catalog) == 512
+    assert catalog.separation == 0.5
+    assert 0 < catalog.nunique <= 512
+    assert np.all(catalog.ref == ref)
+
+    # The catalog has its own copy of the coordinates
+    ref_copy = ref.copy()
+    ref[:] = 0.0
+
+    for i in range(3):
+        x = ref_copy + (np.random.random((512, 2)) - 0.5) * 0.2
+        for algorithm in ('tolerance', 'triangles'):
+            r_array = stimage.xyxymatch(x, ref_copy, algorithm=algorithm,
+                                        tolerance=0.5, separation=0.5)
+            r_catalog = stimage.xyxymatch(x, catalog, algorithm=algorithm,
+                                          tolerance=0.5)
+
+            if algorithm == 'tolerance':
+                assert len(r_array) > 0
+            assert len(r_array) == len(r_catalog)
+            assert np.all(r_array == r_catalog)
+
+    try:
+        stimage.xyxymatch(x, catalog, separation=1.0)
+    except ValueError as e:
+        assert str(e) == ("separation (1.0) does not match the separation "
+                          "of the ReferenceCatalog (0.5)")
+    else:
+        assert False, "Mismatched separation did not raise ValueError"
+
+
+def test_reference_triangles():
+    import os
+    import shutil
+    import tempfile
+
+    np.random.seed(0)
+    ref = np.random.random((400, 2)) * 1000.0
+    frames = [ref + [5.0, 3.0] + (np.random.random((400, 2)) - 0.5) * 0.2
+              for i in range(3)]
+
+    def match_all(catalog, **kwargs):
+        return [stimage.xyxymatch(x, catalog, algorithm='triangles',
+                                  tolerance=1.0, **kwargs)
+                for x in frames]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'ref.tri')
+
+        for nneighbors in (0, 6):
+            expected = match_all(stimage.ReferenceCatalog(ref, 1.0),
+                                 nneighbors=nneighbors)
+
+            catalog = stimage.ReferenceCatalog(ref, 1.0)
+            assert catalog.ntriangles == 0
+            assert catalog.triangle_params is None
+            catalog.build_triangles(nneighbors=nneighbors, tolerance=1.0,
+                                    nthreads=2)
+            assert catalog.ntriangles > 0
+            assert catalog.triangle_params == (30, nneighbors, 1.0, 10.0)
+            catalog.save_triangles(path)
+
+            loaded = stimage.ReferenceCatalog(ref, 1.0)
+            loaded.load_triangles(path)
+            assert loaded.ntriangles == catalog.ntriangles
+
+            for c in (catalog, loaded):
+                results = match_all(c, nneighbors=nneighbors)
+                for r0, r1 in zip(expected, results):
+                    assert len(r1) > 0
+                    assert np.all(r0 == r1)
+
+            # With other parameters, the triangles are not used
+            r0 = match_all(stimage.ReferenceCatalog(ref, 1.0), nmatch=20,
+                           nneighbors=nneighbors)
+            r1 = match_all(loaded, nmatch=20, nneighbors=nneighbors)
+            for a, b in zip(r0, r1):
+                assert np.all(a == b)
+
+            try:
+                loaded.build_triangles()
+            except ValueError:
+                pass
+            else:
+                assert False, "Replacing the triangles did not raise"
+
+        # The file only fits the catalog it was written for
+        for other in (stimage.ReferenceCatalog(ref[:-1], 1.0),
+                      stimage.ReferenceCatalog(ref, 2.0),
+                      stimage.ReferenceCatalog(ref[::-1], 1.0)):
+            try:
+                other.load_triangles(path)
+            except ValueError:
+                pass
+            else:
+                assert False, "A mismatched catalog did not raise"
+
+        with open(path, 'r+b') as fd:
+            fd.truncate(os.path.getsize(path) - 1)
+        try:
+            stimage.ReferenceCatalog(ref, 1.0).load_triangles(path)
+        except ValueError:
+            pass
+        else:
+            assert False, "A truncated file did not raise"
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _run_threaded(func, args_list, nthreads=8):
+    import threading
+
+    results = [None] * len(args_list)
+    errors = []
+
+    def worker(i):
+        try:
+            for j in range(i, len(args_list), nthreads):
+                results[j] = func(*args_list[j])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors, errors
+    return results
+
+
+def test_threaded():
+    np.random.seed(0)
+    ref = np.random.random((2048, 2)) * 1000.0
+    catalog = stimage.ReferenceCatalog(ref, separation=1.0)
+
+    frames = []
+    for i in range(32):
+        frames.append(
+            ref + (np.random.random((2048, 2)) - 0.5) * 2.0 + i * 0.1)
+
+    def match(x, ref, algorithm):
+        return stimage.xyxymatch(x, ref, algorithm=algorithm,
+                                 tolerance=2.0, separation=1.0,
+                                 nmatch=15)
+
+    args_list = []
+    for x in frames:
+        for algorithm in ('tolerance', 'triangles'):
+            args_list.append((x, ref, algorithm))
+            args_list.append((x, catalog, algorithm))
+
+    serial = [match(*args) for args in args_list]
+    threaded = _run_threaded(match, args_list)
+
+    for r0, r1 in zip(serial, threaded):
+        assert len(r0) == len(r1)
+        assert np.all(r0 == r1)
+
+
+def test_triangles_nthreads():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 1000.0
+    x = ref + [5.0, 3.0] + (np.random.random((512, 2)) - 0.5) * 0.2
+
+    for nneighbors in (0, 6):
+        results = [
+            stimage.xyxymatch(x, ref, algorithm='triangles', tolerance=1.0,
+                              separation=0.0, nmatch=60,
+                              nneighbors=nneighbors, nthreads=nthreads)
+            for nthreads in (1, 2, 5, 0)]
+
+        assert len(results[0]) > 0
+        for r in results[1:]:
+            assert len(r) == len(results[0])
+            assert np.all(r == results[0])
+
+
+def test_triangles_refit():
+    np.random.seed(0)
+    ref = np.random.random((1000, 2)) * 1000.0
+    x = ref * 1.001 + [5.0, 3.0] + (np.random.random((1000, 2)) - 0.5) * 0.2
+
+    # Only nmatch of the coordinates are used to form triangles, but
+    # the transformation fit to their matches lets every coordinate be
+    # matched
+    r = stimage.xyxymatch(x, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=30)
+
+    assert len(r) == len(ref)
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+
+def test_many():
+    np.random.seed(0)
+    ref = np.random.random((1024, 2)) * 1000.0
+    catalog = stimage.ReferenceCatalog(ref, separation=1.0)
+
+    frames = []
+    for i in range(16):
+        n = np.random.randint(0, 1024)
+        frames.append(ref[:n] + (np.random.random((n, 2)) - 0.5) * 2.0)
+
+    for algorithm in ('tolerance', 'triangles'):
+        expected = []
+        for i, x in enumerate(frames):
+            if len(x):
+                r = stimage.xyxymatch(x, ref, algorithm=algorithm,
+                                      tolerance=2.0, separation=1.0)
+                expected.append((np.full(len(r), i), r))
+
+        offsets = np.cumsum([0] + [len(x) for x in frames[:-1]])
+        for nthreads in (0, 1, 4):
+            results = [
+                stimage.xyxymatch_many(
+                    frames, ref, algorithm=algorithm, tolerance=2.0,
+                    separation=1.0, nthreads=nthreads),
+                stimage.xyxymatch_many(
+                    frames, catalog, algorithm=algorithm, tolerance=2.0,
+                    nthreads=nthreads),
+                stimage.xyxymatch_many(
+                    np.concatenate(frames), catalog, algorithm=algorithm,
+                    tolerance=2.0, offsets=offsets, nthreads=nthreads)]
+
+            for r in results:
+                assert r.dtype.names[0] == 'frame'
+                assert len(r) == sum(len(e[1]) for e in expected)
+                assert np.all(r['frame'] ==
+                              np.concatenate([e[0] for e in expected]))
+                for name in expected[0][1].dtype.names:
+                    assert np.all(
+                        r[name] ==
+                        np.concatenate([e[1][name] for e in expected]))
+
+    assert len(stimage.xyxymatch_many([], ref)) == 0
+
+    try:
+        stimage.xyxymatch_many(np.concatenate(frames), ref,
+                               offsets=[0, 10, 5])
+    except ValueError:
+        pass
+    else:
+        assert False, "Decreasing offsets did not raise ValueError"
+
+    try:
+        stimage.xyxymatch_many(np.concatenate(frames), ref,
+                               offsets=[10, 20])
+    except ValueError:
+        pass
+    else:
+        assert False, "Offsets not starting at 0 did not raise ValueError"
+
+
+def test_triangles_local():
+    np.random.seed(0)
+    ref = np.random.random((2000, 2)) * 2048.0
+
+    # Most of the reference coordinates, shifted, with some noise, and
+    # some spurious coordinates
+    keep = np.random.random(len(ref)) < 0.8
+    source = np.concatenate([np.nonzero(keep)[0], np.full(400, -1)])
+    x = np.concatenate([
+        ref[keep] + [20.0, -15.0] +
+        (np.random.random((keep.sum(), 2)) - 0.5) * 0.2,
+        np.random.random((400, 2)) * 2048.0])
+
+    r = stimage.xyxymatch(x, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nneighbors=6)
+
+    assert len(r) > 100
+    assert np.all(source[r['input_idx']] == r['ref_idx'])
+
+    r_many = stimage.xyxymatch_many([x, x[:0], x], ref,
+                                    algorithm='triangles', tolerance=1.0,
+                                    separation=0.0, nneighbors=6)
+    assert np.all(r_many['frame'] == [0] * len(r) + [2] * len(r))
+    for name in r.dtype.names:
+        assert np.all(r_many[name] == np.concatenate([r[name], r[name]]))
+
+    try:
+        stimage.xyxymatch(x, ref, algorithm='triangles', nneighbors=1)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "nneighbors=1 did not raise RuntimeError"
+
+
+def test_offsets():
+    np.random.seed(0)
+    ref = np.random.random((2000, 2)) * 4000.0
+    x = ref + [-812.5, 409.0] + (np.random.random((2000, 2)) - 0.5) * 0.2
+
+    r = stimage.xyxymatch(x, ref, algorithm='offsets', tolerance=1.0,
+                          separation=0.0)
+
+    assert len(r) == len(ref)
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    # A rotation is found from the candidates
+    theta = np.deg2rad(2.0)
+    rot = np.array([[np.cos(theta), -np.sin(theta)],
+                    [np.sin(theta), np.cos(theta)]])
+    x = np.dot(ref, rot.T) + [30.0, -20.0]
+
+    r = stimage.xyxymatch(x, ref, algorithm='offsets', tolerance=1.0,
+                          separation=0.0)
+    assert len(r) < len(ref) / 2
+
+    r = stimage.xyxymatch(x, ref, algorithm='offsets', tolerance=1.0,
+                          separation=0.0,
+                          rotations=np.arange(-4.0, 4.5, 1.0))
+    assert len(r) == len(ref)
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    r2 = stimage.xyxymatch_many([x, x[:500]], ref, algorithm='offsets',
+                                tolerance=1.0, separation=0.0,
+                                rotations=np.arange(-4.0, 4.5, 1.0))
+    assert np.all(r2[r2['frame'] == 0]['input_idx'] == r['input_idx'])
+    assert np.sum(r2['frame'] == 1) == 500
+
+    # Rows that are not finite are ignored, in either list
+    x_bad = x.copy()
+    x_bad[10] = np.nan
+    ref_bad = ref.copy()
+    ref_bad[20, 0] = np.inf
+    r = stimage.xyxymatch(x_bad, ref_bad, algorithm='offsets',
+                          tolerance=1.0, separation=0.0,
+                          rotations=np.arange(-4.0, 4.5, 1.0))
+    assert len(r) == len(ref) - 2
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    try:
+        stimage.xyxymatch(x, ref, algorithm='offsets', scales=[])
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+
+
+def test_triangles_ransac():
+    np.random.seed(0)
+    ref = np.random.random((50, 2)) * 2000.0
+    theta = np.deg2rad(30.0)
+    rot = np.array([[np.cos(theta), -np.sin(theta)],
+                    [np.sin(theta), np.cos(theta)]])
+    x = np.dot(ref, rot.T) * 1.1 + [100.0, -50.0]
+    x += (np.random.random((50, 2)) - 0.5) * 0.2
+
+    # Most of the input coordinates have nothing to do with the
+    # reference coordinates
+    x[:30] = np.random.random((30, 2)) * 2000.0
+
+    r = stimage.xyxymatch(x, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=50, consensus='ransac')
+    assert len(r) == 20
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    # The consensus also matches every coordinate in local mode
+    ref = np.random.random((1000, 2)) * 2000.0
+    x = np.dot(ref, rot.T) + [100.0, -50.0]
+    x[:300] = np.random.random((300, 2)) * 2000.0
+
+    r = stimage.xyxymatch(x, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nneighbors=8, consensus='ransac')
+    assert len(r) == 700
+    assert np.all(r['input_idx'] == r['ref_idx'])
+
+    try:
+        stimage.xyxymatch(x, ref, algorithm='triangles', consensus='vote')
+    except ValueError:
+        pass
+    else:
+        assert False, "Expected ValueError"
+
+
+def test_budget():
+    np.random.seed(0)
+    ref = np.random.random((200, 2)) * 1000.0
+
+    try:
+        stimage.xyxymatch(ref, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=100, max_work=10000)
+    except stimage.BudgetExceededError as e:
+        assert isinstance(e, RuntimeError)
+        assert 'work budget of 10000' in str(e)
+    else:
+        assert False, "Expected BudgetExceededError"
+
+    try:
+        stimage.xyxymatch(ref, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=100, timeout=1e-9)
+    except stimage.BudgetExceededError as e:
+        assert 'time limit' in str(e)
+    else:
+        assert False, "Expected BudgetExceededError"
+
+    try:
+        stimage.xyxymatch_many([ref, ref], ref, algorithm='triangles',
+                               tolerance=1.0, separation=0.0, nmatch=100,
+                               max_work=10000)
+    except stimage.BudgetExceededError:
+        pass
+    else:
+        assert False, "Expected BudgetExceededError"
+
+    # With enough budget, the results are unchanged
+    r = stimage.xyxymatch(ref, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=100, max_work=10**9,
+                          timeout=600.0)
+    r2 = stimage.xyxymatch(ref, ref, algorithm='triangles', tolerance=1.0,
+                           separation=0.0, nmatch=100)
+    assert np.all(r == r2)
+    assert len(r) == len(ref)
+
+
+def test_interrupt():
+    import os
+    import signal
+    import threading
+
+    np.random.seed(0)
+    ref = np.random.random((400, 2)) * 1000.0
+
+    # Takes minutes, unless interrupted.  Only the main thread checks
+    # for signals while matching.
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGINT))
+    timer.start()
+    try:
+        stimage.xyxymatch(ref, ref, algorithm='triangles', tolerance=1.0,
+                          separation=0.0, nmatch=400, timeout=60.0)
+    except KeyboardInterrupt:
+        pass
+    else:
+        assert False, "Expected KeyboardInterrupt"
+    finally:
+        timer.cancel()
+
+    # Other threads still run out of budget as usual
+    errors = []
+
+    def worker():
+        try:
+            stimage.xyxymatch(ref, ref, algorithm='triangles',
+                              tolerance=1.0, separation=0.0, nmatch=100,
+                              max_work=10000)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+    assert isinstance(errors[0], stimage.BudgetExceededError)
+
+
+def test_input_layouts():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 100.0
+    x = ref + (np.random.random((512, 2)) - 0.5) * 0.02
+
+    expected = stimage.xyxymatch(x, ref, algorithm='tolerance',
+                                 tolerance=0.5, separation=0.0)
+    assert len(expected) > 0
+
+    table = np.zeros(512, dtype=[('id', 'i4'), ('x', '>f8'), ('y', 'f4'),
+                                 ('flux', 'f8')])
+    table['x'] = x[:, 0]
+    table['y'] = x[:, 1]
+    packed = np.zeros(512, dtype=[('x', 'f8'), ('y', 'f8')])
+    packed['x'] = x[:, 0]
+    packed['y'] = x[:, 1]
+    wide = np.zeros((512, 5))
+    wide[:, 1:3] = x
+
+    for input in (np.asfortranarray(x),
+                  wide[:, 1:3],
+                  packed,
+                  packed.view(np.recarray),
+                  {'x': x[:, 0], 'y': list(x[:, 1])}):
+        r = stimage.xyxymatch(input, ref, algorithm='tolerance',
+                              tolerance=0.5, separation=0.0)
+        assert np.all(r == expected)
+
+    # Columns of other types are converted
+    r = stimage.xyxymatch(table, ref, algorithm='tolerance',
+                          tolerance=0.5, separation=0.0)
+    assert np.all(r['input_idx'] == expected['input_idx'])
+    assert np.allclose(r['input_y'], expected['input_y'], rtol=1e-6)
+
+    # The x and y fields of a structured array are used in place
+    catalog = stimage.ReferenceCatalog(packed, separation=0.0)
+    packed['x'] = 0.0
+    assert np.all(catalog.ref == x)
+
+    for bad in (np.zeros(3, dtype=[('x', 'f8')]),
+                np.zeros(3, dtype=[('y', 'f8')]).view(np.recarray),
+                {'x': [1.0, 2.0]},
+                {'y': [1.0, 2.0]}):
+        try:
+            stimage.xyxymatch(bad, ref)
+        except TypeError as e:
+            assert str(e) == "input array must have x and y fields"
+        else:
+            assert False, "Input with one field did not raise TypeError"
+
+    try:
+        stimage.xyxymatch({'x': [1.0, 2.0], 'y': [1.0]}, ref)
+    except (TypeError, ValueError):
+        pass
+    else:
+        assert False, "Columns of different lengths did not raise"
+
+
+def test_output_modes():
+    np.random.seed(0)
+    ref = np.random.random((2048, 2)) * 100.0
+    x = np.random.random((2048, 2)) * 100.0
+    x[:100] = ref[:100] + 0.001
+
+    expected = stimage.xyxymatch(x, ref, algorithm='tolerance',
+                                 tolerance=0.01, separation=0.0)
+    assert 100 <= len(expected) < 2048
+    assert expected.flags.owndata and expected.flags.writeable
+
+    input_idx, ref_idx = stimage.xyxymatch(
+        x, ref, algorithm='tolerance', tolerance=0.01, separation=0.0,
+        indices_only=True)
+    assert input_idx.dtype == np.intp and ref_idx.dtype == np.intp
+    assert np.all(input_idx == expected['input_idx'])
+    assert np.all(ref_idx == expected['ref_idx'])
+
+    # Reusing the same preallocated buffers
+    out = np.zeros(len(expected) + 10, dtype=expected.dtype)
+    out_idx = (np.zeros(len(expected), dtype=np.intp),
+               np.zeros(len(expected), dtype=np.intp))
+    for i in range(2):
+        r = stimage.xyxymatch(x, ref, algorithm='tolerance', tolerance=0.01,
+                              separation=0.0, out=out)
+        assert np.all(r == expected)
+        assert np.may_share_memory(r, out)
+
+        r = stimage.xyxymatch(x, ref, algorithm='tolerance', tolerance=0.01,
+                              separation=0.0, indices_only=True, out=out_idx)
+        assert np.all(r[0] == expected['input_idx'])
+        assert np.all(r[1] == expected['ref_idx'])
+        assert np.may_share_memory(r[0], out_idx[0])
+
+    # No matches at all
+    r = stimage.xyxymatch(x + 1000.0, ref, algorithm='tolerance',
+                          tolerance=0.01, separation=0.0)
+    assert len(r) == 0 and r.dtype == expected.dtype
+
+    readonly = out.copy()
+    readonly.flags.writeable = False
+    for kwargs, exc in (({'out': out[:10]}, ValueError),
+                        ({'out': out[::2]}, TypeError),
+                        ({'out': readonly}, TypeError),
+                        ({'out': out_idx, 'indices_only': False}, TypeError),
+                        ({'out': out_idx[0], 'indices_only': True},
+                         TypeError)):
+        try:
+            stimage.xyxymatch(x, ref, algorithm='tolerance', tolerance=0.01,
+                              separation=0.0, **kwargs)
+        except exc:
+            pass
+        else:
+            assert False, "Bad out did not raise %s" % exc.__name__
+
+
+def test_negative_counts():
+    np.random.seed(0)
+    ref = np.random.random((64, 2)) * 100.0
+
+    for func, args in ((stimage.xyxymatch, (ref, ref)),
+                       (stimage.xyxymatch_many, ([ref], ref))):
+        for name in ('nmatch', 'nreject', 'nneighbors', 'nthreads',
+                     'max_work'):
+            try:
+                func(*args, **{name: -1})
+            except ValueError:
+                pass
+            else:
+                assert False, "Negative %s did not raise ValueError" % name
+
+    catalog = stimage.ReferenceCatalog(ref, separation=1.0)
+    for name in ('nmatch', 'nneighbors', 'nthreads'):
+        try:
+            catalog.build_triangles(**{name: -1})
+        except ValueError:
+            pass
+        else:
+            assert False, "Negative %s did not raise ValueError" % name
+
+    for nmatch, nneighbors in ((-1, 0), (30, -1)):
+        try:
+            catalog._set_triangles(b'', nmatch, nneighbors, 1.0, 10.0)
+        except ValueError:
+            pass
+        else:
+            assert False, "Negative count did not raise ValueError"
+
+
+def test_zero_nmatch():
+    np.random.seed(0)
+    ref = np.random.random((64, 2)) * 100.0
+
+    catalog = stimage.ReferenceCatalog(ref, separation=1.0)
+    triangles = {'algorithm': 'triangles', 'nmatch': 0}
+    for func, args, kwargs in ((stimage.xyxymatch, (ref, ref), triangles),
+                               (stimage.xyxymatch_many, ([ref], ref),
+                                triangles),
+                               (catalog.build_triangles, (), {'nmatch': 0})):
+        try:
+            func(*args, **kwargs)
+        except RuntimeError:
+            pass
+        else:
+            assert False, "nmatch=0 did not raise RuntimeError"
@@ -41,6 +41,7 @@ DAMAGE.
 #include <stdio.h>
 
 #include "immatch/geomap.h"
+#include "lib/threads.h"
 #include "lib/xybbox.h"
 #include "surface/fit.h"
 #include "surface/vector.h"
@@ -71,7 +72,7 @@ typedef struct {
     size_t maxiter;
     double reject;
     size_t nreject;
-    int*   rej;
+    size_t* rej;
 
     coord_t oref;
     coord_t oin;
@@ -232,7 +233,7 @@ compute_surface_coefficients(
 
  exit:
 
-    return 0;
+    return status;
 }
 
 static int
@@ -395,7 +396,7 @@ geo_fit_theta(
     for (i = 0; i < ncoord; ++i) {
         syrxi += weights[i] * (ref[i].y - r0.y) * (input[i].x - i0.x);
         sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].y - i0.y);
-        sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
+        sxrxi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
         syryi += weights[i] * (ref[i].y - r0.y) * (input[i].y - i0.y);
     }
 
@@ -738,7 +739,7 @@ geo_fit_linear(
     cthetac.x = xmag * ctheta;
     sthetac.x = ymag * stheta;
     sthetac.y = xmag * stheta;
-    cthetac.x = ymag * ctheta;
+    cthetac.y = ymag * ctheta;
 
     /* Compute the X and Y fit coefficients */
     if (compute_surface_coefficients(
@@ -803,6 +804,49 @@ _geo_fit_xy_validate_fit_error(
     return 0;
 }
 
+/* Fit a surface to the coordinates, using their basis functions from
+   basis, when it is given and has them, rather than computing them
+   again */
+static int
+geo_surface_fit(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const double* const z,
+        double* const weights,
+        /* Output */
+        surface_fit_error_e* const fit_error,
+        stimage_error_t* const error) {
+
+    if (basis != NULL && surface_basis_covers(basis, s, ncoord)) {
+        return surface_fit_basis(s, basis, z, weights, fit_error, error);
+    }
+
+    return surface_fit(
+            s, ncoord, ref, z, weights, surface_fit_weight_user,
+            fit_error, error);
+}
+
+/* Evaluate a surface at the coordinates, using their basis functions
+   from basis, when it is given and has them */
+static int
+geo_surface_vector(
+        const surface_t* const s,
+        const surface_basis_t* const basis,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    if (basis != NULL && surface_basis_covers(basis, s, ncoord)) {
+        return surface_vector_basis(s, basis, zfit, error);
+    }
+
+    return surface_vector(s, ncoord, ref, zfit, error);
+}
+
 /* was geo_fxyd */
 static int
 geo_fit_xy(
@@ -813,6 +857,7 @@ geo_fit_xy(
         const int xfit,
         const coord_t* const input,
         const coord_t* const ref,
+        const surface_basis_t* const basis,
         /* Output */
         int* has_secondary,
         double* const weights,
@@ -821,7 +866,7 @@ geo_fit_xy(
 
     bbox_t              bbox;
     double*             zfit      = NULL;
-    const double* const z = (double*)input + (xfit ? 0 : 1);
+    double*             z         = NULL;
     surface_t           savefit;
     surface_fit_error_e fit_error = surface_fit_error_ok;
     size_t              i         = 0;
@@ -846,6 +891,14 @@ geo_fit_xy(
     zfit = malloc_with_error(ncoord * sizeof(double), error);
     if (zfit == NULL) goto exit;
 
+    /* The surface fitter wants the fitted axis as a contiguous array */
+    z = malloc_with_error(ncoord * sizeof(double), error);
+    if (z == NULL) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        z[i] = xfit ? input[i].x : input[i].y;
+    }
+
     bbox_copy(&fit->bbox, &bbox);
     bbox_make_nonsingular(&bbox);
 
@@ -860,12 +913,12 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].x;
+                zfit[i] = z[i] - ref[i].x;
             }
 
-            if (surface_fit(
-                        sf1, ncoord, ref, zfit, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, zfit, weights,
+                        &fit_error, error)) goto exit;
 
             if (fit->function == surface_type_polynomial) {
                 savefit.coeff[0] = sf1->coeff[0];
@@ -885,9 +938,9 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 1, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, z, weights,
+                        &fit_error, error)) goto exit;
             *has_secondary = 0;
             break;
 
@@ -895,18 +948,15 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, z, weights,
+                        &fit_error, error)) goto exit;
 
             if (fit->xxorder > 2 || fit->xyorder > 2 ||
                 fit->xxterms == xterms_full) {
                 if (surface_init(
                             sf2, fit->function, fit->xxorder, fit->xyorder,
-                            fit->xxterms, &fit->bbox, error)) {
-                    surface_free(sf1);
-                    goto exit;
-                }
+                            fit->xxterms, &bbox, error)) goto exit;
             } else {
                 *has_secondary = 0;
             }
@@ -923,11 +973,11 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].y;
+                zfit[i] = z[i] - ref[i].y;
             }
-            if (surface_fit(
-                        sf1, ncoord, ref, zfit, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, zfit, weights,
+                        &fit_error, error)) goto exit;
             if (fit->function == surface_type_polynomial) {
                 savefit.coeff[0] = sf1->coeff[0];
                 savefit.coeff[1] = 0.0;
@@ -947,9 +997,9 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 1, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, z, weights,
+                        &fit_error, error)) goto exit;
             *has_secondary = 0;
             break;
 
@@ -957,9 +1007,9 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
-                        surface_fit_weight_user, &fit_error, error)) goto exit;
+            if (geo_surface_fit(
+                        sf1, basis, ncoord, ref, z, weights,
+                        &fit_error, error)) goto exit;
             if (fit->yxorder > 2 || fit->yyorder > 2 ||
                 fit->yxterms == xterms_full) {
                 if (surface_init(
@@ -976,22 +1026,22 @@ geo_fit_xy(
     if (_geo_fit_xy_validate_fit_error(
                 fit_error, xfit, fit->projection, error)) goto exit;
 
-    if (surface_vector(sf1, ncoord, ref, residual, error)) goto exit;
+    if (geo_surface_vector(sf1, basis, ncoord, ref, residual, error)) goto exit;
     for (i = 0; i < ncoord; ++i) {
-        residual[i] = z[i<<1] - residual[i];
+        residual[i] = z[i] - residual[i];
     }
 
     /* Calculate the higher-order fit */
     if (*has_secondary) {
-        if (surface_fit(
-                    sf2, ncoord, ref, residual, weights,
-                    surface_fit_weight_user, &fit_error, error)) goto exit;
+        if (geo_surface_fit(
+                    sf2, basis, ncoord, ref, residual, weights,
+                    &fit_error, error)) goto exit;
         if (_geo_fit_xy_validate_fit_error(
                     fit_error, xfit, fit->projection, error)) goto exit;
 
-        if (surface_vector(sf2, ncoord, ref, zfit, error)) goto exit;
+        if (geo_surface_vector(sf2, basis, ncoord, ref, zfit, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
-            residual[i] = zfit[i] - residual[i];
+            residual[i] -= zfit[i];
         }
     }
 
@@ -1019,6 +1069,272 @@ geo_fit_xy(
 
     surface_free(&savefit);
     free(zfit);
+    free(z);
+
+    return status;
+}
+
+/* Solve for the surfaces of one axis of a "general" fit from their
+   accumulated normal equations: acc1 of the linear part, and acc2 of
+   the whole surface.  sf2 is solved as a fit of the whole surface,
+   and then the linear part is subtracted from it, leaving the fit to
+   the residuals from the linear part that geo_fit_xy finds.  This
+   needs the linear terms to be part of the whole surface, which has
+   to have an order of at least 2 in x and y. */
+static int
+geo_fit_xy_solve(
+        const surface_t* const acc1,
+        const surface_t* const acc2,
+        const int has_secondary,
+        const int xfit,
+        const geomap_proj_e projection,
+        surface_t* const sf1,
+        surface_t* const sf2,
+        stimage_error_t* const error) {
+
+    surface_fit_error_e fit_error = surface_fit_error_ok;
+
+    assert(acc1);
+    assert(acc2);
+    assert(sf1);
+    assert(sf2);
+    assert(error);
+
+    surface_free(sf1);
+    surface_free(sf2);
+
+    /* Solving overwrites the factorization, so work on copies, which
+       leaves the normal equations as they were */
+    if (surface_copy(acc1, sf1, error) ||
+        surface_fit_solve(sf1, &fit_error, error) ||
+        _geo_fit_xy_validate_fit_error(
+                fit_error, xfit, projection, error)) return 1;
+
+    if (has_secondary) {
+        assert(acc2->xorder >= 2 && acc2->yorder >= 2);
+
+        if (surface_copy(acc2, sf2, error) ||
+            surface_fit_solve(sf2, &fit_error, error) ||
+            _geo_fit_xy_validate_fit_error(
+                    fit_error, xfit, projection, error)) return 1;
+
+        /* The constant and linear basis functions are the same in both
+           surfaces, and come first in x and y */
+        sf2->coeff[0] -= sf1->coeff[0];
+        sf2->coeff[1] -= sf1->coeff[1];
+        sf2->coeff[sf2->xorder] -= sf1->coeff[2];
+    }
+
+    return 0;
+}
+
+/* Whether geo_fit_reject can downdate the normal equations of the fit
+   rather than fitting all of the points again: the "general" fit
+   geometry, where geo_fit_xy_solve can find the distortion part from
+   a fit of the whole surface */
+static int
+geo_fit_reject_can_downdate(
+        const geomap_fit_t* const fit,
+        const int has_sx2,
+        const int has_sy2) {
+
+    assert(fit);
+
+    return (fit->fit_geometry == geomap_fit_general &&
+            (!has_sx2 || (fit->xxorder >= 2 && fit->xyorder >= 2)) &&
+            (!has_sy2 || (fit->yxorder >= 2 && fit->yyorder >= 2)));
+}
+
+/* Add the coordinates to the normal equations of a surface, using
+   their basis functions from basis, when it is given and has them */
+static int
+geo_surface_add_points(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const double* const z,
+        double* const weights,
+        stimage_error_t* const error) {
+
+    if (basis != NULL && surface_basis_covers(basis, s, ncoord)) {
+        return surface_fit_add_basis(s, basis, z, weights, error);
+    }
+
+    return surface_fit_add_points(
+            s, ncoord, ref, z, weights, surface_fit_weight_user, error);
+}
+
+/* Accumulate the normal equations of one axis of a "general" fit, in
+   the form geo_fit_xy_solve takes them */
+static int
+geo_fit_xy_accumulate(
+        const geomap_fit_t* const fit,
+        const int has_secondary,
+        const size_t ncoord,
+        const int xfit,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const surface_basis_t* const basis,
+        double* const weights,
+        /* Output */
+        surface_t* const acc1,
+        surface_t* const acc2,
+        stimage_error_t* error) {
+
+    bbox_t  bbox;
+    double* z      = NULL;
+    size_t  i      = 0;
+    int     status = 1;
+
+    assert(fit);
+    assert(input);
+    assert(ref);
+    assert(weights);
+    assert(acc1);
+    assert(acc2);
+    assert(error);
+
+    z = malloc_with_error(ncoord * sizeof(double), error);
+    if (z == NULL) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        z[i] = xfit ? input[i].x : input[i].y;
+    }
+
+    bbox_copy(&fit->bbox, &bbox);
+    bbox_make_nonsingular(&bbox);
+
+    if (surface_init(
+                acc1, fit->function, 2, 2, xterms_none, &bbox, error) ||
+        geo_surface_add_points(
+                acc1, basis, ncoord, ref, z, weights, error)) goto exit;
+
+    if (has_secondary) {
+        if (surface_init(
+                    acc2, fit->function,
+                    xfit ? fit->xxorder : fit->yxorder,
+                    xfit ? fit->xyorder : fit->yyorder,
+                    xfit ? fit->xxterms : fit->yxterms,
+                    &bbox, error) ||
+            geo_surface_add_points(
+                    acc2, basis, ncoord, ref, z, weights, error)) goto exit;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(z);
+
+    return status;
+}
+
+/* Refit one axis of a "general" fit after rejecting nnew more points,
+   by subtracting their contributions from the normal equations
+   accumulated by geo_fit_xy_accumulate, rather than fitting all of
+   the points again as geo_fit_xy does.  The results are the same as
+   those of geo_fit_xy. */
+static int
+geo_fit_xy_downdate(
+        geomap_fit_t* const fit,
+        surface_t* const acc1,
+        surface_t* const acc2,
+        const int has_secondary,
+        const size_t ncoord,
+        const int xfit,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const surface_basis_t* const basis,
+        const size_t nnew,
+        const size_t* const new_idx, /* [nnew] */
+        const double* const weights,
+        const double* const tweights,
+        /* Output */
+        surface_t* const sf1,
+        surface_t* const sf2,
+        double* const residual,
+        stimage_error_t* error) {
+
+    coord_t* new_ref = NULL;
+    double*  new_z   = NULL;
+    double*  new_w   = NULL;
+    double*  zfit    = NULL;
+    double   rms     = 0.0;
+    size_t   i       = 0;
+    int      status  = 1;
+
+    assert(fit);
+    assert(acc1);
+    assert(acc2);
+    assert(input);
+    assert(ref);
+    assert(new_idx);
+    assert(weights);
+    assert(tweights);
+    assert(sf1);
+    assert(sf2);
+    assert(residual);
+    assert(error);
+
+    new_ref = malloc_with_error(nnew * sizeof(coord_t), error);
+    if (new_ref == NULL) goto exit;
+    new_z = malloc_with_error(nnew * sizeof(double), error);
+    if (new_z == NULL) goto exit;
+    new_w = malloc_with_error(nnew * sizeof(double), error);
+    if (new_w == NULL) goto exit;
+    zfit = malloc_with_error(ncoord * sizeof(double), error);
+    if (zfit == NULL) goto exit;
+
+    /* The newly rejected points were fit with their original weights */
+    for (i = 0; i < nnew; ++i) {
+        new_ref[i] = ref[new_idx[i]];
+        new_z[i] = xfit ? input[new_idx[i]].x : input[new_idx[i]].y;
+        new_w[i] = weights[new_idx[i]];
+    }
+
+    if (surface_fit_remove_points(
+                acc1, nnew, new_ref, new_z, new_w, error)) goto exit;
+    if (has_secondary &&
+        surface_fit_remove_points(
+                acc2, nnew, new_ref, new_z, new_w, error)) goto exit;
+
+    if (geo_fit_xy_solve(
+                acc1, acc2, has_secondary, xfit, fit->projection,
+                sf1, sf2, error)) goto exit;
+
+    /* The residuals of every point still change with the fit */
+    if (geo_surface_vector(sf1, basis, ncoord, ref, residual, error)) goto exit;
+    for (i = 0; i < ncoord; ++i) {
+        residual[i] = (xfit ? input[i].x : input[i].y) - residual[i];
+    }
+    if (has_secondary) {
+        if (geo_surface_vector(sf2, basis, ncoord, ref, zfit, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            residual[i] -= zfit[i];
+        }
+    }
+
+    /* As geo_fit_xy leaves them */
+    fit->n_zero_weighted = count_zero_weighted(ncoord, tweights);
+    for (i = 0; i < ncoord; ++i) {
+        rms += tweights[i] * residual[i] * residual[i];
+    }
+    if (xfit) {
+        fit->xrms = rms;
+    } else {
+        fit->yrms = rms;
+    }
+    fit->ncoord = ncoord;
+
+    status = 0;
+
+ exit:
+
+    free(new_ref);
+    free(new_z);
+    free(new_w);
+    free(zfit);
 
     return status;
 }
@@ -1036,18 +1352,22 @@ geo_fit_reject(
         const size_t ncoord,
         const coord_t* const input,
         const coord_t* const ref,
+        const surface_basis_t* const basis,
         const double* const weights,
         double* const residual_x,
         double* const residual_y,
         stimage_error_t* error) {
 
-    double* tweights = NULL;
-    size_t  nreject  = 0;
-    size_t  niter    = 0;
-    double  cutx     = 0.0;
-    double  cuty     = 0.0;
-    size_t  i        = 0;
-    int     status   = 1;
+    double*   tweights = NULL;
+    size_t    nreject  = 0;
+    size_t    nnew     = 0;
+    size_t    niter    = 0;
+    double    cutx     = 0.0;
+    double    cuty     = 0.0;
+    size_t    i        = 0;
+    int       downdate = 0;
+    surface_t acc_x1, acc_x2, acc_y1, acc_y2;
+    int       status   = 1;
 
     assert(fit);
     assert(sx1);
@@ -1061,13 +1381,18 @@ geo_fit_reject(
     assert(residual_y);
     assert(error);
 
+    surface_new(&acc_x1);
+    surface_new(&acc_x2);
+    surface_new(&acc_y1);
+    surface_new(&acc_y2);
+
     tweights = malloc_with_error(ncoord * sizeof(double), error);
     if (tweights == NULL) goto exit;
 
     if (fit->rej != NULL) {
         free(fit->rej);
     }
-    fit->rej = malloc_with_error(ncoord * sizeof(int), error);
+    fit->rej = malloc_with_error(ncoord * sizeof(size_t), error);
     if (fit->rej == NULL) goto exit;
 
     fit->nreject = 0;
@@ -1078,6 +1403,19 @@ geo_fit_reject(
         tweights[i] = weights[i];
     }
 
+    /* Where it can, keep the normal equations of the fit, so that each
+       iteration only has to remove the newly rejected points from
+       them, rather than fit all of the points again */
+    downdate = geo_fit_reject_can_downdate(fit, *has_sx2, *has_sy2);
+    if (downdate) {
+        if (geo_fit_xy_accumulate(
+                    fit, *has_sx2, ncoord, 1, input, ref, basis, tweights,
+                    &acc_x1, &acc_x2, error) ||
+            geo_fit_xy_accumulate(
+                    fit, *has_sy2, ncoord, 0, input, ref, basis, tweights,
+                    &acc_y1, &acc_y2, error)) goto exit;
+    }
+
     do { /* while (niter < fit->maxiter) */
         /* Compute the rejection limits */
         if (ncoord - fit->n_zero_weighted > 1) {
@@ -1093,17 +1431,18 @@ geo_fit_reject(
         /* Reject points from the fit */
         for (i = 0; i < ncoord; ++i) {
             if (tweights[i] > 0.0 &&
-                ((abs(residual_x[i]) > cutx) || abs(residual_y[i]) > cuty)) {
+                (fabs(residual_x[i]) > cutx || fabs(residual_y[i]) > cuty)) {
                 tweights[i] = 0.0;
-                ++nreject;
                 assert(nreject < ncoord);
                 fit->rej[nreject] = i;
+                ++nreject;
             }
         }
 
         if ((long)nreject - (long)fit->nreject <= 0) {
             break;
         }
+        nnew = nreject - fit->nreject;
         fit->nreject = nreject;
 
         /* Compute the number of deleted points */
@@ -1127,12 +1466,27 @@ geo_fit_reject(
                         residual_x, residual_y, error)) goto exit;
             break;
         default:
-            if (geo_fit_xy(
-                        fit, sx1, sx2, ncoord, 1, input, ref, has_sx2, tweights,
-                        residual_x, error) ||
-                geo_fit_xy(
-                        fit, sy1, sy2, ncoord, 0, input, ref, has_sy2, tweights,
-                        residual_y, error)) goto exit;
+            if (downdate) {
+                if (geo_fit_xy_downdate(
+                            fit, &acc_x1, &acc_x2, *has_sx2, ncoord, 1,
+                            input, ref, basis, nnew,
+                            fit->rej + nreject - nnew,
+                            weights, tweights, sx1, sx2, residual_x,
+                            error) ||
+                    geo_fit_xy_downdate(
+                            fit, &acc_y1, &acc_y2, *has_sy2, ncoord, 0,
+                            input, ref, basis, nnew,
+                            fit->rej + nreject - nnew,
+                            weights, tweights, sy1, sy2, residual_y,
+                            error)) goto exit;
+            } else {
+                if (geo_fit_xy(
+                            fit, sx1, sx2, ncoord, 1, input, ref, basis,
+                            has_sx2, tweights, residual_x, error) ||
+                    geo_fit_xy(
+                            fit, sy1, sy2, ncoord, 0, input, ref, basis,
+                            has_sy2, tweights, residual_y, error)) goto exit;
+            }
             break;
         }
 
@@ -1149,6 +1503,50 @@ geo_fit_reject(
  exit:
 
     free(tweights);
+    surface_free(&acc_x1);
+    surface_free(&acc_x2);
+    surface_free(&acc_y1);
+    surface_free(&acc_y2);
+
+    return status;
+}
+
+/* Compute the basis functions of the reference coordinates, to the
+   highest order of any of the surfaces of the fit */
+static int
+geo_basis_init(
+        const geomap_fit_t* const fit,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        surface_basis_t* const basis,
+        stimage_error_t* error) {
+
+    bbox_t    bbox;
+    surface_t geometry;
+    int       status = 1;
+
+    assert(fit);
+    assert(ref);
+    assert(basis);
+    assert(error);
+
+    bbox_copy(&fit->bbox, &bbox);
+    bbox_make_nonsingular(&bbox);
+
+    if (surface_init(
+                &geometry, fit->function,
+                MAX(2, MAX(fit->xxorder, fit->yxorder)),
+                MAX(2, MAX(fit->xyorder, fit->yyorder)),
+                xterms_none, &bbox, error)) goto exit;
+
+    if (surface_basis_init(basis, &geometry, ncoord, ref, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    surface_free(&geometry);
 
     return status;
 }
@@ -1166,6 +1564,7 @@ geofit(
         const size_t ncoord,
         const coord_t* const input,
         const coord_t* const ref,
+        const surface_basis_t* const basis,
         double* const weights,
         stimage_error_t* error) {
 
@@ -1212,12 +1611,12 @@ geofit(
         break;
     default:
         if (geo_fit_xy(
-                    fit, sx1, sx2, ncoord, 0, input, ref, has_sx2, weights,
-                    residual_x, error)
+                    fit, sx1, sx2, ncoord, 1, input, ref, basis, has_sx2,
+                    weights, residual_x, error)
             ||
             geo_fit_xy(
-                    fit, sy1, sy2, ncoord, 1, input, ref, has_sy2, weights,
-                    residual_y, error)) goto exit;
+                    fit, sy1, sy2, ncoord, 0, input, ref, basis, has_sy2,
+                    weights, residual_y, error)) goto exit;
         break;
     }
 
@@ -1226,7 +1625,8 @@ geofit(
     } else {
         if (geo_fit_reject(
                     fit, sx1, sy1, sx2, sy2, has_sx2, has_sy2, ncoord, input,
-                    ref, weights, residual_x, residual_y, error)) goto exit;
+                    ref, basis, weights, residual_x, residual_y,
+                    error)) goto exit;
     }
 
     status = 0;
@@ -1248,6 +1648,7 @@ geoeval(
         const int has_sy2,
         const size_t ncoord,
         const coord_t* const ref,
+        const surface_basis_t* const basis,
         double* const xfit,
         double* const yfit,
         stimage_error_t* const error) {
@@ -1270,17 +1671,17 @@ geoeval(
         if (tmp == NULL) goto exit;
     }
 
-    if (surface_vector(sx1, ncoord, ref, xfit, error)) goto exit;
+    if (geo_surface_vector(sx1, basis, ncoord, ref, xfit, error)) goto exit;
     if (has_sx2) {
-        if (surface_vector(sx2, ncoord, ref, tmp, error)) goto exit;
+        if (geo_surface_vector(sx2, basis, ncoord, ref, tmp, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
             xfit[i] += tmp[i];
         }
     }
 
-    if (surface_vector(sy1, ncoord, ref, yfit, error)) goto exit;
+    if (geo_surface_vector(sy1, basis, ncoord, ref, yfit, error)) goto exit;
     if (has_sy2) {
-        if (surface_vector(sy2, ncoord, ref, tmp, error)) goto exit;
+        if (geo_surface_vector(sy2, basis, ncoord, ref, tmp, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
             yfit[i] += tmp[i];
         }
@@ -1308,12 +1709,12 @@ geo_get_coeff(
     size_t nxxcoeff, nxycoeff, nyxcoeff, nyycoeff;
     double xxrange  = 1.0;
     double xyrange  = 1.0;
-    double xxmaxmin = 1.0;
-    double xymaxmin = 1.0;
+    double xxmaxmin = 0.0;
+    double xymaxmin = 0.0;
     double yxrange  = 1.0;
     double yyrange  = 1.0;
-    double yxmaxmin = 1.0;
-    double yymaxmin = 1.0;
+    double yxmaxmin = 0.0;
+    double yymaxmin = 0.0;
     double a, b, c, d;
 
     assert(sx);
@@ -1323,34 +1724,44 @@ geo_get_coeff(
     assert(rot);
     assert(sx->coeff);
     assert(sy->coeff);
-    assert(sx->ncoeff >= 3);
-    assert(sy->ncoeff >= 3);
 
-    nxxcoeff = nyxcoeff = sx->nxcoeff;
-    nxycoeff = nyycoeff = sy->nycoeff;
+    nxxcoeff = sx->nxcoeff;
+    nxycoeff = sx->nycoeff;
+    nyxcoeff = sy->nxcoeff;
+    nyycoeff = sy->nycoeff;
 
     /* Get the data range */
     if (sx->type != surface_type_polynomial) {
         xxrange = (sx->bbox.max.x - sx->bbox.min.x) / 2.0;
-        xxmaxmin = -(sx->bbox.max.x - sx->bbox.min.x) / 2.0;
+        xxmaxmin = -(sx->bbox.max.x + sx->bbox.min.x) / 2.0;
         xyrange = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
-        xymaxmin = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
+        xymaxmin = -(sx->bbox.max.y + sx->bbox.min.y) / 2.0;
     }
 
     if (sy->type != surface_type_polynomial) {
         yxrange = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
-        yxmaxmin = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
+        yxmaxmin = -(sy->bbox.max.x + sy->bbox.min.x) / 2.0;
         yyrange = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
-        yymaxmin = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
+        yymaxmin = -(sy->bbox.max.y + sy->bbox.min.y) / 2.0;
+    }
+
+    /* Get the shifts.  The linear x term is the second coefficient,
+       and the linear y term follows all of the x terms. */
+    shift->x = sx->coeff[0];
+    if (nxxcoeff > 1) {
+        shift->x += sx->coeff[1] * xxmaxmin / xxrange;
+    }
+    if (nxycoeff > 1) {
+        shift->x += sx->coeff[nxxcoeff] * xymaxmin / xyrange;
     }
 
-    /* Get the shifts */
-    shift->x = sx->coeff[0] + \
-        sx->coeff[1] * xxmaxmin / xxrange + \
-        sx->coeff[2] * xymaxmin / xyrange;
-    shift->y = sy->coeff[0] + \
-        sy->coeff[1] * yxmaxmin / yxrange +
-        sx->coeff[2] * yymaxmin / yyrange;
+    shift->y = sy->coeff[0];
+    if (nyxcoeff > 1) {
+        shift->y += sy->coeff[1] * yxmaxmin / yxrange;
+    }
+    if (nyycoeff > 1) {
+        shift->y += sy->coeff[nyxcoeff] * yymaxmin / yyrange;
+    }
 
     /* Get the rotation and scaling parameters */
     if (nxxcoeff > 1) {
@@ -1366,7 +1777,7 @@ geo_get_coeff(
     }
 
     if (nyxcoeff > 1) {
-        c = sx->coeff[1] / yxrange;
+        c = sy->coeff[1] / yxrange;
     } else {
         c = 0.0;
     }
@@ -1488,14 +1899,24 @@ geo_get_results(
         result->y2coeff = NULL;
     }
 
+    /* Keep the surfaces themselves, so the fit can be evaluated
+       later */
+    if (surface_copy(sx1, &result->sx1, error) ||
+        surface_copy(sy1, &result->sy1, error)) goto exit;
+    if (has_sx2) {
+        if (surface_copy(sx2, &result->sx2, error)) goto exit;
+    }
+    if (has_sy2) {
+        if (surface_copy(sy2, &result->sy2, error)) goto exit;
+    }
+    result->has_sx2 = has_sx2;
+    result->has_sy2 = has_sy2;
+
     status = 0;
 
  exit:
     if (status != 0) {
-        free(result->xcoeff);
-        free(result->ycoeff);
-        free(result->x2coeff);
-        free(result->y2coeff);
+        geomap_result_free(result);
     }
 
     return status;
@@ -1535,6 +1956,7 @@ geomap(
     double*          tweights       = NULL;
     geomap_output_t* outi           = NULL;
     surface_t        sx1, sy1, sx2, sy2;
+    surface_basis_t  basis;
     int              has_sx2        = 0;
     int              has_sy2        = 0;
     size_t           i              = 0;
@@ -1545,17 +1967,19 @@ geomap(
     assert(ref);
     assert(error);
 
+    geomap_fit_new(&fit);
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+    surface_basis_new(&basis);
+
     if (ninput != nref) {
         stimage_error_set_message(
             error, "Must have the same number of input and reference coordinates.");
         goto exit;
     }
 
-    surface_new(&sx1);
-    surface_new(&sy1);
-    surface_new(&sx2);
-    surface_new(&sy2);
-
     geomap_fit_init(
             &fit, geomap_proj_none, fit_geometry, function,
             xxorder, xyorder, xxterms, yxorder, yyorder, yxterms,
@@ -1619,15 +2043,21 @@ geomap(
     determine_bbox(nref_in_bbox, ref_in_bbox, &tbbox);
     bbox_copy(&tbbox, &fit.bbox);
 
+    /* Every surface is fit to, and evaluated at, the same reference
+       coordinates, so their basis functions are only computed once */
+    if (ninput_in_bbox > 0 &&
+        geo_basis_init(
+                &fit, ninput_in_bbox, ref_in_bbox, &basis, error)) goto exit;
+
     if (geofit(
                 &fit, &sx1, &sy1, &sx2, &sy2, &has_sx2, &has_sy2,
-                ninput_in_bbox, input_in_bbox, ref_in_bbox, weights,
+                ninput_in_bbox, input_in_bbox, ref_in_bbox, &basis, weights,
                 error)) goto exit;
 
     /* Compute the fitted x and y values */
     if (geoeval(
                 &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, ninput_in_bbox,
-                ref_in_bbox, xfit, yfit, error)) goto exit;
+                ref_in_bbox, &basis, xfit, yfit, error)) goto exit;
 
     if (geo_get_results(
                 &fit, &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, result,
@@ -1689,28 +2119,1004 @@ geomap(
     surface_free(&sy1);
     surface_free(&sx2);
     surface_free(&sy2);
+    surface_basis_free(&basis);
+    geomap_fit_free(&fit);
 
     return status;
 }
 
-void
-geomap_result_init(
-        geomap_result_t* const r) {
+typedef struct {
+    const size_t*                  ninputs;
+    const coord_t* const*          inputs;
+    const size_t*                  nrefs;
+    const coord_t* const*          refs;
+    const bbox_t*                  bboxes;
+    geomap_fit_e                   fit_geometry;
+    surface_type_e                 function;
+    size_t                         xxorder;
+    size_t                         xyorder;
+    size_t                         yxorder;
+    size_t                         yyorder;
+    xterms_e                       xxterms;
+    xterms_e                       yxterms;
+    size_t                         maxiter;
+    double                         reject;
+    size_t*                        noutputs;
+    geomap_output_t* const*        outputs;
+    geomap_result_t*               results;
+} geomap_many_data_t;
 
-    r->xcoeff = NULL;
-    r->ycoeff = NULL;
-    r->x2coeff = NULL;
-    r->y2coeff = NULL;
+static int
+geomap_many_frame(
+        void* data,
+        size_t i,
+        stimage_error_t* const error) {
+
+    geomap_many_data_t* state = (geomap_many_data_t*)data;
+    stimage_error_t     frame_error;
+
+    stimage_error_init(&frame_error);
+
+    state->noutputs[i] = MAX(state->ninputs[i], state->nrefs[i]);
+    if (geomap(
+                state->ninputs[i], state->inputs[i],
+                state->nrefs[i], state->refs[i],
+                state->bboxes != NULL ? &state->bboxes[i] : NULL,
+                state->fit_geometry, state->function,
+                state->xxorder, state->xyorder,
+                state->yxorder, state->yyorder,
+                state->xxterms, state->yxterms,
+                state->maxiter, state->reject,
+                &state->noutputs[i], state->outputs[i],
+                &state->results[i], &frame_error)) {
+        state->noutputs[i] = 0;
+        stimage_error_format_message(
+                error, "Frame %lu: %s", (unsigned long)i,
+                stimage_error_get_message(&frame_error));
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+geomap_many(
+        const size_t nframes,
+        const size_t* const ninputs,
+        const coord_t* const* const inputs,
+        const size_t* const nrefs,
+        const coord_t* const* const refs,
+        const bbox_t* const bboxes,
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t xxorder,
+        const size_t xyorder,
+        const size_t yxorder,
+        const size_t yyorder,
+        const xterms_e xxterms,
+        const xterms_e yxterms,
+        const size_t maxiter,
+        const double reject,
+        size_t* const noutputs,
+        geomap_output_t* const* const outputs,
+        geomap_result_t* const results,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    geomap_many_data_t state;
+    size_t             i = 0;
+
+    assert(error);
+
+    if (nframes == 0) {
+        return 0;
+    }
+
+    assert(ninputs);
+    assert(inputs);
+    assert(nrefs);
+    assert(refs);
+    assert(noutputs);
+    assert(outputs);
+    assert(results);
+
+    for (i = 0; i < nframes; ++i) {
+        noutputs[i] = 0;
+        geomap_result_init(&results[i]);
+    }
+
+    state.ninputs      = ninputs;
+    state.inputs       = inputs;
+    state.nrefs        = nrefs;
+    state.refs         = refs;
+    state.bboxes       = bboxes;
+    state.fit_geometry = fit_geometry;
+    state.function     = function;
+    state.xxorder      = xxorder;
+    state.xyorder      = xyorder;
+    state.yxorder      = yxorder;
+    state.yyorder      = yyorder;
+    state.xxterms      = xxterms;
+    state.yxterms      = yxterms;
+    state.maxiter      = maxiter;
+    state.reject       = reject;
+    state.noutputs     = noutputs;
+    state.outputs      = outputs;
+    state.results      = results;
+
+    return parallel_for(
+            nframes, nthreads, &geomap_many_frame, &state, error);
 }
 
 void
-geomap_result_free(
-        geomap_result_t* const r) {
+geomap_stream_new(
+        geomap_stream_t* const stream) {
 
-    free(r->xcoeff); r->xcoeff = NULL;
+    assert(stream);
+
+    surface_new(&stream->sx1);
+    surface_new(&stream->sy1);
+    surface_new(&stream->sx2);
+    surface_new(&stream->sy2);
+    stream->has_sx2 = 0;
+    stream->has_sy2 = 0;
+}
+
+/* The distortion part of a streaming fit is found by subtracting the
+   linear part from a fit of the whole surface, which needs the linear
+   terms to be part of the whole surface */
+static int
+geomap_stream_check_orders(
+        const size_t xorder,
+        const size_t yorder,
+        const xterms_e xterms) {
+
+    return (!(xorder > 2 || yorder > 2 || xterms == xterms_full) ||
+            (xorder >= 2 && yorder >= 2));
+}
+
+/* Set up the surfaces of one axis of a streaming fit, as geo_fit_xy
+   does for the "general" fit geometry */
+static int
+geomap_stream_init_axis(
+        const geomap_stream_t* const stream,
+        const size_t xorder,
+        const size_t yorder,
+        const xterms_e xterms,
+        surface_t* const sf1,
+        surface_t* const sf2,
+        int* const has_secondary,
+        stimage_error_t* const error) {
+
+    *has_secondary = (xorder > 2 || yorder > 2 || xterms == xterms_full);
+
+    if (surface_init(
+                sf1, stream->function, 2, 2, xterms_none, &stream->bbox,
+                error)) return 1;
+
+    if (*has_secondary) {
+        if (surface_init(
+                    sf2, stream->function, xorder, yorder, xterms,
+                    &stream->bbox, error)) return 1;
+    }
+
+    return 0;
+}
+
+int
+geomap_stream_init(
+        geomap_stream_t* const stream,
+        const bbox_t* const bbox,
+        const surface_type_e function,
+        const size_t xxorder,
+        const size_t xyorder,
+        const size_t yxorder,
+        const size_t yyorder,
+        const xterms_e xxterms,
+        const xterms_e yxterms,
+        stimage_error_t* const error) {
+
+    assert(stream);
+    assert(bbox);
+    assert(error);
+
+    geomap_stream_new(stream);
+
+    if (!isfinite64(bbox->min.x) || !isfinite64(bbox->min.y) ||
+        !isfinite64(bbox->max.x) || !isfinite64(bbox->max.y) ||
+        !(bbox->max.x > bbox->min.x) || !(bbox->max.y > bbox->min.y)) {
+        stimage_error_set_message(
+                error,
+                "A streaming fit needs a finite bbox with a nonzero "
+                "width and height");
+        return 1;
+    }
+
+    if (!geomap_stream_check_orders(xxorder, xyorder, xxterms) ||
+        !geomap_stream_check_orders(yxorder, yyorder, yxterms)) {
+        stimage_error_set_message(
+                error,
+                "A streaming fit needs an order of at least 2 in x and y");
+        return 1;
+    }
+
+    stream->function = function;
+    bbox_copy(bbox, &stream->bbox);
+    bbox_make_nonsingular(&stream->bbox);
+    stream->xxorder = xxorder;
+    stream->xyorder = xyorder;
+    stream->yxorder = yxorder;
+    stream->yyorder = yyorder;
+    stream->xxterms = xxterms;
+    stream->yxterms = yxterms;
+    stream->ncoord = 0;
+    stream->sum_ref.x = 0.0;
+    stream->sum_ref.y = 0.0;
+    stream->sum_input.x = 0.0;
+    stream->sum_input.y = 0.0;
+    stream->nresidual = 0;
+    stream->sum_sq_residual.x = 0.0;
+    stream->sum_sq_residual.y = 0.0;
+
+    if (geomap_stream_init_axis(
+                stream, xxorder, xyorder, xxterms,
+                &stream->sx1, &stream->sx2, &stream->has_sx2, error) ||
+        geomap_stream_init_axis(
+                stream, yxorder, yyorder, yxterms,
+                &stream->sy1, &stream->sy2, &stream->has_sy2, error)) {
+        geomap_stream_free(stream);
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+geomap_stream_add(
+        geomap_stream_t* const stream,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        stimage_error_t* const error) {
+
+    coord_t* input_in_bbox = NULL;
+    coord_t* ref_in_bbox   = NULL;
+    double*  z             = NULL;
+    double*  weights       = NULL;
+    size_t   n             = 0;
+    size_t   i             = 0;
+    int      status        = 1;
+
+    assert(stream);
+    assert(stream->sx1.coeff);
+    assert(error);
+
+    if (ncoord == 0) {
+        return 0;
+    }
+
+    assert(input);
+    assert(ref);
+
+    input_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+    if (input_in_bbox == NULL) goto exit;
+    ref_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+    if (ref_in_bbox == NULL) goto exit;
+
+    n = limit_to_bbox(
+            ncoord, input, ref, &stream->bbox, input_in_bbox, ref_in_bbox);
+    if (n == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    z = malloc_with_error(n * sizeof(double), error);
+    if (z == NULL) goto exit;
+    weights = malloc_with_error(n * sizeof(double), error);
+    if (weights == NULL) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        stream->sum_ref.x += ref_in_bbox[i].x;
+        stream->sum_ref.y += ref_in_bbox[i].y;
+        stream->sum_input.x += input_in_bbox[i].x;
+        stream->sum_input.y += input_in_bbox[i].y;
+        z[i] = input_in_bbox[i].x;
+    }
+    stream->ncoord += n;
+
+    if (surface_fit_add_points(
+                &stream->sx1, n, ref_in_bbox, z, weights,
+                surface_fit_weight_uniform, error)) goto exit;
+    if (stream->has_sx2 &&
+        surface_fit_add_points(
+                &stream->sx2, n, ref_in_bbox, z, weights,
+                surface_fit_weight_uniform, error)) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        z[i] = input_in_bbox[i].y;
+    }
+
+    if (surface_fit_add_points(
+                &stream->sy1, n, ref_in_bbox, z, weights,
+                surface_fit_weight_uniform, error)) goto exit;
+    if (stream->has_sy2 &&
+        surface_fit_add_points(
+                &stream->sy2, n, ref_in_bbox, z, weights,
+                surface_fit_weight_uniform, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(input_in_bbox);
+    free(ref_in_bbox);
+    free(z);
+    free(weights);
+
+    return status;
+}
+
+int
+geomap_stream_solve(
+        geomap_stream_t* const stream,
+        geomap_result_t* const result,
+        stimage_error_t* const error) {
+
+    geomap_fit_t fit;
+    surface_t    sx1, sy1, sx2, sy2;
+    int          status = 1;
+
+    assert(stream);
+    assert(result);
+    assert(error);
+
+    geomap_fit_new(&fit);
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
+    if (stream->ncoord == 0) {
+        stimage_error_set_message(error, "No coordinates in the bbox");
+        goto exit;
+    }
+
+    if (geo_fit_xy_solve(
+                &stream->sx1, &stream->sx2, stream->has_sx2, 1,
+                geomap_proj_none, &sx1, &sx2, error) ||
+        geo_fit_xy_solve(
+                &stream->sy1, &stream->sy2, stream->has_sy2, 0,
+                geomap_proj_none, &sy1, &sy2, error)) goto exit;
+
+    geomap_fit_init(
+            &fit, geomap_proj_none, geomap_fit_general, stream->function,
+            stream->xxorder, stream->xyorder, stream->xxterms,
+            stream->yxorder, stream->yyorder, stream->yxterms,
+            0, 0.0);
+    fit.ncoord = stream->ncoord;
+    fit.n_zero_weighted = 0;
+    fit.oref.x = stream->sum_ref.x / (double)stream->ncoord;
+    fit.oref.y = stream->sum_ref.y / (double)stream->ncoord;
+    fit.oin.x = stream->sum_input.x / (double)stream->ncoord;
+    fit.oin.y = stream->sum_input.y / (double)stream->ncoord;
+    bbox_copy(&stream->bbox, &fit.bbox);
+
+    if (geo_get_results(
+                &fit, &sx1, &sy1, &sx2, &sy2,
+                stream->has_sx2, stream->has_sy2, result, error)) goto exit;
+
+    stream->nresidual = 0;
+    stream->sum_sq_residual.x = 0.0;
+    stream->sum_sq_residual.y = 0.0;
+
+    status = 0;
+
+ exit:
+
+    surface_free(&sx1);
+    surface_free(&sy1);
+    surface_free(&sx2);
+    surface_free(&sy2);
+    geomap_fit_free(&fit);
+
+    return status;
+}
+
+int
+geomap_stream_add_residuals(
+        geomap_stream_t* const stream,
+        geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        size_t* const noutput,
+        geomap_output_t* const output,
+        stimage_error_t* const error) {
+
+    coord_t* input_in_bbox = NULL;
+    coord_t* ref_in_bbox   = NULL;
+    double*  xfit          = NULL;
+    double*  yfit          = NULL;
+    double   rx            = 0.0;
+    double   ry            = 0.0;
+    size_t   n             = 0;
+    size_t   i             = 0;
+    int      status        = 1;
+
+    assert(stream);
+    assert(result);
+    assert(error);
+
+    if (ncoord != 0) {
+        assert(input);
+        assert(ref);
+
+        input_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+        if (input_in_bbox == NULL) goto exit;
+        ref_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+        if (ref_in_bbox == NULL) goto exit;
+        xfit = malloc_with_error(2 * ncoord * sizeof(double), error);
+        if (xfit == NULL) goto exit;
+        yfit = xfit + ncoord;
+
+        n = limit_to_bbox(
+                ncoord, input, ref, &stream->bbox,
+                input_in_bbox, ref_in_bbox);
+    }
+
+    if (geomap_result_eval(result, n, ref_in_bbox, xfit, yfit, error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < n; ++i) {
+        rx = input_in_bbox[i].x - xfit[i];
+        ry = input_in_bbox[i].y - yfit[i];
+        stream->sum_sq_residual.x += rx * rx;
+        stream->sum_sq_residual.y += ry * ry;
+
+        if (output != NULL) {
+            output[i].input = input_in_bbox[i];
+            output[i].ref = ref_in_bbox[i];
+            output[i].fit.x = xfit[i];
+            output[i].fit.y = yfit[i];
+            output[i].residual.x = rx;
+            output[i].residual.y = ry;
+        }
+    }
+    stream->nresidual += n;
+
+    /* As geo_get_results computes it */
+    if (stream->nresidual <= 1) {
+        result->rms.x = 0.0;
+        result->rms.y = 0.0;
+    } else {
+        result->rms.x = sqrt(
+                stream->sum_sq_residual.x / (double)(stream->nresidual - 1));
+        result->rms.y = sqrt(
+                stream->sum_sq_residual.y / (double)(stream->nresidual - 1));
+    }
+
+    if (noutput != NULL) {
+        *noutput = n;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(input_in_bbox);
+    free(ref_in_bbox);
+    free(xfit);
+
+    return status;
+}
+
+int
+geomap_stream_merge(
+        geomap_stream_t* const stream,
+        const geomap_stream_t* const other,
+        stimage_error_t* const error) {
+
+    assert(stream);
+    assert(other);
+    assert(error);
+
+    if (stream->function != other->function ||
+        stream->bbox.min.x != other->bbox.min.x ||
+        stream->bbox.min.y != other->bbox.min.y ||
+        stream->bbox.max.x != other->bbox.max.x ||
+        stream->bbox.max.y != other->bbox.max.y ||
+        stream->xxorder != other->xxorder ||
+        stream->xyorder != other->xyorder ||
+        stream->yxorder != other->yxorder ||
+        stream->yyorder != other->yyorder ||
+        stream->xxterms != other->xxterms ||
+        stream->yxterms != other->yxterms) {
+        stimage_error_set_message(
+                error,
+                "Can not merge streaming fits with different bboxes, "
+                "functions, orders or cross terms");
+        return 1;
+    }
+
+    if (surface_fit_merge(&stream->sx1, &other->sx1, error) ||
+        surface_fit_merge(&stream->sy1, &other->sy1, error)) return 1;
+    if (stream->has_sx2 &&
+        surface_fit_merge(&stream->sx2, &other->sx2, error)) return 1;
+    if (stream->has_sy2 &&
+        surface_fit_merge(&stream->sy2, &other->sy2, error)) return 1;
+
+    stream->ncoord += other->ncoord;
+    stream->sum_ref.x += other->sum_ref.x;
+    stream->sum_ref.y += other->sum_ref.y;
+    stream->sum_input.x += other->sum_input.x;
+    stream->sum_input.y += other->sum_input.y;
+    stream->nresidual += other->nresidual;
+    stream->sum_sq_residual.x += other->sum_sq_residual.x;
+    stream->sum_sq_residual.y += other->sum_sq_residual.y;
+
+    return 0;
+}
+
+/* The layout of the state of a stream: the counts and sums, followed
+   by the number of points, matrix and vector of each of its surfaces,
+   sx1, sy1, and sx2 and sy2 when it has them */
+#define GEOMAP_STREAM_NSUMS 8
+
+static size_t
+geomap_stream_surface_state_size(
+        const surface_t* const s) {
+
+    return 1 + s->ncoeff * s->ncoeff + s->ncoeff;
+}
+
+size_t
+geomap_stream_state_size(
+        const geomap_stream_t* const stream) {
+
+    size_t size = GEOMAP_STREAM_NSUMS;
+
+    assert(stream);
+
+    size += geomap_stream_surface_state_size(&stream->sx1);
+    size += geomap_stream_surface_state_size(&stream->sy1);
+    if (stream->has_sx2) {
+        size += geomap_stream_surface_state_size(&stream->sx2);
+    }
+    if (stream->has_sy2) {
+        size += geomap_stream_surface_state_size(&stream->sy2);
+    }
+
+    return size;
+}
+
+static double*
+geomap_stream_get_surface_state(
+        const surface_t* const s,
+        double* state) {
+
+    size_t i;
+
+    *state++ = (double)s->npoints;
+    for (i = 0; i < s->ncoeff * s->ncoeff; ++i) {
+        *state++ = s->matrix[i];
+    }
+    for (i = 0; i < s->ncoeff; ++i) {
+        *state++ = s->vector[i];
+    }
+
+    return state;
+}
+
+void
+geomap_stream_get_state(
+        const geomap_stream_t* const stream,
+        double* state) {
+
+    assert(stream);
+    assert(state);
+
+    *state++ = (double)stream->ncoord;
+    *state++ = stream->sum_ref.x;
+    *state++ = stream->sum_ref.y;
+    *state++ = stream->sum_input.x;
+    *state++ = stream->sum_input.y;
+    *state++ = (double)stream->nresidual;
+    *state++ = stream->sum_sq_residual.x;
+    *state++ = stream->sum_sq_residual.y;
+
+    state = geomap_stream_get_surface_state(&stream->sx1, state);
+    state = geomap_stream_get_surface_state(&stream->sy1, state);
+    if (stream->has_sx2) {
+        state = geomap_stream_get_surface_state(&stream->sx2, state);
+    }
+    if (stream->has_sy2) {
+        state = geomap_stream_get_surface_state(&stream->sy2, state);
+    }
+}
+
+/* Check that a count in the state of a stream is a whole number that
+   fits in a size_t */
+static int
+geomap_stream_check_count(
+        const double count,
+        stimage_error_t* const error) {
+
+    if (!(count >= 0.0 && count < 9007199254740992.0) ||
+        count != floor(count)) {
+        stimage_error_set_message(
+                error, "Invalid count in the state of a streaming fit");
+        return 1;
+    }
+
+    return 0;
+}
+
+static const double*
+geomap_stream_set_surface_state(
+        surface_t* const s,
+        const double* state,
+        stimage_error_t* const error) {
+
+    size_t i;
+
+    if (geomap_stream_check_count(*state, error)) return NULL;
+    s->npoints = (size_t)*state++;
+    for (i = 0; i < s->ncoeff * s->ncoeff; ++i) {
+        s->matrix[i] = *state++;
+    }
+    for (i = 0; i < s->ncoeff; ++i) {
+        s->vector[i] = *state++;
+    }
+
+    return state;
+}
+
+int
+geomap_stream_set_state(
+        geomap_stream_t* const stream,
+        const size_t nstate,
+        const double* state,
+        stimage_error_t* const error) {
+
+    assert(stream);
+    assert(state);
+    assert(error);
+
+    if (nstate != geomap_stream_state_size(stream)) {
+        stimage_error_format_message(
+                error,
+                "The state of a streaming fit with this geometry has %lu "
+                "values, not %lu",
+                (unsigned long)geomap_stream_state_size(stream),
+                (unsigned long)nstate);
+        return 1;
+    }
+
+    if (geomap_stream_check_count(state[0], error) ||
+        geomap_stream_check_count(state[5], error)) return 1;
+
+    stream->ncoord = (size_t)*state++;
+    stream->sum_ref.x = *state++;
+    stream->sum_ref.y = *state++;
+    stream->sum_input.x = *state++;
+    stream->sum_input.y = *state++;
+    stream->nresidual = (size_t)*state++;
+    stream->sum_sq_residual.x = *state++;
+    stream->sum_sq_residual.y = *state++;
+
+    state = geomap_stream_set_surface_state(&stream->sx1, state, error);
+    if (state == NULL) return 1;
+    state = geomap_stream_set_surface_state(&stream->sy1, state, error);
+    if (state == NULL) return 1;
+    if (stream->has_sx2) {
+        state = geomap_stream_set_surface_state(&stream->sx2, state, error);
+        if (state == NULL) return 1;
+    }
+    if (stream->has_sy2) {
+        state = geomap_stream_set_surface_state(&stream->sy2, state, error);
+        if (state == NULL) return 1;
+    }
+
+    return 0;
+}
+
+void
+geomap_stream_free(
+        geomap_stream_t* const stream) {
+
+    assert(stream);
+
+    surface_free(&stream->sx1);
+    surface_free(&stream->sy1);
+    surface_free(&stream->sx2);
+    surface_free(&stream->sy2);
+    stream->has_sx2 = 0;
+    stream->has_sy2 = 0;
+}
+
+void
+geomap_result_init(
+        geomap_result_t* const r) {
+
+    r->xcoeff = NULL;
+    r->ycoeff = NULL;
+    r->x2coeff = NULL;
+    r->y2coeff = NULL;
+    surface_new(&r->sx1);
+    surface_new(&r->sy1);
+    surface_new(&r->sx2);
+    surface_new(&r->sy2);
+    r->has_sx2 = 0;
+    r->has_sy2 = 0;
+}
+
+void
+geomap_result_free(
+        geomap_result_t* const r) {
+
+    free(r->xcoeff); r->xcoeff = NULL;
     free(r->ycoeff); r->ycoeff = NULL;
     free(r->x2coeff); r->x2coeff = NULL;
     free(r->y2coeff); r->y2coeff = NULL;
+    surface_free(&r->sx1);
+    surface_free(&r->sy1);
+    surface_free(&r->sx2);
+    surface_free(&r->sy2);
+    r->has_sx2 = 0;
+    r->has_sy2 = 0;
+}
+
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref, /* [ncoord] */
+        /* Output */
+        double* const xfit, /* [ncoord] */
+        double* const yfit, /* [ncoord] */
+        stimage_error_t* const error) {
+
+    assert(result);
+    assert(error);
+
+    if (result->sx1.coeff == NULL || result->sy1.coeff == NULL) {
+        stimage_error_set_message(error, "The geomap result has no fit");
+        return 1;
+    }
+
+    if (ncoord == 0) {
+        return 0;
+    }
+
+    return geoeval(
+            &result->sx1, &result->sy1, &result->sx2, &result->sy2,
+            result->has_sx2, result->has_sy2,
+            ncoord, ref, NULL, xfit, yfit, error);
+}
+
+/* Evaluate the partial derivatives of the fit, the sum of the linear
+   and distortion surfaces, with respect to the reference
+   coordinates */
+static int
+geoeval_deriv(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        double* const dxdx,
+        double* const dxdy,
+        double* const dydx,
+        double* const dydy,
+        stimage_error_t* const error) {
+
+    double* tmpx   = NULL;
+    double* tmpy   = NULL;
+    size_t  i      = 0;
+    int     status = 1;
+
+    if (result->has_sx2 || result->has_sy2) {
+        tmpx = malloc_with_error(2 * ncoord * sizeof(double), error);
+        if (tmpx == NULL) goto exit;
+        tmpy = tmpx + ncoord;
+    }
+
+    if (surface_vector_deriv(&result->sx1, ncoord, ref, dxdx, dxdy, error)) {
+        goto exit;
+    }
+    if (result->has_sx2) {
+        if (surface_vector_deriv(
+                    &result->sx2, ncoord, ref, tmpx, tmpy, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            dxdx[i] += tmpx[i];
+            dxdy[i] += tmpy[i];
+        }
+    }
+
+    if (surface_vector_deriv(&result->sy1, ncoord, ref, dydx, dydy, error)) {
+        goto exit;
+    }
+    if (result->has_sy2) {
+        if (surface_vector_deriv(
+                    &result->sy2, ncoord, ref, tmpx, tmpy, error)) goto exit;
+        for (i = 0; i < ncoord; ++i) {
+            dydx[i] += tmpx[i];
+            dydy[i] += tmpy[i];
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(tmpx);
+
+    return status;
+}
+
+int
+geomap_result_eval_inverse(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input, /* [ncoord] */
+        const double tolerance,
+        const size_t maxiter,
+        /* Output */
+        double* const xref, /* [ncoord] */
+        double* const yref, /* [ncoord] */
+        stimage_error_t* const error) {
+
+    size_t*  active  = NULL;
+    coord_t* guess   = NULL;
+    double*  work    = NULL;
+    double*  xfit    = NULL;
+    double*  yfit    = NULL;
+    double*  dxdx    = NULL;
+    double*  dxdy    = NULL;
+    double*  dydx    = NULL;
+    double*  dydy    = NULL;
+    double*  step    = NULL;
+    coord_t  center;
+    coord_t  start;
+    double   det     = 0.0;
+    double   rx      = 0.0;
+    double   ry      = 0.0;
+    double   sx      = 0.0;
+    double   sy      = 0.0;
+    double   size    = 0.0;
+    double   my_nan  = fmod(1.0, 0.0);
+    size_t   nactive = 0;
+    size_t   nkeep   = 0;
+    size_t   iter    = 0;
+    size_t   i       = 0;
+    size_t   j       = 0;
+    int      status  = 1;
+
+    assert(result);
+    assert(input);
+    assert(xref);
+    assert(yref);
+    assert(error);
+
+    if (result->sx1.coeff == NULL || result->sy1.coeff == NULL) {
+        stimage_error_set_message(error, "The geomap result has no fit");
+        return 1;
+    }
+
+    if (!(tolerance >= 0.0)) {
+        stimage_error_set_message(error, "tolerance must be non-negative");
+        return 1;
+    }
+
+    if (ncoord == 0) {
+        return 0;
+    }
+
+    active = malloc_with_error(ncoord * sizeof(size_t), error);
+    if (active == NULL) goto exit;
+    guess = malloc_with_error(ncoord * sizeof(coord_t), error);
+    if (guess == NULL) goto exit;
+    work = malloc_with_error(7 * ncoord * sizeof(double), error);
+    if (work == NULL) goto exit;
+    xfit = work;
+    yfit = work + ncoord;
+    dxdx = work + 2 * ncoord;
+    dxdy = work + 3 * ncoord;
+    dydx = work + 4 * ncoord;
+    dydy = work + 5 * ncoord;
+    step = work + 6 * ncoord;
+
+    /* Start from the fit linearized at the center of its bbox, which
+       is exact for a linear fit */
+    center.x = (result->sx1.bbox.min.x + result->sx1.bbox.max.x) / 2.0;
+    center.y = (result->sx1.bbox.min.y + result->sx1.bbox.max.y) / 2.0;
+    if (geoeval(&result->sx1, &result->sy1, &result->sx2, &result->sy2,
+                result->has_sx2, result->has_sy2,
+                1, &center, NULL, xfit, yfit, error) ||
+        geoeval_deriv(result, 1, &center, dxdx, dxdy, dydx, dydy, error)) {
+        goto exit;
+    }
+    start.x = xfit[0];
+    start.y = yfit[0];
+    det = dxdx[0] * dydy[0] - dxdy[0] * dydx[0];
+    if (det == 0.0 || !isfinite64(det)) {
+        stimage_error_set_message(error, "The geomap fit can not be inverted");
+        goto exit;
+    }
+
+    for (i = 0; i < ncoord; ++i) {
+        rx = input[i].x - start.x;
+        ry = input[i].y - start.y;
+        active[i] = i;
+        guess[i].x = center.x + (dydy[0] * rx - dxdy[0] * ry) / det;
+        guess[i].y = center.y + (dxdx[0] * ry - dydx[0] * rx) / det;
+        step[i] = MAX_DOUBLE;
+    }
+    nactive = ncoord;
+
+    /* Newton's method on the coordinates that have not converged yet.
+       A coordinate is only given once the fit at it is within
+       tolerance of the input coordinate; the others are NaN.  Newton's
+       method converges quadratically near a root, so a coordinate
+       whose step stops shrinking will never get within tolerance (for
+       example, when tolerance is below the rounding error of the fit)
+       and is given up on at once. */
+    for (iter = 0; nactive > 0; ++iter) {
+        if (geoeval(&result->sx1, &result->sy1, &result->sx2, &result->sy2,
+                    result->has_sx2, result->has_sy2,
+                    nactive, guess, NULL, xfit, yfit, error) ||
+            geoeval_deriv(result, nactive, guess,
+                          dxdx, dxdy, dydx, dydy, error)) {
+            goto exit;
+        }
+
+        nkeep = 0;
+        for (j = 0; j < nactive; ++j) {
+            i = active[j];
+            rx = xfit[j] - input[i].x;
+            ry = yfit[j] - input[i].y;
+
+            if (fabs(rx) <= tolerance && fabs(ry) <= tolerance) {
+                xref[i] = guess[j].x;
+                yref[i] = guess[j].y;
+                continue;
+            }
+
+            det = dxdx[j] * dydy[j] - dxdy[j] * dydx[j];
+            if (iter >= maxiter ||
+                !isfinite64(rx) || !isfinite64(ry) ||
+                det == 0.0 || !isfinite64(det)) {
+                xref[i] = my_nan;
+                yref[i] = my_nan;
+                continue;
+            }
+
+            sx = (dydy[j] * rx - dxdy[j] * ry) / det;
+            sy = (dxdx[j] * ry - dydx[j] * rx) / det;
+            size = MAX(fabs(sx), fabs(sy));
+            if (!(size < step[j])) {
+                xref[i] = my_nan;
+                yref[i] = my_nan;
+                continue;
+            }
+
+            active[nkeep] = i;
+            guess[nkeep].x = guess[j].x - sx;
+            guess[nkeep].y = guess[j].y - sy;
+            step[nkeep] = size;
+            ++nkeep;
+        }
+        nactive = nkeep;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(active);
+    free(guess);
+    free(work);
+
+    return status;
 }
 
 void
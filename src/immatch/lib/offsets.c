@@ -0,0 +1,469 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#include <assert.h>
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
+#include <stdlib.h>
+
+#include "immatch/lib/offsets.h"
+
+/* The most reference and input pairs to vote with.  Longer lists are
+   subsampled to stay under this.  Even a subsample of a few percent of
+   each list leaves tens of pairs of the same objects in the peak,
+   against a background of about one pair per bin. */
+#define OFFSETS_MAX_PAIRS ((size_t)1 << 20)
+
+/* The most histogram bins along each axis.  If the tolerance is tiny
+   compared to the spread of the offsets, the bins are made larger, so
+   that both bin numbers always fit in one 64-bit key. */
+#define OFFSETS_MAX_BINS ((STIMAGE_Int64)1 << 30)
+#define OFFSETS_KEY_SCALE ((STIMAGE_Int64)1 << 31)
+
+typedef struct {
+    double min_dx;
+    double min_dy;
+    double bin;
+} offsets_grid_t;
+
+static int
+offsets_key_compare(
+        const void* a,
+        const void* b) {
+
+    const STIMAGE_Int64 ka = *(const STIMAGE_Int64*)a;
+    const STIMAGE_Int64 kb = *(const STIMAGE_Int64*)b;
+
+    return (ka > kb) - (ka < kb);
+}
+
+static STIMAGE_Int64
+offsets_bin_of(
+        const double d,
+        const double min,
+        const double bin) {
+
+    const double i = floor((d - min) / bin);
+
+    if (!(i >= 0.0)) {
+        return 0;
+    }
+    if (i >= (double)(OFFSETS_MAX_BINS - 1)) {
+        return OFFSETS_MAX_BINS - 1;
+    }
+    return (STIMAGE_Int64)i;
+}
+
+/* Find a key in the sorted, unique keys, returning nkeys if it is not
+   there */
+static size_t
+offsets_find(
+        const size_t nkeys,
+        const STIMAGE_Int64* const keys,
+        const STIMAGE_Int64 key) {
+
+    size_t lo = 0;
+    size_t hi = nkeys;
+    size_t mid;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (keys[mid] < key) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return (lo < nkeys && keys[lo] == key) ? lo : nkeys;
+}
+
+static void
+offsets_bounds(
+        const size_t n,
+        const coord_t* const coords,
+        coord_t* const min,
+        coord_t* const max) {
+
+    size_t i;
+
+    *min = *max = coords[0];
+    for (i = 1; i < n; ++i) {
+        min->x = MIN(min->x, coords[i].x);
+        min->y = MIN(min->y, coords[i].y);
+        max->x = MAX(max->x, coords[i].x);
+        max->y = MAX(max->y, coords[i].y);
+    }
+}
+
+/* Histogram the offsets of every pair, and find the 3x3 block of bins
+   with the most pairs.  The block, rather than a single bin, is used
+   so that a peak split across bin edges is not missed. */
+static void
+offsets_vote(
+        const size_t nref,
+        const coord_t* const ref,
+        const size_t ninput,
+        const coord_t* const input,
+        const offsets_grid_t* const grid,
+        STIMAGE_Int64* const keys, /* [nref * ninput] */
+        size_t* const counts, /* [nref * ninput] */
+        STIMAGE_Int64* const peak_x,
+        STIMAGE_Int64* const peak_y,
+        size_t* const score) {
+
+    size_t        nkeys = 0;
+    size_t        maxcount = 0;
+    size_t        min_count;
+    size_t        i, j, k, sum;
+    STIMAGE_Int64 ix, iy, dx, dy;
+
+    for (i = 0; i < nref; ++i) {
+        for (j = 0; j < ninput; ++j) {
+            ix = offsets_bin_of(ref[i].x - input[j].x,
+                                grid->min_dx, grid->bin);
+            iy = offsets_bin_of(ref[i].y - input[j].y,
+                                grid->min_dy, grid->bin);
+            keys[nkeys++] = ix * OFFSETS_KEY_SCALE + iy;
+        }
+    }
+
+    qsort(keys, nkeys, sizeof(STIMAGE_Int64), &offsets_key_compare);
+
+    /* Count the pairs in each occupied bin */
+    for (i = 0, k = 0; i < nkeys; ++k) {
+        keys[k] = keys[i];
+        for (j = i; j < nkeys && keys[j] == keys[k]; ++j) {
+            /* Just counting */
+        }
+        counts[k] = j - i;
+        maxcount = MAX(maxcount, counts[k]);
+        i = j;
+    }
+    nkeys = k;
+
+    /* Only blocks centered on bins with at least two pairs are
+       considered, unless no bin has that many.  A real peak, which
+       can only be split between a few bins, always has one. */
+    min_count = MIN(2, maxcount);
+
+    *score = 0;
+    *peak_x = 0;
+    *peak_y = 0;
+    for (k = 0; k < nkeys; ++k) {
+        if (counts[k] < min_count) {
+            continue;
+        }
+
+        ix = keys[k] / OFFSETS_KEY_SCALE;
+        iy = keys[k] % OFFSETS_KEY_SCALE;
+        sum = 0;
+        for (dx = -1; dx <= 1; ++dx) {
+            for (dy = -1; dy <= 1; ++dy) {
+                if (ix + dx < 0 || iy + dy < 0) {
+                    continue;
+                }
+                j = offsets_find(
+                        nkeys, keys,
+                        (ix + dx) * OFFSETS_KEY_SCALE + (iy + dy));
+                if (j < nkeys) {
+                    sum += counts[j];
+                }
+            }
+        }
+
+        if (sum > *score) {
+            *score = sum;
+            *peak_x = ix;
+            *peak_y = iy;
+        }
+    }
+}
+
+/* The shift is the mean offset of the pairs in the peak block */
+static void
+offsets_refine(
+        const size_t nref,
+        const coord_t* const ref,
+        const size_t ninput,
+        const coord_t* const input,
+        const offsets_grid_t* const grid,
+        const STIMAGE_Int64 peak_x,
+        const STIMAGE_Int64 peak_y,
+        coord_t* const shift) {
+
+    size_t        i, j;
+    size_t        n = 0;
+    double        dx, dy;
+    double        sum_x = 0.0, sum_y = 0.0;
+    STIMAGE_Int64 ix, iy;
+
+    for (i = 0; i < nref; ++i) {
+        for (j = 0; j < ninput; ++j) {
+            dx = ref[i].x - input[j].x;
+            dy = ref[i].y - input[j].y;
+            ix = offsets_bin_of(dx, grid->min_dx, grid->bin);
+            iy = offsets_bin_of(dy, grid->min_dy, grid->bin);
+            if (ix >= peak_x - 1 && ix <= peak_x + 1 &&
+                iy >= peak_y - 1 && iy <= peak_y + 1) {
+                sum_x += dx;
+                sum_y += dy;
+                ++n;
+            }
+        }
+    }
+
+    assert(n > 0);
+
+    shift->x = sum_x / (double)n;
+    shift->y = sum_y / (double)n;
+}
+
+int
+find_offsets_transform(
+        const size_t                 nref,
+        const coord_t* const * const ref_sorted,
+        const size_t                 ninput,
+        const coord_t* const * const input_sorted,
+        const double                 tolerance,
+        const size_t                 nrotations,
+        const double* const          rotations,
+        const size_t                 nscales,
+        const double* const          scales,
+        lintransform_t* const        transform,
+        size_t* const                nvotes,
+        stimage_error_t* const       error) {
+
+    static const double DEFAULT_ROTATION = 0.0;
+    static const double DEFAULT_SCALE    = 1.0;
+    const double*       rotations_       = rotations;
+    const double*       scales_          = scales;
+    size_t              nrotations_      = nrotations;
+    size_t              nscales_         = nscales;
+    size_t              stride           = 1;
+    size_t              nref_finite      = 0;
+    size_t              ninput_finite    = 0;
+    size_t              nref_sub         = 0;
+    size_t              ninput_sub       = 0;
+    coord_t*            ref_sub          = NULL;
+    coord_t*            input_sub        = NULL;
+    coord_t*            input_trans      = NULL;
+    STIMAGE_Int64*      keys             = NULL;
+    size_t*             counts           = NULL;
+    coord_t             center           = {0.0, 0.0};
+    coord_t             ref_min, ref_max, input_min, input_max, shift;
+    offsets_grid_t      grid;
+    STIMAGE_Int64       peak_x, peak_y;
+    size_t              score;
+    double              angle, a, b, d, e, dx, dy, span;
+    size_t              i, j, r, s;
+    int                 status           = 1;
+
+    assert(ref_sorted || nref == 0);
+    assert(input_sorted || ninput == 0);
+    assert(rotations || nrotations == 0);
+    assert(scales || nscales == 0);
+    assert(transform);
+    assert(nvotes);
+    assert(error);
+
+    transform->a = 1.0;
+    transform->b = 0.0;
+    transform->c = 0.0;
+    transform->d = 0.0;
+    transform->e = 1.0;
+    transform->f = 0.0;
+    *nvotes = 0;
+
+    if (!(tolerance > 0.0) || !isfinite64(tolerance)) {
+        stimage_error_set_message(
+            error,
+            "The tolerance must be positive for the offsets algorithm");
+        goto exit;
+    }
+
+    if (rotations_ == NULL) {
+        rotations_ = &DEFAULT_ROTATION;
+        nrotations_ = 1;
+    }
+
+    if (scales_ == NULL) {
+        scales_ = &DEFAULT_SCALE;
+        nscales_ = 1;
+    }
+
+    for (r = 0; r < nrotations_; ++r) {
+        if (!isfinite64(rotations_[r])) {
+            stimage_error_set_message(error, "Rotations must be finite");
+            goto exit;
+        }
+    }
+
+    for (s = 0; s < nscales_; ++s) {
+        if (!(scales_[s] > 0.0) || !isfinite64(scales_[s])) {
+            stimage_error_set_message(
+                error, "Scales must be positive and finite");
+            goto exit;
+        }
+    }
+
+    /* Coordinates that are not finite are treated as absent, as by
+       the other algorithms */
+    for (i = 0; i < nref; ++i) {
+        if (coord_is_finite(ref_sorted[i])) {
+            ++nref_finite;
+        }
+    }
+
+    for (i = 0; i < ninput; ++i) {
+        if (coord_is_finite(input_sorted[i])) {
+            ++ninput_finite;
+        }
+    }
+
+    if (nref_finite == 0 || ninput_finite == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    /* Subsample both lists evenly, so that there are not too many
+       pairs */
+    if ((double)nref_finite * (double)ninput_finite >
+        (double)OFFSETS_MAX_PAIRS) {
+        stride = (size_t)ceil(sqrt(
+            (double)nref_finite * (double)ninput_finite /
+            (double)OFFSETS_MAX_PAIRS));
+    }
+    nref_sub = (nref_finite + stride - 1) / stride;
+    ninput_sub = (ninput_finite + stride - 1) / stride;
+
+    ref_sub = malloc_with_error(nref_sub * sizeof(coord_t), error);
+    if (ref_sub == NULL) goto exit;
+
+    input_sub = malloc_with_error(ninput_sub * sizeof(coord_t), error);
+    if (input_sub == NULL) goto exit;
+
+    input_trans = malloc_with_error(ninput_sub * sizeof(coord_t), error);
+    if (input_trans == NULL) goto exit;
+
+    keys = malloc_with_error(
+            nref_sub * ninput_sub * sizeof(STIMAGE_Int64), error);
+    if (keys == NULL) goto exit;
+
+    counts = malloc_with_error(
+            nref_sub * ninput_sub * sizeof(size_t), error);
+    if (counts == NULL) goto exit;
+
+    for (i = 0, j = 0; i < nref; ++i) {
+        if (coord_is_finite(ref_sorted[i])) {
+            if (j % stride == 0) {
+                ref_sub[j / stride] = *ref_sorted[i];
+            }
+            ++j;
+        }
+    }
+
+    for (i = 0, j = 0; i < ninput; ++i) {
+        if (coord_is_finite(input_sorted[i])) {
+            if (j % stride == 0) {
+                input_sub[j / stride] = *input_sorted[i];
+                center.x += input_sorted[i]->x;
+                center.y += input_sorted[i]->y;
+            }
+            ++j;
+        }
+    }
+    center.x /= (double)ninput_sub;
+    center.y /= (double)ninput_sub;
+
+    offsets_bounds(nref_sub, ref_sub, &ref_min, &ref_max);
+
+    /* Try each rotation and scale about the center of the input, and
+       keep the first with the highest peak */
+    for (r = 0; r < nrotations_; ++r) {
+        for (s = 0; s < nscales_; ++s) {
+            angle = DEGTORAD(rotations_[r]);
+            a = scales_[s] * cos(angle);
+            b = -scales_[s] * sin(angle);
+            d = scales_[s] * sin(angle);
+            e = scales_[s] * cos(angle);
+
+            for (i = 0; i < ninput_sub; ++i) {
+                dx = input_sub[i].x - center.x;
+                dy = input_sub[i].y - center.y;
+                input_trans[i].x = a * dx + b * dy + center.x;
+                input_trans[i].y = d * dx + e * dy + center.y;
+            }
+
+            offsets_bounds(ninput_sub, input_trans, &input_min, &input_max);
+            grid.min_dx = ref_min.x - input_max.x;
+            grid.min_dy = ref_min.y - input_max.y;
+            span = MAX(ref_max.x - input_min.x - grid.min_dx,
+                       ref_max.y - input_min.y - grid.min_dy);
+            grid.bin = MAX(tolerance, span / (double)(OFFSETS_MAX_BINS - 1));
+
+            offsets_vote(
+                    nref_sub, ref_sub, ninput_sub, input_trans, &grid,
+                    keys, counts, &peak_x, &peak_y, &score);
+
+            if (score > *nvotes) {
+                offsets_refine(
+                        nref_sub, ref_sub, ninput_sub, input_trans, &grid,
+                        peak_x, peak_y, &shift);
+
+                *nvotes = score;
+                transform->a = a;
+                transform->b = b;
+                transform->c = center.x + shift.x - a * center.x - b * center.y;
+                transform->d = d;
+                transform->e = e;
+                transform->f = center.y + shift.y - d * center.x - e * center.y;
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(ref_sub);
+    free(input_sub);
+    free(input_trans);
+    free(keys);
+    free(counts);
+
+    return status;
+}
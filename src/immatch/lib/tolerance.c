@@ -34,12 +34,20 @@ DAMAGE.
          mdroe@stsci.edu
 */
 
+
 #include <assert.h>
 
 #include "immatch/lib/tolerance.h"
+#include "lib/xygrid.h"
 
-int
-match_tolerance(
+/* The expected number of input coordinates in the sweep's y band
+   above which tolerance_search_auto builds a grid.  See
+   test_c/bench_tolerance.c for the benchmark this was derived
+   from. */
+#define TOLERANCE_GRID_MIN_BAND 64.0
+
+static int
+match_tolerance_sweep(
         const size_t nref,
         const coord_t* const ref,
         const coord_t* const * const ref_sorted,
@@ -61,13 +69,6 @@ match_tolerance(
     const coord_t* rmatch;
     const coord_t* lmatch;
 
-    assert(ref);
-    assert(ref_sorted);
-    assert(input);
-    assert(input_sorted);
-    assert(callback);
-    assert(error);
-
     for (rp = 0; rp < nref; ++rp) {
         /* Compute the start of the search range */
         for (; blp < ninput; ++blp) {
@@ -122,3 +123,181 @@ match_tolerance(
 
     return 0;
 }
+
+static int
+match_tolerance_grid(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    const double          tolerance2  = tolerance*tolerance;
+    xygrid_t              grid;
+    xygrid_cell_t         center;
+    xygrid_cell_t         row;
+    const xygrid_entry_t* entry;
+    coord_t               refc;
+    size_t                start[2];
+    size_t                end[2];
+    size_t                nranges     = 0;
+    size_t                rp          = 0;
+    size_t                lmatch      = 0;
+    size_t                k           = 0;
+    size_t                r           = 0;
+    int                   j;
+    int                   found;
+    double                dx, dy, rmax2, r2;
+    int                   status      = 1;
+
+    if (xygrid_init(&grid, ninput, input_sorted, tolerance, error)) {
+        return 1;
+    }
+
+    for (rp = 0; rp < nref; ++rp) {
+        if (!coord_is_finite(ref_sorted[rp])) {
+            continue;
+        }
+
+        refc = *ref_sorted[rp];
+        xygrid_cell(&grid, &refc, &center);
+
+        /* Find the closest match to the reference object.  The tests
+           here must select exactly the same candidates as the sweep,
+           including the asymmetric bounds in y, and break ties in
+           favor of the candidate furthest along input_sorted.  Since
+           the bounds are checked exactly, entries from other cells
+           that share a bucket (or are visited twice) are harmless. */
+        rmax2 = tolerance2;
+        found = 0;
+        lmatch = 0;
+        for (j = -1; j <= 1; ++j) {
+            row.x = center.x;
+            row.y = center.y + j;
+            nranges = xygrid_row(&grid, &row, start, end);
+            for (r = 0; r < nranges; ++r) {
+                for (k = start[r]; k < end[r]; ++k) {
+                    entry = &grid.entries[k];
+                    dy = refc.y - entry->coord.y;
+                    if (!(dy < tolerance) || dy < -tolerance) {
+                        continue;
+                    }
+                    dx = refc.x - entry->coord.x;
+                    r2 = dx*dx + dy*dy;
+
+                    if (r2 < rmax2 ||
+                        (r2 == rmax2 && (!found || entry->index > lmatch))) {
+                        rmax2 = r2;
+                        lmatch = entry->index;
+                        found = 1;
+                    }
+                }
+            }
+        }
+
+        if (found) {
+            if (callback(callback_data,
+                         ref_sorted[rp] - ref,
+                         input_sorted[lmatch] - input,
+                         error)) {
+                goto exit;
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    xygrid_free(&grid);
+
+    return status;
+}
+
+static tolerance_search_e
+match_tolerance_choose_search(
+        const size_t ninput,
+        const coord_t* const * const input_sorted,
+        const double tolerance) {
+
+    double yrange;
+    double band;
+
+    if (ninput == 0 || !(tolerance > 0.0) || !isfinite64(tolerance)) {
+        return tolerance_search_sweep;
+    }
+
+    /* Estimate the number of input coordinates the sweep will scan
+       for each reference coordinate, assuming they are spread evenly
+       in y. */
+    yrange = input_sorted[ninput - 1]->y - input_sorted[0]->y;
+    if (!isfinite64(yrange)) {
+        return tolerance_search_sweep;
+    }
+    if (yrange <= 2.0 * tolerance) {
+        band = (double)ninput;
+    } else {
+        band = (double)ninput * (2.0 * tolerance / yrange);
+    }
+
+    if (band > TOLERANCE_GRID_MIN_BAND) {
+        return tolerance_search_grid;
+    }
+
+    return tolerance_search_sweep;
+}
+
+int
+match_tolerance(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        const tolerance_search_e search,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    tolerance_search_e method = search;
+
+    assert(ref);
+    assert(ref_sorted);
+    assert(input);
+    assert(input_sorted);
+    assert(callback);
+    assert(error);
+
+    if (method == tolerance_search_auto) {
+        method = match_tolerance_choose_search(
+                ninput, input_sorted, tolerance);
+    }
+
+    switch (method) {
+    case tolerance_search_sweep:
+        return match_tolerance_sweep(
+                nref, ref, ref_sorted, ninput, input, input_sorted,
+                tolerance, callback, callback_data, error);
+    case tolerance_search_grid:
+        if (!(tolerance > 0.0)) {
+            stimage_error_set_message(
+                    error, "The grid search requires a tolerance > 0");
+            return 1;
+        }
+        return match_tolerance_grid(
+                nref, ref, ref_sorted, ninput, input, input_sorted,
+                tolerance, callback, callback_data, error);
+    case tolerance_search_auto:
+    case tolerance_search_LAST:
+    default:
+        stimage_error_set_message(error, "Invalid tolerance search method");
+        return 1;
+    }
+}
@@ -36,8 +36,13 @@ DAMAGE.
 
 #include <assert.h>
 #include <math.h>
+#include <string.h>
 
 #include "immatch/lib/triangles.h"
+#include "lib/radixsort.h"
+#include "lib/threads.h"
+#include "lib/xybbox.h"
+#include "lib/xygrid.h"
 
 int
 max_num_triangles(
@@ -66,22 +71,407 @@ sides_def [3][2] = {
     { 2, 0 }
 };
 
-/* Uses as a qsort functor */
+/* Fill in a triangle from three coordinates of a list, given the
+   squared lengths of their sides.  Returns zero if the triangle is
+   too elongated and should be rejected. */
 static int
-triangle_ratio_compare(
-        const void* ap,
-        const void* bp) {
+triangle_init(
+        triangle_t* const tri,
+        const coord_t* const * const coords,
+        const size_t i,
+        const size_t j,
+        const size_t k,
+        const double dist_ij,
+        const double dist_jk,
+        const double dist_ki,
+        const double tol2,
+        const double maxratio) {
+
+    size_t m;
+    double dx[3], dy[3], sides2[3], sides[3];
+    double cosc, cosc2, sinc2;
+    double ratio, loctol;
+    const coord_t* v[3];
+
+    /* Order the vertices with the shortest side of the triangle
+       between vertices 1 and 2 and the intermediate side between
+       vertices 2 and 3.
+    */
+    if (dist_ij <= dist_jk) {
+        if (dist_ki <= dist_ij) {
+            tri->vertices[0] = (STIMAGE_UInt32)k;
+            tri->vertices[1] = (STIMAGE_UInt32)i;
+            tri->vertices[2] = (STIMAGE_UInt32)j;
+        } else if (dist_ki >= dist_jk) {
+            tri->vertices[0] = (STIMAGE_UInt32)i;
+            tri->vertices[1] = (STIMAGE_UInt32)j;
+            tri->vertices[2] = (STIMAGE_UInt32)k;
+        } else {
+            tri->vertices[0] = (STIMAGE_UInt32)j;
+            tri->vertices[1] = (STIMAGE_UInt32)i;
+            tri->vertices[2] = (STIMAGE_UInt32)k;
+        }
+    } else {
+        if (dist_ki <= dist_jk) {
+            tri->vertices[0] = (STIMAGE_UInt32)i;
+            tri->vertices[1] = (STIMAGE_UInt32)k;
+            tri->vertices[2] = (STIMAGE_UInt32)j;
+        } else if (dist_ki >= dist_ij) {
+            tri->vertices[0] = (STIMAGE_UInt32)k;
+            tri->vertices[1] = (STIMAGE_UInt32)j;
+            tri->vertices[2] = (STIMAGE_UInt32)i;
+        } else {
+            tri->vertices[0] = (STIMAGE_UInt32)j;
+            tri->vertices[1] = (STIMAGE_UInt32)k;
+            tri->vertices[2] = (STIMAGE_UInt32)i;
+        }
+    }
 
-    const triangle_t* a = (const triangle_t*)ap;
-    const triangle_t* b = (const triangle_t*)bp;
+    for (m = 0; m < 3; ++m) {
+        v[m] = coords[tri->vertices[m]];
+    }
 
-    if (a->ratio < b->ratio) {
-        return -1;
-    } else if (a->ratio > b->ratio) {
-        return 1;
-    } else {
+    /* Compute the lengths of the sides */
+    for (m = 0; m < 3; ++m) {
+        dx[m] = v[sides_def[m][0]]->x - v[sides_def[m][1]]->x;
+        dy[m] = v[sides_def[m][0]]->y - v[sides_def[m][1]]->y;
+        sides2[m] = dx[m]*dx[m] + dy[m]*dy[m];
+        assert(sides2[m] >= 0.0);
+        sides[m] = sqrt(sides2[m]);
+    }
+
+    /* If the ratio of long to short is too high, reject
+       this triangle */
+    ratio = sides[2] / sides[1];
+    if (ratio > maxratio) {
         return 0;
     }
+
+    /* Compute the cos, cos ** 2 and sin ** 2 of the angle at
+       vertex 1. */
+    cosc = (dx[2]*dx[1] + dy[2]*dy[1]) / (sides[2]*sides[1]);
+    cosc2 = MAX(0.0, MIN(1.0, cosc*cosc));
+    sinc2 = MAX(0.0, MIN(1.0, 1.0 - cosc2));
+
+    /* Determine whether the triangles vertices are
+       arranged clockwise or anti-clockwise */
+    tri->sense = (char)((dx[1]*dy[0] - dy[1]*dx[0]) > 0.0);
+
+    /* Compute the tolerances */
+    loctol = (1.0/sides2[2] - cosc/(sides[2]*sides[1]) + 1.0/sides2[1]);
+    tri->ratio_tolerance = 2.0*ratio*ratio*tol2*loctol;
+    tri->cosine_tolerance = \
+        2.0*sinc2*tol2*loctol +
+        2.0*cosc2*tol2*tol2*loctol*loctol;
+
+    /* Compute the perimeter */
+    tri->log_perimeter = log(sides[0] + sides[1] + sides[2]);
+    tri->ratio = ratio;
+    tri->cosine_v1 = cosc;
+
+    return 1;
+}
+
+static int
+check_maxratio(
+        const double maxratio,
+        stimage_error_t* const error) {
+
+    if (maxratio > 10.0 || maxratio < 5.0) {
+        stimage_error_format_message(
+            error,
+            "maxratio should be in the range 5.0 - 10.0 (%f)", maxratio);
+        return 1;
+    }
+
+    return 0;
+}
+
+/* The triangles are sorted with a stable sort, so that the order does
+   not depend on the number of threads.  The list is split into one
+   run per thread, the runs are radix sorted concurrently, and then
+   pairs of neighboring runs are merged concurrently until only one is
+   left. */
+#define TRIANGLE_SORT_MIN_RUN 4096
+
+static void
+triangle_merge(
+        const triangle_t* a,
+        const triangle_t* const a_end,
+        const triangle_t* b,
+        const triangle_t* const b_end,
+        triangle_t* out) {
+
+    while (a < a_end && b < b_end) {
+        /* Take from a on ties to keep the sort stable */
+        if (b->ratio < a->ratio) {
+            *out++ = *b++;
+        } else {
+            *out++ = *a++;
+        }
+    }
+
+    while (a < a_end) {
+        *out++ = *a++;
+    }
+
+    while (b < b_end) {
+        *out++ = *b++;
+    }
+}
+
+/* Sort triangles[0:n] into out[0:n], using records[0:2n] as scratch
+   space.  The ratios are radix sorted, which is stable, so the result
+   is the same as a stable merge sort would give. */
+static void
+triangle_sort_run(
+        const size_t n,
+        const triangle_t* const triangles,
+        triangle_t* const out,
+        radix_record_t* const records) {
+
+    size_t i;
+
+    for (i = 0; i < n; ++i) {
+        records[i].key[0] = radix_key_double((double)triangles[i].ratio);
+        records[i].index = i;
+    }
+
+    radix_sort(n, 1, records, records + n);
+
+    for (i = 0; i < n; ++i) {
+        out[i] = triangles[records[i].index];
+    }
+}
+
+typedef struct {
+    triangle_t*     src;
+    triangle_t*     dst;
+    radix_record_t* records; /* [2 * n] */
+    size_t*         bounds; /* [nruns + 1] */
+    size_t          nruns;
+} triangle_sort_state_t;
+
+static int
+triangle_sort_run_func(
+        void* data,
+        size_t i,
+        stimage_error_t* const error) {
+
+    triangle_sort_state_t* state = (triangle_sort_state_t*)data;
+    const size_t lo = state->bounds[i];
+    const size_t hi = state->bounds[i + 1];
+
+    triangle_sort_run(hi - lo, state->src + lo, state->dst + lo,
+                      state->records + 2 * lo);
+
+    return 0;
+}
+
+static int
+triangle_sort_merge_func(
+        void* data,
+        size_t i,
+        stimage_error_t* const error) {
+
+    triangle_sort_state_t* state = (triangle_sort_state_t*)data;
+    const size_t lo = state->bounds[2 * i];
+    const size_t mid = state->bounds[MIN(2 * i + 1, state->nruns)];
+    const size_t hi = state->bounds[MIN(2 * i + 2, state->nruns)];
+
+    triangle_merge(state->src + lo, state->src + mid,
+                   state->src + mid, state->src + hi,
+                   state->dst + lo);
+
+    return 0;
+}
+
+/* Sort the triangles in increasing order of ratio */
+static int
+triangle_sort(
+        const size_t n,
+        triangle_t* const triangles,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    triangle_sort_state_t state;
+    triangle_t*           tmp     = NULL;
+    triangle_t*           swap    = NULL;
+    radix_record_t*       records = NULL;
+    size_t*               bounds  = NULL;
+    size_t                nruns   = 0;
+    size_t                i       = 0;
+    int                   status  = 1;
+
+    nruns = MIN(nthreads == 0 ? threads_ncpu() : nthreads,
+                MAX(1, n / TRIANGLE_SORT_MIN_RUN));
+
+    tmp = malloc_with_error(n * sizeof(triangle_t) + 1, error);
+    if (tmp == NULL) goto exit;
+
+    records = malloc_with_error(2 * n * sizeof(radix_record_t) + 1, error);
+    if (records == NULL) goto exit;
+
+    bounds = malloc_with_error((nruns + 1) * sizeof(size_t), error);
+    if (bounds == NULL) goto exit;
+
+    for (i = 0; i <= nruns; ++i) {
+        bounds[i] = (size_t)((double)n * (double)i / (double)nruns);
+    }
+    bounds[nruns] = n;
+
+    state.src = triangles;
+    state.dst = tmp;
+    state.records = records;
+    state.bounds = bounds;
+    state.nruns = nruns;
+
+    /* The runs are sorted from src into dst */
+    if (parallel_for(nruns, nruns, triangle_sort_run_func, &state, error)) {
+        goto exit;
+    }
+    swap = state.src; state.src = state.dst; state.dst = swap;
+
+    /* The records are only needed by the runs */
+    free(records);
+    records = NULL;
+
+    while (state.nruns > 1) {
+        if (parallel_for((state.nruns + 1) / 2, nthreads,
+                         triangle_sort_merge_func, &state, error)) {
+            goto exit;
+        }
+
+        for (i = 0; 2 * i < state.nruns; ++i) {
+            bounds[i] = bounds[2 * i];
+        }
+        bounds[i] = n;
+        state.nruns = i;
+
+        swap = state.src; state.src = state.dst; state.dst = swap;
+    }
+
+    if (state.src != triangles) {
+        memcpy(triangles, state.src, n * sizeof(triangle_t));
+    }
+
+    status = 0;
+
+ exit:
+
+    free(tmp);
+    free(records);
+    free(bounds);
+
+    return status;
+}
+
+typedef struct {
+    const coord_t* const * coords;
+    size_t                 nsample;
+    size_t                 npoints;
+    double                 tol2;
+    double                 maxratio;
+    size_t                 first;   /* The first row of the batch */
+    triangle_t*            scratch;
+    const size_t*          offsets; /* [nrows + 1] */
+    size_t*                counts;  /* [nrows] */
+    budget_t*              budget;
+} find_triangles_state_t;
+
+/* Find the triangles whose first vertex is the given row of the
+   sampled coordinates.  Each row of a batch writes to its own part
+   of the scratch space, which is large enough for every triangle it
+   could find. */
+static int
+find_triangles_row(
+        void* data,
+        size_t batch_row,
+        stimage_error_t* const error) {
+
+    find_triangles_state_t* state = (find_triangles_state_t*)data;
+    const coord_t* const * const coords = state->coords;
+    const size_t nsample = state->nsample;
+    const size_t npoints = state->npoints;
+    const double tol2 = state->tol2;
+    const size_t row = state->first + batch_row;
+    triangle_t* const triangles = state->scratch +
+        (state->offsets[row] - state->offsets[state->first]);
+    const size_t i = row * nsample;
+    size_t j, k;
+    size_t ntri = 0;
+    double dist_ij, dist_jk, dist_ki;
+
+    if (budget_charge(state->budget,
+                      state->offsets[row + 1] - state->offsets[row],
+                      "finding triangles", error)) {
+        return 1;
+    }
+
+    for (j = i + nsample; j < npoints - nsample; j += nsample) {
+        dist_ij = euclid_distance2(coords[i], coords[j]);
+        if (dist_ij <= tol2) {
+            continue;
+        }
+
+        for (k = j + nsample; k < npoints; k += nsample) {
+            dist_jk = euclid_distance2(coords[j], coords[k]);
+            if (dist_jk <= tol2) {
+                continue;
+            }
+
+            dist_ki = euclid_distance2(coords[k], coords[i]);
+            if (dist_ki <= tol2) {
+                continue;
+            }
+
+            if (triangle_init(
+                    &triangles[ntri], coords, i, j, k,
+                    dist_ij, dist_jk, dist_ki, tol2, state->maxratio)) {
+                ++ntri;
+            }
+        }
+    }
+
+    state->counts[row] = ntri;
+
+    return 0;
+}
+
+static int
+check_ncoords(
+        const size_t ncoords,
+        stimage_error_t* const error) {
+
+    if (ncoords > (size_t)(STIMAGE_UInt32)-1) {
+        stimage_error_set_message(
+            error,
+            "Too many coordinates for triangle matching");
+        return 1;
+    }
+
+    return 0;
+}
+
+/* The rows are found in batches of about an eighth of all of the
+   possible triangles (or at least one row), so that the scratch
+   space needed is only a fraction of the worst case.  Returns the
+   end of the batch starting at row. */
+static size_t
+find_triangles_batch_end(
+        const size_t* const offsets,
+        const size_t nrows,
+        const size_t row) {
+
+    const size_t budget = MAX(offsets[nrows] / 8,
+                              offsets[row + 1] - offsets[row]);
+    size_t end = row + 1;
+
+    while (end < nrows && offsets[end + 1] - offsets[row] <= budget) {
+        ++end;
+    }
+
+    return end;
 }
 
 int
@@ -89,154 +479,934 @@ find_triangles(
         const size_t ncoords,
         const coord_t* const * const coords,
         size_t* ntriangles,
-        triangle_t* triangles,
+        triangle_t** triangles,
         const size_t maxnpoints,
         const double tolerance,
         const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
         stimage_error_t* const error) {
 
-    const double tol2 = tolerance * tolerance;
-    const size_t nsample = MAX(1, ncoords / maxnpoints);
-    const size_t npoints = MIN(ncoords, nsample * maxnpoints);
-    triangle_t* tri = triangles;
-    size_t i, j, k, m;
+    size_t nsample = 0;
+    size_t npoints = 0;
+    size_t nsampled = 0;
+    size_t nrows = 0;
+    find_triangles_state_t state;
+    size_t* offsets = NULL;
+    size_t* counts = NULL;
+    triangle_t* scratch = NULL;
+    triangle_t* result = NULL;
+    triangle_t* grown = NULL;
+    size_t nallocated = 0;
+    size_t nbatch = 0;
+    size_t row, end;
     size_t ntri = 0;
-    double dist_ij, dist_jk, dist_ki;
-    double dx[3], dy[3], sides2[3], sides[3];
-    double cosc, cosc2, sinc2;
-    double ratio, loctol;
+    double rate;
+    int status = 1;
 
     assert(coords);
     assert(ntriangles);
     assert(triangles);
     assert(error);
 
-    if (maxratio > 10.0 || maxratio < 5.0) {
-        stimage_error_format_message(
+    *ntriangles = 0;
+    *triangles = NULL;
+
+    if (check_maxratio(maxratio, error) ||
+        check_ncoords(ncoords, error) ||
+        max_num_triangles(ncoords, maxnpoints, &nallocated, error)) {
+        goto exit;
+    }
+
+    /* maxnpoints is non-zero once max_num_triangles has accepted it */
+    nsample = MAX(1, ncoords / maxnpoints);
+    npoints = MIN(ncoords, nsample * maxnpoints);
+    nsampled = npoints / nsample;
+    nrows = nsampled >= 3 ? nsampled - 2 : 0;
+
+    offsets = malloc_with_error((nrows + 1) * sizeof(size_t), error);
+    if (offsets == NULL) goto exit;
+
+    counts = malloc_with_error((nrows + 1) * sizeof(size_t), error);
+    if (counts == NULL) goto exit;
+
+    /* Row r can form a triangle with every pair of the sampled
+       coordinates after it */
+    offsets[0] = 0;
+    for (row = 0; row < nrows; ++row) {
+        offsets[row + 1] = offsets[row] +
+            (nsampled - row - 1) * (nsampled - row - 2) / 2;
+    }
+
+    /* The first row is the longest, so no batch is larger than the
+       budget of the first */
+    nallocated = nrows ? MAX(offsets[nrows] / 8, offsets[1]) : 0;
+    scratch = malloc_with_error(
+            nallocated * sizeof(triangle_t) + 1, error);
+    if (scratch == NULL) goto exit;
+    nallocated = 0;
+
+    state.coords = coords;
+    state.nsample = nsample;
+    state.npoints = npoints;
+    state.tol2 = tolerance * tolerance;
+    state.maxratio = maxratio;
+    state.scratch = scratch;
+    state.offsets = offsets;
+    state.counts = counts;
+    state.budget = budget;
+
+    for (row = 0; row < nrows; row = end) {
+        end = find_triangles_batch_end(offsets, nrows, row);
+
+        state.first = row;
+        if (parallel_for(end - row, nthreads, find_triangles_row, &state,
+                         error)) {
+            goto exit;
+        }
+
+        nbatch = 0;
+        for (row = state.first; row < end; ++row) {
+            nbatch += counts[row];
+        }
+
+        /* Grow the result to the expected total, assuming the rest
+           of the rows accept the same fraction of their triangles */
+        if (ntri + nbatch > nallocated) {
+            rate = (double)(ntri + nbatch) / (double)offsets[end];
+            nallocated = ntri + nbatch + (size_t)(
+                    rate * 1.05 * (double)(offsets[nrows] - offsets[end]));
+            nallocated = MIN(nallocated, offsets[nrows]);
+            grown = realloc(result, nallocated * sizeof(triangle_t) + 1);
+            if (grown == NULL) {
+                stimage_error_set_message(
+                    error, "Out of memory allocating triangles");
+                goto exit;
+            }
+            result = grown;
+        }
+
+        /* Pack the rows of the batch together, in order */
+        for (row = state.first; row < end; ++row) {
+            memcpy(&result[ntri],
+                   &scratch[offsets[row] - offsets[state.first]],
+                   counts[row] * sizeof(triangle_t));
+            ntri += counts[row];
+        }
+    }
+
+    free(scratch);
+    scratch = NULL;
+
+    if (ntri < nallocated) {
+        grown = realloc(result, ntri * sizeof(triangle_t) + 1);
+        if (grown != NULL) {
+            result = grown;
+        }
+    }
+
+    if (result == NULL) {
+        result = malloc_with_error(1, error);
+        if (result == NULL) goto exit;
+    }
+
+    if (triangle_sort(ntri, result, nthreads, error)) goto exit;
+
+    *ntriangles = ntri;
+    *triangles = result;
+
+    status = 0;
+
+ exit:
+
+    free(offsets);
+    free(counts);
+    free(scratch);
+    if (status) {
+        free(result);
+    }
+
+    return status;
+}
+
+int
+max_num_triangles_local(
+        const size_t ncoords,
+        const size_t nneighbors,
+        size_t* num_triangles,
+        stimage_error_t* const error) {
+
+    size_t k = 0;
+
+    assert(num_triangles);
+    assert(error);
+
+    if (nneighbors < 2) {
+        stimage_error_set_message(
             error,
-            "maxratio should be in the range 5.0 - 10.0 (%f)", maxratio);
+            "The number of neighbors should be at least 2");
         return 1;
     }
 
-    for (i = 0; i < npoints - (2 * nsample); i += nsample) {
-        for (j = i + nsample; j < npoints - nsample; j += nsample) {
-            dist_ij = euclid_distance2(coords[i], coords[j]);
-            if (dist_ij <= tol2) {
-                continue;
-            }
+    k = MIN(nneighbors, ncoords > 0 ? ncoords - 1 : 0);
+    if (k > 256 || ncoords > ((size_t)-1 / 2) / (k * k + 1)) {
+        stimage_error_set_message(
+            error,
+            "The number of neighbors should be a lower number");
+        return 1;
+    }
 
-            for (k = j + nsample; k < npoints; k += nsample) {
-                dist_jk = euclid_distance2(coords[j], coords[k]);
-                if (dist_jk <= tol2) {
-                    continue;
-                }
+    *num_triangles = ncoords * (k * (k - 1) / 2);
+
+    return 0;
+}
+
+/* Insert a candidate into the list of the nearest neighbors found so
+   far, which is kept sorted by distance and then by index, so the
+   result does not depend on the order in which the grid is scanned. */
+static void
+neighbors_insert(
+        const size_t k,
+        size_t* const nbest,
+        double* const best_d, /* [k] */
+        size_t* const best_i, /* [k] */
+        const double d,
+        const size_t index) {
+
+    size_t j = *nbest;
+
+    if (j == k) {
+        if (d > best_d[k - 1] ||
+            (d == best_d[k - 1] && index > best_i[k - 1])) {
+            return;
+        }
+        --j;
+    } else {
+        ++*nbest;
+    }
 
-                dist_ki = euclid_distance2(coords[k], coords[i]);
-                if (dist_ki <= tol2) {
-                    continue;
+    while (j > 0 &&
+           (best_d[j - 1] > d ||
+            (best_d[j - 1] == d && best_i[j - 1] > index))) {
+        best_d[j] = best_d[j - 1];
+        best_i[j] = best_i[j - 1];
+        --j;
+    }
+
+    best_d[j] = d;
+    best_i[j] = index;
+}
+
+static void
+neighbors_scan_cell(
+        const xygrid_t* const grid,
+        const STIMAGE_Int64 x,
+        const STIMAGE_Int64 y,
+        const coord_t* const center,
+        const size_t self,
+        const size_t k,
+        size_t* const nbest,
+        double* const best_d, /* [k] */
+        size_t* const best_i /* [k] */) {
+
+    xygrid_cell_t         cell;
+    xygrid_cell_t         entry_cell;
+    const xygrid_entry_t* entry;
+    size_t                hash;
+    size_t                e;
+
+    cell.x = x;
+    cell.y = y;
+    hash = xygrid_hash(grid, &cell);
+
+    for (e = grid->bucket_start[hash];
+         e < grid->bucket_start[hash + 1];
+         ++e) {
+        entry = &grid->entries[e];
+        if (entry->index == self) {
+            continue;
+        }
+
+        /* Skip entries from other cells that share the bucket */
+        xygrid_cell(grid, &entry->coord, &entry_cell);
+        if (entry_cell.x != x || entry_cell.y != y) {
+            continue;
+        }
+
+        neighbors_insert(
+                k, nbest, best_d, best_i,
+                euclid_distance2(center, &entry->coord), entry->index);
+    }
+}
+
+/* Find the k nearest neighbors of each coordinate.  The neighbors of
+   coordinate i are stored in neighbors[i*k:i*k+nfound[i]], nearest
+   first.
+
+   The grid cells are chosen to hold about k coordinates each.  The
+   rings of cells around each coordinate are searched outward until
+   the k-th nearest neighbor found is closer than anything that could
+   be in the next ring.  A coordinate far from the rest would need
+   more rings than there are coordinates, so once that many cells
+   have been searched, every coordinate is checked instead. */
+static int
+find_neighbors(
+        const size_t ncoords,
+        const coord_t* const * const coords, /* [ncoords] */
+        const size_t k,
+        size_t* const neighbors, /* [ncoords * k] */
+        size_t* const nfound, /* [ncoords] */
+        stimage_error_t* const error) {
+
+    xygrid_t      grid;
+    xygrid_cell_t center;
+    xygrid_cell_t lo;
+    xygrid_cell_t hi;
+    bbox_t        bbox;
+    bbox_t        extent;
+    double*       best_d    = NULL;
+    double        cell_size = 0.0;
+    double        area      = 0.0;
+    double        span      = 0.0;
+    double        reach     = 0.0;
+    STIMAGE_Int64 r         = 0;
+    STIMAGE_Int64 maxr      = 0;
+    STIMAGE_Int64 t         = 0;
+    size_t        i         = 0;
+    size_t        nbest     = 0;
+    size_t        ninside   = 0;
+    size_t        e         = 0;
+    int           status    = 1;
+
+    assert(coords || ncoords == 0);
+    assert(k > 0);
+    assert(neighbors);
+    assert(nfound);
+    assert(error);
+
+    xygrid_new(&grid);
+
+    bbox_init(&bbox);
+    for (i = 0; i < ncoords; ++i) {
+        nfound[i] = 0;
+        if (coord_is_finite(coords[i])) {
+            if (!(coords[i]->x >= bbox.min.x)) bbox.min.x = coords[i]->x;
+            if (!(coords[i]->y >= bbox.min.y)) bbox.min.y = coords[i]->y;
+            if (!(coords[i]->x <= bbox.max.x)) bbox.max.x = coords[i]->x;
+            if (!(coords[i]->y <= bbox.max.y)) bbox.max.y = coords[i]->y;
+        }
+    }
+
+    if (!isfinite64(bbox.min.x) || ncoords < 2) {
+        status = 0;
+        goto exit;
+    }
+
+    /* Cells that hold about k coordinates each, or, if the
+       coordinates all lie on a line, k coordinates' worth of it.  The
+       density comes from the bulk of the coordinates, so that a few
+       distant ones can not put all of the others in one cell. */
+    if (xygrid_extent(ncoords, coords, &extent, &ninside, error)) goto exit;
+    area = (extent.max.x - extent.min.x) * (extent.max.y - extent.min.y);
+    span = MAX(extent.max.x - extent.min.x, extent.max.y - extent.min.y);
+    if (ninside > 0 && area > 0.0 && isfinite64(area)) {
+        cell_size = sqrt(area * (double)k / (double)ninside);
+    } else if (ninside > 0 && span > 0.0 && isfinite64(span)) {
+        cell_size = span * (double)k / (double)ninside;
+    } else {
+        cell_size = 1.0;
+    }
+
+    if (xygrid_init(&grid, ncoords, coords, cell_size, error)) goto exit;
+
+    best_d = malloc_with_error(k * sizeof(double), error);
+    if (best_d == NULL) goto exit;
+
+    xygrid_cell(&grid, &bbox.min, &lo);
+    xygrid_cell(&grid, &bbox.max, &hi);
+
+    for (i = 0; i < ncoords; ++i) {
+        if (!coord_is_finite(coords[i])) {
+            continue;
+        }
+
+        xygrid_cell(&grid, coords[i], &center);
+        maxr = MAX(MAX(center.x - lo.x, hi.x - center.x),
+                   MAX(center.y - lo.y, hi.y - center.y));
+
+        nbest = 0;
+        for (r = 0; ; ++r) {
+            if (r == 0) {
+                neighbors_scan_cell(
+                        &grid, center.x, center.y, coords[i], i,
+                        k, &nbest, best_d, &neighbors[i * k]);
+            } else {
+                for (t = -r; t <= r; ++t) {
+                    neighbors_scan_cell(
+                            &grid, center.x + t, center.y - r, coords[i], i,
+                            k, &nbest, best_d, &neighbors[i * k]);
+                    neighbors_scan_cell(
+                            &grid, center.x + t, center.y + r, coords[i], i,
+                            k, &nbest, best_d, &neighbors[i * k]);
                 }
+                for (t = -r + 1; t < r; ++t) {
+                    neighbors_scan_cell(
+                            &grid, center.x - r, center.y + t, coords[i], i,
+                            k, &nbest, best_d, &neighbors[i * k]);
+                    neighbors_scan_cell(
+                            &grid, center.x + r, center.y + t, coords[i], i,
+                            k, &nbest, best_d, &neighbors[i * k]);
+                }
+            }
 
-                #ifndef NDEBUG
-                    if (ntri >= *ntriangles) {
-                        stimage_error_format_message(
-                            error,
-                            "Found more triangles than were allocated for (%d)\n",
-                            *ntriangles);
-                        return 1;
+            /* Everything closer than r cells has been seen */
+            reach = (double)r * grid.cell_size;
+            if ((nbest == k && best_d[k - 1] < reach * reach) || r >= maxr) {
+                break;
+            }
+
+            /* Searching the rings has cost more than checking every
+               coordinate would */
+            if ((double)(2 * r + 1) * (double)(2 * r + 1) >
+                (double)grid.nentries) {
+                nbest = 0;
+                for (e = 0; e < grid.nentries; ++e) {
+                    if (grid.entries[e].index == i) {
+                        continue;
                     }
-                #endif /* NDEBUG */
-
-                tri = &triangles[ntri];
-                /* DIFF: The original stores the index of the
-                   triangle.  Do we need to do that? */
-
-                /* Order the vertices with the shortest side of the triangle
-                   between vertices 1 and 2 and the intermediate side between
-                   vertices 2 and 3.
-                */
-                if (dist_ij <= dist_jk) {
-                    if (dist_ki <= dist_ij) {
-                        tri->vertices[0] = coords[k];
-                        tri->vertices[1] = coords[i];
-                        tri->vertices[2] = coords[j];
-                    } else if (dist_ki >= dist_jk) {
-                        tri->vertices[0] = coords[i];
-                        tri->vertices[1] = coords[j];
-                        tri->vertices[2] = coords[k];
-                    } else {
-                        tri->vertices[0] = coords[j];
-                        tri->vertices[1] = coords[i];
-                        tri->vertices[2] = coords[k];
+                    neighbors_insert(
+                            k, &nbest, best_d, &neighbors[i * k],
+                            euclid_distance2(
+                                    coords[i], &grid.entries[e].coord),
+                            grid.entries[e].index);
+                }
+                break;
+            }
+        }
+
+        nfound[i] = nbest;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(best_d);
+    xygrid_free(&grid);
+
+    return status;
+}
+
+typedef struct {
+    size_t v[3];
+} triangle_triple_t;
+
+/* Uses as a qsort functor */
+static int
+triangle_triple_compare(
+        const void* ap,
+        const void* bp) {
+
+    const triangle_triple_t* a = (const triangle_triple_t*)ap;
+    const triangle_triple_t* b = (const triangle_triple_t*)bp;
+    size_t m;
+
+    for (m = 0; m < 3; ++m) {
+        if (a->v[m] < b->v[m]) {
+            return -1;
+        } else if (a->v[m] > b->v[m]) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+int
+find_triangles_local(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t nneighbors,
+        size_t* ntriangles,
+        triangle_t** triangles,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
+        stimage_error_t* const error) {
+
+    const double       tol2       = tolerance * tolerance;
+    size_t             k          = 0;
+    size_t*            neighbors  = NULL;
+    size_t*            nfound     = NULL;
+    triangle_triple_t* triples    = NULL;
+    triangle_triple_t  triple;
+    size_t             ntriples   = 0;
+    size_t             maxtriples = 0;
+    triangle_t*        result     = NULL;
+    triangle_t*        shrunk     = NULL;
+    size_t             ntri       = 0;
+    size_t             i, a, b, m, tmp;
+    double             dist_ij, dist_jk, dist_ki;
+    int                status     = 1;
+
+    assert(coords || ncoords == 0);
+    assert(ntriangles);
+    assert(triangles);
+    assert(error);
+
+    *ntriangles = 0;
+    *triangles = NULL;
+
+    if (check_maxratio(maxratio, error) ||
+        check_ncoords(ncoords, error) ||
+        max_num_triangles_local(ncoords, nneighbors, &maxtriples, error)) {
+        goto exit;
+    }
+
+    if (ncoords >= 3) {
+        k = MIN(nneighbors, ncoords - 1);
+
+        neighbors = malloc_with_error(ncoords * k * sizeof(size_t), error);
+        if (neighbors == NULL) goto exit;
+
+        nfound = malloc_with_error(ncoords * sizeof(size_t), error);
+        if (nfound == NULL) goto exit;
+
+        triples = malloc_with_error(
+                maxtriples * sizeof(triangle_triple_t) + 1, error);
+        if (triples == NULL) goto exit;
+
+        if (find_neighbors(ncoords, coords, k, neighbors, nfound, error)) {
+            goto exit;
+        }
+    }
+
+    /* Each coordinate forms a triangle with every pair of its
+       neighbors.  The vertices are put in increasing order, the same
+       order find_triangles uses, so that the same triangle found from
+       different coordinates can be removed. */
+    for (i = 0; i < ncoords && k > 0; ++i) {
+        if (budget_charge(budget, nfound[i] * (nfound[i] - 1) / 2,
+                          "finding triangles", error)) {
+            goto exit;
+        }
+
+        for (a = 0; a < nfound[i]; ++a) {
+            for (b = a + 1; b < nfound[i]; ++b) {
+                triple.v[0] = i;
+                triple.v[1] = neighbors[i * k + a];
+                triple.v[2] = neighbors[i * k + b];
+                for (m = 0; m < 2; ++m) {
+                    if (triple.v[1] < triple.v[0]) {
+                        tmp = triple.v[0];
+                        triple.v[0] = triple.v[1];
+                        triple.v[1] = tmp;
                     }
-                } else {
-                    if (dist_ki <= dist_jk) {
-                        tri->vertices[0] = coords[i];
-                        tri->vertices[1] = coords[k];
-                        tri->vertices[2] = coords[j];
-                    } else if (dist_ki >= dist_ij) {
-                        tri->vertices[0] = coords[k];
-                        tri->vertices[1] = coords[j];
-                        tri->vertices[2] = coords[i];
-                    } else {
-                        tri->vertices[0] = coords[j];
-                        tri->vertices[1] = coords[k];
-                        tri->vertices[2] = coords[i];
+                    if (triple.v[2] < triple.v[1]) {
+                        tmp = triple.v[1];
+                        triple.v[1] = triple.v[2];
+                        triple.v[2] = tmp;
                     }
                 }
+                assert(ntriples < maxtriples);
+                triples[ntriples++] = triple;
+            }
+        }
+    }
 
-                /* Compute the lengths of the sides */
-                for (m = 0; m < 3; ++m) {
-                    dx[m] = tri->vertices[sides_def[m][0]]->x -
-                        tri->vertices[sides_def[m][1]]->x;
-                    dy[m] = tri->vertices[sides_def[m][0]]->y -
-                        tri->vertices[sides_def[m][1]]->y;
-                    sides2[m] = dx[m]*dx[m] + dy[m]*dy[m];
-                    assert(sides2[m] >= 0.0);
-                    sides[m] = sqrt(sides2[m]);
-                }
+    free(neighbors); neighbors = NULL;
+    free(nfound); nfound = NULL;
 
-                /* If the ratio of long to short is too high, reject
-                   this triangle */
-                ratio = sides[2] / sides[1];
-                if (ratio > maxratio) {
-                    continue;
-                }
+    qsort(triples, ntriples, sizeof(triangle_triple_t),
+          &triangle_triple_compare);
 
-                /* Compute the cos, cos ** 2 and sin ** 2 of the angle at
-                   vertex 1. */
-                cosc = (dx[2]*dx[1] + dy[2]*dy[1]) / (sides[2]*sides[1]);
-                cosc2 = MAX(0.0, MIN(1.0, cosc*cosc));
-                sinc2 = MAX(0.0, MIN(1.0, 1.0 - cosc2));
+    for (i = 0, m = 0; i < ntriples; ++i) {
+        if (m == 0 || triangle_triple_compare(&triples[m - 1], &triples[i])) {
+            triples[m++] = triples[i];
+        }
+    }
+    ntriples = m;
+
+    result = malloc_with_error(ntriples * sizeof(triangle_t) + 1, error);
+    if (result == NULL) goto exit;
+
+    for (i = 0; i < ntriples; ++i) {
+        dist_ij = euclid_distance2(
+                coords[triples[i].v[0]], coords[triples[i].v[1]]);
+        dist_jk = euclid_distance2(
+                coords[triples[i].v[1]], coords[triples[i].v[2]]);
+        dist_ki = euclid_distance2(
+                coords[triples[i].v[2]], coords[triples[i].v[0]]);
+        if (dist_ij <= tol2 || dist_jk <= tol2 || dist_ki <= tol2) {
+            continue;
+        }
 
-                /* Determine whether the triangles vertices are
-                   arranged clockwise or anti-clockwise */
-                tri->sense = ((dx[1]*dy[0] - dy[1]*dx[0]) > 0.0);
+        if (triangle_init(
+                &result[ntri], coords,
+                triples[i].v[0], triples[i].v[1], triples[i].v[2],
+                dist_ij, dist_jk, dist_ki, tol2, maxratio)) {
+            ++ntri;
+        }
+    }
 
-                /* Compute the tolerances */
-                loctol = (1.0/sides2[2] - cosc/(sides[2]*sides[1]) + 1.0/sides2[1]);
-                tri->ratio_tolerance = 2.0*ratio*ratio*tol2*loctol;
-                tri->cosine_tolerance = \
-                    2.0*sinc2*tol2*loctol +
-                    2.0*cosc2*tol2*tol2*loctol*loctol;
+    free(triples); triples = NULL;
 
-                /* Compute the perimeter */
-                tri->log_perimeter = log(sides[0] + sides[1] + sides[2]);
-                tri->ratio = ratio;
-                tri->cosine_v1 = cosc;
+    shrunk = realloc(result, ntri * sizeof(triangle_t) + 1);
+    if (shrunk != NULL) {
+        result = shrunk;
+    }
 
-                ++ntri;
+    if (triangle_sort(ntri, result, nthreads, error)) goto exit;
+
+    *ntriangles = ntri;
+    *triangles = result;
+
+    status = 0;
+
+ exit:
+
+    free(neighbors);
+    free(nfound);
+    free(triples);
+    if (status) {
+        free(result);
+    }
+
+    return status;
+}
+
+/* The triangles of one list are split into tiers by the size of their
+   tolerances, each spanning a factor of TRIANGLE_TIER_SCALE, with any
+   left over going into the last tier.  Within each tier, a grid over
+   (ratio, cosine_v1) finds all of the triangles that could be within
+   tolerance of a given triangle from the other list.  Splitting into
+   tiers keeps a few triangles with very large tolerances (those with
+   very short sides) from making the search window huge for all of the
+   others. */
+#define TRIANGLE_NTIERS 16
+#define TRIANGLE_TIER_SCALE 2
+
+typedef struct {
+    /* The largest tolerances of any triangle in the tier */
+    double            max_ratio_tolerance;
+    double            max_cosine_tolerance;
+    /* The grid covers min_ratio + [0, nratio) * ratio_size in ratio,
+       and similarly in cosine.  Anything outside of that range is in
+       the nearest cell. */
+    double            min_ratio;
+    double            min_cosine;
+    double            ratio_size;
+    double            cosine_size;
+    size_t            nratio;
+    size_t            ncosine;
+    /* The entries of cell (i, j) are first + [cells[k], cells[k+1]),
+       where k = i * ncosine + j, in increasing order of index */
+    size_t*           cells; /* [nratio * ncosine + 1] */
+    size_t            first;
+    size_t            nentries;
+} triangle_tier_t;
+
+/* The entries are kept as separate arrays, rather than an array of
+   structs, so that the search loop in merge_triangles, which mostly
+   rejects on ratio alone, only has to stream through the ratios */
+typedef struct {
+    triangle_tier_t   tiers[TRIANGLE_NTIERS];
+    /* [ntriangles], shared by the tiers */
+    triangle_real_t*  ratio;
+    triangle_real_t*  cosine_v1;
+    triangle_real_t*  ratio_tolerance;
+    triangle_real_t*  cosine_tolerance;
+    /* The index of the triangle in the list the index was built from */
+    size_t*           index;
+} triangle_index_t;
+
+static void
+triangle_index_new(
+        triangle_index_t* const index) {
+
+    size_t i;
+
+    for (i = 0; i < TRIANGLE_NTIERS; ++i) {
+        index->tiers[i].cells = NULL;
+        index->tiers[i].first = 0;
+        index->tiers[i].nentries = 0;
+    }
+    index->ratio = NULL;
+    index->cosine_v1 = NULL;
+    index->ratio_tolerance = NULL;
+    index->cosine_tolerance = NULL;
+    index->index = NULL;
+}
+
+static void
+triangle_index_free(
+        triangle_index_t* const index) {
+
+    size_t i;
+
+    for (i = 0; i < TRIANGLE_NTIERS; ++i) {
+        free(index->tiers[i].cells);
+    }
+    free(index->ratio);
+    free(index->cosine_v1);
+    free(index->ratio_tolerance);
+    free(index->cosine_tolerance);
+    free(index->index);
+    triangle_index_new(index);
+}
+
+static size_t
+triangle_tier_of(
+        const triangle_t* const tri,
+        const int min_exponent) {
+
+    const double tol = MAX(tri->ratio_tolerance, tri->cosine_tolerance);
+    int          exponent;
+
+    if (!isfinite64(tol)) {
+        return TRIANGLE_NTIERS - 1;
+    }
+    if (!(tol > 0.0)) {
+        return 0;
+    }
+    (void)frexp(tol, &exponent);
+
+    return MIN((size_t)((exponent - min_exponent) / TRIANGLE_TIER_SCALE),
+               TRIANGLE_NTIERS - 2);
+}
+
+/* Find the grid cell containing x in one direction, clamped to the
+   grid.  Everything is done in double first, since x may be out of
+   range, infinite or NaN. */
+static size_t
+triangle_cell_of(
+        const double x,
+        const double min,
+        const double size,
+        const size_t n) {
+
+    const double cell = floor((x - min) / size);
+
+    if (!(cell >= 0.0)) {
+        return 0;
+    }
+    if (cell >= (double)n) {
+        return n - 1;
+    }
+    return (size_t)cell;
+}
+
+/* Choose the cell size in one direction: about the width of the
+   search window for the tier, unless that would make too many cells */
+static void
+triangle_tier_axis(
+        const double min,
+        const double max,
+        const double max_tolerance,
+        const size_t max_cells,
+        double* const size,
+        size_t* const n) {
+
+    const double span = max - min;
+    double       cell = sqrt(max_tolerance);
+
+    if (!(span > 0.0)) {
+        *size = 1.0;
+        *n = 1;
+        return;
+    }
+
+    if (!(cell > 0.0) || !isfinite64(cell) ||
+        span / cell >= (double)max_cells) {
+        cell = span / (double)max_cells;
+    }
+
+    *size = cell;
+    *n = MIN((size_t)(span / cell) + 1, max_cells);
+}
+
+static int
+triangle_index_init(
+        triangle_index_t* const index,
+        const size_t ntriangles,
+        const triangle_t* const triangles,
+        stimage_error_t* const error) {
+
+    triangle_tier_t*  tier      = NULL;
+    const size_t      nalloc    = MAX(ntriangles, 1);
+    double            max_ratio[TRIANGLE_NTIERS];
+    double            max_cosine[TRIANGLE_NTIERS];
+    int               min_exponent = 0;
+    int               has_exponent = 0;
+    int               exponent;
+    double            tol;
+    size_t            max_cells, ncells;
+    size_t            i, j, k, t;
+
+    triangle_index_new(index);
+
+    /* Find the smallest tolerance, which is the start of the first
+       tier */
+    for (i = 0; i < ntriangles; ++i) {
+        tol = MAX(triangles[i].ratio_tolerance,
+                  triangles[i].cosine_tolerance);
+        if (tol > 0.0 && isfinite64(tol)) {
+            (void)frexp(tol, &exponent);
+            if (!has_exponent || exponent < min_exponent) {
+                min_exponent = exponent;
+                has_exponent = 1;
             }
         }
     }
 
-    *ntriangles = ntri;
+    /* Count the triangles in each tier, and find its extent */
+    for (t = 0; t < TRIANGLE_NTIERS; ++t) {
+        tier = &index->tiers[t];
+        tier->nentries = 0;
+        tier->max_ratio_tolerance = 0.0;
+        tier->max_cosine_tolerance = 0.0;
+    }
+
+    for (i = 0; i < ntriangles; ++i) {
+        tier = &index->tiers[triangle_tier_of(&triangles[i], min_exponent)];
+        if (tier->nentries == 0) {
+            tier->min_ratio = max_ratio[tier - index->tiers] =
+                triangles[i].ratio;
+            tier->min_cosine = max_cosine[tier - index->tiers] =
+                triangles[i].cosine_v1;
+        } else {
+            t = tier - index->tiers;
+            tier->min_ratio = MIN(tier->min_ratio, triangles[i].ratio);
+            tier->min_cosine = MIN(tier->min_cosine, triangles[i].cosine_v1);
+            max_ratio[t] = MAX(max_ratio[t], triangles[i].ratio);
+            max_cosine[t] = MAX(max_cosine[t], triangles[i].cosine_v1);
+        }
+        tier->max_ratio_tolerance = MAX(
+                tier->max_ratio_tolerance, triangles[i].ratio_tolerance);
+        tier->max_cosine_tolerance = MAX(
+                tier->max_cosine_tolerance, triangles[i].cosine_tolerance);
+        ++tier->nentries;
+    }
+
+    index->ratio = malloc_with_error(
+            nalloc * sizeof(triangle_real_t), error);
+    if (index->ratio == NULL) goto fail;
+
+    index->cosine_v1 = malloc_with_error(
+            nalloc * sizeof(triangle_real_t), error);
+    if (index->cosine_v1 == NULL) goto fail;
+
+    index->ratio_tolerance = malloc_with_error(
+            nalloc * sizeof(triangle_real_t), error);
+    if (index->ratio_tolerance == NULL) goto fail;
+
+    index->cosine_tolerance = malloc_with_error(
+            nalloc * sizeof(triangle_real_t), error);
+    if (index->cosine_tolerance == NULL) goto fail;
+
+    index->index = malloc_with_error(nalloc * sizeof(size_t), error);
+    if (index->index == NULL) goto fail;
+
+    /* Lay out the grid of each tier */
+    for (t = 0, k = 0; t < TRIANGLE_NTIERS; ++t) {
+        tier = &index->tiers[t];
+        tier->first = k;
+        k += tier->nentries;
+
+        if (tier->nentries == 0) {
+            continue;
+        }
+
+        /* Keep the number of cells in proportion to the number of
+           entries */
+        max_cells = (size_t)sqrt((double)tier->nentries) + 1;
+        triangle_tier_axis(
+                tier->min_ratio, max_ratio[t], tier->max_ratio_tolerance,
+                max_cells, &tier->ratio_size, &tier->nratio);
+        triangle_tier_axis(
+                tier->min_cosine, max_cosine[t], tier->max_cosine_tolerance,
+                max_cells, &tier->cosine_size, &tier->ncosine);
+
+        ncells = tier->nratio * tier->ncosine;
+        tier->cells = malloc_with_error(
+                (ncells + 1) * sizeof(size_t), error);
+        if (tier->cells == NULL) goto fail;
+
+        for (i = 0; i <= ncells; ++i) {
+            tier->cells[i] = 0;
+        }
+    }
+
+    /* Count the entries in each cell... */
+    for (i = 0; i < ntriangles; ++i) {
+        tier = &index->tiers[triangle_tier_of(&triangles[i], min_exponent)];
+        j = triangle_cell_of(
+                triangles[i].ratio, tier->min_ratio, tier->ratio_size,
+                tier->nratio) * tier->ncosine +
+            triangle_cell_of(
+                triangles[i].cosine_v1, tier->min_cosine, tier->cosine_size,
+                tier->ncosine);
+        ++tier->cells[j + 1];
+    }
 
-    /* Sort the triangles in increasing order of ratio */
-    qsort(triangles, ntri, sizeof(triangle_t), &triangle_ratio_compare);
+    /* ...turn the counts into offsets... */
+    for (t = 0; t < TRIANGLE_NTIERS; ++t) {
+        tier = &index->tiers[t];
+        if (tier->nentries == 0) {
+            continue;
+        }
+        ncells = tier->nratio * tier->ncosine;
+        for (i = 1; i <= ncells; ++i) {
+            tier->cells[i] += tier->cells[i - 1];
+        }
+    }
+
+    /* ...and fill them in, in order, so each cell stays sorted by
+       index.  cells[j] is used as the insertion point for cell j, and
+       ends up at the start of cell j + 1, so it is shifted back
+       afterward. */
+    for (i = 0; i < ntriangles; ++i) {
+        tier = &index->tiers[triangle_tier_of(&triangles[i], min_exponent)];
+        j = triangle_cell_of(
+                triangles[i].ratio, tier->min_ratio, tier->ratio_size,
+                tier->nratio) * tier->ncosine +
+            triangle_cell_of(
+                triangles[i].cosine_v1, tier->min_cosine, tier->cosine_size,
+                tier->ncosine);
+        k = tier->first + tier->cells[j]++;
+        index->ratio[k] = triangles[i].ratio;
+        index->cosine_v1[k] = triangles[i].cosine_v1;
+        index->ratio_tolerance[k] = triangles[i].ratio_tolerance;
+        index->cosine_tolerance[k] = triangles[i].cosine_tolerance;
+        index->index[k] = i;
+    }
+
+    for (t = 0; t < TRIANGLE_NTIERS; ++t) {
+        tier = &index->tiers[t];
+        if (tier->nentries == 0) {
+            continue;
+        }
+        ncells = tier->nratio * tier->ncosine;
+        for (i = ncells; i > 0; --i) {
+            tier->cells[i] = tier->cells[i - 1];
+        }
+        tier->cells[0] = 0;
+        assert(tier->cells[ncells] == tier->nentries);
+    }
 
     return 0;
+
+ fail:
+
+    triangle_index_free(index);
+    return 1;
 }
 
+/* The number of units of work merge_triangles does between charging
+   its budget */
+#define TRIANGLE_BUDGET_CHUNK 4096
+
 int
 merge_triangles(
         const size_t nr_triangles,
@@ -245,17 +1415,26 @@ merge_triangles(
         const triangle_t* const l_triangles,
         size_t* nmatches,
         triangle_match_t* const matches,
+        budget_t* const budget,
         stimage_error_t* const error) {
 
     size_t i;
     size_t match_iter = 0;
+    size_t work = 0;
     double rmaxtol, lmaxtol, maxtol;
-    size_t blp = 0, rp = 0, lp = 0;
+    size_t rp = 0;
     double dratio, dratio2, dcosine, dcosine2, dtratio, dtcosine;
+    double dmatch, max_dmatch;
+    size_t max_index;
     const triangle_t* max_tri = NULL;
-    const triangle_t* l_tri = NULL;
     const triangle_t* r_tri = NULL;
-    double max_dratio2, max_dcosine2;
+    const triangle_tier_t* tier = NULL;
+    size_t entry, entry_end;
+    triangle_index_t index;
+    double ratio_width, cosine_width;
+    size_t ratio0, ratio1, cosine0, cosine1, cell;
+    size_t t;
+    int status = 1;
 
     assert(nr_triangles);
     assert(r_triangles);
@@ -264,6 +1443,8 @@ merge_triangles(
     assert(matches);
     assert(error);
 
+    triangle_index_new(&index);
+
     /* Find the maximum tolerance for each list */
     rmaxtol = r_triangles[0].ratio_tolerance;
     for (i = 1; i < nr_triangles; ++i) {
@@ -277,72 +1458,106 @@ merge_triangles(
 
     maxtol = sqrt(rmaxtol + lmaxtol);
 
+    if (triangle_index_init(&index, nl_triangles, l_triangles, error)) {
+        goto exit;
+    }
+
     /* Loop over all the triangles in R */
     for (rp = 0; rp < nr_triangles; ++rp) {
         r_tri = r_triangles + rp;
 
-        /* Move to the first triangle in L that satisfies the ratio
-           tolerance requirement */
-        for ( ; blp < nl_triangles; ++blp) {
-            l_tri = l_triangles + blp;
-            dratio = r_tri->ratio - l_tri->ratio;
-            if (dratio <= maxtol) {
-                break;
+        /* The work is charged in chunks, to keep the locking out of
+           the inner loop */
+        ++work;
+        if (work >= TRIANGLE_BUDGET_CHUNK || rp == nr_triangles - 1) {
+            if (budget_charge(budget, work, "merging triangles", error)) {
+                goto exit;
             }
+            work = 0;
         }
 
-        /* If the beginning of the search range becomes greater than
-           the length of the list, then there are no more matches. */
-        if (blp >= nl_triangles) {
-            break;
-        }
-
-        /* If the first triangle in the list is past the tolerance
-           limit, skip to the next reference triangle. */
-        if (dratio < -maxtol) {
-            continue;
-        }
-
-        /* Search through the appropriate range of triangles for the
-           closest fit. */
-
-        /* Initialize the tolerances */
+        /* Search the triangles in L that could be within tolerance
+           for the closest fit.  This finds exactly the same matches
+           as a sort-merge over the lists sorted by ratio: the first
+           (in L) of the closest triangles within the ratio window of
+           maxtol. */
         max_tri = NULL;
-        max_dratio2 = 0.5 * MAX_DOUBLE;
-        max_dcosine2 = 0.5 * MAX_DOUBLE;
-
-        for (lp = blp; lp < nl_triangles; ++lp) {
-            l_tri = l_triangles + lp;
+        max_index = nl_triangles;
+        max_dmatch = MAX_DOUBLE;
 
-            /* Quit the loop if the next triangle is out of match range. */
-            dratio = r_tri->ratio - l_tri->ratio;
-            if (dratio < -maxtol) {
-                break;
+        for (t = 0; t < TRIANGLE_NTIERS; ++t) {
+            tier = &index.tiers[t];
+            if (tier->nentries == 0) {
+                continue;
             }
 
-            /* Compute the tolerances for the two triangles */
-            dratio2 = dratio*dratio;
-            dcosine = r_tri->cosine_v1 - l_tri->cosine_v1;
-            dcosine2 = dcosine*dcosine;
-            dtratio = r_tri->ratio_tolerance + l_tri->ratio_tolerance;
-            dtcosine = r_tri->cosine_tolerance + l_tri->cosine_tolerance;
-
-            /* Find the best of all possible matches */
-            if (dratio2 <= dtratio && dcosine2 <= dtcosine &&
-                (dratio2 + dcosine2) < (max_dratio2 + max_dcosine2)) {
-                max_tri = l_tri;
-                max_dratio2 = dratio2;
-                max_dcosine2 = dcosine2;
+            /* The window is slightly enlarged, so that rounding can
+               not leave out a triangle right at its edge */
+            ratio_width = sqrt(r_tri->ratio_tolerance +
+                               tier->max_ratio_tolerance) * (1.0 + 1e-9);
+            cosine_width = sqrt(r_tri->cosine_tolerance +
+                                tier->max_cosine_tolerance) * (1.0 + 1e-9);
+            ratio_width = MIN(ratio_width, maxtol * (1.0 + 1e-9));
+
+            ratio0 = triangle_cell_of(
+                    r_tri->ratio - ratio_width, tier->min_ratio,
+                    tier->ratio_size, tier->nratio);
+            ratio1 = triangle_cell_of(
+                    r_tri->ratio + ratio_width, tier->min_ratio,
+                    tier->ratio_size, tier->nratio);
+            cosine0 = triangle_cell_of(
+                    r_tri->cosine_v1 - cosine_width, tier->min_cosine,
+                    tier->cosine_size, tier->ncosine);
+            cosine1 = triangle_cell_of(
+                    r_tri->cosine_v1 + cosine_width, tier->min_cosine,
+                    tier->cosine_size, tier->ncosine);
+
+            for (i = ratio0; i <= ratio1; ++i) {
+                /* The cells of a row within the window are contiguous */
+                cell = i * tier->ncosine;
+                entry = tier->first + tier->cells[cell + cosine0];
+                entry_end = tier->first + tier->cells[cell + cosine1 + 1];
+                work += entry_end - entry;
+
+                for ( ; entry < entry_end; ++entry) {
+                    dratio = r_tri->ratio - index.ratio[entry];
+                    if (dratio > maxtol || dratio < -maxtol) {
+                        continue;
+                    }
+
+                    /* Compute the tolerances for the two triangles */
+                    dratio2 = dratio*dratio;
+                    dcosine = r_tri->cosine_v1 - index.cosine_v1[entry];
+                    dcosine2 = dcosine*dcosine;
+                    dtratio = r_tri->ratio_tolerance +
+                        index.ratio_tolerance[entry];
+                    dtcosine = r_tri->cosine_tolerance +
+                        index.cosine_tolerance[entry];
+
+                    /* Find the best of all possible matches */
+                    if (dratio2 <= dtratio && dcosine2 <= dtcosine) {
+                        dmatch = dratio2 + dcosine2;
+                        if (dmatch < max_dmatch ||
+                            (dmatch == max_dmatch &&
+                             max_index < nl_triangles &&
+                             index.index[entry] < max_index)) {
+                            max_index = index.index[entry];
+                            max_dmatch = dmatch;
+                        }
+                    }
+                }
             }
         }
 
-        if (max_tri != NULL) {
+        if (max_index < nl_triangles) {
+            max_tri = l_triangles + max_index;
+
             #ifndef NDEBUG
                 if (match_iter >= *nmatches) {
                     stimage_error_set_message(
                         error,
                         "Found more triangle matches than were allocated for");
-                    return 1;
+                    goto exit;
                 }
             #endif /* NDEBUG */
 
@@ -354,7 +1569,12 @@ merge_triangles(
 
     *nmatches = match_iter;
 
-    return 0;
+    status = 0;
+
+ exit:
+
+    triangle_index_free(&index);
+    return status;
 }
 
 static int
@@ -409,6 +1629,7 @@ reject_triangles(
         size_t* nmatches,
         triangle_match_t* const matches,
         const size_t nreject,
+        budget_t* const budget,
         stimage_error_t* error) {
 
     size_t            i            = 0;
@@ -466,6 +1687,11 @@ reject_triangles(
 
     /* Begin the rejection loop */
     for (niter = 0; niter < nreject; ++niter) {
+        if (budget_charge(budget, ncurrmatches, "rejecting triangles",
+                          error)) {
+            goto exit;
+        }
+
         ncount = 0;
         locut = mode - factor * sigma;
         hicut = mode + factor * sigma;
@@ -559,37 +1785,113 @@ reject_triangles(
     return status;
 }
 
+int
+find_list_triangles(
+        const size_t ncoords,
+        const coord_t* const * const coords,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        budget_t* const budget,
+        size_t* ntriangles,
+        triangle_t** triangles,
+        stimage_error_t* const error) {
+
+    assert(ntriangles);
+    assert(triangles);
+    assert(*triangles == NULL);
+
+    if (nneighbors) {
+        return find_triangles_local(
+                ncoords, coords, nneighbors, ntriangles, triangles,
+                tolerance, maxratio, nthreads, budget, error);
+    }
+
+    return find_triangles(
+            ncoords, coords, ntriangles, triangles,
+            nmatch, tolerance, maxratio, nthreads, budget, error);
+}
+
+typedef struct {
+    size_t                 ncoords;
+    const coord_t* const * coords;
+    size_t                 ntriangles;
+    triangle_t*            triangles;
+} triangle_list_t;
+
+typedef struct {
+    triangle_list_t lists[2];
+    size_t          nmatch;
+    size_t          nneighbors;
+    double          tolerance;
+    double          maxratio;
+    size_t          nthreads;
+    budget_t*       budget;
+} find_lists_state_t;
+
+static int
+find_lists_func(
+        void* data,
+        size_t i,
+        stimage_error_t* const error) {
+
+    find_lists_state_t* state = (find_lists_state_t*)data;
+    triangle_list_t* list = &state->lists[i];
+
+    return find_list_triangles(
+            list->ncoords, list->coords, state->nmatch, state->nneighbors,
+            state->tolerance, state->maxratio, state->nthreads,
+            state->budget, &list->ntriangles, &list->triangles, error);
+}
+
 static int
 _match_triangles(
+        const size_t nref_all,
         const size_t nref,
-        const coord_t* const ref,
+        const coord_t* const ref, /*[nref_all]*/
         const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t nref_cached,
+        const triangle_t* const ref_cached, /*[nref_cached]*/
+        const size_t ninput_all,
         const size_t ninput,
-        const coord_t* const input, /*[ninput]*/
-        const coord_t* const * const input_sorted,
+        const coord_t* const input, /*[ninput_all]*/
+        const coord_t* const * const input_sorted, /*[ninput]*/
         size_t* ncoord_matches,
         const coord_t** refcoord_matches_,
         const coord_t** inputcoord_matches_,
         const size_t nmatch,
+        const size_t nneighbors,
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const triangle_consensus_e consensus,
+        const size_t nthreads,
+        budget_t* const budget,
         size_t* nkeep,
         size_t* nmerge,
         stimage_error_t* const error) {
 
+    const size_t      nthreads_          =
+        nthreads == 0 ? threads_ncpu() : nthreads;
     const coord_t**   refcoord_matches   = NULL;
     const coord_t**   inputcoord_matches = NULL;
     size_t            nleft              = 0;
     const coord_t*    left               = NULL;
+    size_t            nleft_coords       = 0;
+    const coord_t* const * left_coords   = NULL;
     size_t            nright             = 0;
     const coord_t*    right              = NULL;
+    size_t            nright_coords      = 0;
+    const coord_t* const * right_coords  = NULL;
     size_t            nref_triangles     = 0;
-    triangle_t*       ref_triangles      = NULL;
+    const triangle_t* ref_triangles      = NULL;
     size_t            ninput_triangles   = 0;
     triangle_t*       input_triangles    = NULL;
     size_t            ntriangle_matches  = 0;
     triangle_match_t* triangle_matches   = NULL;
+    find_lists_state_t lists;
     int               status             = 1;
 
     assert(ref);
@@ -603,6 +1905,21 @@ _match_triangles(
     assert(nmerge);
     assert(error);
 
+    lists.lists[0].ncoords = nref;
+    lists.lists[0].coords = ref_sorted;
+    lists.lists[0].ntriangles = 0;
+    lists.lists[0].triangles = NULL;
+    lists.lists[1].ncoords = ninput;
+    lists.lists[1].coords = input_sorted;
+    lists.lists[1].ntriangles = 0;
+    lists.lists[1].triangles = NULL;
+    lists.nmatch = nmatch;
+    lists.nneighbors = nneighbors;
+    lists.tolerance = tolerance;
+    lists.maxratio = maxratio;
+    lists.nthreads = MAX(1, nthreads_ / 2);
+    lists.budget = budget;
+
     if (nref < 3) {
         stimage_error_set_message(
             error,
@@ -617,15 +1934,27 @@ _match_triangles(
         goto exit;
     }
 
-    /* Find all the reference triangles */
-    if (max_num_triangles(nref, nmatch, &nref_triangles, error)) goto exit;
-
-    ref_triangles = malloc_with_error(
-            nref_triangles * sizeof(triangle_t), error);
-    if (ref_triangles == NULL) goto exit;
+    /* Find the reference and input triangles.  With more than one
+       thread, the two lists are found at the same time, each with
+       half of the threads.  If the reference triangles were found
+       ahead of time, all of the threads go to the input triangles. */
+    if (ref_cached != NULL) {
+        lists.nthreads = nthreads_;
+        if (find_lists_func(&lists, 1, error)) {
+            goto exit;
+        }
+        nref_triangles = nref_cached;
+        ref_triangles = ref_cached;
+    } else {
+        if (parallel_for(2, nthreads_, find_lists_func, &lists, error)) {
+            goto exit;
+        }
+        nref_triangles = lists.lists[0].ntriangles;
+        ref_triangles = lists.lists[0].triangles;
+    }
 
-    if (find_triangles(nref, ref_sorted, &nref_triangles, ref_triangles,
-                       nmatch, tolerance, maxratio, error)) goto exit;
+    ninput_triangles = lists.lists[1].ntriangles;
+    input_triangles = lists.lists[1].triangles;
 
     if (nref_triangles == 0) {
         stimage_error_set_message(
@@ -634,17 +1963,6 @@ _match_triangles(
         goto exit;
     }
 
-    /* Find all the input triangles */
-    if (max_num_triangles(ninput, nmatch, &ninput_triangles, error)) goto exit;
-
-    input_triangles = malloc_with_error(
-            ninput_triangles * sizeof(triangle_t), error);
-    if (input_triangles == NULL) goto exit;
-
-    if (find_triangles(ninput, input_sorted, &ninput_triangles,
-                       input_triangles, nmatch, tolerance, maxratio,
-                       error)) goto exit;
-
     if (ninput_triangles == 0) {
         stimage_error_set_message(
             error,
@@ -662,27 +1980,35 @@ _match_triangles(
     if (nref_triangles <= ninput_triangles) {
         refcoord_matches = inputcoord_matches_;
         inputcoord_matches = refcoord_matches_;
-        nleft = ninput;
+        nleft = ninput_all;
         left = input;
-        nright = nref;
+        nleft_coords = ninput;
+        left_coords = input_sorted;
+        nright = nref_all;
         right = ref;
+        nright_coords = nref;
+        right_coords = ref_sorted;
         if (merge_triangles(
                 nref_triangles, ref_triangles,
                 ninput_triangles, input_triangles,
                 &ntriangle_matches, triangle_matches,
-                error)) goto exit;
+                budget, error)) goto exit;
     } else {
         refcoord_matches = refcoord_matches_;
         inputcoord_matches = inputcoord_matches_;
-        nleft = nref;
+        nleft = nref_all;
         left = ref;
-        nright = ninput;
+        nleft_coords = nref;
+        left_coords = ref_sorted;
+        nright = ninput_all;
         right = input;
+        nright_coords = ninput;
+        right_coords = input_sorted;
         if (merge_triangles(
                 ninput_triangles, input_triangles,
                 nref_triangles, ref_triangles,
                 &ntriangle_matches, triangle_matches,
-                error)) goto exit;
+                budget, error)) goto exit;
     }
 
     *nmerge = ntriangle_matches;
@@ -692,9 +2018,21 @@ _match_triangles(
         goto exit;
     }
 
+    if (consensus == triangle_consensus_ransac) {
+        if (ransac_triangle_matches(
+                    nleft_coords, left_coords, nright_coords, right_coords,
+                    ntriangle_matches, triangle_matches, tolerance,
+                    ncoord_matches, refcoord_matches, inputcoord_matches,
+                    nkeep, budget, error)) {
+            goto exit;
+        }
+        status = 0;
+        goto exit;
+    }
+
     /* Reject triangles */
     if (reject_triangles(&ntriangle_matches, triangle_matches,
-                         nreject,
+                         nreject, budget,
                          error)) {
         goto exit;
     }
@@ -709,10 +2047,10 @@ _match_triangles(
 
     /* Match the coordinates */
     if (vote_triangle_matches(
-                nleft, left, nright, right,
+                nleft, left, left_coords, nright, right, right_coords,
                 ntriangle_matches, triangle_matches,
                 ncoord_matches, refcoord_matches, inputcoord_matches,
-                error)) {
+                nneighbors != 0, error)) {
         goto exit;
     }
 
@@ -720,8 +2058,8 @@ _match_triangles(
 
  exit:
 
-    free(ref_triangles);
-    free(input_triangles);
+    free(lists.lists[0].triangles);
+    free(lists.lists[1].triangles);
     free(triangle_matches);
     return status;
 }
@@ -732,19 +2070,30 @@ match_triangles(
         const size_t nref_unique,
         const coord_t* const ref,
         const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles, /*[nref_triangles]*/
         const size_t ninput,
         const size_t ninput_unique,
         const coord_t* const input, /*[ninput]*/
         const coord_t* const * const input_sorted,
         const size_t nmatch,
+        const size_t nneighbors,
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const triangle_consensus_e consensus,
+        const size_t nthreads,
+        budget_t* const budget,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error) {
 
-    size_t          ncoord_matches     = nmatch;
+    /* In local mode, every unique coordinate takes part, and the
+       consensus may match any of them, not just those in triangles */
+    const size_t    maxmatch           =
+        (nneighbors || consensus == triangle_consensus_ransac) ?
+        MAX(1, MAX(nref_unique, ninput_unique)) : nmatch;
+    size_t          ncoord_matches     = maxmatch;
     const coord_t** refcoord_matches   = NULL;
     const coord_t** inputcoord_matches = NULL;
     size_t          nkeep              = 0;
@@ -763,14 +2112,23 @@ match_triangles(
             ncoord_matches * sizeof(coord_t*), error);
     if (inputcoord_matches == NULL) goto exit;
 
+    /* The votes are indexed by position in the full coordinate
+       arrays, not in the culled, sorted lists */
     if (_match_triangles(
-        nref_unique, ref, ref_sorted,
-        ninput_unique, input, input_sorted,
+        nref, nref_unique, ref, ref_sorted, nref_triangles, ref_triangles,
+        ninput, ninput_unique, input, input_sorted,
         &ncoord_matches, refcoord_matches, inputcoord_matches,
-        nmatch, tolerance, maxratio, nreject,
-        &nkeep, &nmerge,
+        nmatch, nneighbors, tolerance, maxratio, nreject, consensus, nthreads,
+        budget, &nkeep, &nmerge,
         error)) goto exit;
 
+    /* The consensus has already checked the matches against a single
+       transformation, so another pass would not tell us anything */
+    if (consensus == triangle_consensus_ransac) {
+        status = 0;
+        goto exit;
+    }
+
     if (ncoord_matches == 0 || (ncoord_matches <= 3 && nkeep < nmerge)) {
         status = 0;
         goto exit;
@@ -780,14 +2138,14 @@ match_triangles(
        through the triangles matching algorithm. If the number of
        matches decreases as a result of this then all the matches were
        not true matches and declare the list unmatched. */
-    if (ncoord_matches < nmatch && ncoord_matches > 2) {
+    if (ncoord_matches < maxmatch && ncoord_matches > 2) {
         ncheck = ncoord_matches;
         if (_match_triangles(
-                ncoord_matches, ref, refcoord_matches,
-                ncoord_matches, input, inputcoord_matches,
+                nref, ncoord_matches, ref, refcoord_matches, 0, NULL,
+                ninput, ncoord_matches, input, inputcoord_matches,
                 &ncoord_matches, refcoord_matches, inputcoord_matches,
-                nmatch, tolerance, maxratio, nreject,
-                &nkeep, &nmerge, error)) goto exit;
+                nmatch, nneighbors, tolerance, maxratio, nreject, consensus,
+                nthreads, budget, &nkeep, &nmerge, error)) goto exit;
 
         if (ncoord_matches < ncheck) {
             ncoord_matches = 0;
@@ -0,0 +1,504 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#include <assert.h>
+#include <math.h>
+
+#include "immatch/lib/triangles.h"
+#include "lib/xygrid.h"
+
+/* The probability with which the consensus stage must have drawn at
+   least one sample of true matches before it stops early */
+#define RANSAC_CONFIDENCE 0.999
+
+/* The most samples that are ever drawn */
+#define RANSAC_MAX_ITERATIONS 2000
+
+/* A similarity transformation: a rotation, uniform scale and shift,
+   with an optional flip of the y axis before it */
+typedef struct {
+    double a;
+    double b;
+    double c;
+    double f;
+    int    flip;
+} similarity_t;
+
+static void
+similarity_apply(
+        const similarity_t* const s,
+        const coord_t* const in,
+        coord_t* const out) {
+
+    const double x = in->x;
+    const double y = s->flip ? -in->y : in->y;
+
+    out->x = s->a * x - s->b * y + s->c;
+    out->y = s->b * x + s->a * y + s->f;
+}
+
+/* Fit a similarity transformation from the l coordinates to the r
+   coordinates in the least-squares sense.  Returns non-zero if the l
+   coordinates are all in the same place. */
+static int
+similarity_fit(
+        const size_t n,
+        const coord_t* const * const l,
+        const coord_t* const * const r,
+        const int flip,
+        similarity_t* const s) {
+
+    double lx = 0.0, ly = 0.0, rx = 0.0, ry = 0.0;
+    double sxx = 0.0, sa = 0.0, sb = 0.0;
+    double px, py, qx, qy;
+    size_t i;
+
+    assert(n > 0);
+
+    for (i = 0; i < n; ++i) {
+        lx += l[i]->x;
+        ly += flip ? -l[i]->y : l[i]->y;
+        rx += r[i]->x;
+        ry += r[i]->y;
+    }
+    lx /= (double)n;
+    ly /= (double)n;
+    rx /= (double)n;
+    ry /= (double)n;
+
+    for (i = 0; i < n; ++i) {
+        px = l[i]->x - lx;
+        py = (flip ? -l[i]->y : l[i]->y) - ly;
+        qx = r[i]->x - rx;
+        qy = r[i]->y - ry;
+        sxx += px*px + py*py;
+        sa += px*qx + py*qy;
+        sb += px*qy - py*qx;
+    }
+
+    if (!(sxx > 0.0)) {
+        return 1;
+    }
+
+    s->a = sa / sxx;
+    s->b = sb / sxx;
+    s->c = rx - (s->a * lx - s->b * ly);
+    s->f = ry - (s->b * lx + s->a * ly);
+    s->flip = flip;
+
+    return 0;
+}
+
+/* Find the closest coordinate in the grid within tolerance of c.
+   Returns non-zero if there is one, with its index in *index and its
+   squared distance in *r2. */
+static int
+ransac_nearest(
+        const xygrid_t* const grid,
+        const coord_t* const c,
+        const double tolerance,
+        size_t* const index,
+        double* const r2) {
+
+    const double          tolerance2 = tolerance*tolerance;
+    xygrid_cell_t         center;
+    xygrid_cell_t         row;
+    const xygrid_entry_t* entry;
+    size_t                start[2];
+    size_t                end[2];
+    size_t                nranges;
+    size_t                k, r;
+    int                   j;
+    int                   found      = 0;
+    double                dx, dy, d2;
+
+    if (!coord_is_finite(c)) {
+        return 0;
+    }
+
+    xygrid_cell(grid, c, &center);
+    *r2 = tolerance2;
+    for (j = -1; j <= 1; ++j) {
+        row.x = center.x;
+        row.y = center.y + j;
+        nranges = xygrid_row(grid, &row, start, end);
+        for (r = 0; r < nranges; ++r) {
+            for (k = start[r]; k < end[r]; ++k) {
+                entry = &grid->entries[k];
+                dx = c->x - entry->coord.x;
+                dy = c->y - entry->coord.y;
+                d2 = dx*dx + dy*dy;
+                if (d2 < *r2 ||
+                    (d2 == *r2 && (!found || entry->index < *index))) {
+                    *r2 = d2;
+                    *index = entry->index;
+                    found = 1;
+                }
+            }
+        }
+    }
+
+    return found;
+}
+
+/* The number of triangle matches whose vertices are all carried to
+   within tolerance of each other by s */
+static size_t
+ransac_count_triangles(
+        const coord_t* const * const left_coords,
+        const coord_t* const * const right_coords,
+        const size_t ntriangle_matches,
+        const triangle_match_t* const triangle_matches,
+        const similarity_t* const s,
+        const double tolerance) {
+
+    const double      tolerance2 = tolerance*tolerance;
+    const triangle_t* l_tri;
+    const triangle_t* r_tri;
+    coord_t           c;
+    size_t            count      = 0;
+    size_t            i, j;
+    double            dx, dy;
+
+    for (i = 0; i < ntriangle_matches; ++i) {
+        l_tri = triangle_matches[i].l;
+        r_tri = triangle_matches[i].r;
+        for (j = 0; j < 3; ++j) {
+            similarity_apply(s, left_coords[l_tri->vertices[j]], &c);
+            dx = c.x - right_coords[r_tri->vertices[j]]->x;
+            dy = c.y - right_coords[r_tri->vertices[j]]->y;
+            if (!(dx*dx + dy*dy <= tolerance2)) {
+                break;
+            }
+        }
+        if (j == 3) {
+            ++count;
+        }
+    }
+
+    return count;
+}
+
+/* Pair each right coordinate with the closest left coordinate that s
+   carries to within tolerance of it, and that is not closer to any
+   other right coordinate.  Returns the number of pairs, which are
+   stored in order of right coordinate. */
+static size_t
+ransac_pairs(
+        const xygrid_t* const grid,
+        const size_t nleft_coords,
+        const coord_t* const * const left_coords,
+        const size_t nright_coords,
+        const similarity_t* const s,
+        const double tolerance,
+        size_t* const best_left, /* [nright_coords] */
+        double* const best_r2, /* [nright_coords] */
+        size_t* const pair_left, /* [nright_coords] */
+        size_t* const pair_right /* [nright_coords] */) {
+
+    coord_t c;
+    size_t  i, ri;
+    size_t  npairs = 0;
+    double  r2;
+
+    for (i = 0; i < nright_coords; ++i) {
+        best_left[i] = nleft_coords;
+    }
+
+    for (i = 0; i < nleft_coords; ++i) {
+        similarity_apply(s, left_coords[i], &c);
+        if (ransac_nearest(grid, &c, tolerance, &ri, &r2) &&
+            (best_left[ri] == nleft_coords || r2 < best_r2[ri])) {
+            best_left[ri] = i;
+            best_r2[ri] = r2;
+        }
+    }
+
+    for (i = 0; i < nright_coords; ++i) {
+        if (best_left[i] != nleft_coords) {
+            pair_left[npairs] = best_left[i];
+            pair_right[npairs] = i;
+            ++npairs;
+        }
+    }
+
+    return npairs;
+}
+
+int
+ransac_triangle_matches(
+        const size_t nleft_coords,
+        const coord_t* const * const left_coords,
+        const size_t nright_coords,
+        const coord_t* const * const right_coords,
+        const size_t ntriangle_matches,
+        const triangle_match_t* const triangle_matches,
+        const double tolerance,
+        size_t* ncoord_matches,
+        const coord_t** const refcoord_matches,
+        const coord_t** const inputcoord_matches,
+        size_t* nconsensus,
+        budget_t* const budget,
+        stimage_error_t* const error) {
+
+    xygrid_t          grid;
+    similarity_t      s, best;
+    STIMAGE_UInt32    seed        = 2463534242u;
+    size_t*           order       = NULL;
+    size_t*           candidates  = NULL;
+    char*             seen        = NULL;
+    size_t*           best_left   = NULL;
+    double*           best_r2     = NULL;
+    size_t*           pair_left   = NULL;
+    size_t*           pair_right  = NULL;
+    const coord_t*    l[3];
+    const coord_t*    r[3];
+    const coord_t**   l_pairs     = NULL;
+    const coord_t**   r_pairs     = NULL;
+    const triangle_t* l_tri;
+    const triangle_t* r_tri;
+    size_t            ncandidates = 0;
+    size_t            niter       = 0;
+    size_t            maxiter     = 0;
+    size_t            score       = 0;
+    size_t            best_score  = 0;
+    size_t            nbest       = 0;
+    size_t            npairs      = 0;
+    size_t            i, j, tmp, index;
+    coord_t           c;
+    double            r2, w, needed;
+    int               status      = 1;
+
+    assert(left_coords);
+    assert(right_coords);
+    assert(triangle_matches || ntriangle_matches == 0);
+    assert(ncoord_matches);
+    assert(refcoord_matches);
+    assert(inputcoord_matches);
+    assert(nconsensus);
+    assert(error);
+
+    xygrid_new(&grid);
+    *nconsensus = 0;
+
+    if (ntriangle_matches == 0 || nleft_coords == 0 || nright_coords == 0) {
+        *ncoord_matches = 0;
+        return 0;
+    }
+
+    /* The right coordinates are found from the transformed left
+       coordinates with a grid, so scoring a hypothesis costs about
+       one lookup per left coordinate */
+    if (xygrid_init(&grid, nright_coords, right_coords, tolerance, error)) {
+        goto exit;
+    }
+
+    order = malloc_with_error(ntriangle_matches * sizeof(size_t), error);
+    if (order == NULL) goto exit;
+
+    candidates = malloc_with_error(nleft_coords * sizeof(size_t), error);
+    if (candidates == NULL) goto exit;
+
+    seen = malloc_with_error(nleft_coords * sizeof(char), error);
+    if (seen == NULL) goto exit;
+
+    best_left = malloc_with_error(nright_coords * sizeof(size_t), error);
+    if (best_left == NULL) goto exit;
+
+    best_r2 = malloc_with_error(nright_coords * sizeof(double), error);
+    if (best_r2 == NULL) goto exit;
+
+    pair_left = malloc_with_error(nright_coords * sizeof(size_t), error);
+    if (pair_left == NULL) goto exit;
+
+    pair_right = malloc_with_error(nright_coords * sizeof(size_t), error);
+    if (pair_right == NULL) goto exit;
+
+    l_pairs = malloc_with_error(nright_coords * sizeof(coord_t*), error);
+    if (l_pairs == NULL) goto exit;
+
+    r_pairs = malloc_with_error(nright_coords * sizeof(coord_t*), error);
+    if (r_pairs == NULL) goto exit;
+
+    /* Hypotheses are scored on the left coordinates that are in some
+       matched triangle, since the others can not have been sampled */
+    for (i = 0; i < nleft_coords; ++i) {
+        seen[i] = 0;
+    }
+    for (i = 0; i < ntriangle_matches; ++i) {
+        for (j = 0; j < 3; ++j) {
+            index = triangle_matches[i].l->vertices[j];
+            assert(index < nleft_coords);
+            if (!seen[index]) {
+                seen[index] = 1;
+                candidates[ncandidates++] = index;
+            }
+        }
+    }
+
+    /* Each sample is a single matched triangle, whose three pairs of
+       vertices determine a similarity transformation.  The triangle
+       matches are drawn in a shuffled order, without replacement, so
+       the result does not depend on the order of the matches and is
+       the same from run to run. */
+    for (i = 0; i < ntriangle_matches; ++i) {
+        order[i] = i;
+    }
+    for (i = ntriangle_matches - 1; i > 0; --i) {
+        seed ^= seed << 13;
+        seed ^= seed >> 17;
+        seed ^= seed << 5;
+        j = (size_t)(seed % (STIMAGE_UInt32)(i + 1));
+        tmp = order[i];
+        order[i] = order[j];
+        order[j] = tmp;
+    }
+
+    maxiter = MIN(ntriangle_matches, RANSAC_MAX_ITERATIONS);
+    for (niter = 0; niter < maxiter; ++niter) {
+        l_tri = triangle_matches[order[niter]].l;
+        r_tri = triangle_matches[order[niter]].r;
+        for (j = 0; j < 3; ++j) {
+            l[j] = left_coords[l_tri->vertices[j]];
+            r[j] = right_coords[r_tri->vertices[j]];
+        }
+
+        /* Triangles of opposite sense are related by a flip */
+        if (similarity_fit(3, l, r, l_tri->sense != r_tri->sense, &s)) {
+            continue;
+        }
+
+        if (budget_charge(budget, ncandidates, "scoring triangle matches",
+                          error)) {
+            goto exit;
+        }
+
+        score = 0;
+        for (i = 0; i < ncandidates; ++i) {
+            similarity_apply(&s, left_coords[candidates[i]], &c);
+            if (ransac_nearest(&grid, &c, tolerance, &index, &r2)) {
+                ++score;
+            }
+        }
+
+        if (score <= best_score) {
+            continue;
+        }
+
+        best_score = score;
+        best = s;
+
+        /* Update the number of samples needed to have drawn a good
+           one with the target confidence, from the fraction of the
+           triangle matches that agree with the best hypothesis */
+        nbest = ransac_count_triangles(
+                left_coords, right_coords,
+                ntriangle_matches, triangle_matches, &best, tolerance);
+        w = (double)nbest / (double)ntriangle_matches;
+        if (w >= 1.0) {
+            maxiter = niter + 1;
+        } else if (w > 0.0) {
+            needed = ceil(log(1.0 - RANSAC_CONFIDENCE) / log(1.0 - w));
+            if (needed < (double)maxiter) {
+                maxiter = MAX((size_t)needed, niter + 1);
+            }
+        }
+    }
+
+    if (best_score < 3) {
+        *ncoord_matches = 0;
+        status = 0;
+        goto exit;
+    }
+
+    /* Refit the best hypothesis to all of the coordinates it pairs
+       up, and pair them up again with the refined transformation */
+    npairs = ransac_pairs(
+            &grid, nleft_coords, left_coords, nright_coords, &best,
+            tolerance, best_left, best_r2, pair_left, pair_right);
+    if (npairs >= 3) {
+        for (i = 0; i < npairs; ++i) {
+            l_pairs[i] = left_coords[pair_left[i]];
+            r_pairs[i] = right_coords[pair_right[i]];
+        }
+        if (similarity_fit(npairs, l_pairs, r_pairs, best.flip, &s) == 0) {
+            best = s;
+            npairs = ransac_pairs(
+                    &grid, nleft_coords, left_coords, nright_coords, &best,
+                    tolerance, best_left, best_r2, pair_left, pair_right);
+        }
+    }
+
+    *nconsensus = ransac_count_triangles(
+            left_coords, right_coords,
+            ntriangle_matches, triangle_matches, &best, tolerance);
+
+    if (npairs < 3) {
+        *ncoord_matches = 0;
+        status = 0;
+        goto exit;
+    }
+
+    if (npairs > *ncoord_matches) {
+        stimage_error_format_message(
+            error,
+            "Found more coordinate matches than was allocated for\n");
+        goto exit;
+    }
+
+    for (i = 0; i < npairs; ++i) {
+        refcoord_matches[i] = left_coords[pair_left[i]];
+        inputcoord_matches[i] = right_coords[pair_right[i]];
+    }
+    *ncoord_matches = npairs;
+
+    status = 0;
+
+ exit:
+
+    xygrid_free(&grid);
+    free(order);
+    free(candidates);
+    free(seen);
+    free(best_left);
+    free(best_r2);
+    free(pair_left);
+    free(pair_right);
+    free(l_pairs);
+    free(r_pairs);
+
+    return status;
+}
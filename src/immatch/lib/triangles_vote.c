@@ -39,79 +39,134 @@ DAMAGE.
 
 #include "immatch/lib/triangles.h"
 
+/* One vote for matching the left coordinate li to the right
+   coordinate ri, or after counting, all of the votes for that pair */
+typedef struct {
+    size_t ri;
+    size_t li;
+    size_t votes;
+} vote_pair_t;
+
+/* Used as a qsort functor, to sort the votes by (ri, li) */
+static int
+vote_pair_compare(
+        const void* ap,
+        const void* bp) {
+
+    const vote_pair_t* a = (const vote_pair_t*)ap;
+    const vote_pair_t* b = (const vote_pair_t*)bp;
+
+    if (a->ri < b->ri) {
+        return -1;
+    } else if (a->ri > b->ri) {
+        return 1;
+    } else if (a->li < b->li) {
+        return -1;
+    } else if (a->li > b->li) {
+        return 1;
+    }
+    return 0;
+}
+
 int
 vote_triangle_matches(
         const size_t nleft,
         const coord_t* const left,
+        const coord_t* const * const left_coords,
         const size_t nright,
         const coord_t* const right,
+        const coord_t* const * const right_coords,
         const size_t ntriangle_matches,
         const triangle_match_t* const triangle_matches,
         size_t* ncoord_matches,
         const coord_t** const refcoord_matches,
         const coord_t** const inputcoord_matches,
+        const int majority,
         stimage_error_t* const error) {
 
     typedef size_t vote_t;
 
-    vote_t*           votes        = NULL;
+    vote_pair_t*      pairs        = NULL;
+    size_t            npairs       = 0;
+    char*             used         = NULL;
     vote_t            maxvote      = 0;
     vote_t            half_maxvote = 0;
     vote_t            row_maxvote  = 0;
     vote_t            row_2maxvote = 0;
     vote_t            vote         = 0;
+    vote_t            row_total    = 0;
     const triangle_t* r_tri        = NULL;
     const triangle_t* l_tri        = NULL;
     const coord_t*    r_coord      = NULL;
     const coord_t*    l_coord      = NULL;
     size_t            li           = 0;
     size_t            ri           = 0;
-    size_t            ri2          = 0;
     size_t            ncount       = 0;
     size_t            i            = 0;
     size_t            j            = 0;
     int               status       = 1;
 
+    assert(left_coords);
+    assert(right_coords);
     assert(triangle_matches);
     assert(ncoord_matches);
     assert(refcoord_matches);
     assert(inputcoord_matches);
     assert(error);
 
-    /* Since the vote tallies are rather sparse, this uses a nested
-       map from reference coordinates to a map from input coordinates
-       to vote counts. */
+    /* Since the vote tallies are rather sparse, each vote is stored
+       as a (ri, li) pair.  Sorting the pairs brings together the
+       votes for the same pair, and then the pairs for the same right
+       coordinate, in order of left coordinate, so the memory used
+       depends only on the number of triangle matches. */
 
-    #define VOTE(li, ri) votes[(ri) * nleft + (li)]
+    pairs = malloc_with_error(
+            MAX(3 * ntriangle_matches, 1) * sizeof(vote_pair_t), error);
+    if (pairs == NULL) goto exit;
 
-    votes = malloc(nleft * nright * sizeof(size_t));
-    if (votes == NULL) {
-        goto exit;
-    }
+    used = malloc_with_error(MAX(nleft, 1) * sizeof(char), error);
+    if (used == NULL) goto exit;
 
-    for (i = 0; i < nleft * nright; ++i) {
-        votes[i] = 0;
+    for (i = 0; i < nleft; ++i) {
+        used[i] = 0;
     }
 
-    /* Accumulate the votes */
+    /* Collect the votes */
     for (i = 0; i < ntriangle_matches; ++i) {
         r_tri = triangle_matches[i].r;
         l_tri = triangle_matches[i].l;
 
         for (j = 0; j < 3; ++j) {
-            l_coord = l_tri->vertices[j];
-            r_coord = r_tri->vertices[j];
+            l_coord = left_coords[l_tri->vertices[j]];
+            r_coord = right_coords[r_tri->vertices[j]];
             li = l_coord - left;
             assert(li >= 0 && li < nleft);
             ri = r_coord - right;
             assert(ri >= 0 && ri < nright);
-            vote = ++VOTE(li, ri);
-            if (maxvote < vote) {
-                maxvote = vote;
-            }
+            pairs[npairs].ri = ri;
+            pairs[npairs].li = li;
+            ++npairs;
         }
     }
 
+    qsort(pairs, npairs, sizeof(vote_pair_t), &vote_pair_compare);
+
+    /* Count the votes for each distinct pair, compacting them in
+       place */
+    for (i = 0, j = 0; i < npairs; ++j) {
+        pairs[j] = pairs[i];
+        pairs[j].votes = 0;
+        for ( ; i < npairs &&
+                  pairs[i].ri == pairs[j].ri &&
+                  pairs[i].li == pairs[j].li; ++i) {
+            ++pairs[j].votes;
+        }
+        if (maxvote < pairs[j].votes) {
+            maxvote = pairs[j].votes;
+        }
+    }
+    npairs = j;
+
     if (maxvote == 0) {
         *ncoord_matches = 0;
         status = 0;
@@ -120,18 +175,28 @@ vote_triangle_matches(
 
     half_maxvote = maxvote >> 1;
     ncount = 0;
-    for (ri = 0; ri < nright; ++ri) {
+    for (i = 0; i < npairs; ) {
+        ri = pairs[i].ri;
         r_coord = right + ri;
 
+        /* A right coordinate without any votes is never matched, so
+           only those with pairs need to be visited */
         row_maxvote = 0;
         row_2maxvote = 0;
+        row_total = 0;
         l_coord = NULL;
-        for (li = 0; li < nleft; ++li) {
-            vote = VOTE(li, ri);
+        for ( ; i < npairs && pairs[i].ri == ri; ++i) {
+            /* Left coordinates that have already been matched have
+               no votes left */
+            if (used[pairs[i].li]) {
+                continue;
+            }
+            vote = pairs[i].votes;
+            row_total += vote;
             if (vote > row_maxvote) {
                 row_2maxvote = row_maxvote;
                 row_maxvote = vote;
-                l_coord = left + li;
+                l_coord = left + pairs[i].li;
             }
         }
 
@@ -139,13 +204,15 @@ vote_triangle_matches(
 
            1. Have no votes, or less than half the number of maximum
               votes (this is handled by the same test, since hmaxvotes
-              >= 0),
+              >= 0).  With majority, it is instead half of all of the
+              votes for this right coordinate, since coordinates may
+              be in very different numbers of triangles,
 
            2. Have a tie
 
            3. Which only have a single vote if we expect more
         */
-        if (row_maxvote <= half_maxvote ||
+        if (row_maxvote <= (majority ? row_total / 2 : half_maxvote) ||
             row_maxvote == row_2maxvote ||
             (row_maxvote == 1 && (maxvote > 1 || ntriangle_matches > 1))) {
             continue;
@@ -153,10 +220,7 @@ vote_triangle_matches(
 
         /* Remove all future matches involving the input coord, so it
            won't be matched twice. */
-        for (ri2 = ri; ri2 < nright; ++ri2) {
-            li = l_coord - left;
-            VOTE(li, ri) = 0;
-        }
+        used[l_coord - left] = 1;
 
         #ifndef NDEBUG
             if (ncount >= *ncoord_matches) {
@@ -178,7 +242,8 @@ vote_triangle_matches(
 
  exit:
 
-    free(votes);
+    free(pairs);
+    free(used);
 
     return status;
 }
@@ -38,17 +38,21 @@ DAMAGE.
 
 #include "immatch/xyxymatch.h"
 #include "lib/lintransform.h"
+#include "lib/threads.h"
 #include "lib/xycoincide.h"
 #include "lib/xysort.h"
+#include "immatch/lib/offsets.h"
 #include "immatch/lib/triangles.h"
 #include "immatch/lib/tolerance.h"
 
 typedef struct {
-    const coord_t*      ref;
-    const coord_t*      input;
-    size_t              noutput;
-    size_t              outputp;
-    xyxymatch_output_t* output;
+    const coord_t*          ref;
+    const coord_t*          input;
+    size_t                  noutput;
+    size_t                  outputp;
+    xyxymatch_output_t*     output;
+    xyxymatch_output_func_t output_func;
+    void*                   output_data;
 } xyxymatch_callback_data_t;
 
 static int
@@ -60,27 +64,183 @@ xyxymatch_callback(
 
     xyxymatch_callback_data_t* state = (xyxymatch_callback_data_t*)data;
     xyxymatch_output_t* entry;
+    xyxymatch_output_t  match;
 
-    if (state->outputp >= state->noutput) {
+    if (state->output_func != NULL) {
+        entry = &match;
+    } else if (state->outputp >= state->noutput) {
         stimage_error_format_message(
             error,
             "Number of output coordinates exceeded allocation (%d)",
             state->noutput);
         return 1;
+    } else {
+        entry = &(state->output[state->outputp]);
     }
 
-    entry = &(state->output[state->outputp]);
-
     entry->coord     = state->input[input_index];
     entry->ref       = state->ref[ref_index];
     entry->coord_idx = input_index;
     entry->ref_idx   = ref_index;
 
+    if (state->output_func != NULL &&
+        state->output_func(state->output_data, entry, error)) {
+        return 1;
+    }
+
     ++(state->outputp);
 
     return 0;
 }
 
+/* The smallest allocation of a growable output buffer */
+#define XYXYMATCH_OUTPUT_BUFFER_MIN 64
+
+void
+xyxymatch_output_buffer_init(
+        xyxymatch_output_buffer_t* const buffer,
+        xyxymatch_output_t* const output, /* [size] */
+        const size_t size) {
+
+    assert(buffer);
+
+    buffer->output = output;
+    buffer->n = 0;
+    buffer->size = output == NULL ? 0 : size;
+    buffer->growable = output == NULL;
+    buffer->full = 0;
+}
+
+int
+xyxymatch_output_buffer_append(
+        void* data,
+        const xyxymatch_output_t* const match,
+        stimage_error_t* const error) {
+
+    xyxymatch_output_buffer_t* buffer = (xyxymatch_output_buffer_t*)data;
+    xyxymatch_output_t*        grown  = NULL;
+    size_t                     size;
+
+    if (buffer->n >= buffer->size) {
+        if (!buffer->growable) {
+            buffer->full = 1;
+            stimage_error_format_message(
+                error,
+                "Number of output coordinates exceeded allocation (%lu)",
+                (unsigned long)buffer->size);
+            return 1;
+        }
+
+        size = MAX(buffer->size * 2, XYXYMATCH_OUTPUT_BUFFER_MIN);
+        grown = realloc(buffer->output, size * sizeof(xyxymatch_output_t));
+        if (grown == NULL) {
+            stimage_error_set_message(
+                error, "Out of memory allocating matches");
+            return 1;
+        }
+        buffer->output = grown;
+        buffer->size = size;
+    }
+
+    buffer->output[buffer->n++] = *match;
+
+    return 0;
+}
+
+void
+xyxymatch_output_buffer_trim(
+        xyxymatch_output_buffer_t* const buffer) {
+
+    xyxymatch_output_t* shrunk = NULL;
+
+    assert(buffer);
+
+    if (!buffer->growable || buffer->n == buffer->size) {
+        return;
+    }
+
+    if (buffer->n == 0) {
+        free(buffer->output);
+        buffer->output = NULL;
+        buffer->size = 0;
+        return;
+    }
+
+    /* If this fails, the buffer is just left as it was */
+    shrunk = realloc(buffer->output, buffer->n * sizeof(xyxymatch_output_t));
+    if (shrunk != NULL) {
+        buffer->output = shrunk;
+        buffer->size = buffer->n;
+    }
+}
+
+void
+xyxymatch_output_buffer_free(
+        xyxymatch_output_buffer_t* const buffer) {
+
+    assert(buffer);
+
+    if (buffer->growable) {
+        free(buffer->output);
+    }
+    xyxymatch_output_buffer_init(buffer, NULL, 0);
+}
+
+/* Collects the coordinate pairs matched by the triangles algorithm, so
+   that a new transformation can be fit to them */
+typedef struct {
+    const coord_t* ref;
+    const coord_t* input;
+    size_t         npairs;
+    size_t         pairsp;
+    coord_t*       ref_pairs;
+    coord_t*       input_pairs;
+} xyxymatch_pairs_data_t;
+
+static int
+xyxymatch_pairs_callback(
+        void* data,
+        size_t ref_index,
+        size_t input_index,
+        stimage_error_t* error) {
+
+    xyxymatch_pairs_data_t* state = (xyxymatch_pairs_data_t*)data;
+
+    if (state->pairsp >= state->npairs) {
+        stimage_error_format_message(
+            error,
+            "Number of matched pairs exceeded allocation (%d)",
+            state->npairs);
+        return 1;
+    }
+
+    state->ref_pairs[state->pairsp] = state->ref[ref_index];
+    state->input_pairs[state->pairsp] = state->input[input_index];
+
+    ++(state->pairsp);
+
+    return 0;
+}
+
+void
+xyxymatch_options_init(
+        xyxymatch_options_t* const options) {
+
+    assert(options);
+
+    options->search = tolerance_search_auto;
+    options->nneighbors = 0;
+    options->nthreads = 1;
+    options->consensus = triangle_consensus_reject;
+    options->budget = NULL;
+    options->nrotations = 0;
+    options->rotations = NULL;
+    options->nscales = 0;
+    options->scales = NULL;
+    options->output_func = NULL;
+    options->output_data = NULL;
+}
+
 /** DIFF
 
 The original takes lists of input, reference and output files.  This
@@ -112,6 +272,225 @@ xyxymatch(
         const size_t nmatch,
         const double maxratio,
         const size_t nreject,
+        const xyxymatch_options_t* options,
+        stimage_error_t* const error) {
+
+    xyxymatch_ref_t prepared;
+    int             status = 1;
+
+    assert(ref);
+    assert(error);
+
+    xyxymatch_ref_new(&prepared);
+
+    if (nref == 0) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        goto exit;
+    }
+
+    if (xyxymatch_ref_init(&prepared, nref, ref, separation, error) ||
+        xyxymatch_prepared(
+                ninput, input, &prepared, noutput, output,
+                origin, mag, rotation, ref_origin,
+                algorithm, tolerance, nmatch, maxratio, nreject,
+                options, error)) {
+        goto exit;
+    }
+
+    status = 0;
+
+exit:
+
+    xyxymatch_ref_free(&prepared);
+    return status;
+}
+
+void
+xyxymatch_ref_new(
+        xyxymatch_ref_t* const prepared) {
+
+    assert(prepared);
+
+    prepared->nref = 0;
+    prepared->ref = NULL;
+    prepared->separation = 0.0;
+    prepared->nref_unique = 0;
+    prepared->ref_sorted = NULL;
+    prepared->ntriangles = 0;
+    prepared->triangles = NULL;
+    prepared->triangles_owned = NULL;
+    prepared->triangles_nmatch = 0;
+    prepared->triangles_nneighbors = 0;
+    prepared->triangles_tolerance = 0.0;
+    prepared->triangles_maxratio = 0.0;
+}
+
+int
+xyxymatch_ref_init(
+        xyxymatch_ref_t* const prepared,
+        const size_t nref,
+        const coord_t* const ref /*[nref]*/,
+        const double separation,
+        stimage_error_t* const error) {
+
+    assert(prepared);
+    assert(ref);
+    assert(error);
+
+    xyxymatch_ref_new(prepared);
+
+    if (nref == 0) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        return 1;
+    }
+
+    prepared->ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    if (prepared->ref_sorted == NULL) return 1;
+
+    prepared->nref = nref;
+    prepared->ref = ref;
+    prepared->separation = separation;
+
+    xysort(nref, ref, prepared->ref_sorted);
+    prepared->nref_unique = xycoincide(
+            nref, prepared->ref_sorted, prepared->ref_sorted, separation);
+
+    return 0;
+}
+
+static void
+xyxymatch_ref_set_params(
+        xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio) {
+
+    prepared->triangles_nmatch = nmatch;
+    prepared->triangles_nneighbors = nneighbors;
+    prepared->triangles_tolerance = tolerance;
+    prepared->triangles_maxratio = maxratio;
+}
+
+int
+xyxymatch_ref_build_triangles(
+        xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    size_t      ntriangles = 0;
+    triangle_t* triangles  = NULL;
+
+    assert(prepared);
+    assert(error);
+
+    if (prepared->ref_sorted == NULL) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        return 1;
+    }
+
+    if (prepared->nref_unique < 3) {
+        stimage_error_set_message(
+            error,
+            "Too few reference coordinates to do triangle matching");
+        return 1;
+    }
+
+    if (find_list_triangles(
+                prepared->nref_unique, prepared->ref_sorted,
+                nmatch, nneighbors, tolerance, maxratio,
+                nthreads == 0 ? threads_ncpu() : nthreads, NULL,
+                &ntriangles, &triangles, error)) {
+        return 1;
+    }
+
+    free(prepared->triangles_owned);
+    prepared->ntriangles = ntriangles;
+    prepared->triangles = triangles;
+    prepared->triangles_owned = triangles;
+    xyxymatch_ref_set_params(
+            prepared, nmatch, nneighbors, tolerance, maxratio);
+
+    return 0;
+}
+
+int
+xyxymatch_ref_set_triangles(
+        xyxymatch_ref_t* const prepared,
+        const size_t nmatch,
+        const size_t nneighbors,
+        const double tolerance,
+        const double maxratio,
+        const size_t ntriangles,
+        const triangle_t* const triangles /*[ntriangles]*/,
+        stimage_error_t* const error) {
+
+    size_t i, j;
+
+    assert(prepared);
+    assert(triangles || ntriangles == 0);
+    assert(error);
+
+    if (prepared->ref_sorted == NULL) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        return 1;
+    }
+
+    /* The triangles are only referred to by index, so make sure none
+       of them can point outside of the reference list */
+    for (i = 0; i < ntriangles; ++i) {
+        for (j = 0; j < 3; ++j) {
+            if (triangles[i].vertices[j] >= prepared->nref_unique) {
+                stimage_error_format_message(
+                    error,
+                    "Reference triangle %lu has a vertex outside of the "
+                    "reference list",
+                    (unsigned long)i);
+                return 1;
+            }
+        }
+    }
+
+    free(prepared->triangles_owned);
+    prepared->triangles_owned = NULL;
+    prepared->ntriangles = ntriangles;
+    prepared->triangles = triangles;
+    xyxymatch_ref_set_params(
+            prepared, nmatch, nneighbors, tolerance, maxratio);
+
+    return 0;
+}
+
+void
+xyxymatch_ref_free(
+        xyxymatch_ref_t* const prepared) {
+
+    assert(prepared);
+
+    free(prepared->ref_sorted);
+    free(prepared->triangles_owned);
+    xyxymatch_ref_new(prepared);
+}
+
+int
+xyxymatch_prepared(
+        const size_t ninput, const coord_t* const input /*[ninput]*/,
+        const xyxymatch_ref_t* const prepared,
+        size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+        const coord_t* origin, /* good default: 0.0, 0.0 */
+        const coord_t* mag, /* good default: 1.0, 1.0 */
+        const coord_t* rotation, /* good default: 0.0, 0.0 */
+        const coord_t* ref_origin, /* good default: 0.0, 0.0 */
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t nreject,
+        const xyxymatch_options_t* options,
         stimage_error_t* const error) {
 
     static const coord_t      DEFAULT_ORIGIN     = {0.0, 0.0};
@@ -121,9 +500,15 @@ xyxymatch(
     coord_t*                  input_trans        = NULL;
     const coord_t**           input_trans_sorted = NULL;
     size_t                    ninput_unique      = ninput;
-    const coord_t**           ref_sorted         = NULL;
-    size_t                    nref_unique        = nref;
+    xyxymatch_pairs_data_t    pairs;
+    size_t                    nref_triangles     = 0;
+    const triangle_t*         ref_triangles      = NULL;
+    const coord_t*            ref                = NULL;
+    size_t                    nref               = 0;
     lintransform_t            lintransform;
+    lintransform_t            refit;
+    size_t                    nvotes             = 0;
+    xyxymatch_options_t       default_options;
     xyxymatch_callback_data_t state;
     int                       status             = 1;
 
@@ -131,21 +516,26 @@ xyxymatch(
      CHECK ARGUMENTS
     */
     assert(input);
-    assert(ref);
-    assert(output);
+    assert(prepared);
+    assert(noutput);
     assert(error);
-    assert(*noutput > 0);
+
+    pairs.ref_pairs = NULL;
+    pairs.input_pairs = NULL;
 
     if (ninput == 0) {
         stimage_error_set_message(error, "The input coordinate list is empty");
         goto exit;
     }
 
-    if (nref == 0) {
+    if (prepared->nref == 0 || prepared->ref_sorted == NULL) {
         stimage_error_set_message(error, "The reference coordinate list is empty");
         goto exit;
     }
 
+    ref = prepared->ref;
+    nref = prepared->nref;
+
     if (algorithm >= xyxymatch_algo_LAST || algorithm < 0) {
         stimage_error_set_message(error, "Invalid algorithm specified");
         goto exit;
@@ -167,14 +557,34 @@ xyxymatch(
         ref_origin = &DEFAULT_REF_ORIGIN;
     }
 
-    /****************************************
-     PREPARE REFERENCE COORDINATES
-    */
-    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
-    if (ref_sorted == NULL) goto exit;
+    if (options == NULL) {
+        xyxymatch_options_init(&default_options);
+        options = &default_options;
+    }
+
+    assert(options->output_func != NULL || (output != NULL && *noutput > 0));
+
+    if (options->search >= tolerance_search_LAST || options->search < 0) {
+        stimage_error_set_message(error, "Invalid tolerance search specified");
+        goto exit;
+    }
 
-    xysort(nref, ref, ref_sorted);
-    nref_unique = xycoincide(nref, ref_sorted, ref_sorted, separation);
+    if (options->consensus >= triangle_consensus_LAST ||
+        options->consensus < 0) {
+        stimage_error_set_message(error, "Invalid triangle consensus specified");
+        goto exit;
+    }
+
+    /* Use the reference triangles that were found ahead of time, but
+       only if they were found the same way they would be here */
+    if (prepared->triangles != NULL &&
+        prepared->triangles_nmatch == nmatch &&
+        prepared->triangles_nneighbors == options->nneighbors &&
+        prepared->triangles_tolerance == tolerance &&
+        prepared->triangles_maxratio == maxratio) {
+        nref_triangles = prepared->ntriangles;
+        ref_triangles = prepared->triangles;
+    }
 
     /****************************************
      DETERMINE INITIAL TRANSFORM
@@ -192,7 +602,9 @@ xyxymatch(
 
     apply_lintransform(&lintransform, ninput, input, input_trans);
     xysort(ninput, input_trans, input_trans_sorted);
-    ninput_unique = xycoincide(ninput, input_trans_sorted, input_trans_sorted, separation);
+    ninput_unique = xycoincide(
+            ninput, input_trans_sorted, input_trans_sorted,
+            prepared->separation);
 
     /****************************************
      RUN THE DESIRED ALGORITHM
@@ -202,26 +614,113 @@ xyxymatch(
     state.noutput = *noutput;
     state.outputp = 0;
     state.output = output;
+    state.output_func = options->output_func;
+    state.output_data = options->output_data;
 
     switch (algorithm) {
     case xyxymatch_algo_tolerance:
         if (match_tolerance(
-                nref_unique, ref, ref_sorted,
+                prepared->nref_unique, ref, prepared->ref_sorted,
                 ninput_unique, input_trans, input_trans_sorted,
-                tolerance,
+                tolerance, options->search,
                 xyxymatch_callback, &state,
                 error)) goto exit;
         *noutput = state.outputp;
         break;
     case xyxymatch_algo_triangles:
+        if (options->nneighbors == 0 &&
+            (prepared->nref_unique > nmatch || ninput_unique > nmatch)) {
+            /* The triangles were only formed from a subsample of the
+               lists, so use their matches to fit a new
+               transformation, and then match the entire lists with the
+               tolerance algorithm */
+            pairs.ref = ref;
+            pairs.input = input_trans;
+            pairs.npairs = options->consensus == triangle_consensus_ransac ?
+                MAX(1, MAX(prepared->nref_unique, ninput_unique)) :
+                MAX(nmatch, 1);
+            pairs.pairsp = 0;
+
+            pairs.ref_pairs = malloc_with_error(
+                    pairs.npairs * sizeof(coord_t), error);
+            if (pairs.ref_pairs == NULL) goto exit;
+
+            pairs.input_pairs = malloc_with_error(
+                    pairs.npairs * sizeof(coord_t), error);
+            if (pairs.input_pairs == NULL) goto exit;
+
+            if (match_triangles(
+                    nref, prepared->nref_unique, ref, prepared->ref_sorted,
+                    nref_triangles, ref_triangles,
+                    ninput, ninput_unique, input_trans, input_trans_sorted,
+                    nmatch, options->nneighbors, tolerance, maxratio,
+                    nreject, options->consensus, options->nthreads,
+                    options->budget, &xyxymatch_pairs_callback, &pairs,
+                    error)) goto exit;
+
+            if (pairs.pairsp == 0) {
+                *noutput = 0;
+                break;
+            }
+
+            fit_lintransform(
+                    pairs.pairsp, pairs.input_pairs, pairs.ref_pairs,
+                    &refit);
+            apply_lintransform(&refit, ninput, input_trans, input_trans);
+            xysort(ninput, input_trans, input_trans_sorted);
+            ninput_unique = xycoincide(
+                    ninput, input_trans_sorted, input_trans_sorted,
+                    prepared->separation);
+
+            if (match_tolerance(
+                    prepared->nref_unique, ref, prepared->ref_sorted,
+                    ninput_unique, input_trans, input_trans_sorted,
+                    tolerance, options->search,
+                    xyxymatch_callback, &state,
+                    error)) goto exit;
+            *noutput = state.outputp;
+            break;
+        }
+
         if (match_triangles(
-                nref, nref_unique, ref, ref_sorted,
+                nref, prepared->nref_unique, ref, prepared->ref_sorted,
+                nref_triangles, ref_triangles,
                 ninput, ninput_unique, input_trans, input_trans_sorted,
-                nmatch, tolerance, maxratio, nreject,
+                nmatch, options->nneighbors, tolerance, maxratio, nreject,
+                options->consensus, options->nthreads, options->budget,
                 &xyxymatch_callback, &state,
                 error)) goto exit;
         *noutput = state.outputp;
         break;
+    case xyxymatch_algo_offsets:
+        if (find_offsets_transform(
+                prepared->nref_unique, prepared->ref_sorted,
+                ninput_unique, input_trans_sorted,
+                tolerance,
+                options->nrotations, options->rotations,
+                options->nscales, options->scales,
+                &refit, &nvotes, error)) goto exit;
+
+        /* A peak of one or two pairs may just be chance */
+        if (nvotes < 3) {
+            *noutput = 0;
+            break;
+        }
+
+        apply_lintransform(&refit, ninput, input_trans, input_trans);
+        xysort(ninput, input_trans, input_trans_sorted);
+        ninput_unique = xycoincide(
+                ninput, input_trans_sorted, input_trans_sorted,
+                prepared->separation);
+
+        if (match_tolerance(
+                prepared->nref_unique, ref, prepared->ref_sorted,
+                ninput_unique, input_trans, input_trans_sorted,
+                tolerance, options->search,
+                xyxymatch_callback, &state,
+                error)) goto exit;
+        *noutput = state.outputp;
+        break;
     case xyxymatch_algo_LAST:
     default:
         stimage_error_set_message(error, "Invalid algorithm");
@@ -232,11 +731,147 @@ xyxymatch(
 
 exit:
 
-    free(ref_sorted);
+    free(pairs.ref_pairs);
+    free(pairs.input_pairs);
     free(input_trans_sorted);
     free(input_trans);
     return status;
 }
 
+typedef struct {
+    const size_t*              ninputs;
+    const coord_t* const*      inputs;
+    const xyxymatch_ref_t*     prepared;
+    size_t*                    noutputs;
+    xyxymatch_output_t**       outputs;
+    const coord_t*             origin;
+    const coord_t*             mag;
+    const coord_t*             rotation;
+    const coord_t*             ref_origin;
+    xyxymatch_algo_e           algorithm;
+    double                     tolerance;
+    size_t                     nmatch;
+    double                     maxratio;
+    size_t                     nreject;
+    const xyxymatch_options_t* options;
+} xyxymatch_many_data_t;
+
+static int
+xyxymatch_many_frame(
+        void* data,
+        size_t i,
+        stimage_error_t* const error) {
+
+    xyxymatch_many_data_t*    state = (xyxymatch_many_data_t*)data;
+    xyxymatch_output_buffer_t buffer;
+    xyxymatch_options_t       options;
+    size_t                    noutput = 0;
+    stimage_error_t           frame_error;
+
+    stimage_error_init(&frame_error);
+
+    /* Collect the matches in a buffer that only grows as big as it
+       needs to */
+    xyxymatch_output_buffer_init(&buffer, NULL, 0);
+    if (state->options != NULL) {
+        options = *state->options;
+    } else {
+        xyxymatch_options_init(&options);
+    }
+    options.output_func = &xyxymatch_output_buffer_append;
+    options.output_data = &buffer;
+
+    if (state->ninputs[i] != 0 &&
+        xyxymatch_prepared(
+                state->ninputs[i], state->inputs[i],
+                state->prepared,
+                &noutput, NULL,
+                state->origin, state->mag, state->rotation,
+                state->ref_origin, state->algorithm, state->tolerance,
+                state->nmatch, state->maxratio, state->nreject,
+                &options, &frame_error)) {
+        goto fail;
+    }
+
+    xyxymatch_output_buffer_trim(&buffer);
+    if (buffer.output == NULL) {
+        /* Callers expect an array, even if it is empty */
+        buffer.output = malloc_with_error(
+                sizeof(xyxymatch_output_t), &frame_error);
+        if (buffer.output == NULL) goto fail;
+    }
+
+    state->noutputs[i] = buffer.n;
+    state->outputs[i] = buffer.output;
+
+    return 0;
+
+ fail:
+
+    xyxymatch_output_buffer_free(&buffer);
+    stimage_error_format_message(
+            error, "Frame %lu: %s", (unsigned long)i,
+            stimage_error_get_message(&frame_error));
+    return 1;
+}
+
+int
+xyxymatch_many(
+        const size_t nframes,
+        const size_t* const ninputs /*[nframes]*/,
+        const coord_t* const* const inputs /*[nframes][ninputs[i]]*/,
+        const xyxymatch_ref_t* const prepared,
+        size_t* const noutputs /*[nframes]*/,
+        xyxymatch_output_t** const outputs /*[nframes][noutputs[i]]*/,
+        const coord_t* const origin, /* good default: 0.0, 0.0 */
+        const coord_t* const mag, /* good default: 1.0, 1.0 */
+        const coord_t* const rotation, /* good default: 0.0, 0.0 */
+        const coord_t* const ref_origin, /* good default: 0.0, 0.0 */
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t nreject,
+        const xyxymatch_options_t* options,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    xyxymatch_many_data_t state;
+    size_t                i = 0;
 
+    assert(prepared);
+    assert(error);
 
+    if (nframes == 0) {
+        return 0;
+    }
+
+    assert(ninputs);
+    assert(inputs);
+    assert(noutputs);
+    assert(outputs);
+
+    for (i = 0; i < nframes; ++i) {
+        noutputs[i] = 0;
+        outputs[i] = NULL;
+    }
+
+    state.ninputs    = ninputs;
+    state.inputs     = inputs;
+    state.prepared   = prepared;
+    state.noutputs   = noutputs;
+    state.outputs    = outputs;
+    state.origin     = origin;
+    state.mag        = mag;
+    state.rotation   = rotation;
+    state.ref_origin = ref_origin;
+    state.algorithm  = algorithm;
+    state.tolerance  = tolerance;
+    state.nmatch     = nmatch;
+    state.maxratio   = maxratio;
+    state.nreject    = nreject;
+    state.options    = options;
+
+    return parallel_for(
+            nframes, nthreads, &xyxymatch_many_frame, &state, error);
+}
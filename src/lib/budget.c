@@ -0,0 +1,199 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#include <assert.h>
+
+#if defined(_WIN32)
+    #include <windows.h>
+#else
+    #include <time.h>
+#endif
+
+#include "lib/budget.h"
+
+/* The least time, in seconds, between calls to the cancel callback,
+   which may be expensive (for example, acquiring Python's GIL) */
+#define BUDGET_CANCEL_INTERVAL 0.01
+
+/* Returns a monotonic clock in seconds */
+static double
+budget_clock(void) {
+
+#if defined(_WIN32)
+    LARGE_INTEGER count, frequency;
+
+    QueryPerformanceCounter(&count);
+    QueryPerformanceFrequency(&frequency);
+    return (double)count.QuadPart / (double)frequency.QuadPart;
+#else
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
+#endif
+}
+
+void
+budget_init(
+        budget_t* const budget,
+        const size_t max_work,
+        const double timeout,
+        budget_cancel_func_t cancel,
+        void* cancel_data) {
+
+    double now;
+
+    assert(budget);
+
+    budget->max_work = max_work;
+    budget->timeout = timeout;
+    budget->cancel = cancel;
+    budget->cancel_data = cancel_data;
+    budget->work = 0;
+    budget->status = budget_ok;
+    threads_mutex_init(&budget->mutex);
+
+    now = (timeout > 0.0 || cancel != NULL) ? budget_clock() : 0.0;
+    budget->deadline = timeout > 0.0 ? now + timeout : 0.0;
+    budget->next_cancel = now;
+}
+
+void
+budget_free(
+        budget_t* const budget) {
+
+    assert(budget);
+
+    threads_mutex_destroy(&budget->mutex);
+}
+
+static void
+budget_format_error(
+        const budget_t* const budget,
+        const budget_status_e status,
+        const char* const stage,
+        stimage_error_t* const error) {
+
+    switch (status) {
+    case budget_exceeded_work:
+        stimage_error_format_message(
+            error, "Exceeded the work budget of %lu units while %s",
+            (unsigned long)budget->max_work, stage);
+        break;
+    case budget_exceeded_time:
+        stimage_error_format_message(
+            error, "Exceeded the time limit of %g seconds while %s",
+            budget->timeout, stage);
+        break;
+    case budget_cancelled:
+    default:
+        stimage_error_format_message(error, "Cancelled while %s", stage);
+        break;
+    }
+}
+
+int
+budget_charge(
+        budget_t* const budget,
+        const size_t work,
+        const char* const stage,
+        stimage_error_t* const error) {
+
+    budget_status_e status;
+    double          now       = 0.0;
+    int             do_cancel = 0;
+
+    assert(stage);
+    assert(error);
+
+    if (budget == NULL) {
+        return 0;
+    }
+
+    threads_mutex_lock(&budget->mutex);
+
+    if (budget->status == budget_ok) {
+        budget->work += work;
+        if (budget->max_work && budget->work > budget->max_work) {
+            budget->status = budget_exceeded_work;
+        } else if (budget->deadline > 0.0 || budget->cancel != NULL) {
+            now = budget_clock();
+            if (budget->deadline > 0.0 && now > budget->deadline) {
+                budget->status = budget_exceeded_time;
+            } else if (budget->cancel != NULL && now >= budget->next_cancel) {
+                budget->next_cancel = now + BUDGET_CANCEL_INTERVAL;
+                do_cancel = 1;
+            }
+        }
+    }
+
+    threads_mutex_unlock(&budget->mutex);
+
+    /* The callback is called without holding the lock, since it may
+       need to take locks of its own */
+    if (do_cancel && budget->cancel(budget->cancel_data)) {
+        threads_mutex_lock(&budget->mutex);
+        if (budget->status == budget_ok) {
+            budget->status = budget_cancelled;
+        }
+        threads_mutex_unlock(&budget->mutex);
+    }
+
+    status = budget_get_status(budget);
+    if (status != budget_ok) {
+        budget_format_error(budget, status, stage, error);
+        return 1;
+    }
+
+    return 0;
+}
+
+budget_status_e
+budget_get_status(
+        budget_t* const budget) {
+
+    budget_status_e status;
+
+    if (budget == NULL) {
+        return budget_ok;
+    }
+
+    threads_mutex_lock(&budget->mutex);
+    status = budget->status;
+    threads_mutex_unlock(&budget->mutex);
+
+    return status;
+}
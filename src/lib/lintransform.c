@@ -78,9 +78,9 @@ apply_lintransform(
     assert(input);
     assert(output);
 
+    /* Coordinates that are not finite are passed through, still not
+       finite, to be ignored by the matching */
     for (i = 0; i < ncoords; ++i) {
-        assert(coord_is_finite(input + i));
-
         x = input[i].x;
         y = input[i].y;
 
@@ -88,3 +88,72 @@ apply_lintransform(
         output[i].y = coeffs->d * x + coeffs->e * y + coeffs->f;
     }
 }
+
+void
+fit_lintransform(
+    size_t ncoords,
+    const coord_t* const input, /* [ncoords] */
+    const coord_t* const ref, /* [ncoords] */
+    lintransform_t* coeffs) {
+
+    size_t i;
+    double xm = 0.0, ym = 0.0, xrm = 0.0, yrm = 0.0;
+    double sxx = 0.0, sxy = 0.0, syy = 0.0;
+    double sxxr = 0.0, syxr = 0.0, sxyr = 0.0, syyr = 0.0;
+    double dx, dy, dxr, dyr, det;
+
+    assert(input || ncoords == 0);
+    assert(ref || ncoords == 0);
+    assert(coeffs);
+
+    coeffs->a = 1.0;
+    coeffs->b = 0.0;
+    coeffs->c = 0.0;
+    coeffs->d = 0.0;
+    coeffs->e = 1.0;
+    coeffs->f = 0.0;
+
+    if (ncoords == 0) {
+        return;
+    }
+
+    /* Work relative to the means, which both decouples the shift from
+       the rest of the fit and keeps the sums well-conditioned */
+    for (i = 0; i < ncoords; ++i) {
+        xm += input[i].x;
+        ym += input[i].y;
+        xrm += ref[i].x;
+        yrm += ref[i].y;
+    }
+    xm /= (double)ncoords;
+    ym /= (double)ncoords;
+    xrm /= (double)ncoords;
+    yrm /= (double)ncoords;
+
+    for (i = 0; i < ncoords; ++i) {
+        dx = input[i].x - xm;
+        dy = input[i].y - ym;
+        dxr = ref[i].x - xrm;
+        dyr = ref[i].y - yrm;
+        sxx += dx * dx;
+        sxy += dx * dy;
+        syy += dy * dy;
+        sxxr += dx * dxr;
+        syxr += dy * dxr;
+        sxyr += dx * dyr;
+        syyr += dy * dyr;
+    }
+
+    /* Solve the normal equations, which share the same matrix for x
+       and y, unless the coordinates are too close to a line */
+    det = sxx * syy - sxy * sxy;
+    if (ncoords >= 3 && det > 1e-12 * sxx * syy) {
+        coeffs->a = (sxxr * syy - syxr * sxy) / det;
+        coeffs->b = (syxr * sxx - sxxr * sxy) / det;
+        coeffs->d = (sxyr * syy - syyr * sxy) / det;
+        coeffs->e = (syyr * sxx - sxyr * sxy) / det;
+    }
+
+    coeffs->c = xrm - coeffs->a * xm - coeffs->b * ym;
+    coeffs->f = yrm - coeffs->d * xm - coeffs->e * ym;
+}
@@ -34,6 +34,13 @@ DAMAGE.
 
 #include "lib/polynomial.h"
 
+/* Gives the constants a and b of the recurrence relation for the kth
+   basis function, B_k = a u B_(k-1) + b B_(k-2), for k >= 2 */
+typedef void (*recurrence_function_t)(
+        const size_t,
+        double* const,
+        double* const);
+
 typedef int (*basis_function_t)(
         const size_t,
         const size_t,
@@ -101,7 +108,7 @@ eval_1dpoly(
 
     free(tmp);
 
-    return 0;
+    return status;
 }
 
 int
@@ -195,7 +202,7 @@ eval_1dchebyshev(
     free(pnm1);
     free(pnm2);
 
-    return 0;
+    return status;
 }
 
 int
@@ -442,6 +449,99 @@ basis_legendre(
     return 0;
 }
 
+int
+eval_basis(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const xterms_e xterms,
+        const double* const xb,
+        const double* const yb,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    size_t        i        = 0;
+    size_t        j        = 0;
+    size_t        k        = 0;
+    double*       accum    = NULL;
+    size_t        cp       = 0;
+    const size_t  maxorder = MAX(xorder + 1, yorder + 1);
+    size_t        xincr    = 0;
+    const double* xbp      = NULL;
+    const double* ybp      = NULL;
+
+    assert(coeff);
+    assert(xb);
+    assert(yb);
+    assert(zfit);
+    assert(error);
+
+    /* Accumulate the output vector */
+    for (i = 0; i < ncoord; ++i) {
+        zfit[i] = 0.0;
+    }
+
+    if (xterms != xterms_none) {
+        accum = malloc_with_error(ncoord * sizeof(double), error);
+        if (accum == NULL) return 1;
+
+        /* The coefficients are stored by rows in y, each row holding
+           the x terms that go with that power of y */
+        xincr = xorder;
+        ybp = yb;
+        for (j = 0; j < yorder; ++j) {
+            for (i = 0; i < ncoord; ++i) {
+                accum[i] = 0.0;
+            }
+
+            xbp = xb;
+            for (k = 0; k < xincr; ++k) {
+                for (i = 0; i < ncoord; ++i) {
+                    accum[i] += xbp[i] * coeff[cp+k];
+                }
+                xbp += ncoord;
+            }
+
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += accum[i] * ybp[i];
+            }
+
+            cp += xincr;
+            ybp += ncoord;
+
+            if (xterms == xterms_half) {
+                if ((j + xorder + 2) > maxorder) {
+                    xincr -= 1;
+                }
+            }
+        }
+
+        free(accum);
+    } else { /* xterms == surface_xterms_none */
+        xbp = xb;
+        for (k = 0; k < xorder; ++k) {
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += xbp[i] * coeff[k];
+            }
+
+            xbp += ncoord;
+        }
+
+        ybp = yb + ncoord;
+        for (k = 0; k < yorder - 1; ++k) {
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += ybp[i] * coeff[xorder+k];
+            }
+
+            ybp += ncoord;
+        }
+    }
+
+    return 0;
+}
+
 static int
 eval_poly_generic(
         const int xorder,
@@ -459,18 +559,10 @@ eval_poly_generic(
         double* const zfit,
         stimage_error_t* const error) {
 
-    size_t       i        = 0;
-    size_t       j        = 0;
-    size_t       k        = 0;
-    double*      xb       = NULL;
-    double*      yb       = NULL;
-    double*      accum    = NULL;
-    size_t       cp       = 0;
-    const size_t maxorder = MAX(xorder + 1, yorder + 1);
-    size_t       xincr    = 0;
-    double*      xbp      = xb;
-    double*      ybp      = yb;
-    int          status   = 1;
+    size_t  i      = 0;
+    double* xb     = NULL;
+    double* yb     = NULL;
+    int     status = 1;
 
     assert(coeff);
     assert(ref);
@@ -487,25 +579,11 @@ eval_poly_generic(
     }
 
     /* Fit first order in x and y */
-    if (xorder == 2 && yorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1];
-        }
-
-        return 0;
-    }
-
-    if (yorder == 2 && xorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].y * coeff[1];
-        }
-
-        return 0;
-    }
-
     if (yorder == 2 && xorder == 2 && xterms == xterms_none) {
         for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1] + ref[i].y * coeff[2];
+            zfit[i] = coeff[0] +
+                (ref[i].x + k1x) * k2x * coeff[1] +
+                (ref[i].y + k1y) * k2y * coeff[2];
         }
 
         return 0;
@@ -515,63 +593,258 @@ eval_poly_generic(
     if (xb == NULL) goto exit;
     yb = malloc_with_error(yorder * ncoord * sizeof(double), error);
     if (yb == NULL) goto exit;
-    accum = malloc_with_error(ncoord * sizeof(double), error);
-    if (accum == NULL) goto exit;
 
     /* Calculate basis functions */
     if (basis_function(ncoord, 0, ref, xorder, k1x, k2x, xb, error)) goto exit;
     if (basis_function(ncoord, 1, ref, yorder, k1y, k2y, yb, error)) goto exit;
 
-    /* Accumulate the output vector */
+    if (eval_basis(
+                xorder, yorder, coeff, ncoord, xterms, xb, yb, zfit,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+    free(xb);
+    free(yb);
+
+    return status;
+}
+
+int
+eval_poly(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    return eval_poly_generic(
+            xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
+            &basis_poly, zfit, error);
+}
+
+int
+eval_chebyshev(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    return eval_poly_generic(
+            xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
+            &basis_chebyshev, zfit, error);
+}
+
+int
+eval_legendre(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    return eval_poly_generic(
+            xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
+            &basis_legendre, zfit, error);
+}
+
+static void
+recurrence_poly(
+        const size_t k,
+        double* const a,
+        double* const b) {
+
+    *a = 1.0;
+    *b = 0.0;
+}
+
+static void
+recurrence_chebyshev(
+        const size_t k,
+        double* const a,
+        double* const b) {
+
+    *a = 2.0;
+    *b = -1.0;
+}
+
+static void
+recurrence_legendre(
+        const size_t k,
+        double* const a,
+        double* const b) {
+
+    const double ri = (double)k + 1.0;
+
+    *a = (2.0 * ri - 3.0) / (ri - 1.0);
+    *b = -(ri - 2.0) / (ri - 1.0);
+}
+
+/* Calculate the basis functions, like basis_poly and friends, and
+   their derivatives with respect to the coordinate (not the
+   normalized coordinate) */
+static void
+basis_deriv_generic(
+        const size_t ncoord,
+        const size_t axis,
+        const coord_t* const ref,
+        const int order,
+        const double k1,
+        const double k2,
+        recurrence_function_t recurrence,
+        /* Output */
+        double* const basis,
+        double* const dbasis) {
+
+    size_t              i  = 0;
+    size_t              k  = 0;
+    const double* const x  = (double*)ref + axis;
+    double*             bp = basis;
+    double*             dp = dbasis;
+    double              u  = 0.0;
+    double              a  = 0.0;
+    double              b  = 0.0;
+
+    for (k = 0; k < order; ++k) {
+        if (k == 0) {
+            for (i = 0; i < ncoord; ++i) {
+                bp[i] = 1.0;
+                dp[i] = 0.0;
+            }
+        } else if (k == 1) {
+            for (i = 0; i < ncoord; ++i) {
+                bp[i] = (x[i<<1] + k1) * k2;
+                dp[i] = k2;
+            }
+        } else {
+            recurrence(k, &a, &b);
+            for (i = 0; i < ncoord; ++i) {
+                u = basis[ncoord+i];
+                bp[i] = a * u * bp[i-ncoord] + b * bp[i-(2 * ncoord)];
+                dp[i] = a * (k2 * bp[i-ncoord] + u * dp[i-ncoord]) +
+                    b * dp[i-(2 * ncoord)];
+            }
+        }
+
+        bp += ncoord;
+        dp += ncoord;
+    }
+}
+
+static int
+deriv_poly_generic(
+        const int xorder,
+        const int yorder,
+        const double* const coeff,
+        const size_t ncoord,
+        const coord_t* const ref,
+        const xterms_e xterms,
+        const double k1x,
+        const double k2x,
+        const double k1y,
+        const double k2y,
+        recurrence_function_t recurrence,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error) {
+
+    size_t       i        = 0;
+    size_t       j        = 0;
+    size_t       k        = 0;
+    double*      xb       = NULL;
+    double*      xdb      = NULL;
+    double*      yb       = NULL;
+    double*      ydb      = NULL;
+    double       accum    = 0.0;
+    double       daccum   = 0.0;
+    size_t       cp       = 0;
+    const size_t maxorder = MAX(xorder + 1, yorder + 1);
+    size_t       xincr    = 0;
+    int          status   = 1;
+
+    assert(coeff);
+    assert(ref);
+    assert(dzdx);
+    assert(dzdy);
+    assert(error);
+
+    xb = malloc_with_error(2 * xorder * ncoord * sizeof(double), error);
+    if (xb == NULL) goto exit;
+    yb = malloc_with_error(2 * yorder * ncoord * sizeof(double), error);
+    if (yb == NULL) goto exit;
+    xdb = xb + xorder * ncoord;
+    ydb = yb + yorder * ncoord;
+
+    basis_deriv_generic(ncoord, 0, ref, xorder, k1x, k2x, recurrence, xb, xdb);
+    basis_deriv_generic(ncoord, 1, ref, yorder, k1y, k2y, recurrence, yb, ydb);
+
     for (i = 0; i < ncoord; ++i) {
-        zfit[i] = 0.0;
+        dzdx[i] = 0.0;
+        dzdy[i] = 0.0;
     }
 
-    if (xterms != xterms_none) {
+    /* A surface of order 1 in x or y is stored as if it had no cross
+       terms, whatever xterms is */
+    if (xterms != xterms_none && xorder > 1 && yorder > 1) {
         xincr = xorder;
-        ybp = yb;
         for (j = 0; j < yorder; ++j) {
             for (i = 0; i < ncoord; ++i) {
-                accum[i] = 0.0;
-            }
-            xbp = xb;
-            for (k = 0; k < xincr; ++k) {
-                for (i = 0; i < ncoord; ++i) {
-                    accum[i] += xbp[i] * coeff[cp+k];
+                accum = 0.0;
+                daccum = 0.0;
+                for (k = 0; k < xincr; ++k) {
+                    accum += xb[k*ncoord+i] * coeff[cp+k];
+                    daccum += xdb[k*ncoord+i] * coeff[cp+k];
                 }
+                dzdx[i] += daccum * yb[j*ncoord+i];
+                dzdy[i] += accum * ydb[j*ncoord+i];
             }
-            xbp += ncoord;
-        }
 
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += accum[i] * ybp[i];
-        }
-
-        cp += xincr;
-        ybp += ncoord;
+            cp += xincr;
 
-        if (xterms == xterms_half) {
-            if ((j + xorder + 1) > maxorder) {
-                xincr -= 1;
+            if (xterms == xterms_half) {
+                if ((j + xorder + 2) > maxorder) {
+                    xincr -= 1;
+                }
             }
         }
-    } else { /* xterms == surface_xterms_none */
-        xbp = xb;
+    } else {
         for (k = 0; k < xorder; ++k) {
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] += xbp[i] * coeff[k];
+                dzdx[i] += xdb[k*ncoord+i] * coeff[k];
             }
-
-            xbp += ncoord;
         }
 
-        ybp = yb + ncoord;
-        for (k = 0; k < yorder - 1; ++k) {
+        for (k = 1; k < yorder; ++k) {
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] += ybp[i] * coeff[xorder+k];
+                dzdy[i] += ydb[k*ncoord+i] * coeff[xorder+k-1];
             }
-
-            ybp += ncoord;
         }
     }
 
@@ -580,13 +853,12 @@ eval_poly_generic(
  exit:
     free(xb);
     free(yb);
-    free(accum);
 
     return status;
 }
 
 int
-eval_poly(
+deriv_poly(
         const int xorder,
         const int yorder,
         const double* const coeff,
@@ -598,16 +870,17 @@ eval_poly(
         const double k1y,
         const double k2y,
         /* Output */
-        double* const zfit,
+        double* const dzdx,
+        double* const dzdy,
         stimage_error_t* const error) {
 
-    return eval_poly_generic(
+    return deriv_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_poly, zfit, error);
+            &recurrence_poly, dzdx, dzdy, error);
 }
 
 int
-eval_chebyshev(
+deriv_chebyshev(
         const int xorder,
         const int yorder,
         const double* const coeff,
@@ -619,16 +892,17 @@ eval_chebyshev(
         const double k1y,
         const double k2y,
         /* Output */
-        double* const zfit,
+        double* const dzdx,
+        double* const dzdy,
         stimage_error_t* const error) {
 
-    return eval_poly_generic(
+    return deriv_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_chebyshev, zfit, error);
+            &recurrence_chebyshev, dzdx, dzdy, error);
 }
 
 int
-eval_legendre(
+deriv_legendre(
         const int xorder,
         const int yorder,
         const double* const coeff,
@@ -640,10 +914,11 @@ eval_legendre(
         const double k1y,
         const double k2y,
         /* Output */
-        double* const zfit,
+        double* const dzdx,
+        double* const dzdy,
         stimage_error_t* const error) {
 
-    return eval_poly_generic(
+    return deriv_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_legendre, zfit, error);
+            &recurrence_legendre, dzdx, dzdy, error);
 }
@@ -0,0 +1,193 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#include <assert.h>
+#include <string.h>
+
+#include "lib/radixsort.h"
+
+#define RADIX_BITS 8
+#define RADIX_BUCKETS (1 << RADIX_BITS)
+#define RADIX_DIGITS (64 / RADIX_BITS)
+
+/* Shorter lists are sorted by insertion, which is faster than
+   building the histograms */
+#define RADIX_INSERTION_MAX 32
+
+/* Compare two records on keys [first, nkeys) */
+static inline int
+radix_record_less(
+        const radix_record_t* const a,
+        const radix_record_t* const b,
+        const size_t first,
+        const size_t nkeys) {
+
+    size_t k;
+
+    for (k = first; k < nkeys; ++k) {
+        if (a->key[k] != b->key[k]) {
+            return a->key[k] < b->key[k];
+        }
+    }
+
+    return 0;
+}
+
+/* Stable sort of records on key[k] alone, one byte at a time from the
+   least significant */
+static void
+radix_sort_key(
+        const size_t n,
+        const size_t k,
+        radix_record_t* const records,
+        radix_record_t* const tmp) {
+
+    size_t          counts[RADIX_DIGITS][RADIX_BUCKETS];
+    size_t*         count;
+    radix_record_t* src = records;
+    radix_record_t* dst = tmp;
+    radix_record_t* swap;
+    STIMAGE_UInt64  key;
+    size_t          offset, c;
+    size_t          i, d;
+    unsigned int    shift;
+
+    /* The histograms of every byte are made in a single pass */
+    memset(counts, 0, sizeof(counts));
+    for (i = 0; i < n; ++i) {
+        key = records[i].key[k];
+        for (d = 0; d < RADIX_DIGITS; ++d) {
+            ++counts[d][(key >> (d * RADIX_BITS)) & (RADIX_BUCKETS - 1)];
+        }
+    }
+
+    for (d = 0; d < RADIX_DIGITS; ++d) {
+        count = counts[d];
+        shift = (unsigned int)(d * RADIX_BITS);
+
+        /* Skip the pass if every record has the same value of this
+           byte */
+        if (count[(src[0].key[k] >> shift) & (RADIX_BUCKETS - 1)] == n) {
+            continue;
+        }
+
+        /* Turn the counts into the offsets of each bucket... */
+        offset = 0;
+        for (i = 0; i < RADIX_BUCKETS; ++i) {
+            c = count[i];
+            count[i] = offset;
+            offset += c;
+        }
+
+        /* ...and scatter the records into them */
+        for (i = 0; i < n; ++i) {
+            dst[count[(src[i].key[k] >> shift) & (RADIX_BUCKETS - 1)]++] =
+                src[i];
+        }
+
+        swap = src; src = dst; dst = swap;
+    }
+
+    if (src != records) {
+        memcpy(records, src, n * sizeof(radix_record_t));
+    }
+}
+
+/* Sort records on keys [first, nkeys) */
+static void
+radix_sort_from(
+        const size_t n,
+        const size_t first,
+        const size_t nkeys,
+        radix_record_t* const records,
+        radix_record_t* const tmp) {
+
+    radix_record_t t;
+    size_t         lo, hi;
+    size_t         i, j;
+
+    if (n < RADIX_INSERTION_MAX) {
+        for (i = 1; i < n; ++i) {
+            t = records[i];
+            for (j = i;
+                 j > 0 && radix_record_less(&t, &records[j - 1], first, nkeys);
+                 --j) {
+                records[j] = records[j - 1];
+            }
+            records[j] = t;
+        }
+        return;
+    }
+
+    radix_sort_key(n, first, records, tmp);
+
+    if (first + 1 >= nkeys) {
+        return;
+    }
+
+    /* Rather than also making passes over the later keys of every
+       record, only sort the runs with equal values of this key, which
+       are usually few and short */
+    for (lo = 0; lo < n; lo = hi) {
+        for (hi = lo + 1;
+             hi < n && records[hi].key[first] == records[lo].key[first];
+             ++hi) {
+            /* empty */
+        }
+        if (hi - lo > 1) {
+            radix_sort_from(hi - lo, first + 1, nkeys,
+                            records + lo, tmp + lo);
+        }
+    }
+}
+
+void
+radix_sort(
+        const size_t n,
+        const size_t nkeys,
+        radix_record_t* const records, /* [n] */
+        radix_record_t* const tmp /* [n] */) {
+
+    assert(nkeys >= 1 && nkeys <= RADIX_MAX_KEYS);
+    assert(n == 0 || records);
+    assert(n == 0 || tmp);
+
+    if (n == 0) {
+        return;
+    }
+
+    radix_sort_from(n, 0, nkeys, records, tmp);
+}
@@ -0,0 +1,240 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+#include <assert.h>
+#include <string.h>
+
+#if !defined(_WIN32)
+    #include <unistd.h>
+#endif
+
+#include "lib/threads.h"
+
+typedef struct {
+    parallel_for_func_t func;
+    void*               data;
+    size_t              n;
+    /* The next index to hand out */
+    size_t              next;
+    /* The lowest index that failed, or n if none have */
+    size_t              failed;
+    /* The error from the lowest failed index */
+    stimage_error_t     error;
+    threads_mutex_t     mutex;
+} parallel_for_t;
+
+static int
+parallel_for_next(
+        parallel_for_t* const state,
+        size_t* const i) {
+
+    int has_next;
+
+    threads_mutex_lock(&state->mutex);
+    has_next = (state->failed == state->n && state->next < state->n);
+    if (has_next) {
+        *i = state->next++;
+    }
+    threads_mutex_unlock(&state->mutex);
+
+    return has_next;
+}
+
+static void
+parallel_for_fail(
+        parallel_for_t* const state,
+        const size_t i,
+        const stimage_error_t* const error) {
+
+    threads_mutex_lock(&state->mutex);
+    if (i < state->failed) {
+        state->failed = i;
+        memcpy(&state->error, error, sizeof(stimage_error_t));
+    }
+    threads_mutex_unlock(&state->mutex);
+}
+
+static void
+parallel_for_worker(
+        parallel_for_t* const state) {
+
+    stimage_error_t error;
+    size_t          i = 0;
+
+    stimage_error_init(&error);
+
+    while (parallel_for_next(state, &i)) {
+        if (state->func(state->data, i, &error)) {
+            parallel_for_fail(state, i, &error);
+            stimage_error_init(&error);
+        }
+    }
+}
+
+#if defined(_WIN32)
+static DWORD WINAPI
+parallel_for_thread(
+        LPVOID arg) {
+
+    parallel_for_worker((parallel_for_t*)arg);
+    return 0;
+}
+
+static int
+threads_start(
+        threads_thread_t* const thread,
+        parallel_for_t* const state) {
+
+    *thread = CreateThread(NULL, 0, parallel_for_thread, state, 0, NULL);
+    return *thread == NULL;
+}
+
+static void
+threads_join(
+        threads_thread_t thread) {
+
+    WaitForSingleObject(thread, INFINITE);
+    CloseHandle(thread);
+}
+#else
+static void*
+parallel_for_thread(
+        void* arg) {
+
+    parallel_for_worker((parallel_for_t*)arg);
+    return NULL;
+}
+
+static int
+threads_start(
+        threads_thread_t* const thread,
+        parallel_for_t* const state) {
+
+    return pthread_create(thread, NULL, parallel_for_thread, state) != 0;
+}
+
+static void
+threads_join(
+        threads_thread_t thread) {
+
+    pthread_join(thread, NULL);
+}
+#endif
+
+size_t
+threads_ncpu(void) {
+
+#if defined(_WIN32)
+    SYSTEM_INFO info;
+
+    GetSystemInfo(&info);
+    if (info.dwNumberOfProcessors > 0) {
+        return (size_t)info.dwNumberOfProcessors;
+    }
+#elif defined(_SC_NPROCESSORS_ONLN)
+    long ncpu = sysconf(_SC_NPROCESSORS_ONLN);
+
+    if (ncpu > 0) {
+        return (size_t)ncpu;
+    }
+#endif
+
+    return 1;
+}
+
+int
+parallel_for(
+        const size_t n,
+        const size_t nthreads,
+        parallel_for_func_t func,
+        void* data,
+        stimage_error_t* const error) {
+
+    parallel_for_t    state;
+    threads_thread_t* threads   = NULL;
+    size_t            nthreads_ = nthreads;
+    size_t            nstarted  = 0;
+    size_t            i         = 0;
+
+    assert(func);
+    assert(error);
+
+    if (n == 0) {
+        return 0;
+    }
+
+    if (nthreads_ == 0) {
+        nthreads_ = threads_ncpu();
+    }
+    nthreads_ = MIN(nthreads_, n);
+
+    state.func = func;
+    state.data = data;
+    state.n = n;
+    state.next = 0;
+    state.failed = n;
+    stimage_error_init(&state.error);
+    threads_mutex_init(&state.mutex);
+
+    /* The calling thread is one of the workers.  If a thread can not
+       be started, the work is just spread over fewer threads. */
+    if (nthreads_ > 1) {
+        threads = malloc((nthreads_ - 1) * sizeof(threads_thread_t));
+        if (threads != NULL) {
+            for (nstarted = 0; nstarted < nthreads_ - 1; ++nstarted) {
+                if (threads_start(&threads[nstarted], &state)) {
+                    break;
+                }
+            }
+        }
+    }
+
+    parallel_for_worker(&state);
+
+    for (i = 0; i < nstarted; ++i) {
+        threads_join(threads[i]);
+    }
+
+    free(threads);
+    threads_mutex_destroy(&state.mutex);
+
+    if (state.failed < n) {
+        memcpy(error, &state.error, sizeof(stimage_error_t));
+        return 1;
+    }
+
+    return 0;
+}
@@ -105,7 +105,7 @@ limit_to_bbox(
         ref_in_bbox[nout].y   = ref[i].y;
         ++nout;
 
-        assert(nout < ncoord);
+        assert(nout <= ncoord);
     }
 
     return nout;
@@ -38,28 +38,39 @@ DAMAGE.
 #include <string.h>
 
 #include "lib/xycoincide.h"
+#include "lib/xygrid.h"
 
-size_t
-xycoincide(
+/* Below this many coordinates, building the grid costs more than the
+   sweep saves. */
+#define XYCOINCIDE_GRID_MIN 64
+
+/* The expected number of coordinates the sweep scans forward from each
+   one above which the grid is faster.  On uniformly spread
+   coordinates, the grid costs about as much as a sweep with a band of
+   64 to 128. */
+#define XYCOINCIDE_GRID_MIN_BAND 64.0
+
+/* The fraction of the sorted coordinates left out at each end when
+   estimating the band */
+#define XYCOINCIDE_TRIM 0.05
+
+/* The original algorithm: sweep forward in y from each coordinate that
+   survives, deleting those that are too close to it.  This is
+   O(n * band), where band is the number of coordinates within the
+   tolerance in y, so it degrades to O(n^2) when many coordinates share
+   a narrow range of y. */
+static size_t
+xycoincide_sweep(
     const size_t ncoords,
-    const coord_t* const * const input /*[ncoords]*/,
     const coord_t** const output /*[ncoords]*/,
-    const double tolerance) {
+    const double tolerance2) {
 
-    double tolerance2 = tolerance * tolerance;
     size_t nunique = ncoords;
     double distance = 0.0;
     double r2 = 0.0;
     size_t iprev = 0;
     size_t i = 0;
 
-    assert(input);
-    assert(output);
-
-    if ((coord_t **)input != (coord_t **)output) {
-        memcpy(output, input, sizeof(coord_t *) * ncoords);
-    }
-
     for (iprev = 0; iprev < ncoords; ++iprev) {
         /* Jump to the next object if this one has been deleted,
            since all comparisons are invalid */
@@ -93,6 +104,154 @@ xycoincide(
         }
     }
 
+    return nunique;
+}
+
+/* Estimate the number of coordinates the sweep will scan forward from
+   each one, assuming they are spread evenly in y.  Since the
+   coordinates are sorted in y, the range of the bulk of them can be
+   read off directly, so that a few distant coordinates can not make
+   the sweep look cheaper than it is.  If that range is not finite,
+   the band is taken to be everything. */
+static double
+xycoincide_band(
+    const size_t ncoords,
+    const coord_t* const * const sorted /*[ncoords]*/,
+    const double tolerance) {
+
+    const size_t lo = (size_t)(XYCOINCIDE_TRIM * (double)(ncoords - 1));
+    const size_t hi = ncoords - 1 - lo;
+    const double yrange = sorted[hi]->y - sorted[lo]->y;
+
+    if (!isfinite64(yrange) || yrange <= tolerance) {
+        return (double)ncoords;
+    }
+
+    return (double)(hi - lo + 1) * (tolerance / yrange);
+}
+
+/* The same greedy keep-first rule as the sweep, turned around: in
+   list order, a coordinate is deleted if any earlier coordinate that
+   survived is within the tolerance.  Since the cells are at least the
+   tolerance on a side, those earlier coordinates can only be in the
+   3x3 block of cells around it, so this is about linear in the number
+   of coordinates however they are distributed.  The distances are
+   computed exactly as the sweep does, so the results are identical.
+
+   Returns non-zero if the grid could not be built, in which case
+   output is unchanged. */
+static int
+xycoincide_grid(
+    const size_t ncoords,
+    const coord_t** const output /*[ncoords]*/,
+    const double tolerance2,
+    size_t* const nunique) {
+
+    xygrid_t              grid;
+    xygrid_cell_t         center;
+    xygrid_cell_t         row;
+    const xygrid_entry_t* entry;
+    const coord_t*        c;
+    stimage_error_t       error;
+    double                distance;
+    double                r2;
+    size_t                nranges;
+    size_t                start[2];
+    size_t                end[2];
+    size_t                i, k, r;
+    int                   j;
+
+    stimage_error_init(&error);
+    xygrid_new(&grid);
+
+    if (xygrid_init(&grid, ncoords, output, sqrt(tolerance2), &error)) {
+        xygrid_free(&grid);
+        return 1;
+    }
+
+    *nunique = ncoords;
+    for (i = 0; i < ncoords; ++i) {
+        c = output[i];
+        /* Coordinates that are not finite are never close to
+           anything */
+        if (!coord_is_finite(c)) {
+            continue;
+        }
+
+        xygrid_cell(&grid, c, &center);
+        for (j = -1; j <= 1; ++j) {
+            row.x = center.x;
+            row.y = center.y + j;
+            nranges = xygrid_row(&grid, &row, start, end);
+            for (r = 0; r < nranges; ++r) {
+                for (k = start[r]; k < end[r]; ++k) {
+                    entry = &grid.entries[k];
+                    /* Only earlier coordinates that have not been
+                       deleted themselves count */
+                    if (entry->index >= i || output[entry->index] == NULL) {
+                        continue;
+                    }
+
+                    distance = c->y - entry->coord.y;
+                    r2 = distance * distance;
+                    if (r2 > tolerance2) {
+                        continue;
+                    }
+
+                    distance = c->x - entry->coord.x;
+                    r2 += distance * distance;
+                    if (r2 <= tolerance2) {
+                        goto delete;
+                    }
+                }
+            }
+        }
+
+        continue;
+
+    delete:
+        output[i] = NULL;
+        --(*nunique);
+    }
+
+    xygrid_free(&grid);
+
+    return 0;
+}
+
+size_t
+xycoincide(
+    const size_t ncoords,
+    const coord_t* const * const input /*[ncoords]*/,
+    const coord_t** const output /*[ncoords]*/,
+    const double tolerance) {
+
+    double tolerance2 = tolerance * tolerance;
+    size_t nunique = ncoords;
+    size_t iprev = 0;
+    size_t i = 0;
+
+    assert(input);
+    assert(output);
+
+    if ((coord_t **)input != (coord_t **)output) {
+        memcpy(output, input, sizeof(coord_t *) * ncoords);
+    }
+
+    /* The sweep is faster unless many coordinates share a narrow
+       range of y, so the grid is only used then.  The grid needs a
+       cell size, so exact duplicates (a zero tolerance) are always
+       left to the sweep, which only has to compare coordinates with
+       the same y.  So is the rare case of running out of memory for
+       the grid, since this function can not report errors. */
+    if (ncoords < XYCOINCIDE_GRID_MIN ||
+        !(tolerance2 > 0.0) || !isfinite64(tolerance2) ||
+        xycoincide_band(ncoords, output, tolerance) <=
+            XYCOINCIDE_GRID_MIN_BAND ||
+        xycoincide_grid(ncoords, output, tolerance2, &nunique)) {
+        nunique = xycoincide_sweep(ncoords, output, tolerance2);
+    }
+
     /* Compress the array */
     if (nunique < ncoords) {
         iprev = 0;
@@ -0,0 +1,272 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+
+#include <assert.h>
+#include <string.h>
+
+#include "lib/xybbox.h"
+#include "lib/xygrid.h"
+
+void
+xygrid_new(
+        xygrid_t* const grid) {
+
+    assert(grid);
+
+    memset(grid, 0, sizeof(xygrid_t));
+}
+
+/* The fraction of the coordinates left out at each end of each axis
+   by xygrid_extent, and the most coordinates it looks at */
+#define XYGRID_TRIM 0.05
+#define XYGRID_NSAMPLE 1024
+
+int
+xygrid_extent(
+        const size_t ncoords,
+        const coord_t* const * const coords, /* [ncoords] */
+        bbox_t* const extent,
+        size_t* const ninside,
+        stimage_error_t* const error) {
+
+    double* xs     = NULL;
+    double* ys     = NULL;
+    size_t  step   = ncoords / XYGRID_NSAMPLE + 1;
+    size_t  n      = 0;
+    size_t  lo     = 0;
+    size_t  hi     = 0;
+    size_t  i      = 0;
+    int     status = 1;
+
+    assert(coords || ncoords == 0);
+    assert(extent);
+    assert(ninside);
+    assert(error);
+
+    bbox_init(extent);
+    *ninside = 0;
+
+    xs = malloc_with_error(XYGRID_NSAMPLE * sizeof(double), error);
+    if (xs == NULL) goto exit;
+    ys = malloc_with_error(XYGRID_NSAMPLE * sizeof(double), error);
+    if (ys == NULL) goto exit;
+
+    for (i = 0; i < ncoords; i += step) {
+        if (coord_is_finite(coords[i])) {
+            xs[n] = coords[i]->x;
+            ys[n] = coords[i]->y;
+            ++n;
+        }
+    }
+
+    if (n == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    sort_doubles(n, xs);
+    sort_doubles(n, ys);
+    lo = (size_t)(XYGRID_TRIM * (double)(n - 1));
+    hi = n - 1 - lo;
+    extent->min.x = xs[lo];
+    extent->min.y = ys[lo];
+    extent->max.x = xs[hi];
+    extent->max.y = ys[hi];
+
+    for (i = 0; i < ncoords; ++i) {
+        if (coords[i]->x >= extent->min.x && coords[i]->x <= extent->max.x &&
+            coords[i]->y >= extent->min.y && coords[i]->y <= extent->max.y) {
+            ++(*ninside);
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(xs);
+    free(ys);
+
+    return status;
+}
+
+int
+xygrid_init(
+        xygrid_t* const grid,
+        const size_t ncoords,
+        const coord_t* const * const coords, /* [ncoords] */
+        const double cell_size,
+        stimage_error_t* const error) {
+
+    size_t        nbuckets = 4;
+    size_t*       hashes   = NULL;
+    size_t        i        = 0;
+    size_t        hash     = 0;
+    size_t        k        = 0;
+    size_t        ninside  = 0;
+    xygrid_cell_t cell;
+    bbox_t        extent;
+    double        width    = 0.0;
+    double        area     = 0.0;
+    int           status   = 1;
+
+    assert(grid);
+    assert(coords || ncoords == 0);
+    assert(error);
+
+    xygrid_new(grid);
+
+    if (!(cell_size > 0.0) || !isfinite64(cell_size)) {
+        stimage_error_set_message(error, "Grid cell size must be > 0");
+        goto exit;
+    }
+
+    while (nbuckets < ncoords) {
+        nbuckets <<= 1;
+    }
+    grid->nbuckets = nbuckets;
+
+    if (xygrid_extent(ncoords, coords, &extent, &ninside, error)) goto exit;
+
+    /* If the coordinates are sparse compared to cell_size, most cells
+       would be empty, and the occupied ones scattered through the
+       hash.  Larger cells, holding about one coordinate each, keep
+       the hash free of collisions and neighbouring rows close
+       together in memory, at the cost of a few more distance checks
+       per cell.  The density comes from the bulk of the coordinates,
+       not their full bounding box, so that a single distant
+       coordinate can not put all of the others in one cell. */
+    area = (extent.max.x - extent.min.x) * (extent.max.y - extent.min.y);
+    if (ninside > 0 && area > 0.0 && isfinite64(area)) {
+        grid->cell_size = MAX(cell_size, sqrt(area / (double)ninside));
+    } else {
+        grid->cell_size = cell_size;
+    }
+
+    /* Make the cells slightly larger than requested so that rounding
+       can never put two coordinates that are within cell_size of each
+       other more than one cell apart. */
+    grid->cell_size *= 1.0 + 1e-6;
+
+    /* Put the origin at the lower-left corner of the bulk of the
+       coordinates, and make each row of the hash as wide as it.  Cells
+       outside of it still hash correctly, they may just share buckets
+       with cells that are far away. */
+    if (isfinite64(extent.min.x)) {
+        grid->origin = extent.min;
+        width = (extent.max.x - extent.min.x) / grid->cell_size + 1.0;
+        grid->row_stride = (size_t)MIN(width, 1073741824.0);
+        /* Keep rows that are wider than the hash from all starting in
+           the same bucket */
+        if (grid->row_stride >= nbuckets) {
+            grid->row_stride |= 1;
+        }
+    } else {
+        grid->origin.x = 0.0;
+        grid->origin.y = 0.0;
+        grid->row_stride = 1;
+    }
+
+    grid->bucket_start = calloc_with_error(
+            nbuckets + 1, sizeof(size_t), error);
+    if (grid->bucket_start == NULL) goto exit;
+
+    hashes = malloc_with_error(ncoords * sizeof(size_t) + 1, error);
+    if (hashes == NULL) goto exit;
+
+    /* Count the number of entries in each bucket.  Non-finite
+       coordinates can never be near anything, so they are marked
+       with an out-of-range hash and left out. */
+    for (i = 0; i < ncoords; ++i) {
+        if (!coord_is_finite(coords[i])) {
+            hashes[i] = nbuckets;
+            continue;
+        }
+        xygrid_cell(grid, coords[i], &cell);
+        hash = xygrid_hash(grid, &cell);
+        hashes[i] = hash;
+        ++grid->bucket_start[hash + 1];
+        ++grid->nentries;
+    }
+
+    for (i = 0; i < nbuckets; ++i) {
+        grid->bucket_start[i + 1] += grid->bucket_start[i];
+    }
+
+    grid->entries = malloc_with_error(
+            grid->nentries * sizeof(xygrid_entry_t) + 1, error);
+    if (grid->entries == NULL) goto exit;
+
+    /* Fill the buckets.  bucket_start[hash] is used as the insertion
+       point, which leaves it pointing at the start of the next
+       bucket, so it is shifted back afterward. */
+    for (i = 0; i < ncoords; ++i) {
+        hash = hashes[i];
+        if (hash == nbuckets) {
+            continue;
+        }
+        k = grid->bucket_start[hash]++;
+        grid->entries[k].coord = *coords[i];
+        grid->entries[k].index = i;
+    }
+
+    for (i = nbuckets; i > 0; --i) {
+        grid->bucket_start[i] = grid->bucket_start[i - 1];
+    }
+    grid->bucket_start[0] = 0;
+
+    status = 0;
+
+ exit:
+
+    free(hashes);
+    if (status) {
+        xygrid_free(grid);
+    }
+
+    return status;
+}
+
+void
+xygrid_free(
+        xygrid_t* const grid) {
+
+    assert(grid);
+
+    free(grid->bucket_start); grid->bucket_start = NULL;
+    free(grid->entries); grid->entries = NULL;
+}
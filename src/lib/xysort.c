@@ -37,6 +37,7 @@ DAMAGE.
 #include <assert.h>
 #include <stdlib.h>
 
+#include "lib/radixsort.h"
 #include "lib/xysort.h"
 
 /* DIFF: The documentation of the original function (part of rg_sort)
@@ -73,21 +74,57 @@ xysort_compare(const void* ap, const void* bp) {
     }
 }
 
+/* Sort with qsort, if the key buffers for the radix sort can not be
+   allocated */
+static void
+xysort_qsort(
+    const size_t ncoords,
+    const coord_t* const coords,
+    const coord_t** const coords_ptr /* [ncoords] */) {
+
+    size_t i;
+
+    /* Fill the pointer array */
+    for (i = 0; i < ncoords; ++i) {
+        coords_ptr[i] = (coord_t*)coords + i;
+    }
+
+    qsort(coords_ptr, ncoords, sizeof(coord_t**), &xysort_compare);
+}
+
 void
 xysort(
     const size_t ncoords,
-    const coord_t* const coords /* [ncoords] */,
+    const coord_t* const coords,
     const coord_t** const coords_ptr /* [ncoords] */) {
 
+    radix_record_t* records = NULL;
     size_t i;
 
     assert(coords);
     assert(coords_ptr);
 
-    /* Fill the pointer array */
+    /* The (y, x) keys are copied out and radix sorted, which gives
+       the same order as xysort_compare.  Since the sort is stable,
+       coordinates that are exactly the same stay in their original
+       order. */
+    records = malloc(2 * ncoords * sizeof(radix_record_t) + 1);
+    if (records == NULL) {
+        xysort_qsort(ncoords, coords, coords_ptr);
+        return;
+    }
+
     for (i = 0; i < ncoords; ++i) {
-        coords_ptr[i] = (coord_t*)coords + i;
+        records[i].key[0] = radix_key_double(coords[i].y);
+        records[i].key[1] = radix_key_double(coords[i].x);
+        records[i].index = i;
     }
 
-    qsort(coords_ptr, ncoords, sizeof(coord_t**), &xysort_compare);
+    radix_sort(ncoords, 2, records, records + ncoords);
+
+    for (i = 0; i < ncoords; ++i) {
+        coords_ptr[i] = (coord_t*)coords + records[i].index;
+    }
+
+    free(records);
 }
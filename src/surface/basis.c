@@ -0,0 +1,156 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+
+#include "lib/polynomial.h"
+#include "surface/vector.h"
+#include <assert.h>
+#include <stdlib.h>
+
+#include "lib/polynomial.h"
+#include "surface/basis.h"
+
+void
+surface_basis_new(
+        surface_basis_t* const b) {
+
+    assert(b);
+
+    b->ncoord = 0;
+    b->xorder = 0;
+    b->yorder = 0;
+    b->xbasis = NULL;
+    b->ybasis = NULL;
+}
+
+int
+surface_basis_init(
+        surface_basis_t* const b,
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        stimage_error_t* const error) {
+
+    assert(b);
+    assert(s);
+    assert(coord);
+    assert(error);
+
+    surface_basis_new(b);
+
+    b->type = s->type;
+    b->xrange = s->xrange;
+    b->xmaxmin = s->xmaxmin;
+    b->yrange = s->yrange;
+    b->ymaxmin = s->ymaxmin;
+
+    /* Always allocate something, so that an empty basis still looks
+       initialized */
+    b->xbasis = malloc_with_error(
+            MAX(s->xorder * ncoord, 1) * sizeof(double), error);
+    if (b->xbasis == NULL) goto fail;
+    b->ybasis = malloc_with_error(
+            MAX(s->yorder * ncoord, 1) * sizeof(double), error);
+    if (b->ybasis == NULL) goto fail;
+
+    switch (s->type) {
+    case surface_type_polynomial:
+        if (basis_poly(
+                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
+                    b->xbasis, error)) goto fail;
+        if (basis_poly(
+                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
+                    b->ybasis, error)) goto fail;
+        break;
+    case surface_type_chebyshev:
+        if (basis_chebyshev(
+                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
+                    b->xbasis, error)) goto fail;
+        if (basis_chebyshev(
+                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
+                    b->ybasis, error)) goto fail;
+        break;
+    case surface_type_legendre:
+        if (basis_legendre(
+                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
+                    b->xbasis, error)) goto fail;
+        if (basis_legendre(
+                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
+                    b->ybasis, error)) goto fail;
+        break;
+    default:
+        stimage_error_set_message(error, "Illegal curve type");
+        goto fail;
+    }
+
+    b->ncoord = ncoord;
+    b->xorder = s->xorder;
+    b->yorder = s->yorder;
+
+    return 0;
+
+ fail:
+    surface_basis_free(b);
+
+    return 1;
+}
+
+int
+surface_basis_covers(
+        const surface_basis_t* const b,
+        const surface_t* const s,
+        const size_t ncoord) {
+
+    assert(b);
+    assert(s);
+
+    return (b->xbasis != NULL &&
+            b->type == s->type &&
+            b->ncoord == ncoord &&
+            b->xorder >= s->xorder &&
+            b->yorder >= s->yorder &&
+            b->xrange == s->xrange &&
+            b->xmaxmin == s->xmaxmin &&
+            b->yrange == s->yrange &&
+            b->ymaxmin == s->ymaxmin);
+}
+
+void
+surface_basis_free(
+        surface_basis_t* const b) {
+
+    assert(b);
+
+    free(b->xbasis);
+    free(b->ybasis);
+    surface_basis_new(b);
+}
@@ -33,6 +33,7 @@ DAMAGE.
 #include <stdio.h>
 
 #include "surface/cholesky.h"
+#include "surface/basis.h"
 #include "surface/fit.h"
 #include "lib/polynomial.h"
 
@@ -52,30 +53,30 @@ vector_dot_product(
     return sum;
 }
 
-/* was dgsacpts */
+/* Accumulate the normal equations of a surface for a number of data
+   points, given the values of the basis functions at each point,
+   xbasis [s->xorder * ncoord] and ybasis [s->yorder * ncoord] */
 static int
-surface_fit_add_points(
+surface_fit_accumulate(
         surface_t* const s,
         const size_t ncoord,
-        const coord_t* const coord,
+        const double* const xbasis,
+        const double* const ybasis,
         const double* const z,
-        double* const w,
-        const surface_fit_weight_e weight_type,
+        const double* const w,
         stimage_error_t* const error) {
 
     size_t i, j, k, l, ii, jj, ll;
     double* byw = NULL;
     double* bw = NULL;
-    double* xbasis = NULL;
-    double* ybasis = NULL;
     double* vzp;
     double* mzp;
-    double* bxp;
-    double* byp;
+    const double* bxp;
+    const double* byp;
     double* vindex;
     double* mindex;
-    double* bbyp;
-    double* bbxp;
+    const double* bbyp;
+    const double* bbxp;
     int xorder;
     int xxorder;
     int maxorder;
@@ -83,81 +84,14 @@ surface_fit_add_points(
     int status = 1;
 
     assert(s);
-    assert(coord);
+    assert(xbasis);
+    assert(ybasis);
     assert(z);
     assert(w);
     assert(error);
     assert(s->vector);
     assert(s->matrix);
 
-    /* Increment the number of points */
-    s->npoints += ncoord;
-
-    /* Calculate weights */
-    switch (weight_type) {
-    case surface_fit_weight_spacing:
-        if (ncoord == 1) {
-            w[0] = 1.0;
-        } else {
-            w[0] = ABS(coord[1].x - coord[0].x);
-        }
-
-        for (i = 1; i < ncoord - 1; ++i) {
-            w[i] = ABS(coord[i+1].x - coord[i-1].x);
-        }
-
-        if (ncoord == 1) {
-            w[ncoord-1] = 1.0;
-        } else {
-            w[ncoord-1] = ABS(coord[ncoord-1].x - coord[ncoord-2].x);
-        }
-        break;
-    case surface_fit_weight_user:
-        /* User supplied-weights: don't touch the w vector */
-        break;
-    default:
-        for (i = 0; i < ncoord; ++i) {
-            w[i] = 1.0;
-        }
-        break;
-    }
-
-    xbasis = malloc_with_error(ncoord * s->xorder * sizeof(double), error);
-    if (xbasis == NULL) goto exit;
-    ybasis = malloc_with_error(ncoord * s->yorder * sizeof(double), error);
-    if (ybasis == NULL) goto exit;
-
-    /* Calculate the non-zero basis functions */
-    switch (s->type) {
-    case surface_type_polynomial:
-        if (basis_poly(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_poly(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    case surface_type_chebyshev:
-        if (basis_chebyshev(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_chebyshev(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    case surface_type_legendre:
-        if (basis_legendre(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_legendre(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    default:
-        stimage_error_set_message(error, "Illegal curve type");
-        goto exit;
-    }
-
     /* Allocate temporary space for matrix accumulation */
     byw = malloc_with_error(ncoord * sizeof(double), error);
     if (byw == NULL) goto exit;
@@ -179,7 +113,7 @@ surface_fit_add_points(
 
         bxp = xbasis;
 
-        for (k = 1; k <= s->xorder; ++k) {
+        for (k = 1; k <= xorder; ++k) {
             for (i = 0; i < ncoord; ++i) {
                 bw[i] = byw[i] * bxp[i];
             }
@@ -248,19 +182,152 @@ surface_fit_add_points(
 
     status = 0;
 
-    surface_print(s);
-
  exit:
 
     free(byw);
     free(bw);
-    free(xbasis);
-    free(ybasis);
 
     return status;
 }
 
-static int
+/* was dgsacpts */
+int
+surface_fit_add_points(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        stimage_error_t* const error) {
+
+    surface_basis_t basis;
+    size_t i;
+    int status = 1;
+
+    assert(s);
+    assert(coord);
+    assert(z);
+    assert(w);
+    assert(error);
+    assert(s->vector);
+    assert(s->matrix);
+
+    surface_basis_new(&basis);
+
+    /* Increment the number of points */
+    s->npoints += ncoord;
+
+    /* Calculate weights */
+    switch (weight_type) {
+    case surface_fit_weight_spacing:
+        if (ncoord == 1) {
+            w[0] = 1.0;
+        } else {
+            w[0] = ABS(coord[1].x - coord[0].x);
+        }
+
+        for (i = 1; i < ncoord - 1; ++i) {
+            w[i] = ABS(coord[i+1].x - coord[i-1].x);
+        }
+
+        if (ncoord == 1) {
+            w[ncoord-1] = 1.0;
+        } else {
+            w[ncoord-1] = ABS(coord[ncoord-1].x - coord[ncoord-2].x);
+        }
+        break;
+    case surface_fit_weight_user:
+        /* User supplied-weights: don't touch the w vector */
+        break;
+    default:
+        for (i = 0; i < ncoord; ++i) {
+            w[i] = 1.0;
+        }
+        break;
+    }
+
+    /* Calculate the non-zero basis functions */
+    if (surface_basis_init(&basis, s, ncoord, coord, error)) goto exit;
+
+    if (surface_fit_accumulate(
+                s, ncoord, basis.xbasis, basis.ybasis, z, w,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    surface_basis_free(&basis);
+
+    return status;
+}
+
+int
+surface_fit_add_basis(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const double* const z,
+        const double* const w,
+        stimage_error_t* const error) {
+
+    assert(s);
+    assert(basis);
+    assert(surface_basis_covers(basis, s, basis->ncoord));
+
+    s->npoints += basis->ncoord;
+
+    return surface_fit_accumulate(
+            s, basis->ncoord, basis->xbasis, basis->ybasis, z, w, error);
+}
+
+int
+surface_fit_remove_points(
+        surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const coord,
+        const double* const z,
+        const double* const w,
+        stimage_error_t* const error) {
+
+    double* negw = NULL;
+    size_t  i;
+    int     status = 1;
+
+    assert(s);
+    assert(error);
+
+    if (ncoord == 0) {
+        return 0;
+    }
+
+    assert(coord);
+    assert(z);
+    assert(w);
+
+    /* The normal equations are linear in the weights, so adding the
+       points again with their weights negated removes them */
+    negw = malloc_with_error(ncoord * sizeof(double), error);
+    if (negw == NULL) goto exit;
+    for (i = 0; i < ncoord; ++i) {
+        negw[i] = -w[i];
+    }
+
+    if (surface_fit_add_points(
+                s, ncoord, coord, z, negw, surface_fit_weight_user,
+                error)) goto exit;
+    s->npoints -= ncoord;
+
+    status = 0;
+
+ exit:
+
+    free(negw);
+
+    return status;
+}
+
+int
 surface_fit_solve(
         surface_t* const s,
         /* Output  */
@@ -302,7 +369,46 @@ surface_fit_solve(
         return 1;
     }
 
-    surface_print(s);
+    return 0;
+}
+
+int
+surface_fit_merge(
+        surface_t* const s,
+        const surface_t* const other,
+        stimage_error_t* const error) {
+
+    size_t i;
+
+    assert(s);
+    assert(other);
+    assert(error);
+    assert(s->matrix);
+    assert(s->vector);
+    assert(other->matrix);
+    assert(other->vector);
+
+    if (s->type != other->type ||
+        s->xorder != other->xorder ||
+        s->yorder != other->yorder ||
+        s->xterms != other->xterms ||
+        s->ncoeff != other->ncoeff ||
+        s->xrange != other->xrange ||
+        s->xmaxmin != other->xmaxmin ||
+        s->yrange != other->yrange ||
+        s->ymaxmin != other->ymaxmin) {
+        stimage_error_set_message(
+                error, "Can not merge the fits of different surfaces");
+        return 1;
+    }
+
+    s->npoints += other->npoints;
+    for (i = 0; i < s->ncoeff; ++i) {
+        s->vector[i] += other->vector[i];
+    }
+    for (i = 0; i < s->ncoeff * s->ncoeff; ++i) {
+        s->matrix[i] += other->matrix[i];
+    }
 
     return 0;
 }
@@ -333,3 +439,28 @@ surface_fit(
 
     return 0;
 }
+
+int
+surface_fit_basis(
+        surface_t* const s,
+        const surface_basis_t* const basis,
+        const double* const z,
+        const double* const w,
+        /* Output */
+        surface_fit_error_e* const error_type,
+        stimage_error_t* const error) {
+
+    assert(s);
+    assert(basis);
+    assert(z);
+    assert(w);
+    assert(error);
+
+    if (surface_zero(s, error) ||
+        surface_fit_add_basis(s, basis, z, w, error) ||
+        surface_fit_solve(s, error_type, error)) {
+        return 1;
+    }
+
+    return 0;
+}
@@ -88,9 +88,9 @@ surface_init(
             goto fail;
         }
         s->xrange = 2.0 / (bbox->max.x - bbox->min.x);
-        s->xmaxmin = -(bbox->max.x - bbox->min.x) / 2.0;
+        s->xmaxmin = -(bbox->max.x + bbox->min.x) / 2.0;
         s->yrange = 2.0 / (bbox->max.y - bbox->min.y);
-        s->ymaxmin = -(bbox->max.y - bbox->min.y) / 2.0;
+        s->ymaxmin = -(bbox->max.y + bbox->min.y) / 2.0;
         break;
 
     case surface_type_polynomial:
@@ -257,7 +257,7 @@ surface_zero(
     case surface_type_legendre:
     case surface_type_polynomial:
     case surface_type_chebyshev:
-        /* s->npoints = 0; */
+        s->npoints = 0;
 
         for (i = 0; i < s->ncoeff; ++i) {
             s->vector[i] = 0.0;
@@ -113,3 +113,69 @@ surface_vector(
 
     return status;
 }
+
+int
+surface_vector_basis(
+        const surface_t* const s,
+        const surface_basis_t* const basis,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    assert(s);
+    assert(basis);
+    assert(surface_basis_covers(basis, s, basis->ncoord));
+    assert(zfit);
+    assert(error);
+
+    return eval_basis(
+            s->xorder, s->yorder, s->coeff, basis->ncoord, s->xterms,
+            basis->xbasis, basis->ybasis, zfit, error);
+}
+
+int
+surface_vector_deriv(
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        double* const dzdx,
+        double* const dzdy,
+        stimage_error_t* const error) {
+
+    assert(s);
+    assert(ref);
+    assert(dzdx);
+    assert(dzdy);
+    assert(error);
+
+    switch (s->type) {
+    case surface_type_polynomial:
+        return deriv_poly(
+                s->xorder, s->yorder, s->coeff,
+                ncoord, ref, s->xterms,
+                s->xmaxmin, s->xrange,
+                s->ymaxmin, s->yrange,
+                dzdx, dzdy, error);
+
+    case surface_type_chebyshev:
+        return deriv_chebyshev(
+                s->xorder, s->yorder, s->coeff,
+                ncoord, ref, s->xterms,
+                s->xmaxmin, s->xrange,
+                s->ymaxmin, s->yrange,
+                dzdx, dzdy, error);
+
+    case surface_type_legendre:
+        return deriv_legendre(
+                s->xorder, s->yorder, s->coeff,
+                ncoord, ref, s->xterms,
+                s->xmaxmin, s->xrange,
+                s->ymaxmin, s->yrange,
+                dzdx, dzdy, error);
+
+    default:
+        stimage_error_set_message(error, "Unknown surface function");
+        return 1;
+    }
+}
@@ -42,6 +42,13 @@ DAMAGE.
 #include "wrap_util.h"
 #include "immatch/geomap.h"
 
+/* A row of the output of geomap_many.  This must match the dtype
+   built by geomap_output_dtype. */
+typedef struct {
+    size_t          frame;
+    geomap_output_t output;
+} geomap_many_output_t;
+
 typedef struct {
     PyObject_HEAD
     PyObject *fit_geometry;
@@ -56,13 +63,21 @@ typedef struct {
     PyObject *ycoeff;
     PyObject *x2coeff;
     PyObject *y2coeff;
+    geomap_result_t result;
 } geomap_object;
 
+/* The number of coordinates evaluated at a time, so the scratch
+   buffers stay small however many there are */
+#define GEOMAP_EVAL_CHUNK 65536
+
 static PyObject *
 geomap_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
     geomap_object *self;
     self = (geomap_object *)type->tp_alloc(type, 0);
+    if (self != NULL) {
+        geomap_result_init(&self->result);
+    }
 
     return (PyObject *)self;
 }
@@ -139,10 +154,248 @@ geomap_dealloc(geomap_object *self)
     Py_XDECREF(self->ycoeff);
     Py_XDECREF(self->x2coeff);
     Py_XDECREF(self->y2coeff);
+    geomap_result_free(&self->result);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
+/* Evaluate the fit at n reference coordinates, given as separate x
+   and y arrays with the given strides in bytes, into xfit and yfit,
+   with the same strides.  If inverse is set, the coordinates are
+   input coordinates instead, and the output is the reference
+   coordinates, found to the given tolerance.  The GIL is released
+   while it works. */
+static int
+geomap_eval_strided(
+        const geomap_result_t* const fit,
+        const int inverse,
+        const double tolerance,
+        const size_t maxiter,
+        const size_t n,
+        const char* x,
+        const char* y,
+        const npy_intp in_stride,
+        char* xfit,
+        char* yfit,
+        const npy_intp out_stride) {
+
+    coord_t*        ref    = NULL;
+    double*         buffer = NULL;
+    size_t          chunk  = MAX(MIN(n, GEOMAP_EVAL_CHUNK), 1);
+    size_t          start  = 0;
+    size_t          m      = 0;
+    size_t          i      = 0;
+    int             status = 1;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    ref = malloc(chunk * sizeof(coord_t));
+    buffer = malloc(2 * chunk * sizeof(double));
+    if (ref == NULL || buffer == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (start = 0; start < n; start += m) {
+        m = MIN(n - start, chunk);
+        for (i = 0; i < m; ++i) {
+            ref[i].x = *(double*)(x + (start + i) * in_stride);
+            ref[i].y = *(double*)(y + (start + i) * in_stride);
+        }
+        if (inverse) {
+            if (geomap_result_eval_inverse(
+                        fit, m, ref, tolerance, maxiter,
+                        buffer, buffer + chunk, &error)) {
+                break;
+            }
+        } else if (geomap_result_eval(
+                           fit, m, ref, buffer, buffer + chunk, &error)) {
+            break;
+        }
+        for (i = 0; i < m; ++i) {
+            *(double*)(xfit + (start + i) * out_stride) = buffer[i];
+            *(double*)(yfit + (start + i) * out_stride) = buffer[chunk + i];
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (start < n) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(ref);
+    free(buffer);
+
+    return status;
+}
+
+static PyObject *
+geomap_evaluate(geomap_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject* x_obj   = NULL;
+    PyObject* y_obj   = NULL;
+    PyObject* x_array = NULL;
+    PyObject* y_array = NULL;
+    PyObject* xfit    = NULL;
+    PyObject* yfit    = NULL;
+    PyObject* result  = NULL;
+
+    const char* keywords[] = {"x", "y", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO:evaluate", (char **)keywords,
+                &x_obj, &y_obj)) {
+        return NULL;
+    }
+
+    x_array = PyArray_ContiguousFromAny(x_obj, NPY_DOUBLE, 0, 0);
+    if (x_array == NULL) {
+        goto exit;
+    }
+
+    y_array = PyArray_ContiguousFromAny(y_obj, NPY_DOUBLE, 0, 0);
+    if (y_array == NULL) {
+        goto exit;
+    }
+
+    if (!PyArray_SAMESHAPE((PyArrayObject*)x_array, (PyArrayObject*)y_array)) {
+        PyErr_SetString(PyExc_ValueError, "x and y must be the same shape");
+        goto exit;
+    }
+
+    xfit = PyArray_SimpleNew(
+            PyArray_NDIM(x_array), PyArray_DIMS(x_array), NPY_DOUBLE);
+    if (xfit == NULL) {
+        goto exit;
+    }
+
+    yfit = PyArray_SimpleNew(
+            PyArray_NDIM(x_array), PyArray_DIMS(x_array), NPY_DOUBLE);
+    if (yfit == NULL) {
+        goto exit;
+    }
+
+    if (geomap_eval_strided(
+                &self->result, 0, 0.0, 0, (size_t)PyArray_SIZE(x_array),
+                PyArray_DATA(x_array), PyArray_DATA(y_array), sizeof(double),
+                PyArray_DATA(xfit), PyArray_DATA(yfit), sizeof(double))) {
+        goto exit;
+    }
+
+    result = Py_BuildValue("OO", xfit, yfit);
+
+ exit:
+
+    Py_XDECREF(x_array);
+    Py_XDECREF(y_array);
+    Py_XDECREF(xfit);
+    Py_XDECREF(yfit);
+
+    return result;
+}
+
+/* Evaluate the fit, or its inverse, at an Nx2 array of coordinates */
+static PyObject *
+geomap_eval_coords(
+        geomap_object *self,
+        PyObject *xy_obj,
+        const int inverse,
+        const double tolerance,
+        const size_t maxiter)
+{
+    PyObject* xy_array = NULL;
+    PyObject* fit      = NULL;
+    double*   data     = NULL;
+
+    xy_array = to_coord_array("xy", xy_obj);
+    if (xy_array == NULL) {
+        return NULL;
+    }
+
+    fit = PyArray_SimpleNew(2, PyArray_DIMS(xy_array), NPY_DOUBLE);
+    if (fit == NULL) {
+        goto exit;
+    }
+
+    data = (double*)PyArray_DATA(xy_array);
+    if (geomap_eval_strided(
+                &self->result, inverse, tolerance, maxiter,
+                (size_t)PyArray_DIM(xy_array, 0),
+                (char*)data, (char*)(data + 1), sizeof(coord_t),
+                PyArray_DATA(fit), (char*)PyArray_DATA(fit) + sizeof(double),
+                sizeof(coord_t))) {
+        Py_CLEAR(fit);
+        goto exit;
+    }
+
+ exit:
+
+    Py_DECREF(xy_array);
+
+    return fit;
+}
+
+static PyObject *
+geomap_call(geomap_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject* xy_obj = NULL;
+
+    const char* keywords[] = {"xy", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O:GeomapResults", (char **)keywords, &xy_obj)) {
+        return NULL;
+    }
+
+    return geomap_eval_coords(self, xy_obj, 0, 0.0, 0);
+}
+
+static PyObject *
+geomap_inverse(geomap_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject* xy_obj      = NULL;
+    double    tolerance   = 1e-8;
+    Py_ssize_t maxiter_arg = 20;
+    size_t    maxiter     = 0;
+
+    const char* keywords[] = {"xy", "tolerance", "maxiter", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O|dn:inverse", (char **)keywords,
+                &xy_obj, &tolerance, &maxiter_arg)) {
+        return NULL;
+    }
+
+    if (!(tolerance >= 0.0)) {
+        PyErr_SetString(PyExc_ValueError, "tolerance must be non-negative");
+        return NULL;
+    }
+
+    if (to_size_t("maxiter", maxiter_arg, &maxiter)) {
+        return NULL;
+    }
+
+    return geomap_eval_coords(self, xy_obj, 1, tolerance, maxiter);
+}
+
 static PyMethodDef geomap_methods[] = {
+    {"evaluate", (PyCFunction)geomap_evaluate, METH_VARARGS | METH_KEYWORDS,
+     "evaluate(x, y) -> (xfit, yfit)\n\n"
+     "Evaluate the fit at the reference coordinates given by the arrays "
+     "*x* and *y*, of the same shape, and return the fitted input "
+     "coordinates as two arrays of that shape."},
+    {"inverse", (PyCFunction)geomap_inverse, METH_VARARGS | METH_KEYWORDS,
+     "inverse(xy, tolerance=1e-8, maxiter=20) -> array\n\n"
+     "Find the reference coordinates that the fit maps to each of an "
+     "Nx2 array of input coordinates.  Each is found by Newton's method, "
+     "to within *tolerance* in input coordinates, or is NaN if that "
+     "takes more than *maxiter* iterations or the steps stop shrinking."},
     {NULL}  /* Sentinel */
 };
 
@@ -164,7 +417,7 @@ static PyMemberDef geomap_members[] = {
 
 static PyTypeObject geomap_class = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "py_geomap.GeomapResults", /* tp_name */
+    "stsci.stimage._stimage.GeomapResults", /* tp_name */
     sizeof(geomap_object),     /* tp_basicsize */
     0,                         /* tp_itemsize */
     (destructor)geomap_dealloc,/* tp_dealloc */
@@ -177,13 +430,16 @@ static PyTypeObject geomap_class = {
     0,                         /* tp_as_sequence */
     0,                         /* tp_as_mapping */
     0,                         /* tp_hash */
-    0,                         /* tp_call */
+    (ternaryfunc)geomap_call,  /* tp_call */
     0,                         /* tp_str */
     0,                         /* tp_getattro */
     0,                         /* tp_setattro */
     0,                         /* tp_as_buffer */
     Py_TPFLAGS_DEFAULT,        /* tp_flags */
-    "geomap result objects",   /* tp_doc */
+    "geomap result objects.\n\n"
+    "Calling the object with an Nx2 array of reference coordinates "
+    "returns the fitted input coordinates as an Nx2 array.",
+                               /* tp_doc */
     0,		                   /* tp_traverse */
     0,		                   /* tp_clear */
     0,		                   /* tp_richcompare */
@@ -203,6 +459,111 @@ static PyTypeObject geomap_class = {
     geomap_new,                /* tp_new */
 };
 
+/* The dtype of the output of geomap, with a leading frame column for
+   geomap_many.  Returns a new reference, or NULL with a Python
+   exception set. */
+static PyArray_Descr*
+geomap_output_dtype(const int with_frame)
+{
+    PyObject*      dtype_list = NULL;
+    PyObject*      frame      = NULL;
+    PyArray_Descr* dtype      = NULL;
+
+    dtype_list = Py_BuildValue(
+            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
+            "input_x", "f8",
+            "input_y", "f8",
+            "ref_x", "f8",
+            "ref_y", "f8",
+            "fit_x", "f8",
+            "fit_y", "f8",
+            "resid_x", "f8",
+            "resid_y", "f8");
+    if (dtype_list == NULL) {
+        goto exit;
+    }
+
+    if (with_frame) {
+        frame = Py_BuildValue("(ss)", "frame", SIZE_T_D);
+        if (frame == NULL || PyList_Insert(dtype_list, 0, frame)) {
+            goto exit;
+        }
+    }
+
+    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+        dtype = NULL;
+    }
+
+ exit:
+
+    Py_XDECREF(dtype_list);
+    Py_XDECREF(frame);
+
+    return dtype;
+}
+
+/* Make a GeomapResults object for a fit.  On success, the object
+   takes over the memory of the fit, and it is reset, as if by
+   geomap_result_init. */
+static PyObject *
+geomap_results_from_fit(geomap_result_t* fit)
+{
+    PyObject* fit_obj = NULL;
+    PyObject* tmp     = NULL;
+    npy_intp  dims    = 0;
+    size_t    i       = 0;
+
+    fit_obj = geomap_new(&geomap_class, NULL, NULL);
+    if (fit_obj == NULL) {
+        return NULL;
+    }
+
+    #define ADD_ATTR(func, member, name) \
+        if ((func)((member), &tmp)) goto exit;      \
+        if (PyObject_SetAttrString(fit_obj, (name), tmp)) { \
+            Py_DECREF(tmp); \
+            goto exit; \
+        } \
+        Py_DECREF(tmp);
+
+    #define ADD_ARRAY(size, member, name) \
+        dims = (size); \
+        tmp = PyArray_SimpleNew(1, &dims, NPY_DOUBLE); \
+        if (tmp == NULL) goto exit; \
+        for (i = 0; i < (size); ++i) ((double*)PyArray_DATA(tmp))[i] = (member)[i]; \
+        if (PyObject_SetAttrString(fit_obj, (name), tmp)) { \
+            Py_DECREF(tmp); \
+            goto exit; \
+        } \
+        Py_DECREF(tmp);
+
+    ADD_ATTR(from_geomap_fit_e, fit->fit_geometry, "fit_geometry");
+    ADD_ATTR(from_surface_type_e, fit->function, "function");
+    ADD_ATTR(from_coord_t, &fit->rms, "rms");
+    ADD_ATTR(from_coord_t, &fit->mean_ref, "mean_ref");
+    ADD_ATTR(from_coord_t, &fit->mean_input, "mean_input");
+    ADD_ATTR(from_coord_t, &fit->shift, "shift");
+    ADD_ATTR(from_coord_t, &fit->mag, "mag");
+    ADD_ATTR(from_coord_t, &fit->rotation, "rotation");
+    ADD_ARRAY(fit->nxcoeff, fit->xcoeff, "xcoeff");
+    ADD_ARRAY(fit->nycoeff, fit->ycoeff, "ycoeff");
+    ADD_ARRAY(fit->nx2coeff, fit->x2coeff, "x2coeff");
+    ADD_ARRAY(fit->ny2coeff, fit->y2coeff, "y2coeff");
+
+    /* The result object keeps the fitted surfaces, so it can evaluate
+       the fit at other coordinates */
+    ((geomap_object*)fit_obj)->result = *fit;
+    geomap_result_init(fit);
+
+    return fit_obj;
+
+ exit:
+
+    Py_DECREF(fit_obj);
+
+    return NULL;
+}
+
 PyObject*
 py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     PyObject* input_obj        = NULL;
@@ -231,15 +592,13 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     xterms_e       yxterms      = xterms_half;
 
     geomap_result_t  fit;
-    PyObject*        tmp          = NULL;
     npy_intp         dims         = 0;
-    size_t           i            = 0;
     size_t           noutput      = 0;
     geomap_output_t* output       = NULL;
-    PyObject*        dtype_list   = NULL;
     PyArray_Descr*   dtype        = NULL;
     PyObject*        result       = NULL;
     PyObject*        output_array = NULL;
+    int              status       = 0;
     stimage_error_t  error;
 
     const char*    keywords[]    = {
@@ -261,25 +620,15 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
         return NULL;
     }
 
-    input_array = (PyObject*)PyArray_ContiguousFromAny(
-            input_obj, NPY_DOUBLE, 2, 2);
+    input_array = to_coord_array("input", input_obj);
     if (input_array == NULL) {
         goto exit;
     }
-    if (PyArray_DIM(input_array, 1) != 2) {
-        PyErr_SetString(PyExc_TypeError, "input array must be an Nx2 array");
-        goto exit;
-    }
 
-    ref_array = (PyObject*)PyArray_ContiguousFromAny(
-            ref_obj, NPY_DOUBLE, 2, 2);
+    ref_array = to_coord_array("ref", ref_obj);
     if (ref_array == NULL) {
         goto exit;
     }
-    if (PyArray_DIM(ref_array, 1) != 2) {
-        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
-        goto exit;
-    }
 
     if (to_bbox_t("bbox", bbox_obj, &bbox) ||
         to_geomap_fit_e("fit_geometry", fit_geometry_str, &fit_geometry) ||
@@ -298,129 +647,821 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    if (geomap(
-                ninput, (coord_t*)PyArray_DATA(input_array),
-                nref, (coord_t*)PyArray_DATA(ref_array),
-                &bbox, fit_geometry, surface_type,
-                xxorder, xyorder, yxorder, yyorder,
-                xxterms, yxterms,
-                maxiter, reject,
-                &noutput, output, &fit,
-                &error)) {
+    /* geomap only touches the arrays and its own arguments, so other
+       Python threads may run while it works */
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap(
+            ninput, (coord_t*)PyArray_DATA(input_array),
+            nref, (coord_t*)PyArray_DATA(ref_array),
+            &bbox, fit_geometry, surface_type,
+            xxorder, xyorder, yxorder, yyorder,
+            xxterms, yxterms,
+            maxiter, reject,
+            &noutput, output, &fit,
+            &error);
+    Py_END_ALLOW_THREADS
+
+    if (status) {
         PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
         goto exit;
     }
 
-    dtype_list = Py_BuildValue(
-            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
-            "input_x", "f8",
-            "input_y", "f8",
-            "ref_x", "f8",
-            "ref_y", "f8",
-            "fit_x", "f8",
-            "fit_y", "f8",
-            "resid_x", "f8",
-            "resid_y", "f8");
-    if (dtype_list == NULL) {
-        goto exit;
-    }
-    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+    dtype = geomap_output_dtype(0);
+    if (dtype == NULL) {
         goto exit;
     }
-    Py_DECREF(dtype_list);
     dims = (npy_intp)noutput;
     output_array = PyArray_NewFromDescr(
             &PyArray_Type, dtype, 1, &dims, NULL, output,
-            NPY_OWNDATA, NULL);
+            NPY_ARRAY_CARRAY, NULL);
     if (output_array == NULL) {
         goto exit;
     }
+    /* The array owns the output buffer from here on.  Numpy ignores
+       NPY_ARRAY_OWNDATA when it is given the data, so it has to be
+       set afterward. */
+    PyArray_ENABLEFLAGS((PyArrayObject*)output_array, NPY_ARRAY_OWNDATA);
+    output = NULL;
 
-    fit_obj = geomap_new(&geomap_class, NULL, NULL);
-    
-    #define ADD_ATTR(func, member, name) \
-        if ((func)((member), &tmp)) goto exit;      \
-        PyObject_SetAttrString(fit_obj, (name), tmp);       \
-        Py_DECREF(tmp);
+    fit_obj = geomap_results_from_fit(&fit);
+    if (fit_obj == NULL) {
+        goto exit;
+    }
 
-    #define ADD_ARRAY(size, member, name) \
-        dims = (size); \
-        tmp = PyArray_SimpleNew(1, &dims, NPY_DOUBLE); \
-        if (tmp == NULL) goto exit; \
-        for (i = 0; i < (size); ++i) ((double*)PyArray_DATA(tmp))[i] = (member)[i]; \
-        PyObject_SetAttrString(fit_obj, (name), tmp); \
-        Py_DECREF(tmp);
+    result = Py_BuildValue("OO", fit_obj, output_array);
 
-    ADD_ATTR(from_geomap_fit_e, fit.fit_geometry, "fit_geometry");
-    ADD_ATTR(from_surface_type_e, fit.function, "function");
-    ADD_ATTR(from_coord_t, &fit.rms, "rms");
-    ADD_ATTR(from_coord_t, &fit.mean_ref, "mean_ref");
-    ADD_ATTR(from_coord_t, &fit.mean_input, "mean_input");
-    ADD_ATTR(from_coord_t, &fit.shift, "shift");
-    ADD_ATTR(from_coord_t, &fit.mag, "mag");
-    ADD_ATTR(from_coord_t, &fit.rotation, "rotation");
-    ADD_ARRAY(fit.nxcoeff, fit.xcoeff, "xcoeff");
-    ADD_ARRAY(fit.nycoeff, fit.ycoeff, "ycoeff");
-    ADD_ARRAY(fit.nx2coeff, fit.x2coeff, "x2coeff");
-    ADD_ARRAY(fit.ny2coeff, fit.y2coeff, "y2coeff");
+ exit:
 
-    result = Py_BuildValue("OO", fit_obj, output_array);
+    Py_XDECREF(input_array);
+    Py_XDECREF(ref_array);
+    geomap_result_free(&fit);
+    Py_XDECREF(output_array);
+    Py_XDECREF(fit_obj);
+    free(output);
+
+    return result;
+}
+
+/* Convert the bboxes argument of geomap_many, an optional sequence of
+   one bbox (or None) per frame.  *bboxes is left NULL if there are
+   none. */
+static int
+to_bboxes(
+        PyObject* o,
+        const size_t nframes,
+        bbox_t** bboxes) {
+
+    PyObject* seq    = NULL;
+    size_t    i      = 0;
+    int       status = -1;
+
+    if (o == NULL || o == Py_None) {
+        return 0;
+    }
+
+    seq = PySequence_Fast(o, "bboxes must be a sequence of bboxes");
+    if (seq == NULL) {
+        goto exit;
+    }
+
+    if ((size_t)PySequence_Fast_GET_SIZE(seq) != nframes) {
+        PyErr_SetString(
+                PyExc_ValueError, "There must be one bbox for each frame");
+        goto exit;
+    }
+
+    *bboxes = malloc(MAX(nframes, 1) * sizeof(bbox_t));
+    if (*bboxes == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    for (i = 0; i < nframes; ++i) {
+        bbox_init(&(*bboxes)[i]);
+        if (to_bbox_t("bbox", PySequence_Fast_GET_ITEM(seq, i),
+                      &(*bboxes)[i])) {
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    Py_XDECREF(seq);
+
+    return status;
+}
+
+PyObject*
+py_geomap_many(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject* inputs_obj       = NULL;
+    PyObject* refs_obj         = NULL;
+    PyObject* bboxes_obj       = NULL;
+    char*     fit_geometry_str = NULL;
+    char*     surface_type_str = NULL;
+    size_t    xxorder          = 2;
+    size_t    xyorder          = 2;
+    size_t    yxorder          = 2;
+    size_t    yyorder          = 2;
+    char*     xxterms_str      = NULL;
+    char*     yxterms_str      = NULL;
+    size_t    maxiter          = 0;
+    double    reject           = 0.0;
+    PyObject* offsets_obj      = NULL;
+    Py_ssize_t nthreads_arg    = 0;
+    size_t    nthreads         = 0;
+
+    PyObject*        input_arrays = NULL;
+    PyObject*        ref_arrays   = NULL;
+    size_t           nframes      = 0;
+    size_t           nref_frames  = 0;
+    size_t*          ninputs      = NULL;
+    const coord_t**  inputs       = NULL;
+    size_t*          nrefs        = NULL;
+    const coord_t**  refs         = NULL;
+    bbox_t*          bboxes       = NULL;
+    geomap_fit_e     fit_geometry = geomap_fit_general;
+    surface_type_e   surface_type = surface_type_polynomial;
+    xterms_e         xxterms      = xterms_half;
+    xterms_e         yxterms      = xterms_half;
+
+    size_t*               noutputs   = NULL;
+    geomap_output_t**     outputs    = NULL;
+    geomap_output_t*      block      = NULL;
+    geomap_result_t*      fits       = NULL;
+    PyObject*             fit_list   = NULL;
+    PyObject*             fit_obj    = NULL;
+    PyArray_Descr*        dtype      = NULL;
+    PyObject*             output_array = NULL;
+    geomap_many_output_t* row        = NULL;
+    PyObject*             result     = NULL;
+    npy_intp              dims       = 0;
+    size_t                nrows      = 0;
+    size_t                i          = 0;
+    size_t                j          = 0;
+    int                   status     = 0;
+    stimage_error_t       error;
+
+    const char*    keywords[]    = {
+        "inputs", "refs", "bboxes", "fit_geometry", "function",
+        "xxorder", "xyorder", "yxorder", "yyorder", "xxterms",
+        "yxterms", "maxiter", "reject", "offsets", "nthreads", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|OssnnnnssndOn:geomap_many",
+                (char **)keywords,
+                &inputs_obj, &refs_obj, &bboxes_obj, &fit_geometry_str,
+                &surface_type_str, &xxorder, &xyorder, &yxorder, &yyorder,
+                &xxterms_str, &yxterms_str, &maxiter, &reject,
+                &offsets_obj, &nthreads_arg)) {
+        return NULL;
+    }
+
+    if (to_size_t("nthreads", nthreads_arg, &nthreads) ||
+        to_coord_frames("inputs", "input", inputs_obj, offsets_obj,
+                        &input_arrays, &nframes, &ninputs, &inputs) ||
+        to_coord_frames("refs", "ref", refs_obj, offsets_obj,
+                        &ref_arrays, &nref_frames, &nrefs, &refs)) {
+        goto exit;
+    }
+
+    if (nref_frames != nframes) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "inputs and refs must have the same number of frames");
+        goto exit;
+    }
+
+    if (to_bboxes(bboxes_obj, nframes, &bboxes) ||
+        to_geomap_fit_e("fit_geometry", fit_geometry_str, &fit_geometry) ||
+        to_surface_type_e("surface_type", surface_type_str, &surface_type) ||
+        to_xterms_e("xxterms", xxterms_str, &xxterms) ||
+        to_xterms_e("yxterms", yxterms_str, &yxterms)) {
+        goto exit;
+    }
+
+    /* All of the output records go in one block */
+    for (i = 0; i < nframes; ++i) {
+        nrows += MAX(ninputs[i], nrefs[i]);
+    }
+    noutputs = malloc(MAX(nframes, 1) * sizeof(size_t));
+    outputs = malloc(MAX(nframes, 1) * sizeof(geomap_output_t*));
+    block = malloc(MAX(nrows, 1) * sizeof(geomap_output_t));
+    fits = calloc(MAX(nframes, 1), sizeof(geomap_result_t));
+    if (noutputs == NULL || outputs == NULL || block == NULL ||
+        fits == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    for (i = 0, nrows = 0; i < nframes; ++i) {
+        outputs[i] = block + nrows;
+        nrows += MAX(ninputs[i], nrefs[i]);
+        geomap_result_init(&fits[i]);
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap_many(
+            nframes, ninputs, inputs, nrefs, refs, bboxes,
+            fit_geometry, surface_type,
+            xxorder, xyorder, yxorder, yyorder,
+            xxterms, yxterms,
+            maxiter, reject,
+            noutputs, outputs, fits, nthreads,
+            &error);
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    fit_list = PyList_New(nframes);
+    if (fit_list == NULL) {
+        goto exit;
+    }
+    for (i = 0; i < nframes; ++i) {
+        fit_obj = geomap_results_from_fit(&fits[i]);
+        if (fit_obj == NULL) {
+            goto exit;
+        }
+        PyList_SET_ITEM(fit_list, i, fit_obj);
+    }
+
+    dtype = geomap_output_dtype(1);
+    if (dtype == NULL) {
+        goto exit;
+    }
+    for (i = 0; i < nframes; ++i) {
+        dims += (npy_intp)noutputs[i];
+    }
+    output_array = PyArray_NewFromDescr(
+            &PyArray_Type, dtype, 1, &dims, NULL, NULL, 0, NULL);
+    if (output_array == NULL) {
+        goto exit;
+    }
+
+    row = (geomap_many_output_t*)PyArray_DATA(output_array);
+    for (i = 0; i < nframes; ++i) {
+        for (j = 0; j < noutputs[i]; ++j, ++row) {
+            row->frame = i;
+            row->output = outputs[i][j];
+        }
+    }
+
+    result = Py_BuildValue("OO", fit_list, output_array);
+
+ exit:
+
+    Py_XDECREF(input_arrays);
+    Py_XDECREF(ref_arrays);
+    Py_XDECREF(fit_list);
+    Py_XDECREF(output_array);
+    free(ninputs);
+    free(inputs);
+    free(nrefs);
+    free(refs);
+    free(bboxes);
+    free(noutputs);
+    free(outputs);
+    free(block);
+    if (fits != NULL) {
+        for (i = 0; i < nframes; ++i) {
+            geomap_result_free(&fits[i]);
+        }
+    }
+    free(fits);
+
+    return result;
+}
+
+typedef struct {
+    PyObject_HEAD
+    geomap_stream_t stream;
+    /* The GeomapResults of the last call to fit, or NULL */
+    PyObject*       fit;
+} geomap_stream_object;
+
+static PyTypeObject geomap_stream_class;
+
+static PyObject *
+geomap_stream_object_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    geomap_stream_object *self    = NULL;
+    PyObject*      bbox_obj         = NULL;
+    char*          surface_type_str = NULL;
+    Py_ssize_t     xxorder_arg      = 2;
+    Py_ssize_t     xyorder_arg      = 2;
+    Py_ssize_t     yxorder_arg      = 2;
+    Py_ssize_t     yyorder_arg      = 2;
+    size_t         xxorder          = 0;
+    size_t         xyorder          = 0;
+    size_t         yxorder          = 0;
+    size_t         yyorder          = 0;
+    char*          xxterms_str      = NULL;
+    char*          yxterms_str      = NULL;
+    bbox_t         bbox;
+    surface_type_e surface_type     = surface_type_polynomial;
+    xterms_e       xxterms          = xterms_half;
+    xterms_e       yxterms          = xterms_half;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "bbox", "function", "xxorder", "xyorder", "yxorder", "yyorder",
+        "xxterms", "yxterms", NULL
+    };
+
+    bbox_init(&bbox);
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O|snnnnss:GeomapStream",
+                (char **)keywords,
+                &bbox_obj, &surface_type_str,
+                &xxorder_arg, &xyorder_arg, &yxorder_arg, &yyorder_arg,
+                &xxterms_str, &yxterms_str)) {
+        return NULL;
+    }
+
+    if (to_size_t("xxorder", xxorder_arg, &xxorder) ||
+        to_size_t("xyorder", xyorder_arg, &xyorder) ||
+        to_size_t("yxorder", yxorder_arg, &yxorder) ||
+        to_size_t("yyorder", yyorder_arg, &yyorder) ||
+        to_bbox_t("bbox", bbox_obj, &bbox) ||
+        to_surface_type_e("surface_type", surface_type_str, &surface_type) ||
+        to_xterms_e("xxterms", xxterms_str, &xxterms) ||
+        to_xterms_e("yxterms", yxterms_str, &yxterms)) {
+        return NULL;
+    }
+
+    self = (geomap_stream_object *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    geomap_stream_new(&self->stream);
+    self->fit = NULL;
+
+    if (geomap_stream_init(
+                &self->stream, &bbox, surface_type,
+                xxorder, xyorder, yxorder, yyorder, xxterms, yxterms,
+                &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    return (PyObject *)self;
+}
+
+static void
+geomap_stream_object_dealloc(geomap_stream_object *self)
+{
+    geomap_stream_free(&self->stream);
+    Py_XDECREF(self->fit);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+/* Convert the input and ref arguments of the GeomapStream methods,
+   which must be the same length */
+static int
+geomap_stream_parse_coords(
+        PyObject* args,
+        PyObject* kwds,
+        const char* const format,
+        PyObject** input_array,
+        PyObject** ref_array) {
+
+    PyObject* input_obj = NULL;
+    PyObject* ref_obj   = NULL;
+
+    const char*    keywords[]    = {
+        "input", "ref", NULL
+    };
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, format, (char **)keywords,
+                &input_obj, &ref_obj)) {
+        return 1;
+    }
+
+    *input_array = to_coord_array("input", input_obj);
+    if (*input_array == NULL) {
+        return 1;
+    }
+
+    *ref_array = to_coord_array("ref", ref_obj);
+    if (*ref_array == NULL) {
+        Py_CLEAR(*input_array);
+        return 1;
+    }
+
+    if (PyArray_DIM(*input_array, 0) != PyArray_DIM(*ref_array, 0)) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "input and ref must have the same number of coordinates");
+        Py_CLEAR(*input_array);
+        Py_CLEAR(*ref_array);
+        return 1;
+    }
+
+    return 0;
+}
+
+static PyObject *
+geomap_stream_object_add(
+        geomap_stream_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject*       input_array = NULL;
+    PyObject*       ref_array   = NULL;
+    PyObject*       result      = NULL;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    if (geomap_stream_parse_coords(
+                args, kwds, "OO:add", &input_array, &ref_array)) {
+        return NULL;
+    }
+
+    /* The GIL is kept, since the stream is shared by every thread
+       that can see this object */
+    if (geomap_stream_add(
+                &self->stream, PyArray_DIM(input_array, 0),
+                (coord_t*)PyArray_DATA(input_array),
+                (coord_t*)PyArray_DATA(ref_array),
+                &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
 
  exit:
 
     Py_DECREF(input_array);
     Py_DECREF(ref_array);
+
+    return result;
+}
+
+static PyObject *
+geomap_stream_object_fit(geomap_stream_object *self)
+{
+    geomap_result_t fit;
+    PyObject*       fit_obj = NULL;
+    stimage_error_t error;
+
+    geomap_result_init(&fit);
+    stimage_error_init(&error);
+
+    if (geomap_stream_solve(&self->stream, &fit, &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    fit_obj = geomap_results_from_fit(&fit);
+    if (fit_obj == NULL) {
+        goto exit;
+    }
+
+    Py_XDECREF(self->fit);
+    Py_INCREF(fit_obj);
+    self->fit = fit_obj;
+
+ exit:
+
     geomap_result_free(&fit);
-    if (result == NULL) {
-        Py_XDECREF(output_array);
-        free(output);
-        Py_XDECREF(fit_obj);
+
+    return fit_obj;
+}
+
+static PyObject *
+geomap_stream_object_add_residuals(
+        geomap_stream_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject*        input_array  = NULL;
+    PyObject*        ref_array    = NULL;
+    geomap_object*   fit_obj      = NULL;
+    npy_intp         dims         = 0;
+    size_t           noutput      = 0;
+    geomap_output_t* output       = NULL;
+    PyArray_Descr*   dtype        = NULL;
+    PyObject*        output_array = NULL;
+    PyObject*        rms          = NULL;
+    stimage_error_t  error;
+
+    stimage_error_init(&error);
+
+    if (self->fit == NULL) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "fit must be called before add_residuals");
+        return NULL;
+    }
+    fit_obj = (geomap_object*)self->fit;
+
+    if (geomap_stream_parse_coords(
+                args, kwds, "OO:add_residuals", &input_array, &ref_array)) {
+        return NULL;
+    }
+
+    output = malloc(MAX(PyArray_DIM(input_array, 0), 1) *
+                    sizeof(geomap_output_t));
+    if (output == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    if (geomap_stream_add_residuals(
+                &self->stream, &fit_obj->result,
+                PyArray_DIM(input_array, 0),
+                (coord_t*)PyArray_DATA(input_array),
+                (coord_t*)PyArray_DATA(ref_array),
+                &noutput, output, &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    /* Keep the rms attribute of the GeomapResults up to date */
+    if (from_coord_t(&fit_obj->result.rms, &rms)) {
+        goto exit;
+    }
+    Py_XDECREF(fit_obj->rms);
+    fit_obj->rms = rms;
+
+    dtype = geomap_output_dtype(0);
+    if (dtype == NULL) {
+        goto exit;
+    }
+    dims = (npy_intp)noutput;
+    output_array = PyArray_NewFromDescr(
+            &PyArray_Type, dtype, 1, &dims, NULL, output,
+            NPY_ARRAY_CARRAY, NULL);
+    if (output_array == NULL) {
+        goto exit;
+    }
+    PyArray_ENABLEFLAGS((PyArrayObject*)output_array, NPY_ARRAY_OWNDATA);
+    output = NULL;
+
+ exit:
+
+    Py_DECREF(input_array);
+    Py_DECREF(ref_array);
+    free(output);
+
+    return output_array;
+}
+
+static PyObject *
+geomap_stream_object_merge(
+        geomap_stream_object *self, PyObject *args, PyObject *kwds)
+{
+    geomap_stream_object* other = NULL;
+    stimage_error_t       error;
+
+    const char*    keywords[]    = {
+        "other", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O!:merge", (char **)keywords,
+                &geomap_stream_class, &other)) {
+        return NULL;
+    }
+
+    if (other == self) {
+        PyErr_SetString(
+                PyExc_ValueError, "A GeomapStream can not merge itself");
+        return NULL;
+    }
+
+    if (geomap_stream_merge(&self->stream, &other->stream, &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+geomap_stream_object_get_params(geomap_stream_object *self)
+{
+    const geomap_stream_t* stream   = &self->stream;
+    PyObject*              function = NULL;
+    PyObject*              xxterms  = NULL;
+    PyObject*              yxterms  = NULL;
+    PyObject*              result   = NULL;
+
+    if (from_surface_type_e(stream->function, &function) ||
+        from_xterms_e(stream->xxterms, &xxterms) ||
+        from_xterms_e(stream->yxterms, &yxterms)) {
+        goto exit;
     }
 
+    result = Py_BuildValue(
+            "(dddd)OnnnnOO",
+            stream->bbox.min.x, stream->bbox.min.y,
+            stream->bbox.max.x, stream->bbox.max.y,
+            function,
+            (Py_ssize_t)stream->xxorder, (Py_ssize_t)stream->xyorder,
+            (Py_ssize_t)stream->yxorder, (Py_ssize_t)stream->yyorder,
+            xxterms, yxterms);
+
+ exit:
+
+    Py_XDECREF(function);
+    Py_XDECREF(xxterms);
+    Py_XDECREF(yxterms);
+
     return result;
 }
 
-#if PY_MAJOR_VERSION >= 3
+static PyObject *
+geomap_stream_object_get_state(geomap_stream_object *self)
+{
+    PyObject* state = NULL;
+    npy_intp  dims  = 0;
 
-static PyModuleDef geomap_module = {
-    PyModuleDef_HEAD_INIT,
-    "geomap_results",
-    "Python object to hold the results of geomap",
-    -1,
-    NULL, NULL, NULL, NULL, NULL
-};
+    dims = (npy_intp)geomap_stream_state_size(&self->stream);
+    state = PyArray_SimpleNew(1, &dims, NPY_DOUBLE);
+    if (state == NULL) {
+        return NULL;
+    }
 
-PyMODINIT_FUNC
-PyInit_geomap_results(void) 
+    geomap_stream_get_state(&self->stream, (double*)PyArray_DATA(state));
+
+    return state;
+}
+
+static PyObject *
+geomap_stream_object_set_state(
+        geomap_stream_object *self, PyObject *args, PyObject *kwds)
 {
-    PyObject* m;
+    PyObject*       state_obj   = NULL;
+    PyObject*       state_array = NULL;
+    PyObject*       result      = NULL;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "state", NULL
+    };
+
+    stimage_error_init(&error);
 
-    geomap_class.tp_new = PyType_GenericNew;
-    if (PyType_Ready(&geomap_class) < 0)
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O:_set_state", (char **)keywords,
+                &state_obj)) {
         return NULL;
+    }
 
-    m = PyModule_Create(&geomap_module);
-    if (m == NULL)
+    state_array = PyArray_ContiguousFromAny(state_obj, NPY_DOUBLE, 1, 1);
+    if (state_array == NULL) {
         return NULL;
+    }
 
-    Py_INCREF(&geomap_class);
-    PyModule_AddObject(m, "GeomapResults", (PyObject *)&geomap_class);
-    return m;
+    if (geomap_stream_set_state(
+                &self->stream, (size_t)PyArray_DIM(state_array, 0),
+                (double*)PyArray_DATA(state_array), &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    /* The residuals of the old state are no longer of the last fit */
+    Py_CLEAR(self->fit);
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+ exit:
+
+    Py_DECREF(state_array);
+
+    return result;
 }
 
-#else
-PyMODINIT_FUNC
-initgeomap_results(void) 
+static PyObject *
+geomap_stream_object_get_ncoord(geomap_stream_object *self, void *closure)
 {
-    PyObject* m;
+    return PyLong_FromSize_t(self->stream.ncoord);
+}
+
+static PyGetSetDef geomap_stream_object_getset[] = {
+    {"ncoord", (getter)geomap_stream_object_get_ncoord, NULL,
+     "The number of coordinates in the bbox added so far", NULL},
+    {NULL}  /* Sentinel */
+};
 
-    geomap_class.tp_new = PyType_GenericNew;
-    if (PyType_Ready(&geomap_class) < 0)
-        return;
+static PyMethodDef geomap_stream_object_methods[] = {
+    {"add", (PyCFunction)geomap_stream_object_add,
+     METH_VARARGS | METH_KEYWORDS,
+     "add(input, ref)\n\n"
+     "Add a chunk of matched input and reference coordinates to the fit."},
+    {"fit", (PyCFunction)geomap_stream_object_fit, METH_NOARGS,
+     "fit() -> GeomapResults\n\n"
+     "Fit all of the coordinates added so far."},
+    {"add_residuals", (PyCFunction)geomap_stream_object_add_residuals,
+     METH_VARARGS | METH_KEYWORDS,
+     "add_residuals(input, ref) -> array\n\n"
+     "Find the residuals of a chunk of coordinates from the last fit, "
+     "updating its rms, and return them as geomap does."},
+    {"merge", (PyCFunction)geomap_stream_object_merge,
+     METH_VARARGS | METH_KEYWORDS,
+     "merge(other)\n\n"
+     "Add the coordinates added to another GeomapStream, with the same "
+     "parameters, to this one."},
+    {"_get_params", (PyCFunction)geomap_stream_object_get_params,
+     METH_NOARGS,
+     "The arguments to construct an empty GeomapStream like this one"},
+    {"_get_state", (PyCFunction)geomap_stream_object_get_state,
+     METH_NOARGS,
+     "The sums and normal equations accumulated so far, as an array"},
+    {"_set_state", (PyCFunction)geomap_stream_object_set_state,
+     METH_VARARGS | METH_KEYWORDS,
+     "Replace the accumulated state with one from _get_state"},
+    {NULL}  /* Sentinel */
+};
 
-    m = Py_InitModule("GeomapResults", geomap_methods);
+static PyTypeObject geomap_stream_class = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "stsci.stimage._stimage.GeomapStream", /* tp_name */
+    sizeof(geomap_stream_object),       /* tp_basicsize */
+    0,                                  /* tp_itemsize */
+    (destructor)geomap_stream_object_dealloc, /* tp_dealloc */
+    0,                                  /* tp_print */
+    0,                                  /* tp_getattr */
+    0,                                  /* tp_setattr */
+    0,                                  /* tp_reserved */
+    0,                                  /* tp_repr */
+    0,                                  /* tp_as_number */
+    0,                                  /* tp_as_sequence */
+    0,                                  /* tp_as_mapping */
+    0,                                  /* tp_hash */
+    0,                                  /* tp_call */
+    0,                                  /* tp_str */
+    0,                                  /* tp_getattro */
+    0,                                  /* tp_setattro */
+    0,                                  /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /* tp_flags */
+    "A geomap fit of coordinates given a chunk at a time", /* tp_doc */
+    0,                                  /* tp_traverse */
+    0,                                  /* tp_clear */
+    0,                                  /* tp_richcompare */
+    0,                                  /* tp_weaklistoffset */
+    0,                                  /* tp_iter */
+    0,                                  /* tp_iternext */
+    geomap_stream_object_methods,       /* tp_methods */
+    0,                                  /* tp_members */
+    geomap_stream_object_getset,        /* tp_getset */
+    0,                                  /* tp_base */
+    0,                                  /* tp_dict */
+    0,                                  /* tp_descr_get */
+    0,                                  /* tp_descr_set */
+    0,                                  /* tp_dictoffset */
+    0,                                  /* tp_init */
+    0,                                  /* tp_alloc */
+    geomap_stream_object_new,           /* tp_new */
+};
+
+int
+add_geomap_results_type(
+        PyObject* module) {
+
+    if (PyType_Ready(&geomap_class) < 0) {
+        return -1;
+    }
 
     Py_INCREF(&geomap_class);
-    PyModule_AddObject(m, "GeomapResults", (PyObject *)&geomap_class);
+    if (PyModule_AddObject(
+                module, "GeomapResults", (PyObject *)&geomap_class) < 0) {
+        Py_DECREF(&geomap_class);
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+add_geomap_stream_type(
+        PyObject* module) {
+
+    if (PyType_Ready(&geomap_stream_class) < 0) {
+        return -1;
+    }
+
+    Py_INCREF(&geomap_stream_class);
+    if (PyModule_AddObject(
+                module, "GeomapStream",
+                (PyObject *)&geomap_stream_class) < 0) {
+        Py_DECREF(&geomap_stream_class);
+        return -1;
+    }
+
+    return 0;
 }
-#endif
@@ -0,0 +1,410 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+
+#define NO_IMPORT_ARRAY
+
+#include <Python.h>
+#include <structmember.h>
+
+#include "wrap_util.h"
+#include "immatch/py_reference_catalog.h"
+
+static PyObject *
+reference_catalog_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    reference_catalog_object *self       = NULL;
+    PyObject*                 ref_obj    = NULL;
+    PyObject*                 ref_array  = NULL;
+    double                    separation = 9.0;
+    stimage_error_t           error;
+
+    const char*    keywords[]    = {
+        "ref", "separation", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O|d:ReferenceCatalog",
+                (char **)keywords,
+                &ref_obj, &separation)) {
+        return NULL;
+    }
+
+    ref_array = to_coord_array("ref", ref_obj);
+    if (ref_array == NULL) {
+        return NULL;
+    }
+    if (PyArray_DIM(ref_array, 0) == 0) {
+        PyErr_SetString(PyExc_ValueError, "ref array must not be empty");
+        Py_DECREF(ref_array);
+        return NULL;
+    }
+
+    self = (reference_catalog_object *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        Py_DECREF(ref_array);
+        return NULL;
+    }
+    xyxymatch_ref_new(&self->prepared);
+    self->has_triangles_view = 0;
+
+    /* The prepared list points into the coordinates, so take a
+       private copy that the caller can't modify or resize behind our
+       back, unless converting them already made one */
+    if (ref_array == ref_obj ||
+        !PyArray_CHKFLAGS((PyArrayObject*)ref_array, NPY_ARRAY_OWNDATA)) {
+        self->ref_array = PyArray_NewCopy(
+                (PyArrayObject*)ref_array, NPY_CORDER);
+        Py_DECREF(ref_array);
+    } else {
+        self->ref_array = ref_array;
+    }
+    if (self->ref_array == NULL) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    if (xyxymatch_ref_init(
+                &self->prepared,
+                PyArray_DIM(self->ref_array, 0),
+                (coord_t*)PyArray_DATA(self->ref_array),
+                separation,
+                &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    return (PyObject *)self;
+}
+
+static void
+reference_catalog_dealloc(reference_catalog_object *self)
+{
+    xyxymatch_ref_free(&self->prepared);
+    if (self->has_triangles_view) {
+        PyBuffer_Release(&self->triangles_view);
+    }
+    Py_XDECREF(self->ref_array);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+reference_catalog_get_ref(reference_catalog_object *self, void *closure)
+{
+    return PyArray_NewCopy((PyArrayObject*)self->ref_array, NPY_CORDER);
+}
+
+static PyObject *
+reference_catalog_get_separation(reference_catalog_object *self, void *closure)
+{
+    return PyFloat_FromDouble(self->prepared.separation);
+}
+
+static PyObject *
+reference_catalog_get_nunique(reference_catalog_object *self, void *closure)
+{
+    return PyLong_FromSize_t(self->prepared.nref_unique);
+}
+
+/* Matching runs without the GIL, and may be using the reference
+   triangles at any time, so they can only be given once */
+static int
+reference_catalog_check_no_triangles(reference_catalog_object *self)
+{
+    if (self->prepared.triangles != NULL) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "The ReferenceCatalog already has reference triangles");
+        return 1;
+    }
+    return 0;
+}
+
+static PyObject *
+reference_catalog_build_triangles(
+        reference_catalog_object *self, PyObject *args, PyObject *kwds)
+{
+    Py_ssize_t      nmatch_arg     = 30;
+    Py_ssize_t      nneighbors_arg = 0;
+    Py_ssize_t      nthreads_arg   = 1;
+    size_t          nmatch     = 0;
+    size_t          nneighbors = 0;
+    double          tolerance  = 1.0;
+    double          maxratio   = 10.0;
+    size_t          nthreads   = 0;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "nmatch", "nneighbors", "tolerance", "maxratio", "nthreads", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "|nnddn:_build_triangles",
+                (char **)keywords,
+                &nmatch_arg, &nneighbors_arg, &tolerance, &maxratio,
+                &nthreads_arg)) {
+        return NULL;
+    }
+
+    if (to_size_t("nmatch", nmatch_arg, &nmatch) ||
+        to_size_t("nneighbors", nneighbors_arg, &nneighbors) ||
+        to_size_t("nthreads", nthreads_arg, &nthreads) ||
+        reference_catalog_check_no_triangles(self)) {
+        return NULL;
+    }
+
+    if (xyxymatch_ref_build_triangles(
+                &self->prepared, nmatch, nneighbors, tolerance, maxratio,
+                nthreads, &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+reference_catalog_set_triangles(
+        reference_catalog_object *self, PyObject *args, PyObject *kwds)
+{
+    PyObject*       buffer_obj     = NULL;
+    Py_ssize_t      nmatch_arg     = 30;
+    Py_ssize_t      nneighbors_arg = 0;
+    size_t          nmatch     = 0;
+    size_t          nneighbors = 0;
+    double          tolerance  = 1.0;
+    double          maxratio   = 10.0;
+    Py_buffer       view;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "buffer", "nmatch", "nneighbors", "tolerance", "maxratio", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "Onndd:_set_triangles",
+                (char **)keywords,
+                &buffer_obj, &nmatch_arg, &nneighbors_arg, &tolerance,
+                &maxratio)) {
+        return NULL;
+    }
+
+    if (to_size_t("nmatch", nmatch_arg, &nmatch) ||
+        to_size_t("nneighbors", nneighbors_arg, &nneighbors) ||
+        reference_catalog_check_no_triangles(self)) {
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(buffer_obj, &view, PyBUF_SIMPLE)) {
+        return NULL;
+    }
+
+    if (view.len % sizeof(triangle_t) != 0 ||
+        (view.len > 0 && (size_t)view.buf % sizeof(triangle_real_t) != 0)) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "buffer is not an aligned array of reference triangles");
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    if (xyxymatch_ref_set_triangles(
+                &self->prepared, nmatch, nneighbors, tolerance, maxratio,
+                (size_t)view.len / sizeof(triangle_t),
+                (const triangle_t*)view.buf, &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        PyBuffer_Release(&view);
+        return NULL;
+    }
+
+    self->triangles_view = view;
+    self->has_triangles_view = 1;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+reference_catalog_get_triangles(
+        reference_catalog_object *self, PyObject *args)
+{
+    if (self->prepared.triangles == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    return PyBytes_FromStringAndSize(
+            (const char*)self->prepared.triangles,
+            (Py_ssize_t)(self->prepared.ntriangles * sizeof(triangle_t)));
+}
+
+static PyObject *
+reference_catalog_get_triangle_params(
+        reference_catalog_object *self, void *closure)
+{
+    if (self->prepared.triangles == NULL) {
+        Py_RETURN_NONE;
+    }
+
+    return Py_BuildValue(
+            "nndd",
+            (Py_ssize_t)self->prepared.triangles_nmatch,
+            (Py_ssize_t)self->prepared.triangles_nneighbors,
+            self->prepared.triangles_tolerance,
+            self->prepared.triangles_maxratio);
+}
+
+static PyObject *
+reference_catalog_get_ntriangles(
+        reference_catalog_object *self, void *closure)
+{
+    return PyLong_FromSize_t(self->prepared.ntriangles);
+}
+
+static PyObject *
+reference_catalog_get_triangle_format(
+        reference_catalog_object *self, void *closure)
+{
+    return Py_BuildValue(
+            "nn",
+            (Py_ssize_t)sizeof(triangle_t),
+            (Py_ssize_t)sizeof(triangle_real_t));
+}
+
+static Py_ssize_t
+reference_catalog_len(reference_catalog_object *self)
+{
+    return (Py_ssize_t)self->prepared.nref;
+}
+
+static PyGetSetDef reference_catalog_getset[] = {
+    {"ref", (getter)reference_catalog_get_ref, NULL,
+     "A copy of the reference coordinates", NULL},
+    {"separation", (getter)reference_catalog_get_separation, NULL,
+     "The minimum separation used to cull the reference coordinates", NULL},
+    {"nunique", (getter)reference_catalog_get_nunique, NULL,
+     "The number of reference coordinates left after culling", NULL},
+    {"ntriangles", (getter)reference_catalog_get_ntriangles, NULL,
+     "The number of reference triangles, or 0 if there are none", NULL},
+    {"triangle_params", (getter)reference_catalog_get_triangle_params, NULL,
+     "(nmatch, nneighbors, tolerance, maxratio) of the reference "
+     "triangles, or None if there are none", NULL},
+    {"_triangle_format", (getter)reference_catalog_get_triangle_format, NULL,
+     "(size of a triangle, size of its real numbers) in bytes", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyMethodDef reference_catalog_methods[] = {
+    {"_build_triangles", (PyCFunction)reference_catalog_build_triangles,
+     METH_VARARGS | METH_KEYWORDS,
+     "Find the reference triangles"},
+    {"_set_triangles", (PyCFunction)reference_catalog_set_triangles,
+     METH_VARARGS | METH_KEYWORDS,
+     "Use the reference triangles held in a buffer"},
+    {"_get_triangles", (PyCFunction)reference_catalog_get_triangles,
+     METH_NOARGS,
+     "A copy of the reference triangles as bytes, or None"},
+    {NULL}  /* Sentinel */
+};
+
+static PySequenceMethods reference_catalog_as_sequence = {
+    (lenfunc)reference_catalog_len, /* sq_length */
+};
+
+PyTypeObject reference_catalog_class = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "stsci.stimage._stimage.ReferenceCatalog", /* tp_name */
+    sizeof(reference_catalog_object),   /* tp_basicsize */
+    0,                                  /* tp_itemsize */
+    (destructor)reference_catalog_dealloc, /* tp_dealloc */
+    0,                                  /* tp_print */
+    0,                                  /* tp_getattr */
+    0,                                  /* tp_setattr */
+    0,                                  /* tp_reserved */
+    0,                                  /* tp_repr */
+    0,                                  /* tp_as_number */
+    &reference_catalog_as_sequence,     /* tp_as_sequence */
+    0,                                  /* tp_as_mapping */
+    0,                                  /* tp_hash */
+    0,                                  /* tp_call */
+    0,                                  /* tp_str */
+    0,                                  /* tp_getattro */
+    0,                                  /* tp_setattro */
+    0,                                  /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /* tp_flags */
+    "A reference coordinate list prepared for xyxymatch", /* tp_doc */
+    0,                                  /* tp_traverse */
+    0,                                  /* tp_clear */
+    0,                                  /* tp_richcompare */
+    0,                                  /* tp_weaklistoffset */
+    0,                                  /* tp_iter */
+    0,                                  /* tp_iternext */
+    reference_catalog_methods,          /* tp_methods */
+    0,                                  /* tp_members */
+    reference_catalog_getset,           /* tp_getset */
+    0,                                  /* tp_base */
+    0,                                  /* tp_dict */
+    0,                                  /* tp_descr_get */
+    0,                                  /* tp_descr_set */
+    0,                                  /* tp_dictoffset */
+    0,                                  /* tp_init */
+    0,                                  /* tp_alloc */
+    reference_catalog_new,              /* tp_new */
+};
+
+int
+add_reference_catalog_type(
+        PyObject* module) {
+
+    if (PyType_Ready(&reference_catalog_class) < 0) {
+        return -1;
+    }
+
+    Py_INCREF(&reference_catalog_class);
+    if (PyModule_AddObject(
+                module, "ReferenceCatalog",
+                (PyObject *)&reference_catalog_class) < 0) {
+        Py_DECREF(&reference_catalog_class);
+        return -1;
+    }
+
+    return 0;
+}
@@ -0,0 +1,69 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+/*
+ Author: Michael Droettboom
+         mdroe@stsci.edu
+*/
+
+
+#ifndef __STIMAGE_PY_REFERENCE_CATALOG_H__
+#define __STIMAGE_PY_REFERENCE_CATALOG_H__
+
+#include "wrap_util.h"
+
+typedef struct {
+    PyObject_HEAD
+    /* A private, contiguous copy of the reference coordinates, which
+       prepared points into */
+    PyObject*       ref_array;
+    xyxymatch_ref_t prepared;
+    /* The buffer holding the reference triangles, if they were given
+       by _set_triangles rather than built */
+    Py_buffer       triangles_view;
+    int             has_triangles_view;
+} reference_catalog_object;
+
+extern PyTypeObject reference_catalog_class;
+
+#define reference_catalog_check(o) \
+    PyObject_TypeCheck((o), &reference_catalog_class)
+
+/**
+Add the ReferenceCatalog type to the given module.
+
+@return Non-zero on error, with a Python exception set.
+*/
+int
+add_reference_catalog_type(
+        PyObject* module);
+
+#endif
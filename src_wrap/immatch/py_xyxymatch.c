@@ -40,6 +40,253 @@ DAMAGE.
 #include "wrap_util.h"
 
 #include "immatch/xyxymatch.h"
+#include "immatch/py_reference_catalog.h"
+
+/* A row of the output of xyxymatch_many.  This must match the dtype
+   built in py_xyxymatch_many. */
+typedef struct {
+    size_t             frame;
+    xyxymatch_output_t match;
+} xyxymatch_many_output_t;
+
+/* Convert an optional sequence of doubles, such as the rotations and
+   scales of the offsets algorithm.  If o is None or NULL, *n is 0 and
+   *data is NULL.  Otherwise, *array is set to a new reference to the
+   array *data points into. */
+static int
+to_double_list(
+        const char* const name,
+        PyObject* o,
+        PyObject** array,
+        size_t* n,
+        const double** data) {
+
+    *n = 0;
+    *data = NULL;
+
+    if (o == NULL || o == Py_None) {
+        return 0;
+    }
+
+    *array = (PyObject*)PyArray_ContiguousFromAny(o, NPY_DOUBLE, 0, 1);
+    if (*array == NULL) {
+        return 1;
+    }
+    if (PyArray_SIZE((PyArrayObject*)*array) == 0) {
+        PyErr_Format(PyExc_ValueError, "%s must not be empty", name);
+        return 1;
+    }
+
+    *n = (size_t)PyArray_SIZE((PyArrayObject*)*array);
+    *data = (const double*)PyArray_DATA(*array);
+
+    return 0;
+}
+
+/* Convert the ref and separation arguments.  If ref is a
+   ReferenceCatalog, *catalog is set to it and the separation must
+   agree with it.  Otherwise, *ref_array is set to a new reference to
+   an Nx2 array. */
+static int
+to_reference(
+        PyObject* ref_obj,
+        PyObject* separation_obj,
+        PyObject** ref_array,
+        reference_catalog_object** catalog,
+        double* separation) {
+
+    char* given    = NULL;
+    char* expected = NULL;
+
+    if (separation_obj != NULL && separation_obj != Py_None) {
+        *separation = PyFloat_AsDouble(separation_obj);
+        if (*separation == -1.0 && PyErr_Occurred()) {
+            return 1;
+        }
+    }
+
+    if (reference_catalog_check(ref_obj)) {
+        /* The reference coordinates have already been sorted and culled,
+           so the separation is fixed by the catalog */
+        *catalog = (reference_catalog_object*)ref_obj;
+        if (separation_obj == NULL || separation_obj == Py_None) {
+            *separation = (*catalog)->prepared.separation;
+        } else if (*separation != (*catalog)->prepared.separation) {
+            /* PyErr_Format has no format for doubles */
+            given = PyOS_double_to_string(
+                    *separation, 'r', 0, Py_DTSF_ADD_DOT_0, NULL);
+            expected = PyOS_double_to_string(
+                    (*catalog)->prepared.separation, 'r', 0, Py_DTSF_ADD_DOT_0,
+                    NULL);
+            if (given != NULL && expected != NULL) {
+                PyErr_Format(
+                        PyExc_ValueError,
+                        "separation (%s) does not match the separation of "
+                        "the ReferenceCatalog (%s)",
+                        given, expected);
+            }
+            PyMem_Free(given);
+            PyMem_Free(expected);
+            return 1;
+        }
+    } else {
+        *ref_array = to_coord_array("ref", ref_obj);
+        if (*ref_array == NULL) {
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* The dtype of the result of xyxymatch.  It must match
+   xyxymatch_output_t. */
+static PyArray_Descr*
+xyxymatch_output_dtype(void) {
+
+    PyObject*      dtype_list = NULL;
+    PyArray_Descr* dtype      = NULL;
+
+    dtype_list = Py_BuildValue(
+            "[(ss)(ss)(ss)(ss)(ss)(ss)]",
+            "input_x", "f8",
+            "input_y", "f8",
+            "input_idx", SIZE_T_D,
+            "ref_x", "f8",
+            "ref_y", "f8",
+            "ref_idx", SIZE_T_D);
+    if (dtype_list == NULL) {
+        return NULL;
+    }
+    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+        dtype = NULL;
+    }
+    Py_DECREF(dtype_list);
+
+    return dtype;
+}
+
+/* Collects just the indices of the matches, for indices_only.  Like
+   xyxymatch_output_buffer_t, it either grows as needed or has a fixed
+   size. */
+typedef struct {
+    npy_intp* input_idx; /* [size] */
+    npy_intp* ref_idx;   /* [size] */
+    size_t    n;
+    size_t    size;
+    int       growable;
+    int       full;
+} index_buffer_t;
+
+static int
+index_buffer_append(
+        void* data,
+        const xyxymatch_output_t* const match,
+        stimage_error_t* const error) {
+
+    index_buffer_t* buffer = (index_buffer_t*)data;
+    npy_intp*       grown  = NULL;
+    size_t          size;
+
+    if (buffer->n >= buffer->size) {
+        if (!buffer->growable) {
+            buffer->full = 1;
+            stimage_error_set_message(
+                error, "Number of output coordinates exceeded allocation");
+            return 1;
+        }
+
+        size = MAX(buffer->size * 2, 64);
+        grown = realloc(buffer->input_idx, size * sizeof(npy_intp));
+        if (grown == NULL) goto fail;
+        buffer->input_idx = grown;
+        grown = realloc(buffer->ref_idx, size * sizeof(npy_intp));
+        if (grown == NULL) goto fail;
+        buffer->ref_idx = grown;
+        buffer->size = size;
+    }
+
+    buffer->input_idx[buffer->n] = (npy_intp)match->coord_idx;
+    buffer->ref_idx[buffer->n] = (npy_intp)match->ref_idx;
+    ++buffer->n;
+
+    return 0;
+
+ fail:
+
+    stimage_error_set_message(error, "Out of memory allocating matches");
+    return 1;
+}
+
+static void
+index_buffer_trim(
+        index_buffer_t* const buffer) {
+
+    npy_intp* shrunk = NULL;
+
+    if (buffer->n == 0 || buffer->n == buffer->size) {
+        return;
+    }
+
+    /* If this fails, the buffer is just left as it was */
+    shrunk = realloc(buffer->input_idx, buffer->n * sizeof(npy_intp));
+    if (shrunk != NULL) {
+        buffer->input_idx = shrunk;
+    }
+    shrunk = realloc(buffer->ref_idx, buffer->n * sizeof(npy_intp));
+    if (shrunk != NULL) {
+        buffer->ref_idx = shrunk;
+    }
+}
+
+/* Check that an out argument is a 1-D, C-contiguous, writeable array
+   of the given type */
+static int
+check_out_array(
+        PyObject* o,
+        PyArray_Descr* dtype) {
+
+    if (!PyArray_Check(o) ||
+        PyArray_NDIM((PyArrayObject*)o) != 1 ||
+        !PyArray_ISCARRAY((PyArrayObject*)o) ||
+        !PyArray_EquivTypes(PyArray_DESCR((PyArrayObject*)o), dtype)) {
+        PyErr_SetString(
+                PyExc_TypeError,
+                "out must be a 1-dimensional, C-contiguous, writeable "
+                "array of the result type");
+        return 1;
+    }
+
+    return 0;
+}
+
+/* Wrap the matches in a growable buffer, which takes its memory, in an
+   array */
+static PyObject*
+array_from_buffer(
+        PyArray_Descr* dtype,
+        void** data,
+        const size_t n) {
+
+    PyObject* array = NULL;
+    npy_intp  dims  = (npy_intp)n;
+
+    if (n == 0) {
+        return PyArray_Zeros(1, &dims, dtype, 0);
+    }
+
+    /* Numpy ignores NPY_ARRAY_OWNDATA when it is given the data, so
+       the array only frees it if the flag is set afterward */
+    array = PyArray_NewFromDescr(
+            &PyArray_Type, dtype, 1, &dims, NULL, *data, NPY_ARRAY_CARRAY,
+            NULL);
+    if (array != NULL) {
+        PyArray_ENABLEFLAGS((PyArrayObject*)array, NPY_ARRAY_OWNDATA);
+        *data = NULL;
+    }
+
+    return array;
+}
 
 PyObject*
 py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
@@ -51,60 +298,339 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
     PyObject* ref_origin_obj = NULL;
     char*     algorithm_str  = NULL;
     double    tolerance      = 1.0;
-    double    separation     = 9.0;
-    size_t    nmatch         = 30;
+    PyObject* separation_obj = NULL;
+    Py_ssize_t nmatch_arg    = 30;
+    size_t    nmatch         = 0;
     double    maxratio       = 10.0;
-    size_t    nreject        = 10;
+    Py_ssize_t nreject_arg   = 10;
+    size_t    nreject        = 0;
+    char*     search_str     = NULL;
+    PyObject* rotations_obj  = NULL;
+    PyObject* scales_obj     = NULL;
+    char*     consensus_str  = NULL;
+    Py_ssize_t nneighbors_arg = 0;
+    Py_ssize_t nthreads_arg  = 1;
+    Py_ssize_t max_work_arg  = 0;
+    size_t    max_work       = 0;
+    double    timeout        = 0.0;
+    PyObject* indices_only_obj = NULL;
+    PyObject* out_obj        = NULL;
+    int       indices_only   = 0;
+    py_budget_t budget;
 
     PyObject*        input_array = NULL;
+    PyObject*        rotations_array = NULL;
+    PyObject*        scales_array = NULL;
     PyObject*        ref_array   = NULL;
+    reference_catalog_object* catalog = NULL;
+    double           separation  = 9.0;
     coord_t          origin      = {0.0, 0.0};
     coord_t          mag         = {1.0, 1.0};
     coord_t          rotation    = {0.0, 0.0};
     coord_t          ref_origin  = {0.0, 0.0};
     xyxymatch_algo_e algorithm   = xyxymatch_algo_tolerance;
+    xyxymatch_options_t options;
 
     PyObject*           result     = NULL;
+    PyObject*           out_input  = NULL;
+    PyObject*           out_ref    = NULL;
     size_t              noutput    = 0;
-    xyxymatch_output_t* output     = NULL;
-    PyObject*           dtype_list = NULL;
+    xyxymatch_output_buffer_t output;
+    index_buffer_t      indices;
     PyArray_Descr*      dtype      = NULL;
-    npy_intp            dims;
+    PyArray_Descr*      index_dtype = NULL;
+    PyObject*           input_idx  = NULL;
+    PyObject*           ref_idx    = NULL;
+    int                 status     = 0;
     stimage_error_t     error;
 
     const char*    keywords[]    = {
         "input", "ref", "origin", "mag", "rotation", "ref_origin", "algorithm",
-        "tolerance", "separation", "nmatch", "maxratio", "nreject", NULL
+        "tolerance", "separation", "nmatch", "maxratio", "nreject", "search",
+        "nneighbors", "nthreads", "rotations", "scales", "consensus",
+        "max_work", "timeout", "indices_only", "out", NULL
     };
 
     stimage_error_init(&error);
+    xyxymatch_options_init(&options);
+    xyxymatch_output_buffer_init(&output, NULL, 0);
+    memset(&indices, 0, sizeof(index_buffer_t));
+    indices.growable = 1;
+    py_budget_new(&budget);
 
     if (!PyArg_ParseTupleAndKeywords(
-                args, kwds, "OO|OOOOsddndn:xyxymatch",
+                args, kwds, "OO|OOOOsdOndnsnnOOsndOO:xyxymatch",
                 (char **)keywords,
                 &input_obj, &ref_obj, &origin_obj, &mag_obj, &rotation_obj,
-                &ref_origin_obj, &algorithm_str, &tolerance, &separation,
-                &nmatch, &maxratio, &nreject)) {
+                &ref_origin_obj, &algorithm_str, &tolerance, &separation_obj,
+                &nmatch_arg, &maxratio, &nreject_arg, &search_str,
+                &nneighbors_arg, &nthreads_arg,
+                &rotations_obj, &scales_obj, &consensus_str,
+                &max_work_arg, &timeout, &indices_only_obj, &out_obj)) {
         return NULL;
     }
 
-    input_array = (PyObject*)PyArray_ContiguousFromAny(
-            input_obj, NPY_DOUBLE, 2, 2);
+    if (to_size_t("nmatch", nmatch_arg, &nmatch) ||
+        to_size_t("nreject", nreject_arg, &nreject) ||
+        to_size_t("nneighbors", nneighbors_arg, &options.nneighbors) ||
+        to_size_t("nthreads", nthreads_arg, &options.nthreads) ||
+        to_size_t("max_work", max_work_arg, &max_work)) {
+        goto exit;
+    }
+
+    input_array = to_coord_array("input", input_obj);
     if (input_array == NULL) {
         goto exit;
     }
-    if (PyArray_DIM(input_array, 1) != 2) {
-        PyErr_SetString(PyExc_TypeError, "input array must be an Nx2 array");
+
+    if (to_reference(ref_obj, separation_obj,
+                     &ref_array, &catalog, &separation)) {
         goto exit;
     }
 
-    ref_array = (PyObject*)PyArray_ContiguousFromAny(
-            ref_obj, NPY_DOUBLE, 2, 2);
-    if (ref_array == NULL) {
+    if (to_coord_t("origin", origin_obj, &origin) ||
+        to_coord_t("mag", mag_obj, &mag) ||
+        to_coord_t("rotation", rotation_obj, &rotation) ||
+        to_coord_t("ref_origin", ref_origin_obj, &ref_origin) ||
+        to_xyxymatch_algo_e("algorithm", algorithm_str, &algorithm) ||
+        to_tolerance_search_e("search", search_str, &options.search) ||
+        to_double_list("rotations", rotations_obj, &rotations_array,
+                       &options.nrotations, &options.rotations) ||
+        to_double_list("scales", scales_obj, &scales_array,
+                       &options.nscales, &options.scales) ||
+        to_triangle_consensus_e("consensus", consensus_str,
+                                &options.consensus) ||
+        py_budget_init(&budget, max_work, timeout)) {
         goto exit;
     }
-    if (PyArray_DIM(ref_array, 1) != 2) {
-        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+    options.budget = &budget.budget;
+
+    if (indices_only_obj != NULL) {
+        indices_only = PyObject_IsTrue(indices_only_obj);
+        if (indices_only == -1) {
+            goto exit;
+        }
+    }
+
+    dtype = xyxymatch_output_dtype();
+    index_dtype = PyArray_DescrFromType(NPY_INTP);
+    if (dtype == NULL || index_dtype == NULL) {
+        goto exit;
+    }
+
+    /* The matches are collected in buffers that grow as needed, unless
+       the caller gave arrays to put them in */
+    if (indices_only) {
+        options.output_func = &index_buffer_append;
+        options.output_data = &indices;
+        if (out_obj != NULL && out_obj != Py_None) {
+            if (!PyTuple_Check(out_obj) || PyTuple_GET_SIZE(out_obj) != 2) {
+                PyErr_SetString(
+                        PyExc_TypeError,
+                        "out must be a pair of arrays when indices_only is "
+                        "True");
+                goto exit;
+            }
+            out_input = PyTuple_GET_ITEM(out_obj, 0);
+            out_ref = PyTuple_GET_ITEM(out_obj, 1);
+            if (check_out_array(out_input, index_dtype) ||
+                check_out_array(out_ref, index_dtype)) {
+                goto exit;
+            }
+            indices.growable = 0;
+            indices.input_idx = (npy_intp*)PyArray_DATA(out_input);
+            indices.ref_idx = (npy_intp*)PyArray_DATA(out_ref);
+            indices.size = (size_t)MIN(PyArray_DIM(out_input, 0),
+                                       PyArray_DIM(out_ref, 0));
+        }
+    } else {
+        options.output_func = &xyxymatch_output_buffer_append;
+        options.output_data = &output;
+        if (out_obj != NULL && out_obj != Py_None) {
+            if (check_out_array(out_obj, dtype)) {
+                goto exit;
+            }
+            xyxymatch_output_buffer_init(
+                    &output,
+                    (xyxymatch_output_t*)PyArray_DATA(out_obj),
+                    (size_t)PyArray_DIM(out_obj, 0));
+        }
+    }
+
+    /* Only the arrays, the catalog and the local arguments are used
+       by the matching, so other Python threads may run while it
+       works.  The catalog is immutable once created. */
+    Py_BEGIN_ALLOW_THREADS
+    if (catalog != NULL) {
+        status = xyxymatch_prepared(
+                PyArray_DIM(input_array, 0),
+                (coord_t*)PyArray_DATA(input_array),
+                &catalog->prepared,
+                &noutput, NULL,
+                &origin, &mag, &rotation, &ref_origin,
+                algorithm, tolerance, nmatch, maxratio, nreject,
+                &options, &error);
+    } else {
+        status = xyxymatch(
+                PyArray_DIM(input_array, 0),
+                (coord_t*)PyArray_DATA(input_array),
+                PyArray_DIM(ref_array, 0),
+                (coord_t*)PyArray_DATA(ref_array),
+                &noutput, NULL,
+                &origin, &mag, &rotation, &ref_origin,
+                algorithm, tolerance, separation, nmatch, maxratio, nreject,
+                &options, &error);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        if (output.full || indices.full) {
+            PyErr_SetString(
+                    PyExc_ValueError, "out is too small for the matches");
+        } else {
+            py_budget_set_error(&budget, &error);
+        }
+        goto exit;
+    }
+
+    if (indices_only && out_input != NULL) {
+        input_idx = PySequence_GetSlice(out_input, 0, (Py_ssize_t)noutput);
+        ref_idx = PySequence_GetSlice(out_ref, 0, (Py_ssize_t)noutput);
+    } else if (indices_only) {
+        /* Give back what the buffers did not use, so the result only
+           takes as much memory as there are matches */
+        index_buffer_trim(&indices);
+        Py_INCREF(index_dtype);
+        input_idx = array_from_buffer(
+                index_dtype, (void**)&indices.input_idx, noutput);
+        Py_INCREF(index_dtype);
+        ref_idx = array_from_buffer(
+                index_dtype, (void**)&indices.ref_idx, noutput);
+    } else if (!output.growable) {
+        result = PySequence_GetSlice(out_obj, 0, (Py_ssize_t)noutput);
+    } else {
+        xyxymatch_output_buffer_trim(&output);
+        Py_INCREF(dtype);
+        result = array_from_buffer(dtype, (void**)&output.output, noutput);
+    }
+
+    if (indices_only && input_idx != NULL && ref_idx != NULL) {
+        result = PyTuple_Pack(2, input_idx, ref_idx);
+    }
+
+ exit:
+
+    Py_XDECREF(input_array);
+    Py_XDECREF(ref_array);
+    Py_XDECREF(rotations_array);
+    Py_XDECREF(scales_array);
+    Py_XDECREF(dtype);
+    Py_XDECREF(index_dtype);
+    Py_XDECREF(input_idx);
+    Py_XDECREF(ref_idx);
+    py_budget_free(&budget);
+    xyxymatch_output_buffer_free(&output);
+    if (indices.growable) {
+        free(indices.input_idx);
+        free(indices.ref_idx);
+    }
+
+    return result;
+}
+
+PyObject*
+py_xyxymatch_many(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject* inputs_obj     = NULL;
+    PyObject* ref_obj        = NULL;
+    PyObject* origin_obj     = NULL;
+    PyObject* mag_obj        = NULL;
+    PyObject* rotation_obj   = NULL;
+    PyObject* ref_origin_obj = NULL;
+    char*     algorithm_str  = NULL;
+    double    tolerance      = 1.0;
+    PyObject* separation_obj = NULL;
+    Py_ssize_t nmatch_arg    = 30;
+    size_t    nmatch         = 0;
+    double    maxratio       = 10.0;
+    Py_ssize_t nreject_arg   = 10;
+    size_t    nreject        = 0;
+    char*     search_str     = NULL;
+    PyObject* offsets_obj    = NULL;
+    Py_ssize_t nthreads_arg  = 0;
+    Py_ssize_t nneighbors_arg = 0;
+    size_t    nthreads       = 0;
+    PyObject* rotations_obj  = NULL;
+    PyObject* scales_obj     = NULL;
+    char*     consensus_str  = NULL;
+    Py_ssize_t max_work_arg  = 0;
+    size_t    max_work       = 0;
+    double    timeout        = 0.0;
+    py_budget_t budget;
+
+    PyObject*        arrays      = NULL;
+    PyObject*        rotations_array = NULL;
+    PyObject*        scales_array = NULL;
+    size_t           nframes     = 0;
+    size_t*          ninputs     = NULL;
+    const coord_t**  inputs      = NULL;
+    PyObject*        ref_array   = NULL;
+    reference_catalog_object* catalog = NULL;
+    xyxymatch_ref_t  prepared;
+    double           separation  = 9.0;
+    coord_t          origin      = {0.0, 0.0};
+    coord_t          mag         = {1.0, 1.0};
+    coord_t          rotation    = {0.0, 0.0};
+    coord_t          ref_origin  = {0.0, 0.0};
+    xyxymatch_algo_e algorithm   = xyxymatch_algo_tolerance;
+    xyxymatch_options_t options;
+
+    PyObject*                result     = NULL;
+    size_t*                  noutputs   = NULL;
+    xyxymatch_output_t**     outputs    = NULL;
+    xyxymatch_many_output_t* row        = NULL;
+    PyObject*                dtype_list = NULL;
+    PyArray_Descr*           dtype      = NULL;
+    npy_intp                 dims       = 0;
+    size_t                   i          = 0;
+    size_t                   j          = 0;
+    int                      status     = 0;
+    stimage_error_t          error;
+
+    const char*    keywords[]    = {
+        "inputs", "ref", "origin", "mag", "rotation", "ref_origin",
+        "algorithm", "tolerance", "separation", "nmatch", "maxratio",
+        "nreject", "search", "offsets", "nthreads", "nneighbors",
+        "rotations", "scales", "consensus", "max_work", "timeout", NULL
+    };
+
+    stimage_error_init(&error);
+    xyxymatch_options_init(&options);
+    py_budget_new(&budget);
+    xyxymatch_ref_new(&prepared);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO|OOOOsdOndnsOnnOOsnd:xyxymatch_many",
+                (char **)keywords,
+                &inputs_obj, &ref_obj, &origin_obj, &mag_obj, &rotation_obj,
+                &ref_origin_obj, &algorithm_str, &tolerance, &separation_obj,
+                &nmatch_arg, &maxratio, &nreject_arg, &search_str, &offsets_obj,
+                &nthreads_arg, &nneighbors_arg, &rotations_obj, &scales_obj,
+                &consensus_str, &max_work_arg, &timeout)) {
+        return NULL;
+    }
+
+    if (to_size_t("nmatch", nmatch_arg, &nmatch) ||
+        to_size_t("nreject", nreject_arg, &nreject) ||
+        to_size_t("nthreads", nthreads_arg, &nthreads) ||
+        to_size_t("nneighbors", nneighbors_arg, &options.nneighbors) ||
+        to_size_t("max_work", max_work_arg, &max_work)) {
+        goto exit;
+    }
+
+    if (to_coord_frames("inputs", "input", inputs_obj, offsets_obj,
+                        &arrays, &nframes, &ninputs, &inputs) ||
+        to_reference(ref_obj, separation_obj,
+                     &ref_array, &catalog, &separation)) {
         goto exit;
     }
 
@@ -112,29 +638,53 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
         to_coord_t("mag", mag_obj, &mag) ||
         to_coord_t("rotation", rotation_obj, &rotation) ||
         to_coord_t("ref_origin", ref_origin_obj, &ref_origin) ||
-        to_xyxymatch_algo_e("algorithm", algorithm_str, &algorithm)) {
+        to_xyxymatch_algo_e("algorithm", algorithm_str, &algorithm) ||
+        to_tolerance_search_e("search", search_str, &options.search) ||
+        to_double_list("rotations", rotations_obj, &rotations_array,
+                       &options.nrotations, &options.rotations) ||
+        to_double_list("scales", scales_obj, &scales_array,
+                       &options.nscales, &options.scales) ||
+        to_triangle_consensus_e("consensus", consensus_str,
+                                &options.consensus) ||
+        py_budget_init(&budget, max_work, timeout)) {
         goto exit;
     }
+    options.budget = &budget.budget;
 
-    noutput = PyArray_DIM(input_array, 0);
-    output = malloc(noutput * sizeof(xyxymatch_output_t));
-    if (output == NULL) {
-        result = PyErr_NoMemory();
+    noutputs = malloc(MAX(nframes, 1) * sizeof(size_t));
+    outputs = calloc(MAX(nframes, 1), sizeof(xyxymatch_output_t*));
+    if (noutputs == NULL || outputs == NULL) {
+        PyErr_NoMemory();
         goto exit;
     }
-    if (xyxymatch(
-                PyArray_DIM(input_array, 0), (coord_t*)PyArray_DATA(input_array),
-                PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
-                &noutput, output,
+
+    Py_BEGIN_ALLOW_THREADS
+    if (catalog == NULL) {
+        status = xyxymatch_ref_init(
+                &prepared,
+                PyArray_DIM(ref_array, 0),
+                (coord_t*)PyArray_DATA(ref_array),
+                separation, &error);
+    }
+    if (status == 0) {
+        status = xyxymatch_many(
+                nframes, ninputs, inputs,
+                catalog != NULL ? &catalog->prepared : &prepared,
+                noutputs, outputs,
                 &origin, &mag, &rotation, &ref_origin,
-                algorithm, tolerance, separation, nmatch, maxratio, nreject,
-                &error)) {
-        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+                algorithm, tolerance, nmatch, maxratio, nreject,
+                &options, nthreads, &error);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        py_budget_set_error(&budget, &error);
         goto exit;
     }
 
     dtype_list = Py_BuildValue(
-            "[(ss)(ss)(ss)(ss)(ss)(ss)]",
+            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
+            "frame", SIZE_T_D,
             "input_x", "f8",
             "input_y", "f8",
             "input_idx", SIZE_T_D,
@@ -147,18 +697,42 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
     if (!PyArray_DescrConverter(dtype_list, &dtype)) {
         goto exit;
     }
-    Py_DECREF(dtype_list);
-    dims = (npy_intp)noutput;
+
+    for (i = 0; i < nframes; ++i) {
+        dims += (npy_intp)noutputs[i];
+    }
     result = PyArray_NewFromDescr(
-            &PyArray_Type, dtype, 1, &dims, NULL, output, NPY_OWNDATA, NULL);
+            &PyArray_Type, dtype, 1, &dims, NULL, NULL, 0, NULL);
+    if (result == NULL) {
+        goto exit;
+    }
+
+    row = (xyxymatch_many_output_t*)PyArray_DATA(result);
+    for (i = 0; i < nframes; ++i) {
+        for (j = 0; j < noutputs[i]; ++j, ++row) {
+            row->frame = i;
+            row->match = outputs[i][j];
+        }
+    }
 
  exit:
 
-    Py_DECREF(input_array);
-    Py_DECREF(ref_array);
-    if (result == NULL) {
-        free(output);
+    Py_XDECREF(dtype_list);
+    Py_XDECREF(arrays);
+    Py_XDECREF(ref_array);
+    Py_XDECREF(rotations_array);
+    Py_XDECREF(scales_array);
+    py_budget_free(&budget);
+    xyxymatch_ref_free(&prepared);
+    free(ninputs);
+    free(inputs);
+    if (outputs != NULL) {
+        for (i = 0; i < nframes; ++i) {
+            free(outputs[i]);
+        }
     }
+    free(noutputs);
+    free(outputs);
 
     return result;
 }
@@ -35,13 +35,20 @@ DAMAGE.
 */
 
 #include "wrap_util.h"
+#include "immatch/py_reference_catalog.h"
 
 PyObject* py_xyxymatch(PyObject*, PyObject*, PyObject*);
+PyObject* py_xyxymatch_many(PyObject*, PyObject*, PyObject*);
 PyObject* py_geomap(PyObject*, PyObject*, PyObject*);
+PyObject* py_geomap_many(PyObject*, PyObject*, PyObject*);
+int add_geomap_results_type(PyObject*);
+int add_geomap_stream_type(PyObject*);
 
 static PyMethodDef module_methods[] = {
     {"xyxymatch", (PyCFunction)py_xyxymatch, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"xyxymatch_many", (PyCFunction)py_xyxymatch_many, METH_VARARGS | METH_KEYWORDS, NULL},
     {"geomap", (PyCFunction)py_geomap, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"geomap_many", (PyCFunction)py_geomap_many, METH_VARARGS | METH_KEYWORDS, NULL},
     {NULL}  /* Sentinel */
 };
 
@@ -72,12 +79,37 @@ init_stimage(void)
 
     SIZE_T_D = sizeof(size_t) == 8 ? "u8" : "u4";
 
+    /* The module is normally first imported from the main thread.  If
+       it is not, calls from the main thread just do not check for
+       signals. */
+    py_budget_set_main_thread();
+
 #if PY_MAJOR_VERSION >= 3
     m = PyModule_Create(&moduledef);
+    if (m == NULL) {
+        return NULL;
+    }
+
+    if (add_reference_catalog_type(m) ||
+        add_geomap_results_type(m) ||
+        add_geomap_stream_type(m) ||
+        add_budget_exceeded_error(m)) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
 	return m;
 #else
     m = Py_InitModule3("_stimage", module_methods,
                        "Example module that creates an extension type.");
+    if (m == NULL) {
+        return;
+    }
+
+    add_reference_catalog_type(m);
+    add_geomap_results_type(m);
+    add_geomap_stream_type(m);
+    add_budget_exceeded_error(m);
 	return;
 #endif
 }
@@ -40,6 +40,153 @@ DAMAGE.
 
 char* SIZE_T_D;
 
+PyObject* BudgetExceededError = NULL;
+
+int
+add_budget_exceeded_error(
+        PyObject* m) {
+
+    BudgetExceededError = PyErr_NewExceptionWithDoc(
+            "stsci.stimage.BudgetExceededError",
+            "Raised when matching runs out of its work budget or time limit\n"
+            "(see the max_work and timeout parameters of xyxymatch).",
+            PyExc_RuntimeError, NULL);
+    if (BudgetExceededError == NULL) {
+        return -1;
+    }
+
+    Py_INCREF(BudgetExceededError);
+    if (PyModule_AddObject(m, "BudgetExceededError", BudgetExceededError)) {
+        Py_DECREF(BudgetExceededError);
+        return -1;
+    }
+
+    return 0;
+}
+
+static unsigned long main_thread = 0;
+
+void
+py_budget_set_main_thread(void) {
+
+    main_thread = PyThread_get_thread_ident();
+}
+
+/* Called without the GIL, from any of the threads doing the work.
+   Python only runs signal handlers in the main thread, so only the
+   thread that started the budget, which is the main thread, takes the
+   GIL to check for them.  Elsewhere, waiting for the GIL would only
+   slow the work down. */
+static int
+py_budget_cancel(
+        void* data) {
+
+    py_budget_t* const b = (py_budget_t*)data;
+    PyGILState_STATE   gstate;
+    int                cancel = 0;
+
+    if (PyThread_get_thread_ident() != b->thread) {
+        return 0;
+    }
+
+    gstate = PyGILState_Ensure();
+    if (PyErr_CheckSignals()) {
+        if (b->exc_type == NULL) {
+            PyErr_Fetch(&b->exc_type, &b->exc_value, &b->exc_traceback);
+        } else {
+            PyErr_Clear();
+        }
+        cancel = 1;
+    }
+    PyGILState_Release(gstate);
+
+    return cancel;
+}
+
+void
+py_budget_new(
+        py_budget_t* const b) {
+
+    b->initialized = 0;
+    b->thread = 0;
+    b->exc_type = NULL;
+    b->exc_value = NULL;
+    b->exc_traceback = NULL;
+}
+
+int
+py_budget_init(
+        py_budget_t* const b,
+        const size_t max_work,
+        const double timeout) {
+
+    if (!(timeout >= 0.0)) {
+        PyErr_SetString(PyExc_ValueError, "timeout must not be negative");
+        return -1;
+    }
+
+    /* Signals are only worth checking for from the main thread */
+    b->thread = PyThread_get_thread_ident();
+    budget_init(&b->budget, max_work, timeout,
+                b->thread == main_thread ? py_budget_cancel : NULL, b);
+    b->initialized = 1;
+
+    return 0;
+}
+
+void
+py_budget_set_error(
+        py_budget_t* const b,
+        stimage_error_t* const error) {
+
+    if (b->exc_type != NULL) {
+        PyErr_Restore(b->exc_type, b->exc_value, b->exc_traceback);
+        b->exc_type = NULL;
+        b->exc_value = NULL;
+        b->exc_traceback = NULL;
+    } else if (b->initialized &&
+               budget_get_status(&b->budget) != budget_ok) {
+        PyErr_SetString(BudgetExceededError, stimage_error_get_message(error));
+    } else {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(error));
+    }
+}
+
+void
+py_budget_free(
+        py_budget_t* const b) {
+
+    if (b->initialized) {
+        budget_free(&b->budget);
+        b->initialized = 0;
+    }
+    Py_XDECREF(b->exc_type);
+    Py_XDECREF(b->exc_value);
+    Py_XDECREF(b->exc_traceback);
+    b->exc_type = NULL;
+    b->exc_value = NULL;
+    b->exc_traceback = NULL;
+}
+
+int
+to_size_t(
+        const char* const name,
+        const Py_ssize_t n,
+        size_t* const s) {
+
+    if (n < 0) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must be >= 0",
+                name);
+        return -1;
+    }
+
+    *s = (size_t)n;
+
+    return 0;
+}
+
 int
 to_coord_t(
         const char* const name,
@@ -74,6 +221,271 @@ to_coord_t(
     return 0;
 }
 
+/* Make a coordinate array from separate x and y columns.  If the
+   columns are already laid out like an array of coord_t, as the x and
+   y fields of a structured array often are, the result is a view of
+   them.  Otherwise they are copied into a new array. */
+static PyObject*
+coord_array_from_columns(
+        const char* const name,
+        PyObject* x_obj,
+        PyObject* y_obj) {
+
+    PyObject*      x        = NULL;
+    PyObject*      y        = NULL;
+    PyObject*      array    = NULL;
+    PyObject*      column   = NULL;
+    PyArray_Descr* descr    = NULL;
+    npy_intp       dims[2];
+    npy_intp       strides[2];
+    npy_intp       n;
+    int            i;
+
+    x = PyArray_FromAny(x_obj, NULL, 1, 1, 0, NULL);
+    if (x == NULL) {
+        goto exit;
+    }
+
+    y = PyArray_FromAny(y_obj, NULL, 1, 1, 0, NULL);
+    if (y == NULL) {
+        goto exit;
+    }
+
+    n = PyArray_DIM(x, 0);
+    if (PyArray_DIM(y, 0) != n) {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s x and y must be the same length", name);
+        goto exit;
+    }
+
+    dims[0] = n;
+    dims[1] = 2;
+
+    if (PyArray_TYPE(x) == NPY_DOUBLE && PyArray_TYPE(y) == NPY_DOUBLE &&
+        PyArray_ISNOTSWAPPED(x) && PyArray_ISNOTSWAPPED(y) &&
+        PyArray_ISALIGNED(x) && PyArray_ISALIGNED(y) &&
+        (n < 2 || (PyArray_STRIDE(x, 0) == sizeof(coord_t) &&
+                   PyArray_STRIDE(y, 0) == sizeof(coord_t))) &&
+        PyArray_BYTES(y) == PyArray_BYTES(x) + sizeof(double)) {
+        strides[0] = sizeof(coord_t);
+        strides[1] = sizeof(double);
+        array = PyArray_NewFromDescr(
+                &PyArray_Type, PyArray_DescrFromType(NPY_DOUBLE), 2, dims,
+                strides, PyArray_DATA(x), 0, NULL);
+        if (array == NULL) {
+            goto exit;
+        }
+        PyArray_UpdateFlags((PyArrayObject*)array, NPY_ARRAY_UPDATE_ALL);
+
+        /* The view keeps the columns alive */
+        Py_INCREF(x);
+        if (PyArray_SetBaseObject((PyArrayObject*)array, x)) {
+            Py_CLEAR(array);
+        }
+        goto exit;
+    }
+
+    array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+    if (array == NULL) {
+        goto exit;
+    }
+
+    /* Cast each column straight into its place in the result */
+    for (i = 0; i < 2; ++i) {
+        strides[0] = sizeof(coord_t);
+        descr = PyArray_DescrFromType(NPY_DOUBLE);
+        column = PyArray_NewFromDescr(
+                &PyArray_Type, descr, 1, dims, strides,
+                (double*)PyArray_DATA(array) + i, NPY_ARRAY_WRITEABLE, NULL);
+        if (column == NULL ||
+            PyArray_CopyInto((PyArrayObject*)column,
+                             (PyArrayObject*)(i == 0 ? x : y))) {
+            Py_XDECREF(column);
+            Py_CLEAR(array);
+            goto exit;
+        }
+        Py_DECREF(column);
+    }
+
+ exit:
+    Py_XDECREF(x);
+    Py_XDECREF(y);
+
+    return array;
+}
+
+PyObject*
+to_coord_array(
+        const char* const name,
+        PyObject* o) {
+
+    PyObject* array  = NULL;
+    PyObject* x      = NULL;
+    PyObject* y      = NULL;
+    int       fields = 0;
+    int       has_x  = 0;
+    int       has_y  = 0;
+
+    if (PyArray_Check(o)) {
+        fields = PyDataType_HASFIELDS(PyArray_DESCR((PyArrayObject*)o));
+    } else if (!PySequence_Check(o) || PyDict_Check(o)) {
+        has_x = PyMapping_HasKeyString(o, "x");
+        has_y = PyMapping_HasKeyString(o, "y");
+        fields = has_x || has_y;
+    }
+
+    if (fields) {
+        /* A structured array or mapping with only one of the fields
+           would otherwise fail later with a less helpful message */
+        if (PyArray_Check(o)) {
+            has_x = PyMapping_HasKeyString(o, "x");
+            has_y = PyMapping_HasKeyString(o, "y");
+        }
+        if (!has_x || !has_y) {
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s array must have x and y fields", name);
+            return NULL;
+        }
+
+        x = PyMapping_GetItemString(o, "x");
+        if (x == NULL) {
+            goto fields_exit;
+        }
+        y = PyMapping_GetItemString(o, "y");
+        if (y == NULL) {
+            goto fields_exit;
+        }
+        array = coord_array_from_columns(name, x, y);
+
+    fields_exit:
+        Py_XDECREF(x);
+        Py_XDECREF(y);
+        if (array == NULL && PyErr_ExceptionMatches(PyExc_KeyError)) {
+            PyErr_Clear();
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s array must have x and y fields", name);
+        }
+        return array;
+    }
+
+    array = (PyObject*)PyArray_ContiguousFromAny(o, NPY_DOUBLE, 2, 2);
+    if (array == NULL) {
+        return NULL;
+    }
+    if (PyArray_DIM(array, 1) != 2) {
+        PyErr_Format(PyExc_TypeError, "%s array must be an Nx2 array", name);
+        Py_DECREF(array);
+        return NULL;
+    }
+
+    return array;
+}
+
+int
+to_coord_frames(
+        const char* const name,
+        const char* const item_name,
+        PyObject* inputs_obj,
+        PyObject* offsets_obj,
+        PyObject** arrays,
+        size_t* nframes,
+        size_t** ninputs,
+        const coord_t*** inputs) {
+
+    PyObject*      seq           = NULL;
+    PyObject*      array         = NULL;
+    PyObject*      offsets_array = NULL;
+    const npy_intp* offsets      = NULL;
+    npy_intp       nrows         = 0;
+    npy_intp       end           = 0;
+    size_t         i             = 0;
+    int            status        = 1;
+
+    *arrays = PyList_New(0);
+    if (*arrays == NULL) {
+        goto exit;
+    }
+
+    if (offsets_obj != NULL && offsets_obj != Py_None) {
+        /* One array holding all of the frames, one after another */
+        array = to_coord_array(name, inputs_obj);
+        if (array == NULL || PyList_Append(*arrays, array)) {
+            goto exit;
+        }
+
+        offsets_array = (PyObject*)PyArray_ContiguousFromAny(
+                offsets_obj, NPY_INTP, 1, 1);
+        if (offsets_array == NULL) {
+            goto exit;
+        }
+        offsets = (const npy_intp*)PyArray_DATA(offsets_array);
+        nrows = PyArray_DIM(array, 0);
+        *nframes = (size_t)PyArray_DIM(offsets_array, 0);
+
+        /* Rows before the first frame would silently be dropped */
+        if (*nframes > 0 && offsets[0] != 0) {
+            PyErr_SetString(PyExc_ValueError, "offsets must start at 0");
+            goto exit;
+        }
+    } else {
+        seq = PySequence_Fast(inputs_obj, "");
+        if (seq == NULL) {
+            PyErr_Format(
+                    PyExc_TypeError,
+                    "%s must be a sequence of Nx2 arrays, or an Nx2 array "
+                    "with offsets",
+                    name);
+            goto exit;
+        }
+        *nframes = (size_t)PySequence_Fast_GET_SIZE(seq);
+    }
+
+    *ninputs = malloc(MAX(*nframes, 1) * sizeof(size_t));
+    *inputs = malloc(MAX(*nframes, 1) * sizeof(coord_t*));
+    if (*ninputs == NULL || *inputs == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    for (i = 0; i < *nframes; ++i) {
+        if (offsets != NULL) {
+            end = (i + 1 < *nframes) ? offsets[i + 1] : nrows;
+            if (offsets[i] < 0 || offsets[i] > end || end > nrows) {
+                PyErr_Format(
+                        PyExc_ValueError,
+                        "offsets must be increasing and within the %s "
+                        "array",
+                        name);
+                goto exit;
+            }
+            (*ninputs)[i] = (size_t)(end - offsets[i]);
+            (*inputs)[i] = (coord_t*)PyArray_DATA(array) + offsets[i];
+        } else {
+            Py_XDECREF(array);
+            array = to_coord_array(
+                    item_name, PySequence_Fast_GET_ITEM(seq, i));
+            if (array == NULL || PyList_Append(*arrays, array)) {
+                goto exit;
+            }
+            (*ninputs)[i] = (size_t)PyArray_DIM(array, 0);
+            (*inputs)[i] = (coord_t*)PyArray_DATA(array);
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    Py_XDECREF(seq);
+    Py_XDECREF(array);
+    Py_XDECREF(offsets_array);
+
+    return status;
+}
+
 int
 from_coord_t(
         const coord_t* const c,
@@ -147,10 +559,64 @@ to_xyxymatch_algo_e(
         *e = xyxymatch_algo_tolerance;
     } else if (strcmp(s, "triangles") == 0) {
         *e = xyxymatch_algo_triangles;
+    } else if (strcmp(s, "offsets") == 0) {
+        *e = xyxymatch_algo_offsets;
+    } else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must be 'tolerance', 'triangles' or 'offsets'",
+                name);
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+to_tolerance_search_e(
+        const char* const name,
+        const char* const s,
+        tolerance_search_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "auto") == 0) {
+        *e = tolerance_search_auto;
+    } else if (strcmp(s, "sweep") == 0) {
+        *e = tolerance_search_sweep;
+    } else if (strcmp(s, "grid") == 0) {
+        *e = tolerance_search_grid;
+    } else {
+        PyErr_Format(
+                PyExc_ValueError,
+                "%s must be 'auto', 'sweep' or 'grid'",
+                name);
+        return -1;
+    }
+
+    return 0;
+}
+
+int
+to_triangle_consensus_e(
+        const char* const name,
+        const char* const s,
+        triangle_consensus_e* const e) {
+
+    if (s == NULL) {
+        return 0;
+    }
+
+    if (strcmp(s, "reject") == 0) {
+        *e = triangle_consensus_reject;
+    } else if (strcmp(s, "ransac") == 0) {
+        *e = triangle_consensus_ransac;
     } else {
         PyErr_Format(
                 PyExc_ValueError,
-                "%s must be 'tolerance' or 'triangles'",
+                "%s must be 'reject' or 'ransac'",
                 name);
         return -1;
     }
@@ -44,17 +44,113 @@ DAMAGE.
 
 #include "immatch/xyxymatch.h"
 #include "immatch/geomap.h"
+#include "lib/budget.h"
 #include "lib/util.h"
 #include "lib/xybbox.h"
 
 extern char* SIZE_T_D;
 
+/* Raised when a call runs out of its work budget or time limit.  A
+   subclass of RuntimeError. */
+extern PyObject* BudgetExceededError;
+
+int
+add_budget_exceeded_error(
+        PyObject* m);
+
+/* Record the current thread as Python's main thread, the only one
+   that runs signal handlers.  Called from the module init. */
+void
+py_budget_set_main_thread(void);
+
+/* A budget for a call that releases the GIL.  When called from the
+   main thread, it also checks for signals, such as KeyboardInterrupt,
+   while the call runs, and keeps the exception they raise until it can
+   be restored with the GIL held. */
+typedef struct {
+    budget_t  budget;
+    int       initialized;
+    /* The thread that started the budget, the only one that checks
+       for signals */
+    unsigned long thread;
+    PyObject* exc_type;
+    PyObject* exc_value;
+    PyObject* exc_traceback;
+} py_budget_t;
+
+/* Set up a budget so that py_budget_free is safe to call on it */
+void
+py_budget_new(
+        py_budget_t* const b);
+
+/* Start the budget.  A timeout of 0 is no time limit, and max_work of
+   0 is no work limit.  Sets a Python exception and returns -1 if the
+   timeout is invalid. */
+int
+py_budget_init(
+        py_budget_t* const b,
+        const size_t max_work,
+        const double timeout);
+
+/* Set the Python exception for a call with the budget that failed
+   with the given error: the exception from a signal, if there was
+   one, BudgetExceededError if the budget ran out, otherwise
+   RuntimeError. */
+void
+py_budget_set_error(
+        py_budget_t* const b,
+        stimage_error_t* const error);
+
+void
+py_budget_free(
+        py_budget_t* const b);
+
+/* Convert a count parsed with the "n" format to a size_t.  Sets a
+   ValueError and returns -1 if it is negative. */
+int
+to_size_t(
+        const char* const name,
+        const Py_ssize_t n,
+        size_t* const s);
+
 int
 to_coord_t(
         const char* const name,
         PyObject* o,
         coord_t* const c);
 
+/* Convert a list of coordinates to an Nx2 array of doubles that can
+   be used as an array of coord_t.  The coordinates may be given as an
+   Nx2 array, or as separate x and y columns: the fields of a
+   structured array, or the items of a mapping, such as a dict or a
+   table.  They are only copied if they are not already laid out like
+   an array of coord_t.  Returns a new reference, or NULL with a Python
+   exception set. */
+PyObject*
+to_coord_array(
+        const char* const name,
+        PyObject* o);
+
+/* Split a list of coordinate lists ("frames") into the number of
+   coordinates in each and a pointer to them.  The frames are given
+   either as a sequence of coordinate lists, each converted with
+   to_coord_array, or as one coordinate list holding all of them, one
+   after another, with offsets_obj giving the index of the start of
+   each.  *arrays is set to a new list holding references to the arrays
+   that *inputs points into, and *ninputs and *inputs must be freed by
+   the caller, even on error.  Returns non-zero with a Python exception
+   set on error. */
+int
+to_coord_frames(
+        const char* const name,
+        const char* const item_name,
+        PyObject* inputs_obj,
+        PyObject* offsets_obj,
+        PyObject** arrays,
+        size_t* nframes,
+        size_t** ninputs,
+        const coord_t*** inputs);
+
 int
 from_coord_t(
         const coord_t* const c,
@@ -72,6 +168,18 @@ to_xyxymatch_algo_e(
         const char* const s,
         xyxymatch_algo_e* const e);
 
+int
+to_tolerance_search_e(
+        const char* const name,
+        const char* const s,
+        tolerance_search_e* const e);
+
+int
+to_triangle_consensus_e(
+        const char* const name,
+        const char* const s,
+        triangle_consensus_e* const e);
+
 int
 to_geomap_fit_e(
         const char* const name,
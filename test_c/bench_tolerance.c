@@ -0,0 +1,132 @@
+/*
+Benchmark the sweep and grid searches in match_tolerance.
+
+For a fixed number of coordinates, the tolerance is increased so that
+the expected number of input coordinates in the sweep's y band grows.
+The sweep's cost grows with the band, while the grid's cost depends
+mostly on the number of coordinates, so there is a crossover point
+where the grid wins.  The "auto" column shows what the default search
+chooses.
+
+Usage: bench_tolerance [ncoords]
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include "lib/xysort.h"
+#include "immatch/lib/tolerance.h"
+
+static int
+count(void* data, size_t ref_index, size_t input_index,
+      stimage_error_t* error) {
+    ++*(size_t*)data;
+    return 0;
+}
+
+static double
+time_search(size_t n, const coord_t* input, const coord_t** input_sorted,
+            const coord_t* ref, const coord_t** ref_sorted,
+            double tolerance, tolerance_search_e search,
+            size_t* nmatches) {
+    stimage_error_t error;
+    clock_t start;
+    clock_t total = 0;
+    size_t repeats = 0;
+
+    stimage_error_init(&error);
+
+    do {
+        *nmatches = 0;
+        start = clock();
+        if (match_tolerance(n, ref, ref_sorted, n, input, input_sorted,
+                            tolerance, search, count, nmatches, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            exit(1);
+        }
+        total += clock() - start;
+        ++repeats;
+    } while (total < CLOCKS_PER_SEC / 10);
+
+    return ((double)total / (double)CLOCKS_PER_SEC) / (double)repeats;
+}
+
+int main(int argc, char** argv) {
+    const double    size        = 4096.0;
+    const double    bands[]     = {0.5, 1, 2, 4, 8, 16, 32, 64, 128, 512};
+    const size_t    nbands      = sizeof(bands) / sizeof(double);
+    size_t          n           = 100000;
+    coord_t*        ref         = NULL;
+    coord_t*        input       = NULL;
+    const coord_t** ref_sorted  = NULL;
+    const coord_t** input_sorted = NULL;
+    size_t          i           = 0;
+    size_t          nsweep      = 0;
+    size_t          ngrid       = 0;
+    size_t          nauto       = 0;
+    double          tolerance   = 0.0;
+    double          tsweep, tgrid, tauto;
+
+    if (argc > 1) {
+        n = (size_t)atol(argv[1]);
+    }
+
+    ref = malloc(n * sizeof(coord_t));
+    input = malloc(n * sizeof(coord_t));
+    ref_sorted = malloc(n * sizeof(coord_t*));
+    input_sorted = malloc(n * sizeof(coord_t*));
+    if (ref == NULL || input == NULL ||
+        ref_sorted == NULL || input_sorted == NULL) {
+        printf("Out of memory\n");
+        return 1;
+    }
+
+    srand48(0);
+
+    for (i = 0; i < n; ++i) {
+        ref[i].x = drand48() * size;
+        ref[i].y = drand48() * size;
+        input[i].x = ref[i].x + (drand48() - 0.5);
+        input[i].y = ref[i].y + (drand48() - 0.5);
+    }
+
+    xysort(n, ref, ref_sorted);
+    xysort(n, input, input_sorted);
+
+    printf("%lu coordinates over a %.0f x %.0f field\n\n",
+           (unsigned long)n, size, size);
+    printf("%8s %10s %10s %10s %10s %10s\n",
+           "band", "tolerance", "matches", "sweep (s)", "grid (s)",
+           "auto (s)");
+
+    for (i = 0; i < nbands; ++i) {
+        /* The expected number of coordinates within tolerance in y */
+        tolerance = bands[i] * size / (2.0 * (double)n);
+
+        tsweep = time_search(n, input, input_sorted, ref, ref_sorted,
+                             tolerance, tolerance_search_sweep, &nsweep);
+        tgrid = time_search(n, input, input_sorted, ref, ref_sorted,
+                            tolerance, tolerance_search_grid, &ngrid);
+        tauto = time_search(n, input, input_sorted, ref, ref_sorted,
+                            tolerance, tolerance_search_auto, &nauto);
+
+        if (nsweep != ngrid || nsweep != nauto) {
+            printf("Searches disagree: %lu %lu %lu\n",
+                   (unsigned long)nsweep, (unsigned long)ngrid,
+                   (unsigned long)nauto);
+            return 1;
+        }
+
+        printf("%8.1f %10.4f %10lu %10.5f %10.5f %10.5f\n",
+               bands[i], tolerance, (unsigned long)nsweep,
+               tsweep, tgrid, tauto);
+    }
+
+    free(ref);
+    free(input);
+    free(ref_sorted);
+    free(input_sorted);
+
+    return 0;
+}
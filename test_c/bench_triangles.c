@@ -0,0 +1,145 @@
+/*
+Benchmark the triangles algorithm of xyxymatch with every triangle of
+a subsample of the coordinates (nneighbors == 0), against triangles
+formed only between nearest neighbors of all of the coordinates.
+
+The input is a rotated and shifted copy of most of the reference
+coordinates, with some noise, plus some spurious coordinates.  For
+each number of coordinates, the time, the number of matches and the
+number of those matches that are correct are printed for each mode.
+
+Usage: bench_triangles [maxncoords]
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include "immatch/xyxymatch.h"
+#include "lib/lintransform.h"
+
+static void
+run(const char* name, size_t n, const coord_t* ref,
+    size_t ninput, const coord_t* input, const size_t* source,
+    size_t nneighbors) {
+    const coord_t origin = {0.0, 0.0};
+    const coord_t mag = {1.0, 1.0};
+    const coord_t rot = {0.0, 0.0};
+    xyxymatch_output_t* output = NULL;
+    xyxymatch_options_t options;
+    stimage_error_t error;
+    size_t noutput = 0;
+    size_t ncorrect = 0;
+    size_t i = 0;
+    clock_t start;
+    double t;
+
+    stimage_error_init(&error);
+    xyxymatch_options_init(&options);
+    options.nneighbors = nneighbors;
+
+    noutput = MAX(n, ninput);
+    output = malloc(noutput * sizeof(xyxymatch_output_t));
+    if (output == NULL) {
+        printf("Out of memory\n");
+        exit(1);
+    }
+
+    start = clock();
+    if (xyxymatch(ninput, input, n, ref, &noutput, output,
+                  &origin, &mag, &rot, &origin,
+                  xyxymatch_algo_triangles,
+                  1.0, 0.0, 30, 10.0, 10, &options, &error)) {
+        printf("%8lu %-12s %s\n", (unsigned long)n, name,
+               stimage_error_get_message(&error));
+        free(output);
+        return;
+    }
+    t = (double)(clock() - start) / (double)CLOCKS_PER_SEC;
+
+    for (i = 0; i < noutput; ++i) {
+        if (source[output[i].coord_idx] == output[i].ref_idx) {
+            ++ncorrect;
+        }
+    }
+
+    printf("%8lu %-12s %10.4f %10lu %10lu\n",
+           (unsigned long)n, name, t,
+           (unsigned long)noutput, (unsigned long)ncorrect);
+
+    free(output);
+}
+
+int main(int argc, char** argv) {
+    const double    size      = 2048.0;
+    size_t          maxn      = 8000;
+    size_t          n         = 0;
+    size_t          ninput    = 0;
+    coord_t*        ref       = NULL;
+    coord_t*        input     = NULL;
+    coord_t*        moved     = NULL;
+    size_t*         source    = NULL;
+    lintransform_t  trans;
+    coord_t         in        = {0.0, 0.0};
+    coord_t         mag       = {1.0, 1.0};
+    coord_t         rot       = {1.5, 1.5};
+    coord_t         out       = {20.0, -15.0};
+    size_t          i         = 0;
+
+    if (argc > 1) {
+        maxn = (size_t)atol(argv[1]);
+    }
+
+    ref = malloc(maxn * sizeof(coord_t));
+    moved = malloc(maxn * sizeof(coord_t));
+    input = malloc(maxn * 2 * sizeof(coord_t));
+    source = malloc(maxn * 2 * sizeof(size_t));
+    if (ref == NULL || moved == NULL || input == NULL || source == NULL) {
+        printf("Out of memory\n");
+        return 1;
+    }
+
+    compute_lintransform(in, mag, rot, out, &trans);
+
+    printf("%8s %-12s %10s %10s %10s\n",
+           "ncoords", "mode", "time (s)", "matches", "correct");
+
+    for (n = 250; n <= maxn; n *= 2) {
+        srand48(0);
+
+        for (i = 0; i < n; ++i) {
+            ref[i].x = drand48() * size;
+            ref[i].y = drand48() * size;
+        }
+        apply_lintransform(&trans, n, ref, moved);
+
+        /* 80% of the reference coordinates, with noise, and 20%
+           spurious ones */
+        ninput = 0;
+        for (i = 0; i < n; ++i) {
+            if (drand48() < 0.8) {
+                input[ninput].x = moved[i].x + (drand48() - 0.5) * 0.2;
+                input[ninput].y = moved[i].y + (drand48() - 0.5) * 0.2;
+                source[ninput] = i;
+                ++ninput;
+            }
+            if (drand48() < 0.2) {
+                input[ninput].x = drand48() * size;
+                input[ninput].y = drand48() * size;
+                source[ninput] = (size_t)-1;
+                ++ninput;
+            }
+        }
+
+        run("all (30)", n, ref, ninput, input, source, 0);
+        run("local (6)", n, ref, ninput, input, source, 6);
+        run("local (10)", n, ref, ninput, input, source, 10);
+    }
+
+    free(ref);
+    free(moved);
+    free(input);
+    free(source);
+
+    return 0;
+}
@@ -3,10 +3,14 @@ import subprocess
 import sys
 
 TESTS = [
+    'budget',
     'cholesky',
     'geomap',
     'lintransform',
+    'offsets',
     'surface',
+    'threads',
+    'tolerance',
     'triangles',
     'xycoincide',
     'xysort',
@@ -0,0 +1,109 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "lib/budget.h"
+#include "immatch/xyxymatch.h"
+
+#define ncoords 200
+
+static int
+cancel_after(void* data) {
+    size_t* ncalls = (size_t*)data;
+
+    return ++(*ncalls) > 2;
+}
+
+int main(int argc, char** argv) {
+    static coord_t ref[ncoords];
+    static xyxymatch_output_t output[ncoords];
+    size_t noutput = ncoords;
+    xyxymatch_options_t options;
+    budget_t budget;
+    stimage_error_t error;
+    size_t ncalls = 0;
+    size_t i;
+
+    stimage_error_init(&error);
+
+    /* No budget is no limit */
+    if (budget_charge(NULL, (size_t)-1, "testing", &error) ||
+        budget_get_status(NULL) != budget_ok) {
+        printf("A NULL budget ran out\n");
+        return 1;
+    }
+
+    /* The work limit is exact, and stays exceeded */
+    budget_init(&budget, 100, 0.0, NULL, NULL);
+    if (budget_charge(&budget, 60, "testing", &error) ||
+        budget_charge(&budget, 40, "testing", &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    if (!budget_charge(&budget, 1, "testing", &error) ||
+        budget_get_status(&budget) != budget_exceeded_work ||
+        !budget_charge(&budget, 0, "testing", &error)) {
+        printf("The work budget was not enforced\n");
+        return 1;
+    }
+    printf("%s\n", stimage_error_get_message(&error));
+    budget_free(&budget);
+
+    /* A time limit that has already passed */
+    budget_init(&budget, 0, 1e-9, NULL, NULL);
+    for (i = 0; i < 1000000 && budget_get_status(&budget) == budget_ok; ++i) {
+        budget_charge(&budget, 1, "testing", &error);
+    }
+    if (budget_get_status(&budget) != budget_exceeded_time) {
+        printf("The time limit was not enforced\n");
+        return 1;
+    }
+    budget_free(&budget);
+
+    /* Cancellation, with the callback not called more than every
+       few milliseconds */
+    budget_init(&budget, 0, 0.0, cancel_after, &ncalls);
+    while (budget_get_status(&budget) == budget_ok) {
+        budget_charge(&budget, 1, "testing", &error);
+    }
+    if (budget_get_status(&budget) != budget_cancelled || ncalls != 3) {
+        printf("Cancellation failed\n");
+        return 1;
+    }
+    budget_free(&budget);
+
+    /* Triangle matching stops with an error once it runs out */
+    srand48(0);
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 1000.0;
+        ref[i].y = drand48() * 1000.0;
+    }
+
+    xyxymatch_options_init(&options);
+    budget_init(&budget, 10000, 0.0, NULL, NULL);
+    options.budget = &budget;
+    if (!xyxymatch(ncoords, ref, ncoords, ref, &noutput, output,
+                   NULL, NULL, NULL, NULL,
+                   xyxymatch_algo_triangles,
+                   1.0, 0.0, 100, 10.0, 10, &options, &error) ||
+        budget_get_status(&budget) != budget_exceeded_work) {
+        printf("Triangle matching did not run out of budget\n");
+        return 1;
+    }
+    printf("%s\n", stimage_error_get_message(&error));
+    budget_free(&budget);
+
+    /* And succeeds with enough of it */
+    budget_init(&budget, 100000000, 0.0, NULL, NULL);
+    noutput = ncoords;
+    if (xyxymatch(ncoords, ref, ncoords, ref, &noutput, output,
+                  NULL, NULL, NULL, NULL,
+                  xyxymatch_algo_triangles,
+                  1.0, 0.0, 100, 10.0, 10, &options, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    budget_free(&budget);
+
+    return 0;
+}
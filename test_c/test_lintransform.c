@@ -2,6 +2,7 @@
 #include <stdio.h>
 #include <stdlib.h>
 
+#include <math.h>
 #include "lib/lintransform.h"
 
 void
@@ -20,6 +21,7 @@ int main(int argv, char** argc) {
     coord_t data[ncoords];
     coord_t data_trans[ncoords];
     lintransform_t transform;
+    lintransform_t fit;
     coord_t in = {0.0, 0.0};
     coord_t mag = {1.0, 1.0};
     coord_t rot = {0.0, 0.0};
@@ -80,6 +82,28 @@ int main(int argv, char** argc) {
 
     print_array(ncoords, data_trans, "rot");
 
+    /* Fitting the transformed coordinates must recover the
+       transformation */
+    fit_lintransform(ncoords, data, data_trans, &fit);
+    if (fabs(fit.a - transform.a) > 1e-12 ||
+        fabs(fit.b - transform.b) > 1e-12 ||
+        fabs(fit.c - transform.c) > 1e-12 ||
+        fabs(fit.d - transform.d) > 1e-12 ||
+        fabs(fit.e - transform.e) > 1e-12 ||
+        fabs(fit.f - transform.f) > 1e-12) {
+        printf("Fit did not recover the transformation\n");
+        return 1;
+    }
+
+    /* Too few coordinates for a full fit only give a shift */
+    fit_lintransform(2, data, data_trans, &fit);
+    if (fit.a != 1.0 || fit.b != 0.0 || fit.d != 0.0 || fit.e != 1.0 ||
+        fabs(fit.c - ((data_trans[0].x - data[0].x) +
+                      (data_trans[1].x - data[1].x)) / 2.0) > 1e-12) {
+        printf("Fit of two coordinates is not a shift\n");
+        return 1;
+    }
+
     printf("\n\n");
     fflush(stdout);
 
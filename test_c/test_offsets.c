@@ -0,0 +1,129 @@
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/xyxymatch.h"
+
+#define ncoords 2000
+
+/* Match a shuffled, shifted, rotated copy of ref, with extra
+   unrelated coordinates in each list, and check that every coordinate
+   in common is matched to itself. */
+int check(const coord_t* const ref,
+          const double shift_x,
+          const double shift_y,
+          const double rotation,
+          const xyxymatch_options_t* const options) {
+    static coord_t input[ncoords];
+    static size_t input_ref[ncoords];
+    static xyxymatch_output_t output[ncoords];
+    const coord_t origin = {0.0, 0.0};
+    const coord_t mag = {1.0, 1.0};
+    const coord_t rot = {0.0, 0.0};
+    const coord_t ref_origin = {0.0, 0.0};
+    const double tolerance = 1.0;
+    const double angle = rotation * M_PI / 180.0;
+    const size_t ncommon = ncoords / 2;
+    size_t noutput = ncoords;
+    size_t nright = 0;
+    stimage_error_t error;
+    size_t i;
+    int status;
+
+    stimage_error_init(&error);
+
+    for (i = 0; i < ncoords; ++i) {
+        if (i < ncommon) {
+            input[i].x = cos(angle) * ref[i].x - sin(angle) * ref[i].y +
+                shift_x + (drand48() - 0.5) * 0.1;
+            input[i].y = sin(angle) * ref[i].x + cos(angle) * ref[i].y +
+                shift_y + (drand48() - 0.5) * 0.1;
+            input_ref[i] = i;
+        } else {
+            input[i].x = drand48() * 4096.0;
+            input[i].y = drand48() * 4096.0;
+            input_ref[i] = ncoords;
+        }
+    }
+
+    status = xyxymatch(
+            ncoords, input,
+            ncoords, ref,
+            &noutput, output,
+            &origin, &mag, &rot, &ref_origin,
+            xyxymatch_algo_offsets,
+            tolerance, 0.0, 0, 0.0, 0, options,
+            &error);
+
+    if (status) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return status;
+    }
+
+    for (i = 0; i < noutput; ++i) {
+        if (input_ref[output[i].coord_idx] == output[i].ref_idx) {
+            ++nright;
+        }
+    }
+
+    /* Only the odd chance match with an unrelated coordinate is
+       allowed */
+    if (nright < ncommon * 99 / 100 || noutput > nright + ncommon / 100) {
+        printf("Expected %lu matches, got %lu right of %lu\n",
+               (unsigned long)ncommon,
+               (unsigned long)nright,
+               (unsigned long)noutput);
+        return 1;
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    static coord_t ref[ncoords];
+    const double rotations[] = {-10.0, -5.0, 0.0, 5.0, 10.0};
+    const double bad_scales[] = {1.0, 0.0};
+    coord_t input[3] = {{0.0, 0.0}, {1.0, 0.0}, {0.0, 1.0}};
+    const coord_t origin = {0.0, 0.0};
+    const coord_t mag = {1.0, 1.0};
+    const coord_t rot = {0.0, 0.0};
+    xyxymatch_output_t output[3];
+    size_t noutput = 3;
+    xyxymatch_options_t options;
+    stimage_error_t error;
+    size_t i;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 4096.0;
+        ref[i].y = drand48() * 4096.0;
+    }
+
+    /* A large shift, with no estimate of it */
+    xyxymatch_options_init(&options);
+    if (check(ref, 731.25, -1208.5, 0.0, &options)) {
+        return 1;
+    }
+
+    /* A rotation that is one of the candidates */
+    options.nrotations = sizeof(rotations) / sizeof(double);
+    options.rotations = rotations;
+    if (check(ref, -50.0, 20.0, 5.0, &options)) {
+        return 1;
+    }
+
+    /* Invalid scales are reported */
+    options.nscales = sizeof(bad_scales) / sizeof(double);
+    options.scales = bad_scales;
+    if (!xyxymatch(3, input, 3, input, &noutput, output,
+                   &origin, &mag, &rot, &origin,
+                   xyxymatch_algo_offsets,
+                   1.0, 0.0, 0, 0.0, 0, &options, &error)) {
+        printf("Expected an error for a zero scale\n");
+        return 1;
+    }
+
+    return 0;
+}
@@ -1,8 +1,201 @@
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
+#include "surface/basis.h"
+#include "surface/fit.h"
 #include "surface/surface.h"
+#include "surface/vector.h"
+
+#define ncoords 50
+
+/* Check the derivatives of a surface with random coefficients against
+   central differences */
+int check_deriv(
+        const surface_type_e type,
+        const int xorder,
+        const int yorder,
+        const xterms_e xterms) {
+
+    surface_t s;
+    bbox_t bbox;
+    coord_t ref[ncoords];
+    coord_t step[ncoords];
+    double z0[ncoords];
+    double z1[ncoords];
+    double dzdx[ncoords];
+    double dzdy[ncoords];
+    const double h = 1e-5;
+    stimage_error_t error;
+    size_t i;
+    int status = 1;
+
+    stimage_error_init(&error);
+    bbox.min.x = -10.0;
+    bbox.min.y = 5.0;
+    bbox.max.x = 30.0;
+    bbox.max.y = 25.0;
+
+    if (surface_init(&s, type, xorder, yorder, xterms, &bbox, &error)) {
+        goto exit;
+    }
+    for (i = 0; i < s.ncoeff; ++i) {
+        s.coeff[i] = drand48() - 0.5;
+        if (type == surface_type_polynomial) {
+            s.coeff[i] *= pow(10.0, -(double)i);
+        }
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = -10.0 + drand48() * 40.0;
+        ref[i].y = 5.0 + drand48() * 20.0;
+    }
+
+    if (surface_vector_deriv(&s, ncoords, ref, dzdx, dzdy, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        step[i].x = ref[i].x + h;
+        step[i].y = ref[i].y;
+    }
+    if (surface_vector(&s, ncoords, step, z1, &error)) goto exit;
+    for (i = 0; i < ncoords; ++i) {
+        step[i].x = ref[i].x - h;
+    }
+    if (surface_vector(&s, ncoords, step, z0, &error)) goto exit;
+    for (i = 0; i < ncoords; ++i) {
+        if (fabs((z1[i] - z0[i]) / (2.0 * h) - dzdx[i]) > 1e-5) {
+            printf("d/dx differs for type %d, order %d %d, xterms %d\n",
+                   type, xorder, yorder, xterms);
+            goto exit;
+        }
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        step[i].x = ref[i].x;
+        step[i].y = ref[i].y + h;
+    }
+    if (surface_vector(&s, ncoords, step, z1, &error)) goto exit;
+    for (i = 0; i < ncoords; ++i) {
+        step[i].y = ref[i].y - h;
+    }
+    if (surface_vector(&s, ncoords, step, z0, &error)) goto exit;
+    for (i = 0; i < ncoords; ++i) {
+        if (fabs((z1[i] - z0[i]) / (2.0 * h) - dzdy[i]) > 1e-5) {
+            printf("d/dy differs for type %d, order %d %d, xterms %d\n",
+                   type, xorder, yorder, xterms);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+    surface_free(&s);
+
+    return status;
+}
+
+/* Check that fitting and evaluating a surface with a basis computed
+   beforehand, to a higher order, gives the same results as without
+   it */
+int check_basis(
+        const surface_type_e type,
+        const int xorder,
+        const int yorder,
+        const xterms_e xterms) {
+
+    surface_t s;
+    surface_t geometry;
+    surface_basis_t basis;
+    surface_fit_error_e fit_error;
+    bbox_t bbox;
+    coord_t ref[ncoords];
+    double z[ncoords];
+    double w[ncoords];
+    double coeff[ncoords];
+    double z0[ncoords];
+    double z1[ncoords];
+    stimage_error_t error;
+    size_t i;
+    int status = 1;
+
+    stimage_error_init(&error);
+    surface_new(&s);
+    surface_new(&geometry);
+    surface_basis_new(&basis);
+    bbox.min.x = -10.0;
+    bbox.min.y = 5.0;
+    bbox.max.x = 30.0;
+    bbox.max.y = 25.0;
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = -10.0 + drand48() * 40.0;
+        ref[i].y = 5.0 + drand48() * 20.0;
+        z[i] = sin(ref[i].x / 10.0) + cos(ref[i].y / 7.0);
+        w[i] = 1.0;
+    }
+
+    if (surface_init(&s, type, xorder, yorder, xterms, &bbox, &error) ||
+        surface_init(&geometry, type, xorder + 2, yorder + 1, xterms_none,
+                     &bbox, &error) ||
+        surface_basis_init(&basis, &geometry, ncoords, ref, &error)) {
+        goto exit;
+    }
+
+    if (!surface_basis_covers(&basis, &s, ncoords) ||
+        surface_basis_covers(&basis, &s, ncoords - 1) ||
+        surface_basis_covers(&basis, &geometry, ncoords) == 0) {
+        printf("surface_basis_covers is wrong\n");
+        goto exit;
+    }
+
+    if (surface_fit(&s, ncoords, ref, z, w, surface_fit_weight_user,
+                    &fit_error, &error) ||
+        surface_vector(&s, ncoords, ref, z0, &error)) {
+        goto exit;
+    }
+    for (i = 0; i < s.ncoeff; ++i) {
+        coeff[i] = s.coeff[i];
+    }
+
+    if (surface_fit_basis(&s, &basis, z, w, &fit_error, &error) ||
+        surface_vector_basis(&s, &basis, z1, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < s.ncoeff; ++i) {
+        if (coeff[i] != s.coeff[i]) {
+            printf("Fit with a basis differs for type %d, order %d %d, "
+                   "xterms %d\n", type, xorder, yorder, xterms);
+            goto exit;
+        }
+    }
+    for (i = 0; i < ncoords; ++i) {
+        if (fabs(z0[i] - z1[i]) > 1e-12 * (1.0 + fabs(z0[i]))) {
+            printf("Evaluation with a basis differs for type %d, "
+                   "order %d %d, xterms %d\n", type, xorder, yorder, xterms);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+    surface_free(&s);
+    surface_free(&geometry);
+    surface_basis_free(&basis);
+
+    return status;
+}
 
 int main(int argv, char** argc) {
     surface_t surface;
@@ -33,6 +226,26 @@ int main(int argv, char** argc) {
     if (copy.matrix == NULL) goto exit;
     if (copy.matrix == surface.matrix) goto exit;
 
+    {
+        const int orders[][2] = {{1, 1}, {1, 3}, {3, 1}, {2, 2}, {4, 3}, {3, 5}};
+        int type, xterms;
+        size_t j;
+
+        srand48(0);
+        for (type = 0; type < surface_type_LAST; ++type) {
+            for (xterms = xterms_none; xterms <= xterms_full; ++xterms) {
+                for (j = 0; j < sizeof(orders) / sizeof(orders[0]); ++j) {
+                    status = check_deriv(
+                            type, orders[j][0], orders[j][1], xterms);
+                    if (status) goto exit;
+                    status = check_basis(
+                            type, orders[j][0], orders[j][1], xterms);
+                    if (status) goto exit;
+                }
+            }
+        }
+    }
+
     status = 0;
 
  exit:
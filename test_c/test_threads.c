@@ -0,0 +1,87 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "lib/threads.h"
+
+#define nitems 10000
+
+typedef struct {
+    size_t visits[nitems];
+    size_t fail_from;
+} work_t;
+
+static int
+visit(void* data, size_t i, stimage_error_t* const error) {
+    work_t* work = (work_t*)data;
+
+    /* Each index is handed out once, so no locking is needed */
+    ++work->visits[i];
+
+    if (i >= work->fail_from && i % 7 == 0) {
+        stimage_error_format_message(error, "Failed at %lu", (unsigned long)i);
+        return 1;
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    static work_t work;
+    const size_t nthreads[] = {0, 1, 2, 3, 16, nitems * 2};
+    stimage_error_t error;
+    size_t i, j;
+
+    stimage_error_init(&error);
+
+    if (threads_ncpu() < 1) {
+        printf("No processors\n");
+        return 1;
+    }
+
+    if (parallel_for(0, 4, visit, &work, &error)) {
+        printf("Empty range failed\n");
+        return 1;
+    }
+
+    for (j = 0; j < sizeof(nthreads) / sizeof(size_t); ++j) {
+        /* Every index is visited exactly once */
+        memset(&work, 0, sizeof(work_t));
+        work.fail_from = nitems;
+        if (parallel_for(nitems, nthreads[j], visit, &work, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        for (i = 0; i < nitems; ++i) {
+            if (work.visits[i] != 1) {
+                printf("Index %lu visited %lu times with %lu threads\n",
+                       (unsigned long)i, (unsigned long)work.visits[i],
+                       (unsigned long)nthreads[j]);
+                return 1;
+            }
+        }
+
+        /* The error of the lowest failing index is reported, and
+           everything below it has been run */
+        memset(&work, 0, sizeof(work_t));
+        work.fail_from = 5000;
+        stimage_error_init(&error);
+        if (!parallel_for(nitems, nthreads[j], visit, &work, &error)) {
+            printf("Failure was not reported\n");
+            return 1;
+        }
+        if (strcmp(stimage_error_get_message(&error), "Failed at 5005")) {
+            printf("Wrong error: %s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        for (i = 0; i <= 5005; ++i) {
+            if (work.visits[i] != 1) {
+                printf("Index %lu below the failure was not run\n",
+                       (unsigned long)i);
+                return 1;
+            }
+        }
+    }
+
+    return 0;
+}
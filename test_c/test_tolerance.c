@@ -0,0 +1,177 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "lib/xygrid.h"
+#include "lib/xysort.h"
+#include "immatch/lib/tolerance.h"
+
+#define ncoords 2048
+
+typedef struct {
+    size_t n;
+    size_t ref_idx[ncoords];
+    size_t input_idx[ncoords];
+} matches_t;
+
+static int
+collect(void* data, size_t ref_index, size_t input_index,
+        stimage_error_t* error) {
+    matches_t* m = (matches_t*)data;
+
+    m->ref_idx[m->n] = ref_index;
+    m->input_idx[m->n] = input_index;
+    ++m->n;
+
+    return 0;
+}
+
+static int
+compare_search(const char* name, size_t n, const coord_t* input,
+               const coord_t* ref, double tolerance) {
+    static matches_t sweep;
+    static matches_t grid;
+    const coord_t* input_sorted[ncoords];
+    const coord_t* ref_sorted[ncoords];
+    stimage_error_t error;
+    size_t i;
+
+    stimage_error_init(&error);
+
+    xysort(n, input, input_sorted);
+    xysort(n, ref, ref_sorted);
+
+    sweep.n = 0;
+    grid.n = 0;
+
+    if (match_tolerance(n, ref, ref_sorted, n, input, input_sorted,
+                        tolerance, tolerance_search_sweep,
+                        collect, &sweep, &error) ||
+        match_tolerance(n, ref, ref_sorted, n, input, input_sorted,
+                        tolerance, tolerance_search_grid,
+                        collect, &grid, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (sweep.n != grid.n) {
+        printf("%s: sweep found %lu matches, grid found %lu\n",
+               name, (unsigned long)sweep.n, (unsigned long)grid.n);
+        return 1;
+    }
+
+    for (i = 0; i < sweep.n; ++i) {
+        if (sweep.ref_idx[i] != grid.ref_idx[i] ||
+            sweep.input_idx[i] != grid.input_idx[i]) {
+            printf("%s: match %lu differs: (%lu, %lu) vs. (%lu, %lu)\n",
+                   name, (unsigned long)i,
+                   (unsigned long)sweep.ref_idx[i],
+                   (unsigned long)sweep.input_idx[i],
+                   (unsigned long)grid.ref_idx[i],
+                   (unsigned long)grid.input_idx[i]);
+            return 1;
+        }
+    }
+
+    if (sweep.n == 0) {
+        printf("%s: no matches found\n", name);
+        return 1;
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    coord_t ref[ncoords];
+    coord_t input[ncoords];
+    const coord_t* input_ptrs[ncoords];
+    xygrid_t grid;
+    stimage_error_t error;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    /* Random fields, over a range of crowding */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 100.0;
+        ref[i].y = drand48() * 100.0;
+        input[i].x = ref[i].x + (drand48() - 0.5) * 2.0;
+        input[i].y = ref[i].y + (drand48() - 0.5) * 2.0;
+    }
+
+    if (compare_search("sparse", ncoords, input, ref, 0.5) ||
+        compare_search("crowded", ncoords, input, ref, 5.0) ||
+        compare_search("huge tolerance", ncoords, input, ref, 500.0)) {
+        return 1;
+    }
+
+    /* Integer lattices, where many candidates are exactly at the
+       tolerance or tied in distance */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = (double)(i % 45);
+        ref[i].y = (double)(i / 45);
+        input[i].x = (double)((i * 7) % 45) + 0.5;
+        input[i].y = (double)((i * 7) / 45 % 45);
+    }
+
+    if (compare_search("lattice ties", ncoords, input, ref, 1.0) ||
+        compare_search("lattice edges", ncoords, input, ref, 0.5)) {
+        return 1;
+    }
+
+    /* Input exactly one tolerance below the reference, which the
+       sweep excludes, mixed with ones that are within tolerance */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = (double)(i % 45) * 4.0;
+        ref[i].y = (double)(i / 45) * 4.0;
+        input[i].x = ref[i].x;
+        input[i].y = ref[i].y - ((i % 2) ? 1.0 : 0.5);
+    }
+
+    if (compare_search("lattice below", ncoords, input, ref, 1.0)) {
+        return 1;
+    }
+
+    /* Everything on one line in y */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() * 1000.0;
+        ref[i].y = 3.0;
+        input[i].x = drand48() * 1000.0;
+        input[i].y = 3.0;
+    }
+
+    if (compare_search("single row", ncoords, input, ref, 0.25)) {
+        return 1;
+    }
+
+    /* A crowded field with one distant coordinate, which must not
+       make the grid cells cover the whole field */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48();
+        ref[i].y = drand48();
+        input[i].x = ref[i].x + (drand48() - 0.5) * 1e-4;
+        input[i].y = ref[i].y + (drand48() - 0.5) * 1e-4;
+    }
+    input[ncoords - 1].x = 1e6;
+    input[ncoords - 1].y = 1e6;
+
+    if (compare_search("distant outlier", ncoords, input, ref, 0.001)) {
+        return 1;
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        input_ptrs[i] = &input[i];
+    }
+    xygrid_new(&grid);
+    if (xygrid_init(&grid, ncoords, input_ptrs, 0.001, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    if (grid.cell_size > 0.1) {
+        printf("distant outlier: grid cells are %g wide\n", grid.cell_size);
+        return 1;
+    }
+    xygrid_free(&grid);
+
+    return 0;
+}
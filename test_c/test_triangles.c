@@ -1,9 +1,591 @@
+#include <math.h>
 #include <stdio.h>
+#include <stdlib.h>
 
 #include "immatch/lib/triangles.h"
 #include "lib/xysort.h"
 #include "lib/xycoincide.h"
 
+/* The original sort-merge of merge_triangles, which the indexed
+   version must agree with exactly */
+static size_t
+merge_triangles_reference(
+        const size_t nr_triangles,
+        const triangle_t* const r_triangles,
+        const size_t nl_triangles,
+        const triangle_t* const l_triangles,
+        triangle_match_t* const matches) {
+
+    size_t i;
+    size_t match_iter = 0;
+    double rmaxtol, lmaxtol, maxtol;
+    size_t blp = 0, rp = 0, lp = 0;
+    double dratio = 0.0, dratio2, dcosine, dcosine2, dtratio, dtcosine;
+    const triangle_t* max_tri = NULL;
+    const triangle_t* l_tri = NULL;
+    const triangle_t* r_tri = NULL;
+    double max_dratio2, max_dcosine2;
+
+    rmaxtol = r_triangles[0].ratio_tolerance;
+    for (i = 1; i < nr_triangles; ++i) {
+        rmaxtol = MAX(rmaxtol, r_triangles[i].ratio_tolerance);
+    }
+
+    lmaxtol = l_triangles[0].ratio_tolerance;
+    for (i = 1; i < nl_triangles; ++i) {
+        lmaxtol = MAX(lmaxtol, l_triangles[i].ratio_tolerance);
+    }
+
+    maxtol = sqrt(rmaxtol + lmaxtol);
+
+    for (rp = 0; rp < nr_triangles; ++rp) {
+        r_tri = r_triangles + rp;
+
+        for ( ; blp < nl_triangles; ++blp) {
+            l_tri = l_triangles + blp;
+            dratio = r_tri->ratio - l_tri->ratio;
+            if (dratio <= maxtol) {
+                break;
+            }
+        }
+
+        if (blp >= nl_triangles) {
+            break;
+        }
+
+        if (dratio < -maxtol) {
+            continue;
+        }
+
+        max_tri = NULL;
+        max_dratio2 = 0.5 * MAX_DOUBLE;
+        max_dcosine2 = 0.5 * MAX_DOUBLE;
+
+        for (lp = blp; lp < nl_triangles; ++lp) {
+            l_tri = l_triangles + lp;
+
+            dratio = r_tri->ratio - l_tri->ratio;
+            if (dratio < -maxtol) {
+                break;
+            }
+
+            dratio2 = dratio*dratio;
+            dcosine = r_tri->cosine_v1 - l_tri->cosine_v1;
+            dcosine2 = dcosine*dcosine;
+            dtratio = r_tri->ratio_tolerance + l_tri->ratio_tolerance;
+            dtcosine = r_tri->cosine_tolerance + l_tri->cosine_tolerance;
+
+            if (dratio2 <= dtratio && dcosine2 <= dtcosine &&
+                (dratio2 + dcosine2) < (max_dratio2 + max_dcosine2)) {
+                max_tri = l_tri;
+                max_dratio2 = dratio2;
+                max_dcosine2 = dcosine2;
+            }
+        }
+
+        if (max_tri != NULL) {
+            matches[match_iter].l = max_tri;
+            matches[match_iter].r = r_tri;
+            ++match_iter;
+        }
+    }
+
+    return match_iter;
+}
+
+/* Merge the triangles of a list with those of a perturbed copy of
+   it, and compare against the reference sort-merge */
+static int
+compare_merge(
+        const size_t npoints,
+        const double noise,
+        const double tolerance) {
+
+    coord_t* data1 = NULL;
+    coord_t* data2 = NULL;
+    const coord_t** ptr1 = NULL;
+    const coord_t** ptr2 = NULL;
+    size_t ntriangles1, ntriangles2, nmatches, nexpected;
+    triangle_t* triangles1 = NULL;
+    triangle_t* triangles2 = NULL;
+    triangle_match_t* matches = NULL;
+    triangle_match_t* expected = NULL;
+    stimage_error_t error;
+    size_t i;
+    int status = 1;
+
+    stimage_error_init(&error);
+
+    data1 = malloc(npoints * sizeof(coord_t));
+    data2 = malloc(npoints * sizeof(coord_t));
+    ptr1 = malloc(npoints * sizeof(coord_t*));
+    ptr2 = malloc(npoints * sizeof(coord_t*));
+    if (data1 == NULL || data2 == NULL || ptr1 == NULL || ptr2 == NULL) {
+        goto exit;
+    }
+
+    for (i = 0; i < npoints; ++i) {
+        data1[i].x = drand48() * 1000.0;
+        data1[i].y = drand48() * 1000.0;
+        data2[i].x = data1[i].x + (drand48() - 0.5) * noise;
+        data2[i].y = data1[i].y + (drand48() - 0.5) * noise;
+    }
+
+    xysort(npoints, data1, ptr1);
+    xysort(npoints, data2, ptr2);
+
+    if (find_triangles(npoints, ptr1, &ntriangles1, &triangles1, npoints,
+                       tolerance, 10.0, 1, NULL, &error) ||
+        find_triangles(npoints, ptr2, &ntriangles2, &triangles2, npoints,
+                       tolerance, 10.0, 1, NULL, &error)) {
+        goto exit;
+    }
+
+    nmatches = MAX(ntriangles1, ntriangles2);
+    matches = malloc(nmatches * sizeof(triangle_match_t) + 1);
+    expected = malloc(nmatches * sizeof(triangle_match_t) + 1);
+    if (matches == NULL || expected == NULL) {
+        goto exit;
+    }
+
+    if (merge_triangles(ntriangles1, triangles1, ntriangles2, triangles2,
+                        &nmatches, matches, NULL, &error)) {
+        goto exit;
+    }
+
+    nexpected = merge_triangles_reference(
+            ntriangles1, triangles1, ntriangles2, triangles2, expected);
+
+    printf("%lu points, noise %g, tolerance %g: %lu of %lu triangles matched\n",
+           (unsigned long)npoints, noise, tolerance,
+           (unsigned long)nmatches, (unsigned long)ntriangles1);
+
+    if (nmatches != nexpected) {
+        printf("Found %lu triangle matches instead of %lu\n",
+               (unsigned long)nmatches, (unsigned long)nexpected);
+        goto exit;
+    }
+
+    for (i = 0; i < nmatches; ++i) {
+        if (matches[i].l != expected[i].l || matches[i].r != expected[i].r) {
+            printf("Triangle match %lu differs\n", (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    if (status && error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    free(data1);
+    free(data2);
+    free(ptr1);
+    free(ptr2);
+    free(triangles1);
+    free(triangles2);
+    free(matches);
+    free(expected);
+
+    return status;
+}
+
+/* When a left coordinate has the most votes for two right
+   coordinates, it may only be matched to the first of them */
+static int
+check_vote_once(void) {
+    coord_t left[4] = {{0.0, 0.0}, {1.0, 0.0}, {0.0, 1.0}, {1.0, 1.0}};
+    coord_t right[4] = {{0.0, 0.0}, {1.0, 0.0}, {0.0, 1.0}, {1.0, 1.0}};
+    triangle_t l_tri[2];
+    triangle_t r_tri[2];
+    triangle_match_t matches[4];
+    const coord_t* left_coords[4];
+    const coord_t* right_coords[4];
+    const coord_t* ref_matches[4];
+    const coord_t* input_matches[4];
+    size_t ncoord_matches = 4;
+    stimage_error_t error;
+    size_t i, j;
+
+    stimage_error_init(&error);
+
+    for (i = 0; i < 4; ++i) {
+        left_coords[i] = &left[i];
+        right_coords[i] = &right[i];
+    }
+
+    /* (L0, L1, L2) <-> (R0, R1, R2) and (L0, L1, L3) <-> (R1, R0, R3),
+       each twice, so L0 ties with L1 for both R0 and R1 */
+    l_tri[0].vertices[0] = 0;
+    l_tri[0].vertices[1] = 1;
+    l_tri[0].vertices[2] = 2;
+    r_tri[0].vertices[0] = 0;
+    r_tri[0].vertices[1] = 1;
+    r_tri[0].vertices[2] = 2;
+    l_tri[1].vertices[0] = 0;
+    l_tri[1].vertices[1] = 1;
+    l_tri[1].vertices[2] = 3;
+    r_tri[1].vertices[0] = 1;
+    r_tri[1].vertices[1] = 0;
+    r_tri[1].vertices[2] = 3;
+    for (i = 0; i < 4; ++i) {
+        matches[i].l = &l_tri[i / 2];
+        matches[i].r = &r_tri[i / 2];
+    }
+
+    if (vote_triangle_matches(4, left, left_coords, 4, right, right_coords,
+                              4, matches,
+                              &ncoord_matches, ref_matches, input_matches,
+                              0, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    for (i = 0; i < ncoord_matches; ++i) {
+        for (j = i + 1; j < ncoord_matches; ++j) {
+            if (ref_matches[i] == ref_matches[j]) {
+                printf("Coordinate %lu matched twice\n",
+                       (unsigned long)(ref_matches[i] - left));
+                return 1;
+            }
+        }
+    }
+
+    if (ncoord_matches != 4) {
+        printf("Found %lu instead of 4 matches from voting\n",
+               (unsigned long)ncoord_matches);
+        return 1;
+    }
+
+    return 0;
+}
+
+typedef struct {
+    size_t v[3];
+} triple_t;
+
+static int
+triple_compare(const void* ap, const void* bp) {
+    const triple_t* a = (const triple_t*)ap;
+    const triple_t* b = (const triple_t*)bp;
+    size_t m;
+
+    for (m = 0; m < 3; ++m) {
+        if (a->v[m] != b->v[m]) {
+            return a->v[m] < b->v[m] ? -1 : 1;
+        }
+    }
+    return 0;
+}
+
+static void
+triple_sort(triple_t* t) {
+    size_t tmp;
+
+    if (t->v[0] > t->v[1]) { tmp = t->v[0]; t->v[0] = t->v[1]; t->v[1] = tmp; }
+    if (t->v[1] > t->v[2]) { tmp = t->v[1]; t->v[1] = t->v[2]; t->v[2] = tmp; }
+    if (t->v[0] > t->v[1]) { tmp = t->v[0]; t->v[0] = t->v[1]; t->v[1] = tmp; }
+}
+
+/* find_triangles_local must form exactly the triangles between each
+   point and pairs of its k nearest neighbors, found here by brute
+   force, with ties in distance going to the lower index */
+static int
+compare_local(
+        const char* name,
+        const size_t npoints,
+        const coord_t* const points,
+        const size_t k,
+        const double max_ratio) {
+
+    const coord_t** ptrs = NULL;
+    size_t* best = NULL;
+    double* bestd = NULL;
+    triple_t* expected = NULL;
+    triple_t* found = NULL;
+    triangle_t* triangles = NULL;
+    size_t ntriangles = 0;
+    size_t nexpected = 0;
+    size_t nbest = 0;
+    size_t i, j, a, b, m;
+    double d, dmin, dmax;
+    stimage_error_t error;
+    int status = 1;
+
+    stimage_error_init(&error);
+
+    ptrs = malloc(npoints * sizeof(coord_t*));
+    best = malloc(k * sizeof(size_t));
+    bestd = malloc(k * sizeof(double));
+    expected = malloc(npoints * k * k * sizeof(triple_t));
+    if (ptrs == NULL || best == NULL || bestd == NULL || expected == NULL) {
+        goto exit;
+    }
+
+    for (i = 0; i < npoints; ++i) {
+        ptrs[i] = &points[i];
+    }
+
+    for (i = 0; i < npoints; ++i) {
+        nbest = 0;
+        for (j = 0; j < npoints; ++j) {
+            if (j == i) {
+                continue;
+            }
+            d = euclid_distance2(&points[i], &points[j]);
+            if (nbest == k && d >= bestd[k - 1]) {
+                continue;
+            }
+            m = nbest < k ? nbest++ : k - 1;
+            for ( ; m > 0 && bestd[m - 1] > d; --m) {
+                bestd[m] = bestd[m - 1];
+                best[m] = best[m - 1];
+            }
+            bestd[m] = d;
+            best[m] = j;
+        }
+
+        for (a = 0; a < nbest; ++a) {
+            for (b = a + 1; b < nbest; ++b) {
+                expected[nexpected].v[0] = i;
+                expected[nexpected].v[1] = best[a];
+                expected[nexpected].v[2] = best[b];
+                triple_sort(&expected[nexpected]);
+                ++nexpected;
+            }
+        }
+    }
+
+    qsort(expected, nexpected, sizeof(triple_t), &triple_compare);
+    for (i = 0, j = 0; i < nexpected; ++i) {
+        if (j > 0 && triple_compare(&expected[j - 1], &expected[i]) == 0) {
+            continue;
+        }
+        dmin = dmax = euclid_distance2(
+                &points[expected[i].v[0]], &points[expected[i].v[1]]);
+        d = euclid_distance2(
+                &points[expected[i].v[1]], &points[expected[i].v[2]]);
+        dmin = MIN(dmin, d); dmax = MAX(dmax, d);
+        d = euclid_distance2(
+                &points[expected[i].v[2]], &points[expected[i].v[0]]);
+        dmin = MIN(dmin, d); dmax = MAX(dmax, d);
+        if (sqrt(dmax) / sqrt(dmin) > max_ratio) {
+            continue;
+        }
+        expected[j++] = expected[i];
+    }
+    nexpected = j;
+
+    if (find_triangles_local(npoints, ptrs, k, &ntriangles, &triangles,
+                             0.0, max_ratio, 1, NULL, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    found = malloc(ntriangles * sizeof(triple_t) + 1);
+    if (found == NULL) {
+        goto exit;
+    }
+
+    for (i = 0; i < ntriangles; ++i) {
+        if (i > 0 && triangles[i].ratio < triangles[i - 1].ratio) {
+            printf("%s: triangles not sorted by ratio\n", name);
+            goto exit;
+        }
+        for (m = 0; m < 3; ++m) {
+            found[i].v[m] = ptrs[triangles[i].vertices[m]] - points;
+        }
+        triple_sort(&found[i]);
+    }
+    qsort(found, ntriangles, sizeof(triple_t), &triple_compare);
+
+    if (ntriangles != nexpected) {
+        printf("%s: found %lu local triangles, expected %lu\n", name,
+               (unsigned long)ntriangles, (unsigned long)nexpected);
+        goto exit;
+    }
+
+    for (i = 0; i < ntriangles; ++i) {
+        if (triple_compare(&found[i], &expected[i]) != 0) {
+            printf("%s: local triangle %lu differs\n",
+                   name, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    free(ptrs);
+    free(best);
+    free(bestd);
+    free(expected);
+    free(found);
+    free(triangles);
+
+    return status;
+}
+
+static int
+check_local(void) {
+    #define nlocal 400
+    coord_t points[nlocal];
+    size_t i;
+
+    /* Uniform, clustered, on a lattice (with many ties in distance),
+       on a line, fewer points than neighbors, and with distant
+       outliers */
+    for (i = 0; i < nlocal; ++i) {
+        points[i].x = drand48() * 1000.0;
+        points[i].y = drand48() * 1000.0;
+    }
+    if (compare_local("uniform", nlocal, points, 6, 10.0) ||
+        compare_local("uniform k=2", nlocal, points, 2, 10.0) ||
+        compare_local("uniform ratio", nlocal, points, 10, 5.0)) {
+        return 1;
+    }
+
+    for (i = 0; i < nlocal; ++i) {
+        points[i].x = (i % 4 ? 0.0 : 900.0) + drand48() * 10.0;
+        points[i].y = (i % 3 ? 0.0 : 500.0) + drand48() * 10.0;
+    }
+    if (compare_local("clustered", nlocal, points, 8, 10.0)) {
+        return 1;
+    }
+
+    for (i = 0; i < nlocal; ++i) {
+        points[i].x = (double)(i % 20);
+        points[i].y = (double)(i / 20);
+    }
+    if (compare_local("lattice", nlocal, points, 6, 10.0)) {
+        return 1;
+    }
+
+    for (i = 0; i < nlocal; ++i) {
+        points[i].x = drand48() * 1000.0;
+        points[i].y = 2.0 * points[i].x;
+    }
+    if (compare_local("line", nlocal, points, 4, 10.0)) {
+        return 1;
+    }
+
+    if (compare_local("few", 5, points, 8, 10.0)) {
+        return 1;
+    }
+
+    /* A few coordinates far from all of the others, which are found
+       by checking everything rather than by searching rings of cells */
+    for (i = 0; i < nlocal; ++i) {
+        points[i].x = drand48() * 1000.0;
+        points[i].y = drand48() * 1000.0;
+    }
+    points[0].x = 1e9;
+    points[0].y = 1e9;
+    points[1].x = -1e9;
+    points[1].y = 5e8;
+    if (compare_local("distant outliers", nlocal, points, 6, 10.0)) {
+        return 1;
+    }
+
+    return 0;
+}
+
+/* The triangles, and their order, must not depend on the number of
+   threads */
+static int
+compare_threads(
+        const size_t npoints,
+        const size_t nneighbors) {
+
+    coord_t* points = NULL;
+    const coord_t** ptrs = NULL;
+    triangle_t* serial = NULL;
+    triangle_t* threaded = NULL;
+    size_t npoints_unique = 0;
+    size_t nserial = 0;
+    size_t nthreaded = 0;
+    size_t nthreads[] = {2, 3, 8, 0};
+    size_t i, j, m;
+    stimage_error_t error;
+    int status = 1;
+
+    stimage_error_init(&error);
+
+    points = malloc(npoints * sizeof(coord_t));
+    ptrs = malloc(npoints * sizeof(coord_t*));
+    if (points == NULL || ptrs == NULL) {
+        goto exit;
+    }
+
+    for (i = 0; i < npoints; ++i) {
+        /* Coarse coordinates, so that there are many ties in ratio */
+        points[i].x = floor(drand48() * 50.0);
+        points[i].y = floor(drand48() * 50.0);
+    }
+    xysort(npoints, points, ptrs);
+    npoints_unique = xycoincide(npoints, ptrs, ptrs, 0.0);
+
+    for (i = 0; i < sizeof(nthreads) / sizeof(size_t) + 1; ++i) {
+        triangle_t** triangles = i == 0 ? &serial : &threaded;
+        size_t* ntriangles = i == 0 ? &nserial : &nthreaded;
+        size_t n = i == 0 ? 1 : nthreads[i - 1];
+
+        free(threaded);
+        threaded = NULL;
+        if (nneighbors ?
+            find_triangles_local(npoints_unique, ptrs, nneighbors,
+                                 ntriangles, triangles, 0.5, 10.0, n,
+                                 NULL, &error) :
+            find_triangles(npoints_unique, ptrs, ntriangles, triangles,
+                           npoints_unique, 0.5, 10.0, n, NULL, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            goto exit;
+        }
+
+        if (i == 0) {
+            continue;
+        }
+
+        if (nthreaded != nserial) {
+            printf("%lu threads found %lu triangles, not %lu\n",
+                   (unsigned long)n, (unsigned long)nthreaded,
+                   (unsigned long)nserial);
+            goto exit;
+        }
+
+        for (j = 0; j < nserial; ++j) {
+            for (m = 0; m < 3; ++m) {
+                if (serial[j].vertices[m] != threaded[j].vertices[m]) {
+                    printf("%lu threads: triangle %lu differs\n",
+                           (unsigned long)n, (unsigned long)j);
+                    goto exit;
+                }
+            }
+            if (j > 0 && threaded[j].ratio < threaded[j - 1].ratio) {
+                printf("%lu threads: triangles not sorted\n",
+                       (unsigned long)n);
+                goto exit;
+            }
+        }
+    }
+
+    printf("%lu points: %lu triangles match with any number of threads\n",
+           (unsigned long)npoints_unique, (unsigned long)nserial);
+
+    status = 0;
+
+ exit:
+    free(points);
+    free(ptrs);
+    free(serial);
+    free(threaded);
+
+    return status;
+}
+
 int main(int argc, char** argv) {
     #define ncoords 512
     coord_t data1[ncoords];
@@ -48,29 +630,15 @@ int main(int argc, char** argv) {
     xysort(ncoords, data2, ptr2);
     nunique = xycoincide(ncoords, ptr1, ptr1, tolerance);
 
-    if (max_num_triangles(nunique, max_points, &ntriangles1, &error)) {
-        goto exit;
-    }
-    ntriangles2 = ntriangles1;
-    printf("Allocating room for %lu triangles\n", (long unsigned)ntriangles1);
-    triangles1 = malloc(sizeof(triangle_t) * ntriangles1);
-    if (triangles1 == NULL) {
-        goto exit;
-    }
-    triangles2 = malloc(sizeof(triangle_t) * ntriangles2);
-    if (triangles1 == NULL) {
-        goto exit;
-    }
-
     if (find_triangles(
-            nunique, ptr1, &ntriangles1, triangles1, max_points,
-            tolerance, max_ratio, &error)) {
+            nunique, ptr1, &ntriangles1, &triangles1, max_points,
+            tolerance, max_ratio, 1, NULL, &error)) {
         goto exit;
     }
 
     if (find_triangles(
-            nunique, ptr2, &ntriangles2, triangles2, max_points,
-            tolerance, max_ratio, &error)) {
+            nunique, ptr2, &ntriangles2, &triangles2, max_points,
+            tolerance, max_ratio, 1, NULL, &error)) {
         goto exit;
     }
 
@@ -82,12 +650,13 @@ int main(int argc, char** argv) {
         printf("Triangle %lu:\n", (unsigned long)i);
 
         printf("   (%.3f, %.3f)--(%.3f, %.3f)--(%.3f, %.3f)\n",
-               tri->vertices[0]->x, tri->vertices[0]->y,
-               tri->vertices[1]->x, tri->vertices[1]->y,
-               tri->vertices[2]->x, tri->vertices[2]->y);
+               ptr1[tri->vertices[0]]->x, ptr1[tri->vertices[0]]->y,
+               ptr1[tri->vertices[1]]->x, ptr1[tri->vertices[1]]->y,
+               ptr1[tri->vertices[2]]->x, ptr1[tri->vertices[2]]->y);
         printf("   ");
         for (j = 0; j < 3; ++j) {
-            dist[j] = euclid_distance2(tri->vertices[j], tri->vertices[(j+1)%3]);
+            dist[j] = euclid_distance2(ptr1[tri->vertices[j]],
+                                       ptr1[tri->vertices[(j+1)%3]]);
             printf("%f ", dist[j]);
         }
         printf("\n");
@@ -114,7 +683,8 @@ int main(int argc, char** argv) {
         }
 
         for (j = 0; j < 3; ++j) {
-            dist[j] = euclid_distance2(tri->vertices[j], tri->vertices[(j+1)%3]);
+            dist[j] = euclid_distance2(ptr1[tri->vertices[j]],
+                                       ptr1[tri->vertices[(j+1)%3]]);
             if (dist[j] <= tol2) {
                 printf("Distances too short\n");
                 goto exit;
@@ -137,7 +707,7 @@ int main(int argc, char** argv) {
 
     if (merge_triangles(
             ntriangles1, triangles1, ntriangles2, triangles2,
-            &ntriangle_matches, triangle_matches, &error)) {
+            &ntriangle_matches, triangle_matches, NULL, &error)) {
         goto exit;
     }
 
@@ -148,7 +718,7 @@ int main(int argc, char** argv) {
     }
 
     if (reject_triangles(
-            &ntriangle_matches, triangle_matches, nreject, &error)) {
+            &ntriangle_matches, triangle_matches, nreject, NULL, &error)) {
         goto exit;
     }
 
@@ -159,11 +729,11 @@ int main(int argc, char** argv) {
     }
 
     if (vote_triangle_matches(
-            ncoords, data2,
-            ncoords, data1,
+            ncoords, data2, ptr2,
+            ncoords, data1, ptr1,
             ntriangle_matches, triangle_matches,
             &ncoord_matches, ref_matches, input_matches,
-            &error)) {
+            0, &error)) {
         goto exit;
     }
 
@@ -189,6 +759,29 @@ int main(int argc, char** argv) {
         }
     }
 
+    if (check_vote_once()) {
+        goto exit;
+    }
+
+    /* The indexed merge must agree exactly with a plain sort-merge */
+    if (compare_merge(30, 0.0, 0.0) ||
+        compare_merge(30, 1.0, 1.0) ||
+        compare_merge(50, 0.5, 1.0) ||
+        compare_merge(50, 2.0, 3.0) ||
+        compare_merge(50, 20.0, 5.0) ||
+        compare_merge(50, 1000.0, 2.0)) {
+        goto exit;
+    }
+
+    if (check_local()) {
+        goto exit;
+    }
+
+    if (compare_threads(80, 0) ||
+        compare_threads(2000, 8)) {
+        goto exit;
+    }
+
     status = 0;
 
  exit:
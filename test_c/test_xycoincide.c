@@ -1,10 +1,63 @@
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
 #include "lib/xysort.h"
 #include "lib/xycoincide.h"
 
+/* Check xycoincide against the obvious O(n^2) keep-first rule: in
+   sorted order, keep each coordinate unless it is within the tolerance
+   of one that has already been kept. */
+int compare(const size_t n, const coord_t* const data,
+            const double tolerance, const char* const name) {
+    const coord_t** ptr = malloc(n * sizeof(coord_t*));
+    const coord_t** expected = malloc(n * sizeof(coord_t*));
+    size_t nexpected = 0;
+    size_t nunique = 0;
+    size_t i, j;
+    double dx, dy;
+    int status = 1;
+
+    xysort(n, data, ptr);
+
+    for (i = 0; i < n; ++i) {
+        for (j = 0; j < nexpected; ++j) {
+            dy = ptr[i]->y - expected[j]->y;
+            dx = ptr[i]->x - expected[j]->x;
+            if (dy*dy + dx*dx <= tolerance*tolerance) {
+                break;
+            }
+        }
+        if (j == nexpected) {
+            expected[nexpected++] = ptr[i];
+        }
+    }
+
+    nunique = xycoincide(n, ptr, ptr, tolerance);
+
+    if (nunique != nexpected) {
+        printf("%s: expected %lu unique, got %lu\n", name,
+               (unsigned long)nexpected, (unsigned long)nunique);
+        goto exit;
+    }
+
+    for (i = 0; i < nunique; ++i) {
+        if (ptr[i] != expected[i]) {
+            printf("%s: mismatch at %lu\n", name, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    free(ptr);
+    free(expected);
+
+    return status;
+}
+
 int main(int argv, char** argc) {
     #define ncoords 512
     coord_t data[ncoords];
@@ -48,5 +101,64 @@ int main(int argv, char** argc) {
         }
     }
 
+    {
+        #define nmany 5000
+        static coord_t many[nmany];
+
+        /* Clumps of coordinates, so that chains of them are within
+           the tolerance of each other */
+        for (i = 0; i < nmany; ++i) {
+            many[i].x = (double)(lrand48() % 50) + drand48() * 0.3;
+            many[i].y = (double)(lrand48() % 50) + drand48() * 0.3;
+        }
+        if (compare(nmany, many, 0.1, "clumps")) {
+            return 1;
+        }
+
+        /* Everything in a narrow band of y, which is the worst case
+           for a sweep in y */
+        for (i = 0; i < nmany; ++i) {
+            many[i].x = drand48() * 1000.0;
+            many[i].y = drand48() * 0.01;
+        }
+        if (compare(nmany, many, 0.5, "band")) {
+            return 1;
+        }
+
+        /* One coordinate far from the others, which must not stop
+           either search from working */
+        for (i = 0; i < nmany; ++i) {
+            many[i].x = drand48();
+            many[i].y = drand48();
+        }
+        many[0].x = 1e6;
+        many[0].y = 1e6;
+        if (compare(nmany, many, 0.001, "outlier")) {
+            return 1;
+        }
+
+        for (i = 0; i < nmany; ++i) {
+            many[i].x = drand48() * 1000.0;
+            many[i].y = drand48() * 0.01;
+        }
+        many[0].x = 1e6;
+        many[0].y = 1e6;
+        if (compare(nmany, many, 0.5, "band with outlier")) {
+            return 1;
+        }
+
+        /* Exact duplicates, and coordinates that are not finite */
+        for (i = 0; i < nmany; ++i) {
+            many[i].x = (double)(lrand48() % 100);
+            many[i].y = (double)(lrand48() % 100);
+        }
+        many[0].x = NAN;
+        many[1].y = INFINITY;
+        if (compare(nmany, many, 0.0, "duplicates") ||
+            compare(nmany, many, 1.0, "neighbours")) {
+            return 1;
+        }
+    }
+
     return 0;
 }
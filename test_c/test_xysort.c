@@ -4,38 +4,87 @@
 
 #include "lib/xysort.h"
 
-int main(int argv, char** argc) {
-    #define ncoords 512
-    coord_t data[ncoords];
-    const coord_t* ptr[ncoords];
-    size_t i = 0;
+/* Check that the coordinates are sorted by (y, x), and that the ones
+   that are exactly the same are in their original order */
+int check(const size_t n, const coord_t* const data, const char* const name) {
+    const coord_t** ptr = malloc(n * sizeof(coord_t*));
     double lastx = 0.0;
     double lasty = 0.0;
     double x = 0.0;
     double y = 0.0;
+    size_t i = 0;
+    int status = 1;
 
-    srand48(0);
-
-    for (i = 0; i < ncoords; ++i) {
-        data[i].x = drand48();
-        data[i].y = drand48();
-    }
-
-    xysort(ncoords, data, ptr);
+    xysort(n, data, ptr);
 
     lastx = ptr[0]->x;
     lasty = ptr[0]->y;
-    for (i = 1; i < ncoords; ++i) {
+    for (i = 1; i < n; ++i) {
         x = ptr[i]->x;
         y = ptr[i]->y;
 
         if (y < lasty || (y == lasty && x < lastx)) {
-            return 1;
+            printf("%s: not sorted at %lu\n", name, (unsigned long)i);
+            goto exit;
+        }
+
+        if (y == lasty && x == lastx && ptr[i] < ptr[i - 1]) {
+            printf("%s: not stable at %lu\n", name, (unsigned long)i);
+            goto exit;
         }
 
         lastx = x;
         lasty = y;
     }
 
+    status = 0;
+
+ exit:
+    free(ptr);
+
+    return status;
+}
+
+int main(int argv, char** argc) {
+    #define ncoords 512
+    #define nmany 5000
+    coord_t data[ncoords];
+    static coord_t many[nmany];
+    size_t i = 0;
+
+    srand48(0);
+
+    for (i = 0; i < ncoords; ++i) {
+        data[i].x = drand48();
+        data[i].y = drand48();
+    }
+
+    if (check(ncoords, data, "uniform")) {
+        return 1;
+    }
+
+    /* Negative values, rows of equal y, exact duplicates and both
+       signs of zero */
+    for (i = 0; i < nmany; ++i) {
+        many[i].x = (double)(lrand48() % 200) - 100.0;
+        many[i].y = (double)(lrand48() % 20) - 10.0;
+    }
+    many[0].x = -0.0;
+    many[0].y = 0.0;
+    many[1].x = 0.0;
+    many[1].y = -0.0;
+    if (check(nmany, many, "rows")) {
+        return 1;
+    }
+
+    /* Very large and very small magnitudes */
+    for (i = 0; i < nmany; ++i) {
+        many[i].x = (drand48() - 0.5) * 1e300;
+        many[i].y = (drand48() - 0.5) * 1e-300;
+    }
+    if (check(nmany, many, "magnitudes")) {
+        return 1;
+    }
+
     return 0;
 }
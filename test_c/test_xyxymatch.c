@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "immatch/xyxymatch.h"
 
@@ -18,6 +19,11 @@ int main(int argc, char** argv) {
     double dx, dy;
     double distance;
     const double tolerance = 0.01;
+    xyxymatch_output_t output2[ncoords];
+    size_t noutput2 = ncoords;
+    xyxymatch_ref_t prepared;
+    xyxymatch_options_t options;
+    xyxymatch_output_buffer_t buffer;
     int status;
 
     size_t i = 0;
@@ -36,7 +42,7 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, NULL,
                        &error);
 
     if (status) {
@@ -81,7 +87,7 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, NULL,
                        &error);
 
     if (status) {
@@ -111,5 +117,79 @@ int main(int argc, char** argv) {
         }
     }
 
+    /* A prepared reference list should give the same results, and
+       be reusable */
+
+    if (xyxymatch_ref_init(&prepared, ncoords, ref, 0.0, &error)) {
+        printf(stimage_error_get_message(&error));
+        return 1;
+    }
+
+    for (i = 0; i < 2; ++i) {
+        noutput2 = ncoords;
+        status = xyxymatch_prepared(ncoords, input,
+                                    &prepared,
+                                    &noutput2, output2,
+                                    &origin, &mag, &rot, &ref_origin,
+                                    xyxymatch_algo_tolerance,
+                                    tolerance, 0, 0.0, 0, NULL,
+                                    &error);
+
+        if (status) {
+            printf(stimage_error_get_message(&error));
+            xyxymatch_ref_free(&prepared);
+            return status;
+        }
+
+        if (noutput2 != noutput ||
+            memcmp(output, output2, noutput * sizeof(xyxymatch_output_t))) {
+            printf("Prepared reference list gave different matches\n");
+            xyxymatch_ref_free(&prepared);
+            return 1;
+        }
+    }
+
+    /* A growable output buffer gets the same matches, and a fixed
+       one that is too small reports that it is full */
+
+    xyxymatch_options_init(&options);
+    xyxymatch_output_buffer_init(&buffer, NULL, 0);
+    options.output_func = &xyxymatch_output_buffer_append;
+    options.output_data = &buffer;
+    status = xyxymatch_prepared(ncoords, input,
+                                &prepared,
+                                &noutput2, NULL,
+                                &origin, &mag, &rot, &ref_origin,
+                                xyxymatch_algo_tolerance,
+                                tolerance, 0, 0.0, 0, &options,
+                                &error);
+    xyxymatch_output_buffer_trim(&buffer);
+    if (status || noutput2 != noutput || buffer.n != noutput ||
+        buffer.size != noutput ||
+        memcmp(output, buffer.output, noutput * sizeof(xyxymatch_output_t))) {
+        printf("Growable output buffer gave different matches\n");
+        xyxymatch_output_buffer_free(&buffer);
+        xyxymatch_ref_free(&prepared);
+        return 1;
+    }
+    xyxymatch_output_buffer_free(&buffer);
+
+    xyxymatch_output_buffer_init(&buffer, output2, noutput - 1);
+    status = xyxymatch_prepared(ncoords, input,
+                                &prepared,
+                                &noutput2, NULL,
+                                &origin, &mag, &rot, &ref_origin,
+                                xyxymatch_algo_tolerance,
+                                tolerance, 0, 0.0, 0, &options,
+                                &error);
+    if (!status || !buffer.full || buffer.n != noutput - 1) {
+        printf("Full output buffer was not reported\n");
+        xyxymatch_ref_free(&prepared);
+        return 1;
+    }
+    status = 0;
+
+    xyxymatch_ref_free(&prepared);
+
     return status;
 }
@@ -7,7 +7,9 @@
 int compare(const size_t ncoords,
             const coord_t* const ref,
             const coord_t* const input,
-            xyxymatch_output_t* output) {
+            xyxymatch_output_t* output,
+            const triangle_consensus_e consensus,
+            const int strict) {
     int status;
     const coord_t origin = {0.0, 0.0};
     const coord_t mag = {1.0, 1.0};
@@ -18,10 +20,13 @@ int compare(const size_t ncoords,
     const size_t max_points = 40;
     const size_t nreject = 10;
     size_t noutput = ncoords;
+    xyxymatch_options_t options;
     stimage_error_t error;
     size_t i = 0;
 
     stimage_error_init(&error);
+    xyxymatch_options_init(&options);
+    options.consensus = consensus;
 
     status = xyxymatch(
             ncoords, input,
@@ -29,7 +34,7 @@ int compare(const size_t ncoords,
             &noutput, output,
             &origin, &mag, &rot, &ref_origin,
             xyxymatch_algo_triangles,
-            tolerance, 0.0, max_points, max_ratio, nreject,
+            tolerance, 0.0, max_points, max_ratio, nreject, &options,
             &error);
 
     if (status) {
@@ -37,15 +42,24 @@ int compare(const size_t ncoords,
         return status;
     }
 
-    if (noutput != max_points) {
+    /* The triangles only use max_points of the coordinates, but the
+       transformation fit to their matches is used to match the
+       entire list */
+    if (noutput != ncoords) {
         printf("Expected %lu pairs, got %lu\n",
-               (unsigned long)max_points,
+               (unsigned long)ncoords,
                (unsigned long)noutput);
+        if (strict) {
+            return 1;
+        }
     }
 
     for (i = 0; i < noutput; ++i) {
         if (output[i].coord_idx != output[i].ref_idx) {
             printf("Mismatched indicies\n");
+            if (strict) {
+                return 1;
+            }
         }
     }
 
@@ -80,7 +94,8 @@ int main(int argc, char** argv) {
         input[i].y = ref[i].y;
     }
 
-    if (compare(ncoords, ref, input, output)) {
+    if (compare(ncoords, ref, input, output, triangle_consensus_reject, 0) ||
+        compare(ncoords, ref, input, output, triangle_consensus_ransac, 1)) {
         return 1;
     }
 
@@ -92,7 +107,8 @@ int main(int argc, char** argv) {
         input[i].y = ref[i].y + 42;
     }
 
-    if (compare(ncoords, ref, input, output)) {
+    if (compare(ncoords, ref, input, output, triangle_consensus_reject, 0) ||
+        compare(ncoords, ref, input, output, triangle_consensus_ransac, 1)) {
         return 1;
     }
 
@@ -104,7 +120,8 @@ int main(int argc, char** argv) {
         input[i].y = ref[i].y * 1.003 + 42;
     }
 
-    if (compare(ncoords, ref, input, output)) {
+    if (compare(ncoords, ref, input, output, triangle_consensus_reject, 0) ||
+        compare(ncoords, ref, input, output, triangle_consensus_ransac, 1)) {
         return 1;
     }
 
@@ -114,7 +131,10 @@ int main(int argc, char** argv) {
     compute_lintransform(in, mag, rot, out, &trans);
     apply_lintransform(&trans, ncoords, ref, input);
 
-    if (compare(ncoords, ref, input, output)) {
+    /* The x and y scales differ by more than the tolerance across
+       the field, which no similarity transformation can match */
+    if (compare(ncoords, ref, input, output, triangle_consensus_reject, 0) ||
+        compare(ncoords, ref, input, output, triangle_consensus_ransac, 0)) {
         return 1;
     }
 